@@ -6,7 +6,11 @@ from __future__ import annotations
 
 import json
 import logging
+import multiprocessing
 import os
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from typing import Any
 
@@ -54,6 +58,33 @@ def zscale_stats_path_for_h5(h5_path: Path) -> Path:
     return Path(h5_path).parent / ZSCALE_STATS_FILENAME
 
 
+def read_samples_in_chunk_order(images: h5py.Dataset, indices: np.ndarray) -> np.ndarray:
+    """
+    Read ``images[indices]`` (all channels) into a preallocated float32 reservoir.
+
+    Row ``k`` of the reservoir is sample ``indices[k]``, exactly as a per-index read would give,
+    but the reads are planned in HDF5 chunk order: the sampled indices are grouped by chunk and
+    each chunk holding any of them is read (and decompressed) once, for all channels together.
+    """
+    indices = np.asarray(indices, dtype=np.int64)
+    chunk_rows = int(images.chunks[0]) if images.chunks else H5_IMAGE_CHUNK
+    reservoir = np.empty((len(indices),) + tuple(images.shape[1:]), dtype=np.float32)
+    if len(indices) == 0:
+        return reservoir
+
+    order = np.argsort(indices, kind="stable")
+    sorted_indices = indices[order]
+    chunk_ids = sorted_indices // chunk_rows
+    boundaries = np.flatnonzero(np.diff(chunk_ids)) + 1
+    for group in np.split(np.arange(len(sorted_indices)), boundaries):
+        rows = sorted_indices[group]
+        start = int(rows[0])
+        end = int(rows[-1]) + 1
+        block = images[start:end]
+        reservoir[order[group]] = block[rows - start]
+    return reservoir
+
+
 def compute_zscale_stats(
     h5_path: str | Path,
     max_samples: int = 5000,
@@ -65,6 +96,9 @@ def compute_zscale_stats(
 
     Pools pixels from a random subset of training cutouts, then runs astropy ZScaleInterval
     separately on each channel — so all targets share one (vmin, vmax), etc.
+
+    The sampled cutouts are read in HDF5 chunk order (see read_samples_in_chunk_order) but
+    pooled in sample order, so the limits are identical to reading them one index at a time.
     """
     try:
         from astropy.visualization import ZScaleInterval
@@ -81,29 +115,27 @@ def compute_zscale_stats(
         n_sample = min(n_total, max_samples)
         indices = rng.choice(n_total, size=n_sample, replace=False) if n_total > n_sample else np.arange(n_total)
 
-        channels: dict[str, dict[str, float]] = {}
-        for ch, name in enumerate(CHANNEL_ORDER):
-            chunks: list[np.ndarray] = []
-            for idx in indices:
-                plane = handle["images"][int(idx), ch].astype(np.float32)
-                chunks.append(plane.ravel())
-            pixels = np.concatenate(chunks)
-            pixels = pixels[np.isfinite(pixels)]
-            if pixels.size == 0:
-                raise RuntimeError(f"No finite pixels for channel {name} in {h5_path}")
-            if pixels.size > max_pixels_per_channel:
-                pixels = rng.choice(pixels, size=max_pixels_per_channel, replace=False)
-            vmin, vmax = zscale.get_limits(pixels)
-            if vmax <= vmin:
-                vmax = vmin + 1.0
-            channels[name] = {"vmin": float(vmin), "vmax": float(vmax)}
-            LOGGER.info(
-                "Z-scale %s from %d train samples: vmin=%.4g vmax=%.4g",
-                name,
-                n_sample,
-                vmin,
-                vmax,
-            )
+        reservoir = read_samples_in_chunk_order(handle["images"], indices)
+
+    channels: dict[str, dict[str, float]] = {}
+    for ch, name in enumerate(CHANNEL_ORDER):
+        pixels = reservoir[:, ch].ravel()
+        pixels = pixels[np.isfinite(pixels)]
+        if pixels.size == 0:
+            raise RuntimeError(f"No finite pixels for channel {name} in {h5_path}")
+        if pixels.size > max_pixels_per_channel:
+            pixels = rng.choice(pixels, size=max_pixels_per_channel, replace=False)
+        vmin, vmax = zscale.get_limits(pixels)
+        if vmax <= vmin:
+            vmax = vmin + 1.0
+        channels[name] = {"vmin": float(vmin), "vmax": float(vmax)}
+        LOGGER.info(
+            "Z-scale %s from %d train samples: vmin=%.4g vmax=%.4g",
+            name,
+            n_sample,
+            vmin,
+            vmax,
+        )
 
     return {
         "method": "zscale_per_channel",
@@ -344,14 +376,86 @@ def write_h5_shard(
         handle.attrs["channel_order"] = ",".join(CHANNEL_ORDER)
 
 
+# merge_h5_shards: shard file handles held open by each reader process.
+_MERGE_READER_HANDLES: dict[str, h5py.File] = {}
+
+
+def _merge_reader_handle(path: str) -> h5py.File:
+    handle = _MERGE_READER_HANDLES.get(path)
+    if handle is None:
+        handle = h5py.File(path, "r")
+        _MERGE_READER_HANDLES[path] = handle
+    return handle
+
+
+def _close_merge_reader_handles() -> None:
+    while _MERGE_READER_HANDLES:
+        _, handle = _MERGE_READER_HANDLES.popitem()
+        handle.close()
+
+
+def _read_merge_chunk(task: dict[str, Any]) -> tuple[int, int, Any]:
+    """
+    Produce one output image chunk for merge_h5_shards (runs in a reader process).
+
+    Returns (chunk index, filter mask, payload). For a ``raw`` task the payload is the stored
+    chunk copied straight from the shard. Otherwise the rows are read (decompressed), padded to
+    a full chunk and encoded for write_direct_chunk (gzip or uncompressed bytes); for any other
+    filter the payload is the decoded block and the writer compresses it.
+    """
+    raw = task.get("raw")
+    if raw is not None:
+        path, row = raw
+        dataset = _merge_reader_handle(path)["images"]
+        filter_mask, payload = dataset.id.read_direct_chunk((row,) + (0,) * (dataset.ndim - 1))
+        return task["index"], filter_mask, payload
+
+    block = np.zeros((task["chunk_rows"],) + tuple(task["sample_shape"]), dtype=np.float32)
+    filled = 0
+    for path, start, end in task["pieces"]:
+        block[filled : filled + end - start] = _merge_reader_handle(path)["images"][start:end]
+        filled += end - start
+
+    if task["encode"] == "gzip":
+        return task["index"], 0, zlib.compress(block.tobytes(), task["level"])
+    if task["encode"] == "none":
+        return task["index"], 0, block.tobytes()
+    return task["index"], 0, block[:filled]
+
+
+def _same_image_storage(shard: h5py.Dataset, output: h5py.Dataset) -> bool:
+    """True if shard image chunks can be copied into the output without recompressing."""
+    return (
+        shard.dtype == output.dtype
+        and shard.chunks == output.chunks
+        and shard.compression == output.compression
+        and shard.compression_opts == output.compression_opts
+        and shard.shuffle == output.shuffle
+        and shard.fletcher32 == output.fletcher32
+        and shard.scaleoffset == output.scaleoffset
+    )
+
+
 def merge_h5_shards(
     shard_paths: list[Path | str],
     output_path: Path,
     compression: str | None = None,
     compression_opts: int = 4,
     delete_shards: bool = True,
+    readers: int = 0,
+    max_chunks_in_flight: int | None = None,
+    raw_copy: bool = True,
 ) -> int:
-    """Concatenate shard HDF5 files into one split file (pre-allocated — steady speed)."""
+    """
+    Concatenate shard HDF5 files into one split file (pre-allocated — steady speed).
+
+    Images are copied one output chunk (256 samples) at a time, so memory is capped at a few
+    chunks however big the shards are. Each output chunk is read from the shard(s) and, for
+    gzip, compressed by a pool of ``readers`` processes (0 = do it all in this process); the
+    writer only writes the stored chunk bytes. At most ``max_chunks_in_flight`` chunks (default
+    2 per reader) are queued. A chunk that lines up with a shard chunk stored with the same
+    filters is copied as is, without decompressing or recompressing (``raw_copy``).
+    """
     ordered = sorted(Path(p) for p in shard_paths if p is not None)
     if not ordered:
         raise ValueError("No shards to merge")
@@ -374,17 +478,31 @@ def merge_h5_shards(
     output_path.parent.mkdir(parents=True, exist_ok=True)
     str_dtype = h5py.string_dtype(encoding="utf-8")
     chunk_n = 256
+    sample_shape = (channels, image_size, image_size)
 
     image_kw: dict[str, Any] = {
-        "shape": (total_n, channels, image_size, image_size),
+        "shape": (total_n,) + sample_shape,
         "dtype": np.float32,
-        "chunks": (chunk_n, channels, image_size, image_size),
+        "chunks": (chunk_n,) + sample_shape,
     }
     if compression:
         image_kw["compression"] = compression
         if compression == "gzip":
             image_kw["compression_opts"] = compression_opts
 
+    if compression is None:
+        encode = "none"
+    elif compression == "gzip":
+        encode = "gzip"
+    else:
+        encode = "decoded"
+
+    readers = max(int(readers), 0)
+    if max_chunks_in_flight is None:
+        max_chunks_in_flight = 2 * readers
+    max_chunks_in_flight = max(int(max_chunks_in_flight), 1)
+
+    n_raw = 0
     with h5py.File(output_path, "w") as out:
         images_ds = out.create_dataset("images", **image_kw)
         labels_ds = out.create_dataset("labels", shape=(total_n,), dtype=np.int64)
@@ -397,19 +515,90 @@ def merge_h5_shards(
         out.attrs["channels"] = channels
         out.attrs["channel_order"] = channel_order
 
+        # Labels and stamps are small — copy them here, a slice at a time.
+        shard_starts: list[int] = []
         offset = 0
+        raw_shards: set[str] = set()
         for path, n in zip(ordered, shard_sizes):
+            shard_starts.append(offset)
             with h5py.File(path, "r") as inp:
-                images_ds[offset : offset + n] = inp["images"][:]
-                labels_ds[offset : offset + n] = inp["labels"][:]
-                stamps_ds[offset : offset + n] = inp["detection_stamps"][:]
+                if raw_copy and _same_image_storage(inp["images"], images_ds):
+                    raw_shards.add(str(path))
+                for start in range(0, n, chunk_n * 64):
+                    end = min(start + chunk_n * 64, n)
+                    labels_ds[offset + start : offset + end] = inp["labels"][start:end]
+                    stamps_ds[offset + start : offset + end] = inp["detection_stamps"][start:end]
             offset += n
 
+        def merge_tasks():
+            shard = 0
+            for index, chunk_start in enumerate(range(0, total_n, chunk_n)):
+                chunk_end = min(chunk_start + chunk_n, total_n)
+                pieces: list[tuple[str, int, int]] = []
+                row = chunk_start
+                while row < chunk_end:
+                    while row >= shard_starts[shard] + shard_sizes[shard]:
+                        shard += 1
+                    start = row - shard_starts[shard]
+                    end = min(chunk_end - shard_starts[shard], shard_sizes[shard])
+                    pieces.append((str(ordered[shard]), start, end))
+                    row += end - start
+                task: dict[str, Any] = {"index": index}
+                if len(pieces) == 1 and pieces[0][0] in raw_shards and pieces[0][1] % chunk_n == 0:
+                    task["raw"] = (pieces[0][0], pieces[0][1])
+                else:
+                    task.update(
+                        pieces=pieces,
+                        chunk_rows=chunk_n,
+                        sample_shape=sample_shape,
+                        encode=encode,
+                        level=compression_opts,
+                    )
+                yield task
+
+        def write_chunk(result: tuple[int, int, Any]) -> None:
+            index, filter_mask, payload = result
+            chunk_start = index * chunk_n
+            if isinstance(payload, np.ndarray):
+                images_ds[chunk_start : chunk_start + len(payload)] = payload
+            else:
+                images_ds.id.write_direct_chunk((chunk_start,) + (0,) * len(sample_shape), payload, filter_mask)
+
+        tasks = merge_tasks()
+        if readers > 0:
+            # Spawn, so the readers don't inherit this process's open HDF5 handles.
+            with ProcessPoolExecutor(
+                max_workers=readers,
+                mp_context=multiprocessing.get_context("spawn"),
+            ) as pool:
+                pending: deque = deque()
+                for task in tasks:
+                    n_raw += "raw" in task
+                    pending.append(pool.submit(_read_merge_chunk, task))
+                    if len(pending) >= max_chunks_in_flight:
+                        write_chunk(pending.popleft().result())
+                while pending:
+                    write_chunk(pending.popleft().result())
+        else:
+            try:
+                for task in tasks:
+                    n_raw += "raw" in task
+                    write_chunk(_read_merge_chunk(task))
+            finally:
+                _close_merge_reader_handles()
+
     if delete_shards:
         for path in ordered:
             path.unlink(missing_ok=True)
 
-    LOGGER.info("Merged %d shards -> %s (%d samples)", len(ordered), output_path, total_n)
+    LOGGER.info(
+        "Merged %d shards -> %s (%d samples, %d of %d image chunks copied without recompression)",
+        len(ordered),
+        output_path,
+        total_n,
+        n_raw,
+        (total_n + chunk_n - 1) // chunk_n,
+    )
     return total_n
 
 
@@ -7,11 +7,14 @@ per-image real-bogus probabilities compatible with the legacy psat-ml pipeline.
 
 from __future__ import annotations
 
+import io
 import logging
 import os
+import time
 from collections import defaultdict
 from dataclasses import dataclass
 from pathlib import Path
+from typing import Any
 
 import numpy as np
 import torch
@@ -29,16 +32,34 @@ from panstarrs_cnn_model import PanSTARRSCNN
 
 LOGGER = logging.getLogger(__name__)
 
+# Inference runtimes. The compiled ones are CPU only.
+RUNTIME_EAGER = "eager"
+RUNTIME_TORCHSCRIPT = "torchscript"
+RUNTIME_ONNX = "onnx"
+RUNTIMES = (RUNTIME_EAGER, RUNTIME_TORCHSCRIPT, RUNTIME_ONNX)
+# Checkpoints written by cnn_quantise.py hold an int8 TorchScript module under this key.
+RUNTIME_INT8 = "int8"
+QUANTISED_MODEL_KEY = "quantised_torchscript"
+
+# A compiled model is only used if its probabilities match eager mode to within this.
+COMPILED_PROBABILITY_TOLERANCE = 1e-4
+
+AUTOTUNE_BATCH_SIZES = (16, 32, 64, 128, 256)
+AUTOTUNE_SECONDS_PER_TRIAL = 0.5
+
 
 @dataclass
 class PyTorchClassifierBundle:
-    model: PanSTARRSCNN
+    model: Any
     device: torch.device
     decision_threshold: float
     lowers: np.ndarray
     uppers: np.ndarray
     camera: str
     model_path: Path
+    runtime: str = RUNTIME_EAGER
+    batch_size: int | None = None
+    threads: int | None = None
 
 
 def pick_device() -> torch.device:
@@ -47,6 +68,168 @@ def pick_device() -> torch.device:
     return torch.device("cpu")
 
 
+def available_cores() -> int:
+    """Cores this process may run on (respects taskset / cgroup CPU affinity)."""
+    try:
+        return max(len(os.sched_getaffinity(0)), 1)
+    except AttributeError:
+        return max(os.cpu_count() or 1, 1)
+
+
+def threads_per_worker(workers: int = 1) -> int:
+    """Intra-op threads for each of ``workers`` processes sharing the host, without oversubscribing."""
+    return max(available_cores() // max(int(workers), 1), 1)
+
+
+def set_torch_threads(threads: int) -> None:
+    torch.set_num_threads(int(threads))
+    try:
+        # Only allowed before any inter-op parallel work has started.
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass
+
+
+class OnnxRuntimeModel:
+    """ONNX Runtime session that can be called like the PyTorch model (logits tensor in and out)."""
+
+    def __init__(self, onnx_bytes: bytes, threads: int = 1) -> None:
+        try:
+            import onnxruntime
+        except ImportError as exc:
+            raise ImportError("The onnx runtime requires onnxruntime: pip install onnxruntime") from exc
+
+        self.onnx_bytes = onnx_bytes
+        self.threads = int(threads)
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = self.threads
+        options.inter_op_num_threads = 1
+        options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(
+            onnx_bytes, sess_options=options, providers=["CPUExecutionProvider"]
+        )
+        self.input_name = self.session.get_inputs()[0].name
+
+    def with_threads(self, threads: int) -> OnnxRuntimeModel:
+        return OnnxRuntimeModel(self.onnx_bytes, threads=threads)
+
+    def __call__(self, tensor: torch.Tensor) -> torch.Tensor:
+        logits = self.session.run(None, {self.input_name: tensor.detach().cpu().numpy().astype(np.float32)})[0]
+        return torch.from_numpy(logits)
+
+
+def compile_classifier(model: PanSTARRSCNN, runtime: str, threads: int = 1) -> Any:
+    """
+    Build a compiled CPU inference module from an eager (eval mode) model.
+
+    torchscript: traced, frozen and optimised for inference (folds conv/batch-norm, drops
+    dropout, fuses conv+activation where the backend supports it).
+    onnx: exported and run with ONNX Runtime at full graph optimisation.
+    """
+    example = torch.zeros(1, 3, IMAGE_SIZE, IMAGE_SIZE)
+    if runtime == RUNTIME_TORCHSCRIPT:
+        with torch.no_grad():
+            traced = torch.jit.trace(model, example)
+            frozen = torch.jit.freeze(traced)
+            return torch.jit.optimize_for_inference(frozen)
+    if runtime == RUNTIME_ONNX:
+        buffer = io.BytesIO()
+        with torch.no_grad():
+            torch.onnx.export(
+                model,
+                (example,),
+                buffer,
+                input_names=["images"],
+                output_names=["logits"],
+                dynamic_axes={"images": {0: "batch"}, "logits": {0: "batch"}},
+                opset_version=17,
+                dynamo=False,
+            )
+        return OnnxRuntimeModel(buffer.getvalue(), threads=threads)
+    raise ValueError(f"runtime must be one of {RUNTIMES}, got {runtime!r}")
+
+
+def compiled_matches_eager(
+    eager: PanSTARRSCNN,
+    compiled: Any,
+    *,
+    n_samples: int = 64,
+    tolerance: float = COMPILED_PROBABILITY_TOLERANCE,
+    seed: int = 0,
+) -> tuple[bool, float]:
+    """Compare compiled and eager probabilities on random stamps. Returns (ok, max abs difference)."""
+    generator = torch.Generator().manual_seed(seed)
+    sample = torch.rand(n_samples, 3, IMAGE_SIZE, IMAGE_SIZE, generator=generator)
+    with torch.no_grad():
+        expected = torch.sigmoid(eager(sample)).numpy().ravel()
+        actual = torch.sigmoid(compiled(sample)).numpy().ravel()
+    difference = float(np.max(np.abs(expected - actual)))
+    return difference <= tolerance, difference
+
+
+def _throughput(model: Any, batch_size: int, seconds: float) -> float:
+    """Stamps per second for one batch size (after a warm-up batch)."""
+    batch = torch.rand(batch_size, 3, IMAGE_SIZE, IMAGE_SIZE)
+    with torch.no_grad():
+        model(batch)
+        n = 0
+        start = time.perf_counter()
+        while True:
+            model(batch)
+            n += batch_size
+            elapsed = time.perf_counter() - start
+            if elapsed >= seconds:
+                return n / elapsed
+
+
+def autotune_inference(
+    model: Any,
+    *,
+    workers: int = 1,
+    batch_sizes: tuple[int, ...] = AUTOTUNE_BATCH_SIZES,
+    seconds_per_trial: float = AUTOTUNE_SECONDS_PER_TRIAL,
+) -> tuple[Any, int, int]:
+    """
+    Pick the batch size and intra-op thread count for this host.
+
+    The thread counts tried never exceed this worker's share of the cores (``workers``
+    processes sharing the box), so workers don't oversubscribe each other.
+    Returns (model, batch_size, threads); for ONNX the returned model is a session with that
+    thread count.
+    """
+    max_threads = threads_per_worker(workers)
+    thread_counts = sorted({1, max_threads} | {t for t in (2, 4, 8, 16, 32) if t < max_threads})
+
+    best = (0.0, batch_sizes[0], 1)
+    best_model = model
+    for threads in thread_counts:
+        if isinstance(model, OnnxRuntimeModel):
+            candidate = model.with_threads(threads)
+        else:
+            set_torch_threads(threads)
+            candidate = model
+        for batch_size in batch_sizes:
+            rate = _throughput(candidate, batch_size, seconds_per_trial)
+            LOGGER.debug("Autotune: threads=%d batch_size=%d -> %.1f stamps/s", threads, batch_size, rate)
+            if rate > best[0]:
+                best = (rate, batch_size, threads)
+                best_model = candidate
+
+    rate, batch_size, threads = best
+    if not isinstance(model, OnnxRuntimeModel):
+        set_torch_threads(threads)
+    LOGGER.info(
+        "Autotuned inference for %d worker(s) on %d cores: batch_size=%d threads=%d (%.1f stamps/s)",
+        workers,
+        available_cores(),
+        batch_size,
+        threads,
+        rate,
+    )
+    return best_model, batch_size, threads
+
+
 def resolve_zscale_stats_path(
     camera: str,
     *,
@@ -89,8 +272,23 @@ def load_pytorch_classifier(
     zscale_stats_path: str | Path | None = None,
     data_root: str | Path | None = None,
     device: torch.device | None = None,
+    runtime: str = RUNTIME_EAGER,
+    autotune: bool = False,
+    threads: int | None = None,
+    workers: int = 1,
 ) -> PyTorchClassifierBundle:
-    """Load a trained .pt checkpoint and matching z-scale stats."""
+    """
+    Load a trained .pt checkpoint and matching z-scale stats.
+
+    ``runtime`` torchscript or onnx builds a compiled CPU module from the checkpoint, which is
+    only used if its probabilities match eager mode (else we fall back to eager). ``threads``
+    fixes the intra-op thread count; ``autotune`` instead picks it, and the batch size, for
+    ``workers`` processes sharing this host.
+
+    An int8 checkpoint from cnn_quantise.py is loaded as is (CPU only, ``runtime`` is ignored).
+    """
+    if runtime not in RUNTIMES:
+        raise ValueError(f"runtime must be one of {RUNTIMES}, got {runtime!r}")
     model_path = Path(model_path)
     if not model_path.is_file():
         raise FileNotFoundError(model_path)
@@ -106,26 +304,70 @@ def load_pytorch_classifier(
     lowers, uppers = load_zscale_stats(stats_path)
 
     checkpoint = torch.load(model_path, map_location=device)
-    model = PanSTARRSCNN().to(device)
-    model.load_state_dict(checkpoint["model_state_dict"])
+    quantised = QUANTISED_MODEL_KEY in checkpoint
+    if quantised:
+        if device.type != "cpu":
+            LOGGER.warning("Quantised models are CPU only. Ignoring device %s.", device)
+            device = torch.device("cpu")
+        engine = checkpoint.get("quantised_engine")
+        if engine in torch.backends.quantized.supported_engines:
+            torch.backends.quantized.engine = engine
+        model = torch.jit.load(io.BytesIO(checkpoint[QUANTISED_MODEL_KEY]), map_location=device)
+    else:
+        model = PanSTARRSCNN().to(device)
+        model.load_state_dict(checkpoint["model_state_dict"])
     model.eval()
 
+    if device.type == "cpu":
+        threads = int(threads) if threads else threads_per_worker(workers)
+        set_torch_threads(threads)
+    else:
+        threads = None
+        if runtime != RUNTIME_EAGER:
+            LOGGER.warning("The %s runtime is CPU only. Using eager mode on %s.", runtime, device)
+            runtime = RUNTIME_EAGER
+
+    inference_model: Any = model
+    if quantised:
+        runtime = RUNTIME_INT8
+    elif runtime != RUNTIME_EAGER:
+        compiled = compile_classifier(model, runtime, threads=threads)
+        ok, difference = compiled_matches_eager(model, compiled)
+        if ok:
+            inference_model = compiled
+        else:
+            LOGGER.warning(
+                "%s probabilities differ from eager mode by %.3g (> %.3g). Using eager mode.",
+                runtime,
+                difference,
+                COMPILED_PROBABILITY_TOLERANCE,
+            )
+            runtime = RUNTIME_EAGER
+
+    batch_size = None
+    if autotune and device.type == "cpu":
+        inference_model, batch_size, threads = autotune_inference(inference_model, workers=workers)
+
     threshold = float(checkpoint.get("decision_threshold", 0.5))
     LOGGER.info(
-        "Loaded PyTorch CNN %s for %s (threshold=%.3f, z-scale from %s)",
+        "Loaded PyTorch CNN %s for %s (threshold=%.3f, z-scale from %s, runtime=%s)",
         model_path,
         camera,
         threshold,
         stats_path,
+        runtime,
     )
     return PyTorchClassifierBundle(
-        model=model,
+        model=inference_model,
         device=device,
         decision_threshold=threshold,
         lowers=lowers,
         uppers=uppers,
         camera=camera,
         model_path=model_path,
+        runtime=runtime,
+        batch_size=batch_size,
+        threads=threads,
     )
 
 
@@ -146,8 +388,11 @@ def predict_triplet_probabilities(
     Run inference on diff (or DB-style) FITS paths.
 
     Returns (filenames_used, probabilities) aligned arrays. Missing triplets
-    are skipped.
+    are skipped. An autotuned bundle's batch size overrides ``batch_size``.
     """
+    if bundle.batch_size:
+        batch_size = bundle.batch_size
+
     valid_paths: list[str] = []
     tensors: list[np.ndarray] = []
 
@@ -208,6 +453,10 @@ def get_rb_values_pytorch(
     data_root: str | Path | None = None,
     replace_from: str | None = None,
     replace_to: str | None = None,
+    runtime: str = RUNTIME_EAGER,
+    autotune: bool = False,
+    threads: int | None = None,
+    workers: int = 1,
 ) -> dict[str, list[float]]:
     """
     Drop-in analogue of runKerasTensorflowClassifierOnPSATImages.getRBValues.
@@ -219,6 +468,10 @@ def get_rb_values_pytorch(
         camera,
         zscale_stats_path=zscale_stats_path,
         data_root=data_root,
+        runtime=runtime,
+        autotune=autotune,
+        threads=threads,
+        workers=workers,
     )
     used_paths, probs = predict_triplet_probabilities(
         image_filenames,
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+Post-training int8 quantisation of the Pan-STARRS triplet CNN, with accuracy guardrails.
+
+Static mode quantises the whole network (conv stack and head) with activation ranges
+calibrated on the validation split; dynamic mode only quantises the dense head (weights
+int8, activations quantised on the fly) and needs no calibration.
+
+The float and int8 models are then both run over the validation split and compared:
+ROC AUC, false positive rate at a fixed missed detection rate, and per-class score drift.
+The quantised model is only written if it stays within the guardrails (or --force).
+
+The output is an ordinary .pt checkpoint (with the quantised TorchScript module inside),
+so cnn_inference.load_pytorch_classifier loads it as a drop-in:
+
+  python cnn_quantise.py --model cnn_models/cnn_model_ps1.pt --camera PS1 \\
+      --output cnn_models/cnn_model_ps1_int8.pt
+"""
+
+from __future__ import annotations
+
+import argparse
+import copy
+import io
+import json
+import logging
+import sys
+import time
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Subset
+
+from cnn_data import (
+    CNN_DATA_ROOT,
+    IMAGE_SIZE,
+    ORIG_LABEL_NAMES,
+    H5TripletDataset,
+    split_h5_path,
+)
+from cnn_inference import (
+    QUANTISED_MODEL_KEY,
+    load_pytorch_classifier,
+    resolve_zscale_stats_path,
+)
+
+LOGGER = logging.getLogger(__name__)
+
+QUANTISE_MODES = ("static", "dynamic")
+
+# Guardrail defaults.
+MAX_AUC_DROP = 0.002
+MAX_FPR_INCREASE = 0.005
+MAX_MEAN_DRIFT = 0.01
+FIXED_MDR = 0.05
+
+
+def quantised_engine() -> str:
+    """Best available quantised CPU kernel backend."""
+    engines = torch.backends.quantized.supported_engines
+    for engine in ("x86", "fbgemm", "qnnpack"):
+        if engine in engines:
+            return engine
+    raise RuntimeError("This PyTorch build has no quantised CPU engine")
+
+
+def roc_auc(labels: np.ndarray, scores: np.ndarray) -> float:
+    """ROC AUC (Mann-Whitney U, ties counted as half)."""
+    labels = np.asarray(labels).astype(bool)
+    scores = np.asarray(scores, dtype=np.float64)
+    n_pos = int(labels.sum())
+    n_neg = int(labels.size - n_pos)
+    if n_pos == 0 or n_neg == 0:
+        return float("nan")
+    order = np.argsort(scores, kind="mergesort")
+    sorted_scores = scores[order]
+    ranks = np.empty(scores.size, dtype=np.float64)
+    # Average ranks over ties.
+    _, first, counts = np.unique(sorted_scores, return_index=True, return_counts=True)
+    average = first + (counts + 1) / 2.0
+    ranks[order] = np.repeat(average, counts)
+    return float((ranks[labels].sum() - n_pos * (n_pos + 1) / 2.0) / (n_pos * n_neg))
+
+
+def fpr_at_mdr(labels: np.ndarray, scores: np.ndarray, mdr: float = FIXED_MDR) -> tuple[float, float]:
+    """
+    False positive rate at the threshold that misses a fraction ``mdr`` of the real objects.
+    Returns (fpr, threshold).
+    """
+    labels = np.asarray(labels).astype(bool)
+    scores = np.asarray(scores, dtype=np.float64)
+    if labels.sum() == 0 or (~labels).sum() == 0:
+        return float("nan"), float("nan")
+    threshold = float(np.quantile(scores[labels], mdr))
+    return float(np.mean(scores[~labels] >= threshold)), threshold
+
+
+def predict_dataset(model: Any, loader: DataLoader) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Run a model over a loader. Returns (probabilities, binary labels, original labels)."""
+    probs: list[np.ndarray] = []
+    labels: list[np.ndarray] = []
+    origs: list[np.ndarray] = []
+    with torch.no_grad():
+        for tensor, label, orig in loader:
+            probs.append(torch.sigmoid(model(tensor.float())).numpy().ravel())
+            labels.append(label.numpy())
+            origs.append(orig.numpy())
+    return np.concatenate(probs), np.concatenate(labels), np.concatenate(origs)
+
+
+def compare_models(
+    float_probs: np.ndarray,
+    int8_probs: np.ndarray,
+    labels: np.ndarray,
+    origs: np.ndarray,
+    mdr: float = FIXED_MDR,
+) -> dict[str, Any]:
+    """ROC AUC, FPR at fixed MDR and per-class score drift of the int8 model against the float one."""
+    float_fpr, float_threshold = fpr_at_mdr(labels, float_probs, mdr)
+    int8_fpr, int8_threshold = fpr_at_mdr(labels, int8_probs, mdr)
+    drift = int8_probs.astype(np.float64) - float_probs.astype(np.float64)
+
+    per_class: dict[str, dict[str, float]] = {}
+    for orig_label, name in ORIG_LABEL_NAMES.items():
+        mask = origs == orig_label
+        if not mask.any():
+            continue
+        per_class[name] = {
+            "n": int(mask.sum()),
+            "mean_drift": float(drift[mask].mean()),
+            "mean_abs_drift": float(np.abs(drift[mask]).mean()),
+            "max_abs_drift": float(np.abs(drift[mask]).max()),
+        }
+
+    return {
+        "n_samples": int(labels.size),
+        "fixed_mdr": mdr,
+        "float": {"roc_auc": roc_auc(labels, float_probs), "fpr_at_mdr": float_fpr, "threshold_at_mdr": float_threshold},
+        "int8": {"roc_auc": roc_auc(labels, int8_probs), "fpr_at_mdr": int8_fpr, "threshold_at_mdr": int8_threshold},
+        "mean_abs_drift": float(np.abs(drift).mean()),
+        "max_abs_drift": float(np.abs(drift).max()),
+        "per_class_drift": per_class,
+    }
+
+
+def check_guardrails(
+    report: dict[str, Any],
+    max_auc_drop: float = MAX_AUC_DROP,
+    max_fpr_increase: float = MAX_FPR_INCREASE,
+    max_mean_drift: float = MAX_MEAN_DRIFT,
+) -> list[str]:
+    """Return a list of guardrail failures (empty = passed)."""
+    failures: list[str] = []
+    auc_drop = report["float"]["roc_auc"] - report["int8"]["roc_auc"]
+    if auc_drop > max_auc_drop:
+        failures.append(f"ROC AUC dropped by {auc_drop:.4f} (> {max_auc_drop})")
+    fpr_increase = report["int8"]["fpr_at_mdr"] - report["float"]["fpr_at_mdr"]
+    if fpr_increase > max_fpr_increase:
+        failures.append(
+            f"FPR at MDR={report['fixed_mdr']} rose by {fpr_increase:.4f} (> {max_fpr_increase})"
+        )
+    for name, stats in report["per_class_drift"].items():
+        if stats["mean_abs_drift"] > max_mean_drift:
+            failures.append(f"{name} mean score drift {stats['mean_abs_drift']:.4f} (> {max_mean_drift})")
+    return failures
+
+
+def quantise_model(
+    model: torch.nn.Module,
+    mode: str = "static",
+    calibration_loader: DataLoader | None = None,
+    calibration_batches: int = 32,
+) -> torch.jit.ScriptModule:
+    """
+    Quantise an eval mode float model and return it as a frozen TorchScript module.
+
+    static: FX graph mode post-training quantisation; activation observers are calibrated
+    on ``calibration_batches`` batches from ``calibration_loader``.
+    dynamic: int8 weights for the Linear layers only.
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping, quantize_dynamic
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    engine = quantised_engine()
+    torch.backends.quantized.engine = engine
+    model = copy.deepcopy(model).cpu().eval()
+    example = torch.zeros(1, 3, IMAGE_SIZE, IMAGE_SIZE)
+
+    if mode == "static":
+        if calibration_loader is None:
+            raise ValueError("Static quantisation needs a calibration loader")
+        prepared = prepare_fx(model, get_default_qconfig_mapping(engine), example_inputs=(example,))
+        with torch.no_grad():
+            for i, (tensor, _, _) in enumerate(calibration_loader):
+                if i >= calibration_batches:
+                    break
+                prepared(tensor.float())
+        quantised = convert_fx(prepared)
+    elif mode == "dynamic":
+        quantised = quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    else:
+        raise ValueError(f"mode must be one of {QUANTISE_MODES}, got {mode!r}")
+
+    with torch.no_grad():
+        return torch.jit.freeze(torch.jit.trace(quantised, example))
+
+
+def save_quantised_checkpoint(
+    output_path: str | Path,
+    scripted: torch.jit.ScriptModule,
+    source_checkpoint: dict[str, Any],
+    mode: str,
+    report: dict[str, Any],
+) -> None:
+    buffer = io.BytesIO()
+    torch.jit.save(scripted, buffer)
+    payload = {
+        QUANTISED_MODEL_KEY: buffer.getvalue(),
+        "quantised_engine": torch.backends.quantized.engine,
+        "quantisation_mode": mode,
+        "quantisation_report": json.dumps(report),
+        "decision_threshold": float(source_checkpoint.get("decision_threshold", 0.5)),
+    }
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    torch.save(payload, output_path)
+    LOGGER.info("Wrote quantised model: %s", output_path)
+
+
+def benchmark_speed(model: Any, batch_size: int = 64, repeats: int = 5) -> float:
+    """Stamps per second on random input."""
+    batch = torch.rand(batch_size, 3, IMAGE_SIZE, IMAGE_SIZE)
+    with torch.no_grad():
+        model(batch)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            model(batch)
+    return batch_size * repeats / (time.perf_counter() - start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Quantise the Pan-STARRS triplet CNN to int8.")
+    parser.add_argument("--model", required=True, help="Float checkpoint, e.g. cnn_models/cnn_model_ps1.pt")
+    parser.add_argument("--camera", required=True, choices=["PS1", "PS2"], help="Camera (selects the split and z-scale stats)")
+    parser.add_argument("--output", required=True, help="Quantised checkpoint to write")
+    parser.add_argument("--mode", default="static", choices=QUANTISE_MODES, help="Quantisation mode")
+    parser.add_argument("--data-root", default=str(CNN_DATA_ROOT), help="CNN data root (parent of PS1/PS2 folders)")
+    parser.add_argument("--valid-h5", default=None, help="Override the validation split HDF5")
+    parser.add_argument("--zscale-stats", default=None, help="Override zscale_stats.json path")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--calibration-batches", type=int, default=32, help="Validation batches used to calibrate (static)")
+    parser.add_argument("--max-eval-samples", type=int, default=0, help="Limit the evaluation to this many validation samples (0 = all)")
+    parser.add_argument("--mdr", type=float, default=FIXED_MDR, help="Missed detection rate for the FPR comparison")
+    parser.add_argument("--max-auc-drop", type=float, default=MAX_AUC_DROP)
+    parser.add_argument("--max-fpr-increase", type=float, default=MAX_FPR_INCREASE)
+    parser.add_argument("--max-mean-drift", type=float, default=MAX_MEAN_DRIFT)
+    parser.add_argument("--force", action="store_true", help="Write the model even if the guardrails fail")
+    parser.add_argument("--report", default=None, help="Also write the comparison report (JSON) here")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    bundle = load_pytorch_classifier(
+        args.model,
+        args.camera,
+        zscale_stats_path=args.zscale_stats,
+        data_root=args.data_root,
+        device=torch.device("cpu"),
+    )
+    float_model = bundle.model
+    source_checkpoint = torch.load(args.model, map_location="cpu")
+
+    valid_h5 = Path(args.valid_h5) if args.valid_h5 else split_h5_path(Path(args.data_root), args.camera, "valid")
+    stats_path = resolve_zscale_stats_path(
+        args.camera, explicit=args.zscale_stats, model_path=args.model, data_root=args.data_root
+    )
+    dataset = H5TripletDataset(valid_h5, preprocess=True, norm_stats_path=stats_path)
+    if args.max_eval_samples and len(dataset) > args.max_eval_samples:
+        # An evenly spaced subset keeps the class mix of the split.
+        dataset = Subset(dataset, np.linspace(0, len(dataset) - 1, args.max_eval_samples).astype(int).tolist())
+    loader = DataLoader(dataset, batch_size=args.batch_size, shuffle=False)
+
+    LOGGER.info("Quantising (%s) %s", args.mode, args.model)
+    scripted = quantise_model(
+        float_model,
+        mode=args.mode,
+        calibration_loader=loader,
+        calibration_batches=args.calibration_batches,
+    )
+
+    LOGGER.info("Evaluating float and int8 models on %d samples from %s", len(dataset), valid_h5)
+    float_probs, labels, origs = predict_dataset(float_model, loader)
+    int8_probs, _, _ = predict_dataset(scripted, loader)
+    report = compare_models(float_probs, int8_probs, labels, origs, mdr=args.mdr)
+    report["float"]["stamps_per_second"] = benchmark_speed(float_model, args.batch_size)
+    report["int8"]["stamps_per_second"] = benchmark_speed(scripted, args.batch_size)
+    report["speedup"] = report["int8"]["stamps_per_second"] / report["float"]["stamps_per_second"]
+
+    print(json.dumps(report, indent=2))
+    if args.report:
+        Path(args.report).write_text(json.dumps(report, indent=2), encoding="utf-8")
+
+    failures = check_guardrails(
+        report,
+        max_auc_drop=args.max_auc_drop,
+        max_fpr_increase=args.max_fpr_increase,
+        max_mean_drift=args.max_mean_drift,
+    )
+    for failure in failures:
+        LOGGER.warning("Guardrail failed: %s", failure)
+
+    if failures and not args.force:
+        print("Quantised model NOT written (guardrails failed). Use --force to write it anyway.", file=sys.stderr)
+        sys.exit(1)
+
+    save_quantised_checkpoint(args.output, scripted, source_checkpoint, args.mode, report)
+
+
+if __name__ == "__main__":
+    main()
@@ -149,3 +149,96 @@ def updateObjectRBFactors(conn, objectId, realBogusValue, tableName, columnName)
 
     return rowsUpdated
 
+
+
+# Connection specific temporary table that the bulk score updates are loaded into.
+RB_SCORES_TABLE = 'tmp_rb_scores'
+
+# Number of scores loaded and applied per transaction.
+RB_UPDATE_BATCH_SIZE = 10000
+
+
+def updateTransientRBValues(conn, scores, ps1Data = False, targets = None, batchSize = RB_UPDATE_BATCH_SIZE):
+    """Bulk version of updateTransientRBValue (and updateObjectRBFactors).
+
+    The (id, score) pairs are loaded into a temporary table, a batch at a time, and each batch
+    is applied with ONE joined update per target column, in an explicit transaction.
+    Returns (rows updated, list of IDs that matched no row).
+
+    Args:
+        conn: database connection
+        scores: list of (objectId, realBogusValue) tuples, or a dict of scores keyed by object ID
+        ps1Data: update tcs_transient_objects.confidence_factor (else atlas_diff_objects.zooniverse_score)
+        targets: list of (tableName, columnName) to update instead of the default above
+        batchSize: number of scores per transaction
+    """
+    import MySQLdb
+
+    if targets is None:
+        if ps1Data:
+            targets = [('tcs_transient_objects', 'confidence_factor')]
+        else:
+            targets = [('atlas_diff_objects', 'zooniverse_score')]
+
+    # Last score wins if an object appears more than once.
+    if isinstance(scores, dict):
+        scores = scores.items()
+    scores = list(dict((int(objectId), float(score)) for objectId, score in scores).items())
+
+    rowsUpdated = 0
+    unmatched = set()
+
+    if not scores:
+        return rowsUpdated, []
+
+    batchSize = max(int(batchSize), 1)
+
+    try:
+        cursor = conn.cursor(MySQLdb.cursors.Cursor)
+        cursor.execute("drop temporary table if exists %s" % RB_SCORES_TABLE)
+        cursor.execute("create temporary table %s (id bigint unsigned not null primary key, score double) engine=memory" % RB_SCORES_TABLE)
+
+        for i in range(0, len(scores), batchSize):
+            batch = scores[i:i + batchSize]
+            try:
+                cursor.execute("start transaction")
+                cursor.execute("delete from %s" % RB_SCORES_TABLE)
+                cursor.executemany("insert into " + RB_SCORES_TABLE + " (id, score) values (%s, %s)", batch)
+
+                for tableName, columnName in targets:
+                    cursor.execute ("""
+                         update %s o
+                           join %s s
+                             on s.id = o.id
+                            set o.%s = s.score
+                    """ % (tableName, RB_SCORES_TABLE, columnName))
+                    rowsUpdated += cursor.rowcount
+
+                    cursor.execute ("""
+                         select s.id
+                           from %s s
+                      left join %s o
+                             on o.id = s.id
+                          where o.id is null
+                    """ % (RB_SCORES_TABLE, tableName))
+                    unmatched.update(row[0] for row in cursor.fetchall())
+
+                conn.commit()
+            except MySQLdb.Error as e:
+                conn.rollback()
+                print("Error %d: %s" % (e.args[0], e.args[1]))
+                print("WARNING: Rolled back the scores for objects %d to %d." % (batch[0][0], batch[-1][0]))
+
+        cursor.execute("drop temporary table if exists %s" % RB_SCORES_TABLE)
+        cursor.close ()
+
+    except MySQLdb.Error as e:
+        print("Error %d: %s" % (e.args[0], e.args[1]))
+
+    unmatched = sorted(unmatched)
+
+    # Did any scores not match a transient object row? If so issue a warning.
+    if unmatched:
+        print("WARNING: %d IDs matched no transient object row: %s" % (len(unmatched), ", ".join(str(x) for x in unmatched)))
+
+    return rowsUpdated, unmatched
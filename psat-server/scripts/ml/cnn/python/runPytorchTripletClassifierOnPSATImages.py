@@ -11,7 +11,7 @@ Set PSAT_ML_PATH to the folder containing runKerasTensorflowClassifierOnPSATImag
 when using legacy comparison or if that module is not on PYTHONPATH.
 
 Usage:
-  %s <configFile> [<candidate>...] [--ps1classifier=<ps1classifier>] [--ps2classifier=<ps2classifier>] [--ps1legacyclassifier=<ps1legacyclassifier>] [--ps2legacyclassifier=<ps2legacyclassifier>] [--outputcsv=<outputcsv>] [--comparecsv=<comparecsv>] [--listid=<listid>] [--imageroot=<imageroot>] [--update] [--cnn_data_root=<cnn_data_root>] [--zscale_stats_ps1=<zscale_stats_ps1>] [--zscale_stats_ps2=<zscale_stats_ps2>] [--batch_size=<batch_size>] [--candidatesinfiles] [--trainer=<trainer>]
+  %s <configFile> [<candidate>...] [--ps1classifier=<ps1classifier>] [--ps2classifier=<ps2classifier>] [--ps1legacyclassifier=<ps1legacyclassifier>] [--ps2legacyclassifier=<ps2legacyclassifier>] [--outputcsv=<outputcsv>] [--comparecsv=<comparecsv>] [--listid=<listid>] [--imageroot=<imageroot>] [--update] [--updatebatchsize=<updatebatchsize>] [--cnn_data_root=<cnn_data_root>] [--zscale_stats_ps1=<zscale_stats_ps1>] [--zscale_stats_ps2=<zscale_stats_ps2>] [--batch_size=<batch_size>] [--runtime=<runtime>] [--autotune] [--threads=<threads>] [--candidatesinfiles] [--trainer=<trainer>]
   %s (-h | --help)
   %s --version
 
@@ -29,10 +29,14 @@ Options:
   --comparecsv=<comparecsv>               Comparison CSV when legacy classifiers are supplied.
   --imageroot=<imageroot>                 Root location of stamp images [default: /db4/images/].
   --update                                Update the database with PyTorch scores.
+  --updatebatchsize=<updatebatchsize>     Number of scores written per database transaction [default: 10000].
   --cnn_data_root=<cnn_data_root>         CNN data root for zscale_stats.json [default: /storage1/software/CNN_PANSTARRS/data].
   --zscale_stats_ps1=<zscale_stats_ps1>   Override PS1 z-scale stats JSON.
   --zscale_stats_ps2=<zscale_stats_ps2>   Override PS2 z-scale stats JSON.
   --batch_size=<batch_size>               Inference batch size [default: 32].
+  --runtime=<runtime>                     Inference runtime: eager, torchscript or onnx (compiled runtimes are CPU only) [default: eager].
+  --autotune                              Pick the inference batch size and thread count for this host at start-up.
+  --threads=<threads>                     Intra-op threads per process (default: the cores divided between the processes).
   --candidatesinfiles                     Interpret inline candidate IDs as files.
   --trainer=<trainer>                     Legacy Keras trainer module [default: PSAT-D].
 
@@ -59,7 +63,7 @@ from cnn_inference import get_rb_values_pytorch, median_final_scores
 from pytorch_utils import (
     getImages,
     getObjectsByList,
-    updateTransientRBValue,
+    updateTransientRBValues,
 )
 
 
@@ -152,6 +156,13 @@ def runPytorchTripletClassifier(opts, processNumber=None):
     ps1_filenames, ps2_filenames = _split_ps_filenames(image_filenames)
     batch_size = int(options.batch_size or 32)
     data_root = options.cnn_data_root
+    # The multiprocess wrapper tells us how many processes share the host.
+    inference_kw = {
+        "runtime": options.runtime or "eager",
+        "autotune": bool(options.autotune),
+        "threads": int(options.threads) if options.threads else None,
+        "workers": int(getattr(options, "inferenceworkers", None) or 1),
+    }
 
     pytorch_ps1 = {}
     pytorch_ps2 = {}
@@ -166,6 +177,7 @@ def runPytorchTripletClassifier(opts, processNumber=None):
             batch_size=batch_size,
             zscale_stats_path=options.zscale_stats_ps1,
             data_root=data_root,
+            **inference_kw,
         )
     if ps2_filenames and options.ps2classifier:
         pytorch_ps2 = get_rb_values_pytorch(
@@ -175,6 +187,7 @@ def runPytorchTripletClassifier(opts, processNumber=None):
             batch_size=batch_size,
             zscale_stats_path=options.zscale_stats_ps2,
             data_root=data_root,
+            **inference_kw,
         )
 
 #    if ps1_filenames and options.ps1legacyclassifier:
@@ -225,8 +238,10 @@ def runPytorchTripletClassifier(opts, processNumber=None):
     scores = list(pytorch_sorted.items())
 
     if options.update and processNumber is None:
-        for object_id, score in scores:
-            updateTransientRBValue(conn, object_id, score, ps1Data=True)
+        rows_updated, unmatched = updateTransientRBValues(
+            conn, scores, ps1Data=True, batchSize=int(options.updatebatchsize)
+        )
+        print("Updated %d objects. %d IDs matched no object." % (rows_updated, len(unmatched)))
 
     conn.commit()
     conn.close()
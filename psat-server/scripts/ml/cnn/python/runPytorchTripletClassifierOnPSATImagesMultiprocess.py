@@ -7,7 +7,7 @@ Set PSAT_ML_PATH to the folder containing runKerasTensorflowClassifierOnPSATImag
 when that module is not on PYTHONPATH.
 
 Usage:
-  %s <configFile> [<candidate>...] [--ps1classifier=<ps1classifier>] [--ps2classifier=<ps2classifier>] [--ps1legacyclassifier=<ps1legacyclassifier>] [--ps2legacyclassifier=<ps2legacyclassifier>] [--outputcsv=<outputcsv>] [--comparecsv=<comparecsv>] [--listid=<listid>] [--imageroot=<imageroot>] [--update] [--cnn_data_root=<cnn_data_root>] [--zscale_stats_ps1=<zscale_stats_ps1>] [--zscale_stats_ps2=<zscale_stats_ps2>] [--batch_size=<batch_size>] [--loglocation=<loglocation>] [--logprefix=<logprefix>] [--candidatesinfiles] [--trainer=<trainer>]
+  %s <configFile> [<candidate>...] [--ps1classifier=<ps1classifier>] [--ps2classifier=<ps2classifier>] [--ps1legacyclassifier=<ps1legacyclassifier>] [--ps2legacyclassifier=<ps2legacyclassifier>] [--outputcsv=<outputcsv>] [--comparecsv=<comparecsv>] [--listid=<listid>] [--imageroot=<imageroot>] [--update] [--updatebatchsize=<updatebatchsize>] [--cnn_data_root=<cnn_data_root>] [--zscale_stats_ps1=<zscale_stats_ps1>] [--zscale_stats_ps2=<zscale_stats_ps2>] [--batch_size=<batch_size>] [--runtime=<runtime>] [--autotune] [--threads=<threads>] [--loglocation=<loglocation>] [--logprefix=<logprefix>] [--candidatesinfiles] [--trainer=<trainer>]
   %s (-h | --help)
   %s --version
 
@@ -25,10 +25,14 @@ Options:
   --comparecsv=<comparecsv>               Combined comparison CSV when legacy classifiers are supplied.
   --imageroot=<imageroot>                 Root location of stamp images [default: /db4/images/].
   --update                                Update the database with PyTorch scores.
+  --updatebatchsize=<updatebatchsize>     Number of scores written per database transaction [default: 10000].
   --cnn_data_root=<cnn_data_root>         CNN data root for zscale_stats.json [default: /storage1/software/CNN_PANSTARRS/data].
   --zscale_stats_ps1=<zscale_stats_ps1>   Override PS1 z-scale stats JSON.
   --zscale_stats_ps2=<zscale_stats_ps2>   Override PS2 z-scale stats JSON.
   --batch_size=<batch_size>               Inference batch size [default: 32].
+  --runtime=<runtime>                     Inference runtime: eager, torchscript or onnx (compiled runtimes are CPU only) [default: eager].
+  --autotune                              Pick the inference batch size and thread count for this host at start-up.
+  --threads=<threads>                     Intra-op threads per process (default: the cores divided between the processes).
   --loglocation=<loglocation>             Log file location [default: /tmp/].
   --logprefix=<logprefix>                 Log prefix [default: ml_pytorch_].
   --candidatesinfiles                     Interpret inline candidate IDs as files.
@@ -55,7 +59,7 @@ from gkutils.commonutils import Struct, cleanOptions, dbConnect, parallelProcess
 
 from pytorch_utils import (
     getObjectsByList,
-    updateTransientRBValue,
+    updateTransientRBValues,
 )
 
 from runPytorchTripletClassifierOnPSATImages import runPytorchTripletClassifier
@@ -190,6 +194,8 @@ def runPytorchTripletClassifierMultiprocess(opts):
 
         if len(object_list) > 0:
             n_processors, list_chunks = splitList(sub_list, bins=64)
+            # Share the cores between the worker processes.
+            options.inferenceworkers = n_processors
 
             print("%s Parallel Processing..." % datetime.datetime.now().strftime("%Y:%m:%d:%H:%M:%S"))
             objects_for_update = parallelProcess(
@@ -220,8 +226,10 @@ def runPytorchTripletClassifierMultiprocess(opts):
                 print("Wrote combined comparison CSV:", options.comparecsv)
 
             if options.update:
-                for row in objects_for_update:
-                    updateTransientRBValue(conn, row[0], row[1], ps1Data=True)
+                rows_updated, unmatched = updateTransientRBValues(
+                    conn, objects_for_update, ps1Data=True, batchSize=int(options.updatebatchsize)
+                )
+                print("Updated %d objects. %d IDs matched no object." % (rows_updated, len(unmatched)))
 
     conn.close()
     return all_objects_for_update
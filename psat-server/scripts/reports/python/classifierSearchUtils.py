@@ -1,6 +1,7 @@
 import MySQLdb
 #from utils import *
-from gkutils.commonutils import enum, coneSearchHTM, QUICK, FULL, CAT_ID_RA_DEC_COLS, redshiftToDistance
+from gkutils.commonutils import enum, getAngularSeparation, QUICK, FULL, CAT_ID_RA_DEC_COLS
+from cosmologyUtils import redshiftsToDistances
 import math
 
 ALGORITHMS = enum(THREEPI='THREEPI', MD01='MD01', MD02='MD02', MD03='MD03', MD04='MD04', MD05='MD05', MD06='MD06', MD07='MD07', MD08='MD08', MD09='MD09', MD10='MD10', PESSTO='PESSTO', NEARBYBRIGHT='NEARBYBRIGHT', KEPLERGALAXIES='KEPLERGALAXIES', ATLAS='ATLAS')
@@ -34,6 +35,57 @@ CLASSIFICATION_FLAGS = {'unclassified':   UNCLASSIFIED,
 
 # Do a cone search of the named catalogue
 
+# 2026-10-19 KWS Number of objects whose HTM triangles are ORed together into one catalogue query.
+CONE_SEARCH_BATCH_SIZE = 100
+
+
+def batchConeSearchHTM(conn, objectList, catalogueName, radius = 3.0, htmLevel = 16):
+   """HTM cone search of catalogueName around ALL the objects in objectList in ONE query.
+      Returns a message (empty if OK) and a dict of object id -> [[separation, catalogueRow], ...]
+      sorted by separation, in the same format as coneSearchHTM."""
+
+   from gkhtm import _gkhtm as htmCircle
+
+   try:
+      idColumn, raColumn, decColumn = CAT_ID_RA_DEC_COLS[catalogueName][0][:3]
+   except KeyError as e:
+      return "Table %s not recognised." % catalogueName, {}
+
+   # htmCircleRegion returns " where (htm16ID between a and b or ...)". OR them together.
+   htmClauses = [htmCircle.htmCircleRegion(htmLevel, float(row['ra']), float(row['dec']), radius).strip()[len('where'):].strip() for row in objectList]
+
+   try:
+      cursor = conn.cursor (MySQLdb.cursors.DictCursor)
+      cursor.execute('select * from %s where %s' % (catalogueName, ' or '.join(htmClauses)))
+      resultSet = cursor.fetchall ()
+      cursor.close ()
+   except MySQLdb.Error as e:
+      return "Error %d: %s" % (e.args[0], e.args[1]), {}
+
+   # The HTM query returns a SUPERSET for every object. Work out which catalogue rows are
+   # genuinely inside which object's cone.
+   results = {}
+   for row in objectList:
+      ra = float(row['ra'])
+      dec = float(row['dec'])
+      xmObjects = []
+      for catalogueRow in resultSet:
+         xmRa = catalogueRow[raColumn]
+         xmDec = catalogueRow[decColumn]
+         if catalogueName == 'tcs_guide_star_cat' or catalogueName == 'tcs_cat_v_guide_star_ps':
+            # Guide star cat RA and DEC are in RADIANS
+            xmRa = math.degrees(xmRa)
+            xmDec = math.degrees(xmDec)
+         if abs(xmDec - dec) * 3600.0 > radius:
+            continue
+         separation = getAngularSeparation(ra, dec, xmRa, xmDec)
+         if separation < radius:
+            xmObjects.append([separation, dict(catalogueRow)])
+      xmObjects.sort(key=lambda xm: xm[0])
+      results[row['id']] = xmObjects
+
+   return "", results
+
 
 def searchCatalogue(conn, objectList, catalogueName, radius = 3.0):
    """Cone Search wrapper to make it a little more user friendly"""
@@ -47,9 +99,10 @@ def searchCatalogue(conn, objectList, catalogueName, radius = 3.0):
    matchedObjects = []
    searchDone = True
 
-   for row in objectList:
-      #message, xmObjects = coneSearch(row['ra'], row['dec'], radius, catalogueName, queryType = FULL, conn = conn)
-      message, xmObjects = coneSearchHTM(row['ra'], row['dec'], radius, catalogueName, queryType = FULL, conn = conn)
+   # 2026-10-19 KWS One catalogue query per batch of objects rather than one per object.
+   for i in range(0, len(objectList), CONE_SEARCH_BATCH_SIZE):
+      objectBatch = objectList[i:i+CONE_SEARCH_BATCH_SIZE]
+      message, batchMatches = batchConeSearchHTM(conn, objectBatch, catalogueName, radius = radius)
 
       # Did we search the catalogues correctly?
       if message and (message.startswith('Error') or 'not recognised' in message):
@@ -58,46 +111,10 @@ def searchCatalogue(conn, objectList, catalogueName, radius = 3.0):
          print("\t%s" % message)
          searchDone = False
 
-      if xmObjects:
-         numberOfMatches = len(xmObjects)
-         nearestSep = xmObjects[0][0]
-         nearestCatRow = xmObjects[0][1]
-         nearestCatId = nearestCatRow[CAT_ID_RA_DEC_COLS[catalogueName][0][0]]
-         #print row['id'], row['name'], nearestCatId, nearestSep, numberOfMatches
-
-         redshift = None
-         xmz = None
-         xmscale = None
-         xmdistance = None
-         xmdistanceModulus = None
-
-         for xm in xmObjects:
-            # If there's a redshift, calculate physical parameters
-
-            if len(CAT_ID_RA_DEC_COLS[catalogueName][0]) > 3:
-               # The catalogue has a redshift column
-               redshift = xm[1][CAT_ID_RA_DEC_COLS[catalogueName][0][3]]
-
-            if redshift and redshift > 0.0:
-               # Calculate distance modulus, etc
-               redshiftInfo = redshiftToDistance(redshift)
-
-               if redshiftInfo:
-                  xmz = redshiftInfo['z']
-                  xmscale = redshiftInfo['da_scale']
-                  xmdistance = redshiftInfo['dl_mpc']
-                  xmdistanceModulus = redshiftInfo['dmod']
-
-            # Add the calculated parameters to the crossmatch dictionary.  This
-            # assumes that there are no columns called xmz, xmscale, xmdistance,
-            # xmdistanceModulus. Modify the crossmatch row in situ.
-
-            xm[1]['xmz'] = xmz
-            xm[1]['xmscale'] = xmscale
-            xm[1]['xmdistance'] = xmdistance
-            xm[1]['xmdistanceModulus'] = xmdistanceModulus
-
-         matchedObjects.append([row, xmObjects, catalogueName])
+      for row in objectBatch:
+         xmObjects = batchMatches.get(row['id'])
+         if xmObjects:
+            matchedObjects.append([row, xmObjects, catalogueName])
 
          # Explanation:
          #    matchedObjects[0] = original input row
@@ -107,15 +124,165 @@ def searchCatalogue(conn, objectList, catalogueName, radius = 3.0):
          #       that contains [separation, catalogueRow]
          #    matchedObjects[2] = the catalogue we searched
 
+   # 2026-10-19 KWS If there's a redshift, calculate the physical parameters for the WHOLE
+   #                match set in one go (interpolated) rather than one redshiftToDistance
+   #                call per catalogue row. Rows with no redshift now get None rather than
+   #                inheriting the values of the previous row.
+   addPhysicalParameters(matchedObjects, catalogueName)
+
    return searchDone, matchedObjects
 
 
+def addPhysicalParameters(matchedObjects, catalogueName):
+   """Add xmz, xmscale, xmdistance and xmdistanceModulus to every crossmatch row.
+      This assumes that there are no columns called xmz, xmscale, xmdistance,
+      xmdistanceModulus. Modifies the crossmatch rows in situ."""
+
+   xmRows = [xm[1] for match in matchedObjects for xm in match[1]]
+   if not xmRows:
+      return
+
+   redshifts = [None] * len(xmRows)
+   if len(CAT_ID_RA_DEC_COLS[catalogueName][0]) > 3:
+      # The catalogue has a redshift column
+      redshiftColumn = CAT_ID_RA_DEC_COLS[catalogueName][0][3]
+      redshifts = [xmRow[redshiftColumn] for xmRow in xmRows]
+
+   redshiftInfo = redshiftsToDistances(redshifts)
+
+   for i, xmRow in enumerate(xmRows):
+      if math.isnan(redshiftInfo['da_scale'][i]):
+         xmRow['xmz'] = None
+         xmRow['xmscale'] = None
+         xmRow['xmdistance'] = None
+         xmRow['xmdistanceModulus'] = None
+      else:
+         xmRow['xmz'] = float(redshiftInfo['z'][i])
+         xmRow['xmscale'] = float(redshiftInfo['da_scale'][i])
+         xmRow['xmdistance'] = float(redshiftInfo['dl_mpc'][i])
+         xmRow['xmdistanceModulus'] = float(redshiftInfo['dmod'][i])
+
+
+# 2026-10-19 KWS Several of the crossmatch methods below search the same catalogue around
+#                the same object at different radii. The candidate cache does ONE batched cone
+#                search per catalogue for the whole object list at the largest radius that any
+#                rule needs, and each rule then filters the cached matches at its own radius.
+
+class CatalogueCandidateCache:
+   """Catalogue cone search results for a batch of objects, fetched once at the maximum radius"""
+
+   def __init__(self, catalogueRadii = None):
+      # catalogueName -> maximum radius (arcsec) needed by any rule
+      self.catalogueRadii = dict(catalogueRadii) if catalogueRadii else {}
+      self.fetchedRadii = {}
+      self.fetchedIds = {}
+      self.searchDone = {}
+      self.matches = {}
+
+   def addCatalogue(self, catalogueName, radius):
+      """Register that a rule needs catalogueName searched out to radius."""
+      self.catalogueRadii[catalogueName] = max(radius, self.catalogueRadii.get(catalogueName, 0.0))
+
+   def fetch(self, conn, objectList, catalogueConnections = None):
+      """Do the cone searches for every registered catalogue for the whole object batch.
+         catalogueConnections maps catalogue names to connections other than conn."""
+      catalogueConnections = catalogueConnections if catalogueConnections else {}
+      for catalogueName, radius in self.catalogueRadii.items():
+         searchDone, matchedObjects = searchCatalogue(catalogueConnections.get(catalogueName, conn), objectList, catalogueName, radius = radius)
+         self.fetchedRadii[catalogueName] = radius
+         self.fetchedIds[catalogueName] = set(row['id'] for row in objectList)
+         self.searchDone[catalogueName] = searchDone
+         matches = {}
+         for match in matchedObjects:
+            matches[match[0]['id']] = match
+         self.matches[catalogueName] = matches
+
+   def searchCatalogue(self, conn, objectList, catalogueName, radius = 3.0):
+      """Drop-in replacement for searchCatalogue that filters the cached results. Falls back
+         to a real cone search if the catalogue was not fetched out to the requested radius,
+         or for any objects that were not in the fetched batch."""
+
+      if catalogueName not in self.fetchedRadii or radius > self.fetchedRadii[catalogueName]:
+         print("Catalogue %s not cached out to %.1f arcsec. Doing the cone search." % (catalogueName, radius))
+         return searchCatalogue(conn, objectList, catalogueName, radius = radius)
+
+      searchDone = self.searchDone[catalogueName]
+      matchedObjects = []
+      notFetched = []
+      for row in objectList:
+         if row['id'] not in self.fetchedIds[catalogueName]:
+            notFetched.append(row)
+            continue
+         match = self.matches[catalogueName].get(row['id'])
+         if match is None:
+            continue
+         xmObjects = [xm for xm in match[1] if xm[0] <= radius]
+         if xmObjects:
+            matchedObjects.append([row, xmObjects, catalogueName])
+
+      if notFetched:
+         print("%d objects not cached for catalogue %s. Doing the cone search." % (len(notFetched), catalogueName))
+         notFetchedSearchDone, notFetchedMatches = searchCatalogue(conn, notFetched, catalogueName, radius = radius)
+         searchDone = searchDone and notFetchedSearchDone
+         matchedObjects += notFetchedMatches
+
+      return searchDone, matchedObjects
+
+
+# Which catalogue each of the crossmatch methods searches. (crossmatchWithBrightStars and
+# crossmatchWithCatalogue take the catalogue as a parameter.)
+CROSSMATCH_METHOD_CATALOGUES = {'crossmatchWithNEDGalaxies':            'tcs_cat_v_ned_galaxies',
+                                'crossmatchWithSDSSSpecGalaxies':       'tcs_sdss_spect_galaxies_cat',
+                                'crossmatchWithSDSSDR9SpecGalaxies':    'tcs_cat_v_sdss_dr9_spect_galaxies',
+                                'crossmatchWithFaintSDSSPhotoStars':    'tcs_sdss_stars_cat',
+                                'crossmatchWithFaintSDSSDR9PhotoStars': 'tcs_cat_v_sdss_dr9_stars',
+                                'crossmatchWithSDSSPhotoStars':         'tcs_sdss_stars_cat',
+                                'crossmatchWithSDSSDR9PhotoStars':      'tcs_cat_v_sdss_dr9_stars',
+                                'crossmatchWithFaint2MASSStars':        'tcs_cat_v_2mass_psc_noextended',
+                                'crossmatchWithFaintGSCStars':          'tcs_cat_v_guide_star_ps',
+                                'crossmatchWithBright2MASSStars':       'tcs_cat_v_2mass_psc_noextended',
+                                'crossmatchWithBrightGSCStars':         'tcs_cat_v_guide_star_ps',
+                                'crossmatchWithBrightSDSSStars':        'tcs_cat_v_sdss_dr9_stars',
+                                'crossmatchWithBrightStars':            None,
+                                'crossmatchWithCatalogue':              None}
+
+
 # Why include the complexity of having a separate method for each catalogue?
 # Because a successful cone search doesn't necessarily mean a successful match.
 
 class CatalogueCrossmatchUtils:
    """Similar to the C++ crossmatch utils library"""
 
+   def __init__(self, candidateCache = None):
+      self.candidateCache = candidateCache
+
+   def searchCatalogue(self, conn, objectList, catalogueName, radius = 3.0):
+      """Use the candidate cache if we have one, otherwise do the cone search."""
+      if self.candidateCache is not None:
+         return self.candidateCache.searchCatalogue(conn, objectList, catalogueName, radius = radius)
+      return searchCatalogue(conn, objectList, catalogueName, radius = radius)
+
+   def getRuleCatalogueAndRadius(self, methodName, parameters):
+      """Work out which catalogue a rule searches and out to what radius."""
+      import inspect
+      defaults = {name: p.default for name, p in inspect.signature(getattr(self, methodName)).parameters.items() if p.default is not inspect.Parameter.empty}
+      defaults.update(parameters)
+      catalogueName = CROSSMATCH_METHOD_CATALOGUES.get(methodName) or defaults.get('catalogue')
+      radius = defaults['maxRadius'] if 'maxRadius' in defaults else defaults['radius']
+      return catalogueName, radius
+
+   def crossmatchWithCatalogue(self, conn, objectRow, catalogue = None, radius = 3.0):
+      """crossmatchWithCatalogue. Plain cone search of any catalogue - every match within radius.
+
+      Args:
+          conn:
+          objectRow:
+          catalogue:
+          radius:
+      """
+      return self.searchCatalogue(conn, [objectRow], catalogue, radius = radius)
+
+
    def crossmatchWithNEDGalaxies(self, conn, objectRow, radius = 3.0, physicalRadius = 0.5, angularOnly = False):
       """crossmatchWithNEDGalaxies.
 
@@ -128,7 +295,7 @@ class CatalogueCrossmatchUtils:
       """
 
       # NED Physical Galaxy search
-      searchDone, matches = searchCatalogue(conn, [objectRow], 'tcs_cat_v_ned_galaxies', radius = radius)
+      searchDone, matches = self.searchCatalogue(conn, [objectRow], 'tcs_cat_v_ned_galaxies', radius = radius)
 
       if angularOnly:
          return searchDone, matches
@@ -161,7 +328,7 @@ class CatalogueCrossmatchUtils:
       """
 
       # SDSS Spectroscopic Galaxy search
-      searchDone, matches = searchCatalogue(conn, [objectRow], 'tcs_sdss_spect_galaxies_cat', radius = radius)
+      searchDone, matches = self.searchCatalogue(conn, [objectRow], 'tcs_sdss_spect_galaxies_cat', radius = radius)
 
       # OK - we have some angular separation matches. Now search through these for matches with
       # a physical separation within the physical radius.
@@ -193,7 +360,7 @@ class CatalogueCrossmatchUtils:
       """
 
       # SDSS Spectroscopic Galaxy search
-      searchDone, matches = searchCatalogue(conn, [objectRow], 'tcs_cat_v_sdss_dr9_spect_galaxies', radius = radius)
+      searchDone, matches = self.searchCatalogue(conn, [objectRow], 'tcs_cat_v_sdss_dr9_spect_galaxies', radius = radius)
 
       # OK - we have some angular separation matches. Now search through these for matches with
       # a physical separation within the physical radius.
@@ -222,7 +389,7 @@ class CatalogueCrossmatchUtils:
           radius:
       """
 
-      searchDone, matches = searchCatalogue(conn, [objectRow], 'tcs_sdss_stars_cat', radius = radius)
+      searchDone, matches = self.searchCatalogue(conn, [objectRow], 'tcs_sdss_stars_cat', radius = radius)
 
       matchedObjects = []
       matchSubset = []
@@ -254,7 +421,7 @@ class CatalogueCrossmatchUtils:
           radius:
       """
 
-      searchDone, matches = searchCatalogue(conn, [objectRow], 'tcs_cat_v_sdss_dr9_stars', radius = radius)
+      searchDone, matches = self.searchCatalogue(conn, [objectRow], 'tcs_cat_v_sdss_dr9_stars', radius = radius)
 
       matchedObjects = []
       matchSubset = []
@@ -297,7 +464,7 @@ class CatalogueCrossmatchUtils:
                 it doesn't cross in the right place.) 
       """
 
-      searchDone, matches = searchCatalogue(conn, [objectRow], 'tcs_sdss_stars_cat', radius = radius)
+      searchDone, matches = self.searchCatalogue(conn, [objectRow], 'tcs_sdss_stars_cat', radius = radius)
 
       matchedObjects = []
       matchSubset = []
@@ -343,7 +510,7 @@ class CatalogueCrossmatchUtils:
           radius:
       """
 
-      searchDone, matches = searchCatalogue(conn, [objectRow], 'tcs_cat_v_sdss_dr9_stars', radius = radius)
+      searchDone, matches = self.searchCatalogue(conn, [objectRow], 'tcs_cat_v_sdss_dr9_stars', radius = radius)
 
       matchedObjects = []
       matchSubset = []
@@ -381,7 +548,7 @@ class CatalogueCrossmatchUtils:
           radius:
       """
 
-      searchDone, matches = searchCatalogue(conn, [objectRow], 'tcs_cat_v_2mass_psc_noextended', radius = radius)
+      searchDone, matches = self.searchCatalogue(conn, [objectRow], 'tcs_cat_v_2mass_psc_noextended', radius = radius)
 
       matchedObjects = []
       matchSubset = []
@@ -409,7 +576,7 @@ class CatalogueCrossmatchUtils:
 
       # NOTE: Not all mags are set all the time in GSC.  This only works if the VMag value is set.
 
-      searchDone, matches = searchCatalogue(conn, [objectRow], 'tcs_cat_v_guide_star_ps', radius = radius)
+      searchDone, matches = self.searchCatalogue(conn, [objectRow], 'tcs_cat_v_guide_star_ps', radius = radius)
 
       matchedObjects = []
       matchSubset = []
@@ -431,7 +598,7 @@ class CatalogueCrossmatchUtils:
       Crossmatch against Bright 2MASS Catalogue Stars
       """
 
-      searchDone, matches = searchCatalogue(conn, [objectRow], 'tcs_cat_v_2mass_psc_noextended', radius = radius)
+      searchDone, matches = self.searchCatalogue(conn, [objectRow], 'tcs_cat_v_2mass_psc_noextended', radius = radius)
 
       matchedObjects = []
       matchSubset = []
@@ -455,7 +622,7 @@ class CatalogueCrossmatchUtils:
 
       # NOTE: Not all mags are set all the time in GSC.  This only works if the VMag value is set.
 
-      searchDone, matches = searchCatalogue(conn, [objectRow], 'tcs_cat_v_guide_star_ps', radius = radius)
+      searchDone, matches = self.searchCatalogue(conn, [objectRow], 'tcs_cat_v_guide_star_ps', radius = radius)
 
       matchedObjects = []
       matchSubset = []
@@ -479,7 +646,7 @@ class CatalogueCrossmatchUtils:
 
       # NOTE: Not all mags are set all the time in GSC.  This only works if the VMag value is set.
 
-      searchDone, matches = searchCatalogue(conn, [objectRow], 'tcs_cat_v_sdss_dr9_stars', radius = radius)
+      searchDone, matches = self.searchCatalogue(conn, [objectRow], 'tcs_cat_v_sdss_dr9_stars', radius = radius)
 
       matchedObjects = []
       matchSubset = []
@@ -502,7 +669,7 @@ class CatalogueCrossmatchUtils:
       Crossmatch against Bright Stars
       """
 
-      searchDone, matches = searchCatalogue(conn, [objectRow], catalogue, radius = maxRadius)
+      searchDone, matches = self.searchCatalogue(conn, [objectRow], catalogue, radius = maxRadius)
 
       m = (minMag - maxMag) / (minRadius - maxRadius)  # gradient
       c = maxMag - m * maxRadius                       # intercept
@@ -549,6 +716,57 @@ class SearchAlgorithm(object):
         return
 
 
+    # 2026-10-19 KWS Pluggable catalogue rules. Subclasses list the crossmatch rules they want
+    #                to run as (CatalogueCrossmatchUtils method name, keyword parameters) in
+    #                order of precedence, e.g.
+    #                    [('crossmatchWithNEDGalaxies', {'radius': 30.0, 'physicalRadius': 40.0}),
+    #                     ('crossmatchWithBright2MASSStars', {'radius': 15.0})]
+    #                prefetchCatalogues does ONE batched cone search per catalogue for the whole
+    #                object list at the maximum radius any rule needs, and runRules filters
+    #                those results.
+    rules = []
+
+    def prefetchCatalogues(self, conn, objectList, catalogueConnections = None):
+        """
+        Fetch the candidates from every catalogue used by the rules for the whole object
+        batch. catalogueConnections maps the names of any catalogues that are not
+        accessible via conn to their own connections.
+        Returns the CatalogueCrossmatchUtils object the rules should be run with.
+        """
+        candidateCache = CatalogueCandidateCache()
+        xmUtils = CatalogueCrossmatchUtils(candidateCache = candidateCache)
+
+        for methodName, parameters in self.rules:
+            catalogueName, radius = xmUtils.getRuleCatalogueAndRadius(methodName, parameters)
+            candidateCache.addCatalogue(catalogueName, radius)
+
+        candidateCache.fetch(conn, objectList, catalogueConnections = catalogueConnections)
+        self.xmUtils = xmUtils
+        self.catalogueConnections = catalogueConnections if catalogueConnections else {}
+        return xmUtils
+
+
+    def runRules(self, conn, objectRow, xmUtils = None, catalogueConnections = None):
+        """
+        Run each of the rules in order against the (prefetched) catalogue candidates.
+        Without a prefetch each rule does its own cone search.
+        Returns a list of (method name, catalogue, searchDone, matches) for each rule
+        that matched.
+        """
+        if xmUtils is None:
+            xmUtils = getattr(self, 'xmUtils', None) or CatalogueCrossmatchUtils()
+        if catalogueConnections is None:
+            catalogueConnections = getattr(self, 'catalogueConnections', {})
+
+        results = []
+        for methodName, parameters in self.rules:
+            catalogueName, radius = xmUtils.getRuleCatalogueAndRadius(methodName, parameters)
+            searchDone, matches = getattr(xmUtils, methodName)(catalogueConnections.get(catalogueName, conn), objectRow, **parameters)
+            if matches:
+                results.append((methodName, catalogueName, searchDone, matches))
+        return results
+
+
     # 2013-10-17 KWS Moved these methods from classifierAlgorithmFactory to here.
     def updateTransientObjectType(self, conn, transientObjectId, objectType):
         """
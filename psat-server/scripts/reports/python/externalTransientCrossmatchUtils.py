@@ -3,7 +3,7 @@ from datetime import datetime
 
 UNCLASSIFIED = 0
 
-from classifierSearchUtils import CLASSIFICATION_FLAGS, searchCatalogue
+from classifierSearchUtils import CLASSIFICATION_FLAGS, SearchAlgorithm
 
 
 QUBLISTS = {
@@ -484,7 +484,24 @@ def getCatalogueTables(conn):
     return tables
 
 
-class SearchEXTERNALTRANSIENTS():
+# 2026-10-19 KWS The external lists are now run as SearchAlgorithm catalogue rules, so
+#                crossmatchExternalLists can fetch the candidates for the whole transient
+#                list up front instead of doing every cone search one object at a time.
+#                (list name, table, keep every match rather than just the nearest)
+EXTERNAL_TRANSIENT_LISTS = [('ATel', 'atel_coordinates', True),   # 2015-06-10 KWS For ATels we want EVERY match, not just the nearest.
+                            ('CSS', 'view_fs_crts_css_summary', False),
+                            ('MLS', 'view_fs_crts_mls_summary', False),
+                            ('SSS', 'view_fs_crts_sss_summary', False),
+                            ('ASASSN SNe', 'fs_asassn_sne', False),    # 2015-04-21 KWS Added ASASSN crossmatches
+                            ('ASASSN Transients', 'fs_asassn_transients', False),
+                            ('TNS', 'tcs_cat_tns', False),
+                            ('PESSTO', 'view_transientBucketMaster', False)]
+
+# The lists that live in the catalogues database rather than the PESSTO one.
+CATALOGUE_DATABASE_LISTS = ['tcs_cat_tns']
+
+
+class SearchEXTERNALTRANSIENTS(SearchAlgorithm):
     """
         External Transient List Search Algorithm.
 
@@ -492,6 +509,8 @@ class SearchEXTERNALTRANSIENTS():
         e.g 15 arcsec.
     """
 
+    externalLists = EXTERNAL_TRANSIENT_LISTS
+
     def __init__(self, searchRadius):
         """__init__.
 
@@ -499,6 +518,12 @@ class SearchEXTERNALTRANSIENTS():
             searchRadius:
         """
         self.searchRadius = searchRadius
+        self.rules = [('crossmatchWithCatalogue', {'catalogue': table, 'radius': searchRadius}) for listName, table, keepAll in self.externalLists]
+
+
+    def getCatalogueConnections(self, connCatalogues):
+        """Which connection to use for the lists not in the PESSTO database."""
+        return dict((table, connCatalogues) for table in CATALOGUE_DATABASE_LISTS)
 
 
     def searchField(self, connPESSTO, connCatalogues, objectRow):
@@ -506,99 +531,28 @@ class SearchEXTERNALTRANSIENTS():
         Find matches for this transient in the CBAT, ATel, CRTS and PESSTO lists
         """
 
-
-        objectType = UNCLASSIFIED
         print("\tRunning External Transient List Search Algorithm")
 
-        searchRadius = self.searchRadius
+        externalLists = dict((table, (listName, keepAll)) for listName, table, keepAll in self.externalLists)
 
         allMatches = {}
-        searchDone = False
-
-        #if not match:
-        # 2015-06-10 KWS For ATels we want EVERY match, not just the nearest.
-        print("\t* Crossmatching against ATel List")
-        searchDone, matches = searchCatalogue(connPESSTO, [objectRow], 'atel_coordinates', radius = searchRadius)
-        if searchDone and matches:
-            m = []
-            for match in matches[0][1]:
-                separation = match[0]
-                matchRow = match[1]
-                m.append([separation, matchRow])
-            table = matches[0][2]
-            allMatches[table] = m
-
-        #if not match:
-        print("\t* Crossmatching against CSS List")
-        searchDone, matches = searchCatalogue(connPESSTO, [objectRow], 'view_fs_crts_css_summary', radius = searchRadius)
-        if searchDone and matches:
-            separation = matches[0][1][0][0]
-            nearestMatch = matches[0][1][0][1]
-            table = matches[0][2]
-            allMatches[table] = [[separation, nearestMatch]]
-
-        #if not match:
-        print("\t* Crossmatching against MLS List")
-        searchDone, matches = searchCatalogue(connPESSTO, [objectRow], 'view_fs_crts_mls_summary', radius = searchRadius)
-        if searchDone and matches:
-            separation = matches[0][1][0][0]
-            nearestMatch = matches[0][1][0][1]
-            table = matches[0][2]
-            allMatches[table] = [[separation, nearestMatch]]
-
-        #if not match:
-        print("\t* Crossmatching against SSS List")
-        searchDone, matches = searchCatalogue(connPESSTO, [objectRow], 'view_fs_crts_sss_summary', radius = searchRadius)
-        if searchDone and matches:
-            separation = matches[0][1][0][0]
-            nearestMatch = matches[0][1][0][1]
-            table = matches[0][2]
-            allMatches[table] = [[separation, nearestMatch]]
-
-
-        # 2015-04-21 KWS Added ASASSN crossmatches
-
-        #if not match:
-        print("\t* Crossmatching against ASASSN SNe List")
-        searchDone, matches = searchCatalogue(connPESSTO, [objectRow], 'fs_asassn_sne', radius = searchRadius)
-        if searchDone and matches:
-            separation = matches[0][1][0][0]
-            nearestMatch = matches[0][1][0][1]
-            table = matches[0][2]
-            allMatches[table] = [[separation, nearestMatch]]
-
-        #if not match:
-        print("\t* Crossmatching against ASASSN Transients List")
-        searchDone, matches = searchCatalogue(connPESSTO, [objectRow], 'fs_asassn_transients', radius = searchRadius)
-        if searchDone and matches:
-            separation = matches[0][1][0][0]
-            nearestMatch = matches[0][1][0][1]
-            table = matches[0][2]
-            allMatches[table] = [[separation, nearestMatch]]
-
-        print("\t* Crossmatching against TNS List")
-        #searchDone, matches = searchCatalogue(connPESSTO, [objectRow], 'fs_tns_transients', radius = searchRadius)
-        searchDone, matches = searchCatalogue(connCatalogues, [objectRow], 'tcs_cat_tns', radius = searchRadius)
-        if searchDone and matches:
-            separation = matches[0][1][0][0]
-            nearestMatch = matches[0][1][0][1]
-            table = matches[0][2]
-            allMatches[table] = [[separation, nearestMatch]]
-
-        #if not match:
-        print("\t* Crossmatching against PESSTO List")
-        searchDone, matches = searchCatalogue(connPESSTO, [objectRow], 'view_transientBucketMaster', radius = searchRadius)
-        if searchDone and matches:
-            separation = matches[0][1][0][0]
-            nearestMatch = matches[0][1][0][1]
-            table = matches[0][2]
-            allMatches[table] = [[separation, nearestMatch]]
 
+        for methodName, table, searchDone, matches in self.runRules(connPESSTO, objectRow, catalogueConnections = self.getCatalogueConnections(connCatalogues)):
+            if not searchDone:
+                continue
+            listName, keepAll = externalLists[table]
+            print("\t* Matched against %s List" % listName)
+            if keepAll:
+                allMatches[table] = [[separation, matchRow] for separation, matchRow in matches[0][1]]
+            else:
+                separation = matches[0][1][0][0]
+                nearestMatch = matches[0][1][0][1]
+                allMatches[table] = [[separation, nearestMatch]]
 
         return allMatches
 
 # 2020-03-31 KWS Added TNS only algorithm for fast testing against very large lists.
-class SearchTNSONLY():
+class SearchTNSONLY(SearchEXTERNALTRANSIENTS):
     """
         External Transient List Search Algorithm. Just search the TNS.
 
@@ -606,38 +560,7 @@ class SearchTNSONLY():
         e.g 15 arcsec.
     """
 
-    def __init__(self, searchRadius):
-        """__init__.
-
-        Args:
-            searchRadius:
-        """
-        self.searchRadius = searchRadius
-
-
-    def searchField(self, connPESSTO, connCatalogues, objectRow):
-        """
-        Find matches for this transient in the CBAT, ATel, CRTS and PESSTO lists
-        """
-
-
-        objectType = UNCLASSIFIED
-        print("\tRunning External Transient List Search Algorithm")
-
-        searchRadius = self.searchRadius
-
-        allMatches = {}
-        searchDone = False
-
-        print("\t* Crossmatching against TNS List")
-        searchDone, matches = searchCatalogue(connCatalogues, [objectRow], 'tcs_cat_tns', radius = searchRadius)
-        if searchDone and matches:
-            separation = matches[0][1][0][0]
-            nearestMatch = matches[0][1][0][1]
-            table = matches[0][2]
-            allMatches[table] = [[separation, nearestMatch]]
-
-        return allMatches
+    externalLists = [('TNS', 'tcs_cat_tns', False)]
 
 
 def deleteExternalCrossmatches(conn, objectId):
@@ -820,6 +743,10 @@ def crossmatchExternalLists(conn, connPESSTO, connCatalogues, transientList, tab
     else:
         objectClassifier = SearchEXTERNALTRANSIENTS(searchRadius)
 
+    # One cone search per list for the whole transient list. searchField then just
+    # filters the prefetched candidates.
+    objectClassifier.prefetchCatalogues(connPESSTO, transientList, catalogueConnections = objectClassifier.getCatalogueConnections(connCatalogues))
+
     classifications = 1
     listLength = len(transientList)
     for row in transientList:
@@ -2,7 +2,7 @@
 """Download the Pan-STARRS requested finders
 
 Usage:
-  %s <configfile> [--downloadpath=<downloadpath>] [--nsigma=<nsigma>]
+  %s <configfile> [--downloadpath=<downloadpath>] [--nsigma=<nsigma>] [--connections=<connections>] [--timeout=<timeout>]
   %s (-h | --help)
   %s --version
 
@@ -11,6 +11,8 @@ Options:
   --version                                   Show version.
   --downloadpath=<downloadpath>               Temporary location of image downloads [default: /tmp].
   --nsigma=<nsigma>                           Specify a multiplier of the standard deviation to adjust the contrast [default: 2.0].
+  --connections=<connections>                 Number of concurrent (keep-alive) connections to the data store [default: 4].
+  --timeout=<timeout>                         Connect/read timeout (seconds) for each file. Stalled files are resumed [default: 60].
 
 E.g.:
   %s ../../../../../ps13pi/config/config.yaml
@@ -20,10 +22,11 @@ import sys
 __doc__ = __doc__ % (sys.argv[0], sys.argv[0], sys.argv[0], sys.argv[0])
 from docopt import docopt
 from gkutils.commonutils import dbConnect, calculateRMSScatter, truncate, PROCESSING_FLAGS, cleanOptions, Struct
-from pstamp_utils import getPSRequestList, insertPostageStampImageRecord, downloadFinderImage2, findDictInDictList, GROUP_TYPE_FINDER, ERROR_FILE_NOT_IN_DATASTORE_INDEX, BAD_SERVER_ADDRESS, PAGE_NOT_FOUND, HTTP_ERROR, SUBMITTED, COMPLETE, COMMUNICATION_ERROR, TIMEOUT, FINDER_REQUEST_V2, DOWNLOADING, updateRequestStatus, getDataStoreIndex, parseIndexList, updateDownloadAttempts
+from pstamp_utils import getPSRequestList, insertPostageStampImageRecord, downloadFinderImage2, findDictInDictList, GROUP_TYPE_FINDER, ERROR_FILE_NOT_IN_DATASTORE_INDEX, CORRUPT, BAD_SERVER_ADDRESS, PAGE_NOT_FOUND, HTTP_ERROR, SUBMITTED, COMPLETE, COMMUNICATION_ERROR, TIMEOUT, FINDER_REQUEST_V2, DOWNLOADING, updateRequestStatus, getDataStoreIndex, parseIndexList, updateDownloadAttempts, downloadDataStoreFile, downloadRequestImages
+from pstampDownloader import PostageStampDownloader, DOWNLOAD_OK, ERROR_BAD_FILE_CHECKSUM
 
 import os
-import requests, urllib
+import requests
 from astropy.io import fits as pf
 
 # 2014-03-08 KWS New code for Finders
@@ -34,13 +37,15 @@ resultsFileLocation = '/' + os.uname()[1].split('.')[0] + '/ingest/pstamp/respon
 
 
 
-def downloadAndRenameResultsFile(options, resultsFileInfo, requestName, downloadURL = None):
+def downloadAndRenameResultsFile(conn, options, resultsFileInfo, requestName, downloadURL = None, downloader = None):
    """downloadAndRenameResultsFile.
 
    Args:
+       conn:
        resultsFileInfo:
        requestName:
        downloadURL:
+       downloader:
    """
    # Get the file and rename it.
 
@@ -52,25 +57,21 @@ def downloadAndRenameResultsFile(options, resultsFileInfo, requestName, download
 
    localResultsFile = resultsFileLocation + '/' + requestName + '_results.fits'
 
-   try:
-      urllib.request.urlretrieve(resultsURL + requestName +'/' + resultsFileInfo['fileID'], localResultsFile)
-
-      #if md5(localResultsFile) != resultsFileInfo['md5sum']:
-      #   print "MD5 hashes do not match.  Results file is corrupt."
-      #   # Delete the results file - it's garbage
-      #   os.remove(localResultsFile)
-      #   updateDownloadAttempts(conn, requestName, CORRUPT)
-      #   localResultsFile = None
-
-   except IOError as e:
-      print("ERROR: Could not download results file. Error is: %s" % e.errno)
-      print(e)
+   # 2026-10-19 KWS The results file is now MD5 checked against the index before we parse it.
+   downloadResult = downloadDataStoreFile(requestName, resultsFileInfo, localResultsFile, dataStoreURL = resultsURL, downloader = downloader)
+
+   if downloadResult == ERROR_BAD_FILE_CHECKSUM:
+      print("MD5 hashes do not match.  Results file is corrupt.")
+      updateDownloadAttempts(conn, requestName, CORRUPT)
+      localResultsFile = None
+   elif downloadResult != DOWNLOAD_OK:
+      print("ERROR: Could not download results file.")
       localResultsFile = None
 
    return localResultsFile
 
 
-def downloadAllFinderImages(conn, options, requestName, PSSImageRootLocation, offsetStarFilter = None, downloadURL = None, nsigma = 2.0, connSherlock = None):
+def downloadAllFinderImages(conn, options, requestName, PSSImageRootLocation, offsetStarFilter = None, downloadURL = None, nsigma = 2.0, connSherlock = None, downloader = None):
    """downloadAllFinderImages.
 
    Args:
@@ -81,6 +82,7 @@ def downloadAllFinderImages(conn, options, requestName, PSSImageRootLocation, of
        offsetStarFilter:
        downloadURL:
        connSherlock:
+       downloader:
    """
 
    if connSherlock is None:
@@ -113,7 +115,7 @@ def downloadAllFinderImages(conn, options, requestName, PSSImageRootLocation, of
          return (1)
 
       resultsFileInfo = dataStoreFileInfoList[0][0]
-      localResultsFile = downloadAndRenameResultsFile(options, resultsFileInfo, requestName, downloadURL = downloadURL)
+      localResultsFile = downloadAndRenameResultsFile(conn, options, resultsFileInfo, requestName, downloadURL = downloadURL, downloader = downloader)
 
       if not localResultsFile:
          print("Results file error. Cannot continue...")
@@ -125,6 +127,12 @@ def downloadAllFinderImages(conn, options, requestName, PSSImageRootLocation, of
       headers = pf.open(localResultsFile)
       table = headers[1].data
 
+      # 2026-10-19 KWS Fetch (and verify) all the images concurrently first. A slow or
+      #                broken file no longer holds up the rest of the request.
+      downloadResults = {}
+      if downloader is not None:
+         downloadResults = downloadRequestImages(downloader, requestName, table, imageInfo, PSSImageRootLocation, imageNameSuffix = 'finder')
+
       # 2015-02-24 KWS No need to deal with CMF files anymore. Let's use
       #                the PS1 Ubercal Stars catalog.
       for fitsRow in table:
@@ -138,7 +146,7 @@ def downloadAllFinderImages(conn, options, requestName, PSSImageRootLocation, of
                   recordId = insertPostageStampImageRecord(conn, fitsRow.field('COMMENT') + 'finder', None, None, ERROR_FILE_NOT_IN_DATASTORE_INDEX, groupType=GROUP_TYPE_FINDER)
                else:
                   print("Downloading image...")
-                  downloadStatus = downloadFinderImage2(conn, requestName, fitsRow, dataStoreFileInfo, PSSImageRootLocation, offsetStarFilter = offsetStarFilter, dataStoreURL = downloadURL, nsigma = nsigma, connSherlock = connSherlock)
+                  downloadStatus = downloadFinderImage2(conn, requestName, fitsRow, dataStoreFileInfo, PSSImageRootLocation, offsetStarFilter = offsetStarFilter, dataStoreURL = downloadURL, nsigma = nsigma, connSherlock = connSherlock, downloadResult = downloadResults.get(fitsRow.field('IMG_NAME')))
                   if downloadStatus == True:
                      print("Downloaded the image successfully.")
                   else:
@@ -175,15 +183,19 @@ def downloadPostageStampResults(conn, options, psRequests, PSSImageRootLocation,
          print("Problem updating the database.")
 
 
-   # Set all urllib requests to timeout after 10 minutes, otherwise it will wait forever
+   # Set all socket requests to timeout after 10 minutes, otherwise it will wait forever
+   # 2026-10-19 KWS This now only applies to the index pages. Result files are fetched
+   #                by the download engine, which has its own (much shorter) timeout.
    import socket
    socket.setdefaulttimeout(600)
 
+   downloader = PostageStampDownloader(downloadURL, connections = int(options.connections), timeout = float(options.timeout))
+
    if psRequests:
       for row in psRequests:
          requestName = row["name"]
          print("Processing Request: %s" % requestName)
-         if downloadAllFinderImages(conn, options, requestName, PSSImageRootLocation, offsetStarFilter = offsetStarFilter, downloadURL = downloadURL, nsigma = nsigma, connSherlock = connSherlock) == 0:
+         if downloadAllFinderImages(conn, options, requestName, PSSImageRootLocation, offsetStarFilter = offsetStarFilter, downloadURL = downloadURL, nsigma = nsigma, connSherlock = connSherlock, downloader = downloader) == 0:
             # Update the request status
             if (updateRequestStatus(conn, requestName, COMPLETE) > 0):
                print("Successfully downloaded request from Postage Stamp Server and updated database.")
@@ -195,6 +207,8 @@ def downloadPostageStampResults(conn, options, psRequests, PSSImageRootLocation,
             if not (updateRequestStatus(conn, requestName, COMMUNICATION_ERROR) > 0):
                print("Problem updating the database.")
 
+   downloader.close()
+
    print("Processing complete.")
    return (0)
 
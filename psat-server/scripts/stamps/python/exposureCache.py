@@ -0,0 +1,258 @@
+"""Local ATLAS exposure cache, shared by the stamp, forced photometry and rsync jobs.
+
+The exposures live exactly where they always have (e.g. /atlas/diff/02a/60000/02a60000o0123c.diff.fz)
+so nothing downstream needs to change.  What this adds is:
+
+  * A manifest (SQLite, so it can be shared safely between processes) of the
+    exposures/image types the cache itself downloaded, their size and when they
+    were last used.
+  * We can tell whether we already have a file without running rsync.
+  * Misses are fetched over several concurrent rsync streams.
+  * Exposures can be prefetched in the background while stamp cutting proceeds.
+    require() blocks only until the exposures needed for the next object are here.
+  * Optional size-bounded LRU eviction of the files recorded in the manifest.
+    Only files the cache fetched are ever evicted.  Anything else already under
+    localLocation is used but never deleted.
+
+rsync writes to a temporary file and renames it when complete, so a file that
+exists at its final location is complete.
+"""
+import os
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+IMAGE_TYPES = {'diff': {'directory': 'diff', 'extension': '.diff.fz'},
+               'red':  {'directory': 'red',  'extension': '.fits.fz'},
+               'tph':  {'directory': 'red',  'extension': '.tph'}}
+
+
+class ExposureCache(object):
+    """Size-bounded, manifest backed local exposure store"""
+
+    def __init__(self, localLocation = '/atlas', manifest = None, maxBytes = None, streams = 4, timeout = None, rsyncOptions = None):
+        """
+        localLocation: root of the local exposure tree
+        manifest:      SQLite manifest file. Defaults to <localLocation>/exposure_cache_manifest.sqlite
+        maxBytes:      evict least recently used fetched exposures above this size. None = never evict.
+        streams:       number of concurrent rsync streams used to fetch misses
+        timeout:       timeout (seconds) for each rsync
+        rsyncOptions:  dict of extra keyword arguments for doRsync (userId, remoteMachine, etc)
+        """
+        self.localLocation = localLocation
+        self.manifest = manifest if manifest is not None else os.path.join(localLocation, 'exposure_cache_manifest.sqlite')
+        self.maxBytes = maxBytes
+        self.streams = max(int(streams), 1)
+        self.timeout = timeout
+        self.rsyncOptions = rsyncOptions if rsyncOptions else {}
+
+        self.lock = threading.Lock()
+        self.inFlight = {}
+        self.prefetchThreads = []
+
+        with self.connection() as db:
+            db.execute("""
+                create table if not exists exposures (
+                    expname text not null,
+                    imagetype text not null,
+                    path text not null,
+                    size integer not null,
+                    last_access real not null,
+                    fetched integer not null default 0,
+                    primary key (expname, imagetype))
+            """)
+            # Older manifests also recorded files the cache found but did not download.
+            # Without the fetched column those rows are left alone by evict().
+            columns = [row[1] for row in db.execute("pragma table_info(exposures)")]
+            if 'fetched' not in columns:
+                db.execute("alter table exposures add column fetched integer not null default 0")
+
+
+    @contextmanager
+    def connection(self):
+        """Manifest connection. Commits (or rolls back) and closes on exit."""
+        db = sqlite3.connect(self.manifest, timeout = 60)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+
+    def getPath(self, expname, imageType):
+        """Local location of the exposure. Mirrors the file naming in doRsync."""
+        camera = expname[0:3]
+        mjd = expname[3:8]
+        imageInfo = IMAGE_TYPES[imageType]
+        directory = os.path.join(self.localLocation, imageInfo['directory'], camera, mjd)
+        if imageType == 'tph' and int(mjd) >= 57350:
+            directory = os.path.join(directory, 'AUX')
+        return os.path.join(directory, expname + imageInfo['extension'])
+
+
+    def getSize(self, expname, imageType):
+        """Size of the local exposure, or 0 if it isn't here (or is empty)."""
+        try:
+            return os.path.getsize(self.getPath(expname, imageType))
+        except OSError:
+            return 0
+
+
+    def isPresent(self, expname, imageType):
+        """Is the exposure here and complete? Just a stat - the manifest is not touched."""
+        return self.getSize(expname, imageType) > 0
+
+
+    def getMisses(self, exposures, imageType):
+        """Which of the exposures do we NOT have?"""
+        return [e for e in exposures if not self.isPresent(e, imageType)]
+
+
+    def updateManifest(self, exposures, fetched, imageType):
+        """Record the exposures we just fetched and mark all the requested ones as used,
+           in a single transaction."""
+        now = time.time()
+        with self.connection() as db:
+            # Touch anything we downloaded earlier.  Files we didn't download have no row.
+            db.executemany("update exposures set last_access = ? where expname = ? and imagetype = ?", [(now, e, imageType) for e in exposures])
+            rows = []
+            for exp in fetched:
+                size = self.getSize(exp, imageType)
+                if size > 0:
+                    rows.append((exp, imageType, self.getPath(exp, imageType), size, now))
+            db.executemany("insert or replace into exposures (expname, imagetype, path, size, last_access, fetched) values (?, ?, ?, ?, ?, 1)", rows)
+
+
+    def transfer(self, exposures, imageType, stream):
+        """Run one rsync stream for a list of exposures."""
+        # Imported here because makeATLASStamps imports this module.
+        from makeATLASStamps import doRsync
+
+        rsyncOptions = {'localLocation': self.localLocation}
+        rsyncOptions.update(self.rsyncOptions)
+
+        # Each stream needs its own files-from list.
+        rsyncFileSuffix = '_%d_%d' % (threading.get_ident(), stream)
+
+        if imageType == 'tph':
+            doRsync(list(exposures), 'red', getMetadata = True, metadataExtension = '.tph', ignoreExistingFiles = True, timeout = self.timeout, rsyncFileSuffix = rsyncFileSuffix, **rsyncOptions)
+        else:
+            doRsync(list(exposures), imageType, ignoreExistingFiles = True, timeout = self.timeout, rsyncFileSuffix = rsyncFileSuffix, **rsyncOptions)
+
+
+    def fetch(self, exposures, imageType):
+        """Make sure the exposures are local, fetching the misses over concurrent rsync
+           streams. Returns the list of exposures we still don't have."""
+
+        if imageType not in IMAGE_TYPES:
+            print("Image type must be one of %s" % ', '.join(IMAGE_TYPES.keys()))
+            return list(exposures)
+
+        exposures = sorted(set(exposures))
+        misses = self.getMisses(exposures, imageType)
+
+        # Don't fetch anything another thread is already fetching.  Wait for it instead.
+        toFetch = []
+        toWaitFor = []
+        with self.lock:
+            for exp in misses:
+                key = (exp, imageType)
+                if key in self.inFlight:
+                    toWaitFor.append(self.inFlight[key])
+                else:
+                    self.inFlight[key] = threading.Event()
+                    toFetch.append(exp)
+
+        print("%s: %d exposures requested, %d already local, %d to fetch." % (imageType, len(exposures), len(exposures) - len(misses), len(toFetch)))
+
+        try:
+            if toFetch:
+                nStreams = min(self.streams, len(toFetch))
+                # Round robin the exposures over the streams so each gets a spread of nights.
+                chunks = [toFetch[i::nStreams] for i in range(nStreams)]
+                with ThreadPoolExecutor(max_workers = nStreams) as executor:
+                    list(executor.map(lambda args: self.transfer(args[1], imageType, args[0]), enumerate(chunks)))
+        finally:
+            with self.lock:
+                for exp in toFetch:
+                    self.inFlight.pop((exp, imageType)).set()
+
+        for event in toWaitFor:
+            event.wait()
+
+        # Only the misses can have changed since we looked.
+        stillMissing = self.getMisses(misses, imageType)
+        if stillMissing:
+            print("%s: %d exposures could not be fetched." % (imageType, len(stillMissing)))
+
+        self.updateManifest(exposures, toFetch, imageType)
+
+        if self.maxBytes is not None:
+            self.evict(keep = set((e, imageType) for e in exposures))
+
+        return stillMissing
+
+
+    def prefetch(self, exposures, imageTypes = ('diff', 'red')):
+        """Start fetching the exposures in the background."""
+        def prefetcher():
+            for imageType in imageTypes:
+                self.fetch(exposures, imageType)
+        thread = threading.Thread(target = prefetcher, daemon = True)
+        thread.start()
+        self.prefetchThreads.append(thread)
+        return thread
+
+
+    def require(self, exposures, imageTypes = ('diff', 'red')):
+        """Block until the exposures are local. Anything not being prefetched is fetched now."""
+        stillMissing = []
+        for imageType in imageTypes:
+            stillMissing += self.fetch(exposures, imageType)
+        return stillMissing
+
+
+    def wait(self):
+        """Wait for all the background prefetches to finish."""
+        for thread in self.prefetchThreads:
+            thread.join()
+        self.prefetchThreads = []
+
+
+    def evict(self, keep = None):
+        """Delete the least recently used exposures the cache fetched until we're under maxBytes.
+           Never delete anything in keep, currently being fetched or not downloaded by the cache."""
+        if self.maxBytes is None:
+            return 0
+
+        keep = keep if keep else set()
+        with self.lock:
+            inFlight = set(self.inFlight)
+        freed = 0
+        with self.connection() as db:
+            total = db.execute("select coalesce(sum(size), 0) from exposures where fetched = 1").fetchone()[0]
+            if total <= self.maxBytes:
+                return 0
+
+            for expname, imageType, path, size in db.execute("select expname, imagetype, path, size from exposures where fetched = 1 order by last_access").fetchall():
+                if total <= self.maxBytes:
+                    break
+                key = (expname, imageType)
+                if key in keep or key in inFlight:
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    print("Unable to evict %s: %s" % (path, str(e)))
+                    continue
+                db.execute("delete from exposures where expname = ? and imagetype = ?", key)
+                total -= size
+                freed += size
+
+        if freed > 0:
+            print("Evicted %.1f MB from the exposure cache." % (freed / 1.0e6))
+        return freed
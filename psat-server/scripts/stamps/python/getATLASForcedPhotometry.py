@@ -40,7 +40,8 @@ import os, shutil, re, csv, subprocess, io
 
 
 from psat_server_web.atlas.atlas.commonqueries import getLightcurvePoints, getNonDetections, getNonDetectionsUsingATLASFootprint, ATLAS_METADATADDC, filterWhereClauseddc, LC_POINTS_QUERY_ATLAS_DDC, FILTERS
-from makeATLASStamps import doRsync, getObjectsByList, getObjectsByCustomList
+from makeATLASStamps import getObjectsByList, getObjectsByCustomList
+from exposureCache import ExposureCache
 from gkutils.commonutils import dbConnect, PROCESSING_FLAGS, calculateRMSScatter, Struct, cleanOptions, readGenericDataFile, getMJDFromSqlDate
 
 ATLAS_ROOT = '/atlas'
@@ -368,9 +369,11 @@ def downloadFPExposures(exposureSet):
     Args:
         exposureSet:
     """
-    doRsync(exposureSet, 'diff', ignoreExistingFiles = True)
+    # 2026-10-19 KWS Go via the exposure cache, shared with the stamp jobs.
+    exposureCache = ExposureCache(streams = 1)
+    exposureCache.fetch(exposureSet, 'diff')
     # Grab the tphot photometry files
-    doRsync(exposureSet, 'red', getMetadata = True, metadataExtension = '.tph', ignoreExistingFiles = True)
+    exposureCache.fetch(exposureSet, 'tph')
     return exposureSet
 
 
@@ -468,8 +471,9 @@ def main(argv = None):
         return 0
 
     if not options.skipdownload:
-        doRsync(allExps, 'diff', ignoreExistingFiles = True)
-        doRsync(allExps, 'red', getMetadata = True, metadataExtension = '.tph', ignoreExistingFiles = True)
+        exposureCache = ExposureCache()
+        exposureCache.fetch(allExps, 'diff')
+        exposureCache.fetch(allExps, 'tph')
 
     fphot = doForcedPhotometry(options, objectList, perObjectExps)
 
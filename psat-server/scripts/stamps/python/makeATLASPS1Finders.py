@@ -2,7 +2,7 @@
 """Make PS1 Finders for ATLAS objects above -30 degrees declination.
 
 Usage:
-  %s <configfile> [<candidate>...] [--detectionlist=<detectionlist>] [--customlist=<customlist>] [--update] [--ddc] [--size=<size>] [--flagdate=<flagdate>] [--filters=<filters>] [--singlefilter=<singlefilter>] [--downloadpath=<downloadpath>] [--nsigma=<nsigma>]
+  %s <configfile> [<candidate>...] [--detectionlist=<detectionlist>] [--customlist=<customlist>] [--update] [--ddc] [--size=<size>] [--flagdate=<flagdate>] [--filters=<filters>] [--singlefilter=<singlefilter>] [--downloadpath=<downloadpath>] [--nsigma=<nsigma>] [--downloadthreads=<downloadthreads>] [--renderers=<renderers>]
   %s (-h | --help)
   %s --version
 
@@ -19,6 +19,8 @@ Options:
   --singlefilter=<singlefilter>               Single filter to request [default: g].
   --downloadpath=<downloadpath>               Temporary location of image downloads [default: /tmp].
   --nsigma=<nsigma>                           Specify a multiplier of the standard deviation to adjust the contrast [default: 2.0].
+  --downloadthreads=<downloadthreads>         Maximum number of concurrent PS1 image downloads [default: 8].
+  --renderers=<renderers>                     Number of finder rendering processes [default: 4].
 
 E.g.:
   %s ../../../../../atlas/config/config4_db1.yaml 1161549880293940400 --ddc --update
@@ -33,7 +35,7 @@ from docopt import docopt
 from gkutils.commonutils import dbConnect, calculateRMSScatter, truncate, PROCESSING_FLAGS, cleanOptions, Struct
 import sys, os, shutil, errno
 import logging
-from psat_server_web.atlas.atlas.commonqueries import getLightcurvePoints, getNonDetections, LC_POINTS_QUERY_ATLAS_DDC, filterWhereClauseddc, FILTERS
+from psat_server_web.atlas.atlas.commonqueries import FILTERS
 from image_utils import addJpegCrossHairs, fitsToJpegExtension
 from pstamp_utils import createFinderImage, insertPostageStampImageRecord, GROUP_TYPE_FINDER
 from makeATLASStamps import getObjectsByList, getObjectsByCustomList, updateAtlasObjectProcessingFlag
@@ -107,8 +109,73 @@ def getSpecifiedObjects(conn, objectIds, processingFlags = PROCESSING_FLAGS['ref
     return objectList
 
 
-def grabPS1Finder(ra, dec, size, downloadPath, colourFilters='gri', singleFilter='g', downloader = None):
-    """grabPS1Finder.
+# 2026-10-19 KWS Get the recurrences for ALL the candidates in one query per chunk
+#                rather than one getLightcurvePoints call per object. The points are
+#                selected exactly as LC_POINTS_QUERY_ATLAS_DDC/_DDT + the filter clause
+#                select them, and (ddc) only the dup >= 0 points are used if there are any.
+def getObjectCoordinates(conn, objectIds, ddc = False, chunkSize = 1000):
+    """Get the average RA and Dec of each object. Returns a dict keyed by object id.
+
+    Args:
+        conn:
+        objectIds:
+        ddc:
+        chunkSize:
+    """
+    import MySQLdb
+
+    filterClause = ','.join(['%s'] * len(FILTERS))
+
+    if ddc:
+        query = """
+            select d.atlas_object_id, d.ra, d.`dec`, d.dup
+              from atlas_detectionsddc d, atlas_metadataddc m
+             where d.atlas_object_id in (%s)
+               and d.atlas_metadata_id = m.id
+               and d.deprecated is null
+               and m.filt in (%s)
+        """
+    else:
+        query = """
+            select d.atlas_object_id, d.ra, d.`dec`
+              from atlas_diff_detections d, atlas_metadata m
+             where d.atlas_object_id in (%s)
+               and d.atlas_metadata_id = m.id
+               and d.deprecated is null
+               and d.mag > 0
+               and m.filter in (%s)
+        """
+
+    objectRecurrences = {}
+    try:
+        cursor = conn.cursor(MySQLdb.cursors.DictCursor)
+        for i in range(0, len(objectIds), chunkSize):
+            chunk = objectIds[i:i+chunkSize]
+            cursor.execute(query % (','.join(['%s'] * len(chunk)), filterClause), tuple(chunk) + tuple(FILTERS))
+            for row in cursor.fetchall():
+                objectRecurrences.setdefault(row['atlas_object_id'], []).append(row)
+        cursor.close()
+
+    except MySQLdb.Error as e:
+        sys.stderr.write("Error %d: %s\n" % (e.args[0], e.args[1]))
+        sys.exit (1)
+
+    coords = {}
+    for objectId, recurrences in objectRecurrences.items():
+        if ddc:
+            # Only use the recurrences with dup >= 0 unless there are none.
+            cleanedRecurrences = [row for row in recurrences if row['dup'] is not None and row['dup'] >= 0]
+            if cleanedRecurrences:
+                recurrences = cleanedRecurrences
+        avgRa, avgDec, rms = calculateRMSScatter([{'RA': row['ra'], 'DEC': row['dec']} for row in recurrences])
+        coords[objectId] = (avgRa, avgDec)
+
+    return coords
+
+
+def getFinderRequestPlan(ra, dec, size, downloadPath, colourFilters='gri', singleFilter='g'):
+    """Everything we need to download for one position: the colour JPEG and the
+       single filter FITS (whose WCS we use to position the annotations).
 
     Args:
         ra:
@@ -118,61 +185,52 @@ def grabPS1Finder(ra, dec, size, downloadPath, colourFilters='gri', singleFilter
         colourFilters:
         singleFilter:
     """
+    common = {'settings': False, 'downloadDirectory': downloadPath, 'jpeg': False, 'arcsecSize': size, 'ra': ra, 'dec': dec, 'imageType': 'stack'}
+
+    plan = {'colour': dict(common, fits=False, filterSet=colourFilters, color=True, singleFilters=False),
+            'single': dict(common, fits=True, filterSet=singleFilter, color=False, singleFilters=True)}
+    return plan
 
+
+def fetchFinderRequest(request, downloader = None):
+    """Execute one download from a finder request plan.
+
+    Args:
+        request:
+        downloader:
+    """
     if downloader is None:
         from panstamps.downloader import downloader
 
-    # Use this for the colour Finder.
+    try:
+        fitsPaths, jpegPaths, colorPath = downloader(log=logger, **request).get()
+    except Exception as e:
+        print("Download failed for %s, %s: %s" % (request['ra'], request['dec'], str(e)))
+        return [], [], []
+
+    return fitsPaths, jpegPaths, colorPath
+
 
+def getFinderFiles(results):
+    """Pick the finder files out of the results of a request plan.
+
+    Args:
+        results: dict of (fitsPaths, jpegPaths, colorPath) keyed by request
+    """
     colourFinderJPEG = None
     singleFilterFinderFITS = None
     singleFilterFinderJPEG = None
 
-    fitsPaths, jpegPaths, colorPath = downloader(
-        log=logger,
-        settings=False,
-        downloadDirectory=downloadPath,
-        fits=False,
-        jpeg=False,
-        arcsecSize=size,
-        filterSet=colourFilters,
-        color=True,
-        singleFilters=False,
-        ra=ra,
-        dec=dec,
-        imageType="stack"  # warp | stack
-        ).get()
-
+    fitsPaths, jpegPaths, colorPath = results['colour']
     if len(colorPath) > 0:
-        # Rename the colour finder into the right location
         colourFinderJPEG = colorPath[0]
 
-    # rename colorPath[0] to the name of the finder.
-
-    # Use this for the g-band Finder. We'll be storing the FITS info as well
-    # as using the FITS WCS to position the annotations on the JPEGs.
-
-    fitsPaths, jpegPaths, colorPath = downloader(
-        log=logger,
-        settings=False,
-        downloadDirectory=downloadPath,
-        fits=True,
-        jpeg=False,
-        arcsecSize=size,
-        filterSet=singleFilter,
-        color=False,
-        singleFilters=True,
-        ra=ra,
-        dec=dec,
-        imageType="stack"  # warp | stack
-        ).get()
-
+    fitsPaths, jpegPaths, colorPath = results['single']
     if len(fitsPaths) > 0:
         singleFilterFinderFITS = fitsPaths[0]
 
     if len(jpegPaths) > 0:
         singleFilterFinderJPEG = jpegPaths[0]
-        # mv jpegPaths[0] to name of object
 
     print(colourFinderJPEG)
     print(singleFilterFinderJPEG)
@@ -182,7 +240,129 @@ def grabPS1Finder(ra, dec, size, downloadPath, colourFilters='gri', singleFilter
     return finderFiles
 
 
-def generatePS1Finders(conn, hostname, database, objectList, size, downloadPath='/tmp', colourFilters='gri', singleFilter='g', ddc = False, connSherlock = None, nsigma = 2.0):
+def grabPS1Finder(ra, dec, size, downloadPath, colourFilters='gri', singleFilter='g', downloader = None):
+    """grabPS1Finder.
+
+    Args:
+        ra:
+        dec:
+        size:
+        downloadPath:
+        colourFilters:
+        singleFilter:
+    """
+
+    if downloader is None:
+        from panstamps.downloader import downloader
+
+    plan = getFinderRequestPlan(ra, dec, size, downloadPath, colourFilters = colourFilters, singleFilter = singleFilter)
+    results = {}
+    for key, request in plan.items():
+        results[key] = fetchFinderRequest(request, downloader = downloader)
+
+    return getFinderFiles(results)
+
+
+def renderPS1Finder(conn, candidate, finderFiles, hostname, database, size, colourFilters='gri', singleFilter='g', nsigma = 2.0):
+    """Annotate the downloaded finders and move them into the image store.
+       Returns the image records to be written, or None if something went wrong.
+
+    Args:
+        conn: connection to the catalogues (for offset stars)
+        candidate:
+        finderFiles:
+        hostname:
+        database:
+        size:
+        colourFilters:
+        singleFilter:
+        nsigma:
+    """
+    if finderFiles['colourJPEG'] is None:
+        print("Something went wrong. Aborting creation of colour finder for this object")
+        return None
+    if finderFiles['singleFilterFITS'] is None:
+        print("Something went wrong. Aborting creation of single filter finder for this object")
+        return None
+
+    objectInfo = {}
+    if candidate['atlas_designation']:
+        atlasName = candidate['atlas_designation']
+        if candidate['other_designation']:
+            atlasName += ' (%s)' % candidate['other_designation']
+        objectInfo['name'] = atlasName
+    else:
+        objectInfo['name'] = candidate['id']
+    objectInfo['ra'] = candidate['ra_avg']
+    objectInfo['dec'] = candidate['dec_avg']
+    objectInfo['filter'] = singleFilter
+
+    # Dave uses a size of 1200 pixels for the colour jpeg if this is smaller than the FITS size
+    # Hence I need to adjust the size of the pixel scale bar.
+
+    # For the time being hard wire the colour pixel scale
+
+    colourPixelScale = ((size / 0.25) / 1200.0) * 0.25
+
+    addJpegCrossHairs(finderFiles['colourJPEG'], finderFiles['colourJPEG'], objectInfo = objectInfo, pixelScale = colourPixelScale, flip = False, negate = False, finder = True)
+
+    imageDetails = createFinderImage(conn, finderFiles['singleFilterFITS'], objectInfo = objectInfo, flip = False, nsigma = nsigma)
+
+    # Relocate the finders and update the database. There is no MJD with the colour
+    # jpeg, so use the single filter jpeg to relocate the image to an appropriate directory.
+    imageDownloadLocation = '/' + hostname + '/images/' + database + '/' +  str(int(imageDetails['imageMJD']))
+
+    tdate = truncate(imageDetails['imageMJD'], 3)
+
+    imageGroupNameColour = "%d_%s_%s_%s_%s" % (candidate['id'], tdate, 'ps1%s' % colourFilters, '0', 'reffinder')
+    imageGroupNameMono = "%d_%s_%s_%s_%s" % (candidate['id'], tdate, 'ps1%s' % singleFilter, '0', 'reffinder')
+
+    # Create the relevant MJD directory under the images root
+    if not os.path.exists(imageDownloadLocation):
+       try:
+           os.makedirs(imageDownloadLocation)
+       except OSError as e:
+           if e.errno == errno.EEXIST and os.path.isdir(imageDownloadLocation):
+               pass
+           else:
+               raise
+       os.chmod(imageDownloadLocation, 0o775)
+
+    shutil.move(finderFiles['colourJPEG'], imageDownloadLocation + '/' + imageGroupNameColour + '.jpeg')
+    shutil.move(finderFiles['singleFilterFITS'], imageDownloadLocation + '/' + imageGroupNameMono + '.fits')
+    shutil.move(fitsToJpegExtension(finderFiles['singleFilterFITS']), imageDownloadLocation + '/' + imageGroupNameMono + '.jpeg')
+
+    imageRecords = [(imageGroupNameColour, os.path.basename(finderFiles['colourJPEG']), imageDetails['imageMJD'], colourFilters),
+                    (imageGroupNameMono, os.path.basename(finderFiles['singleFilterFITS']), imageDetails['imageMJD'], singleFilter)]
+    return imageRecords
+
+
+# Rendering pool workers each have their own catalogue connection.
+_rendererConn = None
+
+def finderRendererInitialiser(db):
+    """Open one catalogue connection per rendering worker."""
+    global _rendererConn
+    _rendererConn = dbConnect(db['hostname'], db['username'], db['password'], db['database'])
+
+
+def renderPS1FinderWorker(args):
+    """Render a finder on this worker's connection."""
+    candidate, finderFiles, renderArgs = args
+    try:
+        return candidate, renderPS1Finder(_rendererConn, candidate, finderFiles, **renderArgs)
+    except Exception as e:
+        print("Rendering failed for object %d: %s" % (candidate['id'], str(e)))
+        return candidate, None
+
+
+# 2026-10-19 KWS Pipelined. The coordinates of all the candidates are calculated up
+#                front, then every candidate's request plan (colour JPEG + single
+#                filter FITS) is downloaded concurrently, and each finder is rendered
+#                as soon as both its images have arrived - in a pool of worker
+#                processes if sherlockDb is specified and renderers > 1.
+#                The database records are written here, as the renders complete.
+def generatePS1Finders(conn, hostname, database, objectList, size, downloadPath='/tmp', colourFilters='gri', singleFilter='g', ddc = False, connSherlock = None, nsigma = 2.0, downloadThreads = 8, renderers = 4, sherlockDb = None):
     """generatePS1Finders.
 
     Args:
@@ -195,90 +375,98 @@ def generatePS1Finders(conn, hostname, database, objectList, size, downloadPath=
         colourFilters:
         singleFilter:
         ddc:
+        connSherlock:
+        nsigma:
+        downloadThreads: maximum number of concurrent downloads
+        renderers: number of rendering processes
+        sherlockDb: catalogue database credentials for the rendering processes
     """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
     if connSherlock is None:
         connSherlock = conn
 
     # 2023-07-05 KWS Instatiate the downloader
     from panstamps.downloader import downloader
 
-    counter = 1
-    for candidate in objectList:
-        if ddc:
-            p, recurrences = getLightcurvePoints(candidate['id'], lcQuery=LC_POINTS_QUERY_ATLAS_DDC + filterWhereClauseddc(FILTERS), conn = conn)
-        else:
-            p, recurrences = getLightcurvePoints(candidate['id'], conn = conn)
-        objectCoords = []
+    coords = getObjectCoordinates(conn, [candidate['id'] for candidate in objectList], ddc = ddc)
 
-        for row in recurrences:
-            objectCoords.append({'RA': row.ra, 'DEC': row.dec})
+    plans = []
+    for candidate in objectList:
+        if candidate['id'] not in coords:
+            print("No recurrences for object %d" % candidate['id'])
+            continue
 
-        avgRa, avgDec, rms = calculateRMSScatter(objectCoords)
+        avgRa, avgDec = coords[candidate['id']]
 
         if avgDec < -31.0:
             print("Sorry - PS1 finders only available above -31 degrees declination")
             continue
 
-        print("Generating finder for object %d (%d)" % (candidate['id'], counter))
-        finderFiles = grabPS1Finder(avgRa, avgDec, size, downloadPath=downloadPath, colourFilters=colourFilters, singleFilter=singleFilter, downloader = downloader)
-        if finderFiles['colourJPEG'] is None:
-            print("Something went wrong. Aborting creation of colour finder for this object")
-            continue
-        if finderFiles['singleFilterFITS'] is None:
-            print("Something went wrong. Aborting creation of single filter finder for this object")
-            continue
+        candidate = dict(candidate, ra_avg = avgRa, dec_avg = avgDec)
+        plans.append((candidate, getFinderRequestPlan(avgRa, avgDec, size, downloadPath, colourFilters = colourFilters, singleFilter = singleFilter)))
 
-        objectInfo = {}
-        if candidate['atlas_designation']:
-            atlasName = candidate['atlas_designation']
-            if candidate['other_designation']:
-                atlasName += ' (%s)' % candidate['other_designation']
-            objectInfo['name'] = atlasName
-        else:
-            objectInfo['name'] = candidate['id']
-        objectInfo['ra'] = avgRa
-        objectInfo['dec'] = avgDec
-        objectInfo['filter'] = singleFilter
+    print("Downloading finders for %d objects (%d concurrent downloads)" % (len(plans), downloadThreads))
 
-        # Dave uses a size of 1200 pixels for the colour jpeg if this is smaller than the FITS size
-        # Hence I need to adjust the size of the pixel scale bar.
+    renderArgs = {'hostname': hostname, 'database': database, 'size': size, 'colourFilters': colourFilters, 'singleFilter': singleFilter, 'nsigma': nsigma}
 
-        # For the time being hard wire the colour pixel scale
+    renderPool = None
+    if sherlockDb is not None and renderers > 1:
+        import multiprocessing
+        renderPool = multiprocessing.Pool(renderers, initializer = finderRendererInitialiser, initargs = (sherlockDb,))
 
-        colourPixelScale = ((size / 0.25) / 1200.0) * 0.25
-
-        addJpegCrossHairs(finderFiles['colourJPEG'], finderFiles['colourJPEG'], objectInfo = objectInfo, pixelScale = colourPixelScale, flip = False, negate = False, finder = True)
-
-        imageDetails = createFinderImage(connSherlock, finderFiles['singleFilterFITS'], objectInfo = objectInfo, flip = False, nsigma = nsigma)
+    counter = 1
 
-        # Relocate the finders and update the database. There is no MJD with the colour
-        # jpeg, so use the single filter jpeg to relocate the image to an appropriate directory.
-        imageDownloadLocation = '/' + hostname + '/images/' + database + '/' +  str(int(imageDetails['imageMJD']))
+    def registerFinder(candidate, imageRecords):
+        nonlocal counter
+        if imageRecords is None:
+            return
+        print("Generated finder for object %d (%d)" % (candidate['id'], counter))
+        for imageGroupName, pssName, imageMJD, filterName in imageRecords:
+            (imageId, imageGroupId) = insertPostageStampImageRecord(conn, imageGroupName, pssName, imageMJD, 0, filterName, None,None, groupType = GROUP_TYPE_FINDER)
+        # Update processing_flags for this object
+        updateAtlasObjectProcessingFlag(conn, candidate, processingFlag = PROCESSING_FLAGS['reffinders'])
+        counter += 1
 
-        tdate = truncate(imageDetails['imageMJD'], 3)
+    pendingRenders = []
+    with ThreadPoolExecutor(max_workers = max(int(downloadThreads), 1)) as executor:
+        futures = {}
+        results = []
+        for i, (candidate, plan) in enumerate(plans):
+            results.append({})
+            for key, request in plan.items():
+                futures[executor.submit(fetchFinderRequest, request, downloader)] = (i, key)
+
+        for future in as_completed(futures):
+            i, key = futures[future]
+            results[i][key] = future.result()
+            if len(results[i]) < len(plans[i][1]):
+                continue
+
+            # Both images for this object are here.  Render it.
+            candidate = plans[i][0]
+            finderFiles = getFinderFiles(results[i])
+            results[i] = None
+            if renderPool is not None:
+                pendingRenders.append(renderPool.apply_async(renderPS1FinderWorker, ((candidate, finderFiles, renderArgs),)))
+            else:
+                registerFinder(candidate, renderPS1Finder(connSherlock, candidate, finderFiles, **renderArgs))
 
-        imageGroupNameColour = "%d_%s_%s_%s_%s" % (candidate['id'], tdate, 'ps1%s' % colourFilters, '0', 'reffinder')
-        imageGroupNameMono = "%d_%s_%s_%s_%s" % (candidate['id'], tdate, 'ps1%s' % singleFilter, '0', 'reffinder')
+            # Write the records of any finished renders as we go.
+            stillPending = []
+            for render in pendingRenders:
+                if render.ready():
+                    registerFinder(*render.get())
+                else:
+                    stillPending.append(render)
+            pendingRenders = stillPending
 
-        # Create the relevant MJD directory under the images root
-        if not os.path.exists(imageDownloadLocation):
-           try:
-               os.makedirs(imageDownloadLocation)
-           except OSError as e:
-               if e.errno == errno.EEXIST and os.path.isdir(imageDownloadLocation):
-                   pass
-               else:
-                   raise
-           os.chmod(imageDownloadLocation, 0o775)
+    for render in pendingRenders:
+        registerFinder(*render.get())
 
-        shutil.move(finderFiles['colourJPEG'], imageDownloadLocation + '/' + imageGroupNameColour + '.jpeg')
-        shutil.move(finderFiles['singleFilterFITS'], imageDownloadLocation + '/' + imageGroupNameMono + '.fits')
-        shutil.move(fitsToJpegExtension(finderFiles['singleFilterFITS']), imageDownloadLocation + '/' + imageGroupNameMono + '.jpeg')
-        (imageId, imageGroupId) = insertPostageStampImageRecord(conn, imageGroupNameColour, os.path.basename(finderFiles['colourJPEG']), imageDetails['imageMJD'], 0, colourFilters, None,None, groupType = GROUP_TYPE_FINDER)
-        (imageId, imageGroupId) = insertPostageStampImageRecord(conn, imageGroupNameMono, os.path.basename(finderFiles['singleFilterFITS']), imageDetails['imageMJD'], 0, singleFilter, None,None, groupType = GROUP_TYPE_FINDER)
-        # Update processing_flags for this object
-        updateAtlasObjectProcessingFlag(conn, candidate, processingFlag = PROCESSING_FLAGS['reffinders'])
-        counter += 1
+    if renderPool is not None:
+        renderPool.close()
+        renderPool.join()
 
     return
 
@@ -361,7 +549,9 @@ def main(argv = None):
     PSSImageRootLocation = '/' + hostname + '/images/' + database
 
 
-    generatePS1Finders(conn, hostname, database, objectList, int(options.size), downloadPath=options.downloadpath, colourFilters=options.filters, singleFilter=options.singlefilter, ddc = options.ddc, connSherlock = connSherlock, nsigma = float(options.nsigma))
+    sherlockDb = {'username': susername, 'password': spassword, 'database': sdatabase, 'hostname': shostname}
+
+    generatePS1Finders(conn, hostname, database, objectList, int(options.size), downloadPath=options.downloadpath, colourFilters=options.filters, singleFilter=options.singlefilter, ddc = options.ddc, connSherlock = connSherlock, nsigma = float(options.nsigma), downloadThreads = int(options.downloadthreads), renderers = int(options.renderers), sherlockDb = sherlockDb)
 
     conn.close()
     connSherlock.close()
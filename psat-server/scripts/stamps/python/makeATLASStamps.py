@@ -2,7 +2,7 @@
 """Make ATLAS Stamps in the context of the transient server database.
 
 Usage:
-  %s <configfile> [<candidate>...] [--detectionlist=<detectionlist>] [--customlist=<customlist>] [--limit=<limit>] [--earliest] [--nondetections] [--discoverylimit=<discoverylimit>] [--lastdetectionlimit=<lastdetectionlimit>] [--requesttype=<requesttype>] [--wpwarp=<wpwarp>] [--update] [--ddc] [--skipdownload] [--redregex=<redregex>] [--diffregex=<diffregex>] [--redlocation=<redlocation>] [--difflocation=<difflocation>]
+  %s <configfile> [<candidate>...] [--detectionlist=<detectionlist>] [--customlist=<customlist>] [--limit=<limit>] [--earliest] [--nondetections] [--discoverylimit=<discoverylimit>] [--lastdetectionlimit=<lastdetectionlimit>] [--requesttype=<requesttype>] [--wpwarp=<wpwarp>] [--update] [--ddc] [--skipdownload] [--redregex=<redregex>] [--diffregex=<diffregex>] [--redlocation=<redlocation>] [--difflocation=<difflocation>] [--prefetch] [--transferstreams=<transferstreams>] [--cachesize=<cachesize>]
   %s (-h | --help)
   %s --version
 
@@ -25,6 +25,9 @@ Options:
   --diffregex=<diffregex>                     Diff image regular expression. Caps = variable. [default: EXPNAME.diff.fz]
   --redlocation=<redlocation>                 Reduced image location. E.g. /atlas/diff/CAMERA/fake/MJD.fake (caps = special variable).  Null value means use standard ATLAS archive location.
   --difflocation=<difflocation>               Diff image location. E.g. /atlas/diff/CAMERA/fake/MJD.fake (caps = special variable). Null value means use standard ATLAS archive location.
+  --prefetch                                  Download the exposures in the background and start cutting stamps as soon as each object's exposures arrive.
+  --transferstreams=<transferstreams>         Number of concurrent rsync streams used to fetch missing exposures [default: 4].
+  --cachesize=<cachesize>                     Maximum size (GB) of the local exposure cache. Least recently used exposures fetched by the cache are deleted above this. Default is no limit.
 
 E.g.:
   %s ~/config_fakers.yaml 1130252001002421600 --ddc --skipdownload --redlocation=/atlas/diff/CAMERA/fake/MJD.fake --redregex=EXPNAME.fits+fake --difflocation=/atlas/diff/CAMERA/fake/MJD.fake --diffregex=EXPNAME.diff+fake
@@ -66,6 +69,7 @@ from gkutils.commonutils import dbConnect, PROCESSING_FLAGS, calculateRMSScatter
 import MySQLdb
 from pstamp_utils import getLightcurveDetectionsAtlas2, getExistingDetectionImages, getExistingNonDetectionImages, DETECTIONTYPES, REQUESTTYPES, PSTAMP_SUCCESS, PSTAMP_NO_OVERLAP, PSTAMP_SYSTEM_ERROR, IPP_IDET_NON_DETECTION_VALUE, insertPostageStampImageRecordAtlas
 import image_utils as imu
+from exposureCache import ExposureCache
 #import pyfits as pf
 from astropy.io import fits as pf
 from psat_server_web.atlas.atlas.commonqueries import getLightcurvePoints, getNonDetections, getNonDetectionsUsingATLASFootprint, ATLAS_METADATADDC, filterWhereClauseddc, LC_POINTS_QUERY_ATLAS_DDC, FILTERS
@@ -132,7 +136,8 @@ def eliminateExistingImages(conn, candidate, detections, detectionsWithImages):
 #def doRsync(exposureSet, imageType, userId = 'yoda', remoteMachine = 'sc01', remoteLocation = '/atlas', localLocation = '/atlas', getMetadata = False, metadataExtension = '.tph', ignoreExistingFiles = False):
 #def doRsync(exposureSet, imageType, userId = 'ksmith', remoteMachine = 'atlas-base-sc01.ifa.hawaii.edu', remoteLocation = '/atlas', localLocation = '/atlas', getMetadata = False, metadataExtension = '.tph', ignoreExistingFiles = False):
 #def doRsync(exposureSet, imageType, userId = 'xfer', remoteMachine = 'atlas-base-adm02.ifa.hawaii.edu', remoteLocation = '/atlas', localLocation = '/atlas', getMetadata = False, metadataExtension = '.tph', ignoreExistingFiles = False):
-def doRsync(exposureSet, imageType, userId = 'ksmith', remoteMachine = 'atlas-base-sc01.ifa.hawaii.edu', remoteLocation = '/atlas', localLocation = '/atlas', getMetadata = False, metadataExtension = '.tph', ignoreExistingFiles = False, timeout = None):
+# 2026-10-19 KWS Added rsyncFileSuffix so that several rsyncs can run concurrently from one process.
+def doRsync(exposureSet, imageType, userId = 'ksmith', remoteMachine = 'atlas-base-sc01.ifa.hawaii.edu', remoteLocation = '/atlas', localLocation = '/atlas', getMetadata = False, metadataExtension = '.tph', ignoreExistingFiles = False, timeout = None, rsyncFileSuffix = ''):
     """doRsync.
 
     Args:
@@ -145,6 +150,8 @@ def doRsync(exposureSet, imageType, userId = 'ksmith', remoteMachine = 'atlas-ba
         getMetadata:
         metadataExtension:
         ignoreExistingFiles:
+        timeout:
+        rsyncFileSuffix:
     """
 
     exposureSet.sort()
@@ -156,7 +163,7 @@ def doRsync(exposureSet, imageType, userId = 'ksmith', remoteMachine = 'atlas-ba
 
     imageExtension = {'diff':'.diff.fz','red':'.fits.fz'}
 
-    rsyncFile = '/tmp/rsyncFiles_' + imageType + str(os.getpid()) + '.txt'
+    rsyncFile = '/tmp/rsyncFiles_' + imageType + str(os.getpid()) + rsyncFileSuffix + '.txt'
 
     # Create a diff and input rsync file
     rsf = open(rsyncFile, 'w')
@@ -311,25 +318,31 @@ def getUniqueExposures(conn, candidateList, limit = 0, mostRecent = True, nonDet
     return exposureSet
 
 
-def downloadExposures(exposureSet, useMonsta = True):
+# 2026-10-19 KWS Go via the local exposure cache. Exposures we already have (e.g. from
+#                an earlier forced photometry run) are not passed to rsync at all.
+def downloadExposures(exposureSet, useMonsta = True, exposureCache = None):
    """downloadExposures.
 
    Args:
        exposureSet:
        useMonsta:
+       exposureCache:
    """
 
    funpackCmd = '/atlas/bin/funpack'
 
+   if exposureCache is None:
+       exposureCache = ExposureCache()
+
    # (1.1) Get the diff images.  We no longer download these by default.
 
    print("Fetching Diff Images...")
-   doRsync(exposureSet, 'diff', ignoreExistingFiles = True)
+   exposureCache.fetch(exposureSet, 'diff')
 
    # (3) Go and get the input exposures
 
    print("Fetching Input Images...")
-   doRsync(exposureSet, 'red', ignoreExistingFiles = True)
+   exposureCache.fetch(exposureSet, 'red')
 
    # (2) Unpack the diff data (which we already have) to a temporary location
 
@@ -408,7 +421,7 @@ def downloadExposures(exposureSet, useMonsta = True):
 
 # 2015-12-02 KWS New version of this code for the ATLAS ddet schema
 # 2016-10-10 KWS Added ability to request non-detections
-def makeATLASObjectPostageStamps3(conn, candidateList, PSSImageRootLocation, stampSize = 200, limit = 0, mostRecent = True, detectionType = DETECTIONTYPES['detections'], requestType = REQUESTTYPES['incremental'], useMonsta = True, nonDets = False, discoveryLimit = 10, lastDetectionLimit=20, ddc = False, wpwarp = 1, remoteLocation = 'xfer@atlas-base-adm02.ifa.hawaii.edu:/atlas/red', remoteDiffLocation = 'xfer@atlas-base-adm02.ifa.hawaii.edu:/atlas/diff', localLocation = '/atlas/red', localDiffLocation = '/atlas/diff', options = None):
+def makeATLASObjectPostageStamps3(conn, candidateList, PSSImageRootLocation, stampSize = 200, limit = 0, mostRecent = True, detectionType = DETECTIONTYPES['detections'], requestType = REQUESTTYPES['incremental'], useMonsta = True, nonDets = False, discoveryLimit = 10, lastDetectionLimit=20, ddc = False, wpwarp = 1, remoteLocation = 'xfer@atlas-base-adm02.ifa.hawaii.edu:/atlas/red', remoteDiffLocation = 'xfer@atlas-base-adm02.ifa.hawaii.edu:/atlas/diff', localLocation = '/atlas/red', localDiffLocation = '/atlas/diff', options = None, exposureCache = None):
    """makeATLASObjectPostageStamps3.
 
    Args:
@@ -431,6 +444,7 @@ def makeATLASObjectPostageStamps3(conn, candidateList, PSSImageRootLocation, sta
        localLocation:
        localDiffLocation:
        options:
+       exposureCache: if set, wait for (or fetch) each candidate's exposures before cutting
    """
 
 
@@ -504,6 +518,11 @@ def makeATLASObjectPostageStamps3(conn, candidateList, PSSImageRootLocation, sta
 
          # We need to process a triplet of images at once.
 
+      # 2026-10-19 KWS If the exposures are being prefetched in the background, we only
+      #                need to wait for the ones this candidate needs.
+      if exposureCache is not None:
+         exposureCache.require(list(set([row.expname for row in recurrences])), imageTypes = ('diff', 'red'))
+
       for row in recurrences:
          x = None
          y = None
@@ -865,16 +884,30 @@ def main():
 
     PSSImageRootLocation = '/' + hostname + '/images/' + database
 
+    maxBytes = None
+    if options.cachesize is not None:
+        maxBytes = int(float(options.cachesize) * 1.0e9)
+
+    exposureCache = None
+
     #exposureSet = getUniqueExposures(conn, objectList, limit = limit, mostRecent = mostRecent)
     # Only download exposures if requested. Otherwise assume we already HAVE the data.
     if not options.skipdownload:
+        exposureCache = ExposureCache(maxBytes = maxBytes, streams = int(options.transferstreams))
         exposureSet = getUniqueExposures(conn, objectList, limit = limit, mostRecent = mostRecent, nonDets = nondetections, discoveryLimit = discoverylimit, lastDetectionLimit=lastdetectionlimit, ddc = options.ddc)
         exposureSet.sort()
         for row in exposureSet:
             print(row)
-        downloadExposures(exposureSet)
+        if options.prefetch:
+            exposureCache.prefetch(exposureSet, imageTypes = ('diff', 'red'))
+        else:
+            downloadExposures(exposureSet, exposureCache = exposureCache)
+            exposureCache = None
+
+    makeATLASObjectPostageStamps3(conn, objectList, PSSImageRootLocation, limit = limit, mostRecent = mostRecent, nonDets = nondetections, discoveryLimit = discoverylimit, lastDetectionLimit=lastdetectionlimit, requestType = requestType, ddc = options.ddc, wpwarp = options.wpwarp, options = options, exposureCache = exposureCache)
 
-    makeATLASObjectPostageStamps3(conn, objectList, PSSImageRootLocation, limit = limit, mostRecent = mostRecent, nonDets = nondetections, discoveryLimit = discoverylimit, lastDetectionLimit=lastdetectionlimit, requestType = requestType, ddc = options.ddc, wpwarp = options.wpwarp, options = options)
+    if exposureCache is not None:
+        exposureCache.wait()
 
     conn.close()
 
@@ -0,0 +1,192 @@
+"""Concurrent, resumable downloads from the Pan-STARRS Postage Stamp Server data store.
+
+All the files belonging to a request (results.fits, stamps, finders) are fetched
+over a bounded pool of keep-alive HTTP connections rather than one urlretrieve
+at a time.  Each file is written to <file>.part and only renamed to its final
+name once its MD5 sum matches the one in the data store index, so nothing
+downstream (FITS parsing, JPEG conversion, database registration) ever sees a
+partial or corrupt file.  If a transfer drops, the next attempt resumes the
+.part file with a range request.
+
+The data store URL is just a base URL, so this works equally well against a
+local HTTP server serving synthetic results tables, e.g.
+
+    python -m http.server 8000   (in a directory containing <requestName>/index.txt etc)
+    downloader = PostageStampDownloader('http://localhost:8000/')
+"""
+import os
+import hashlib
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Download status codes. The errors match the locally defined image download
+# error codes in pstamp_utils, so they can be written straight to the database.
+DOWNLOAD_OK                = 0
+ERROR_BAD_FILE_CHECKSUM    = -2
+ERROR_COULD_NOT_DOWNLOAD   = -3
+
+PART_EXTENSION = '.part'
+
+
+def md5(filename, blocksize = 65536):
+    """Compute the md5 hash of a file.
+
+    Args:
+        filename:
+        blocksize:
+    """
+    hash = hashlib.md5()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(blocksize), b""):
+            hash.update(block)
+    return hash.hexdigest()
+
+
+class PostageStampDownloader(object):
+    """Bounded pool of keep-alive connections to the data store"""
+
+    def __init__(self, dataStoreURL, connections = 4, timeout = 60, retries = 3, chunkSize = 1048576):
+        """
+        dataStoreURL: base URL of the data store. Files are at <dataStoreURL><requestName>/<fileID>
+        connections:  maximum number of concurrent connections (and downloads)
+        timeout:      connect and read timeout (seconds).  A stalled transfer is
+                      abandoned after this long and resumed on the next attempt.
+        retries:      number of attempts per file
+        chunkSize:    number of bytes written per read
+        """
+        self.dataStoreURL = dataStoreURL
+        self.connections = max(int(connections), 1)
+        self.timeout = timeout
+        self.retries = max(int(retries), 1)
+        self.chunkSize = chunkSize
+
+        # requests Sessions are not guaranteed to be thread safe, so each worker
+        # thread gets its own, which it keeps (and keeps alive) for the lifetime
+        # of the downloader.  The number of workers bounds the number of connections.
+        self.local = threading.local()
+        self.executor = None
+
+
+    def getSession(self):
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections = 1, pool_maxsize = 1)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self.local.session = session
+        return session
+
+
+    def getURL(self, requestName, fileID):
+        return self.dataStoreURL + requestName + '/' + fileID
+
+
+    def transfer(self, url, partFile):
+        """Download url to partFile, resuming from the end of partFile if it exists.
+           Raises requests exceptions on failure."""
+        offset = 0
+        if os.path.exists(partFile):
+            offset = os.path.getsize(partFile)
+
+        headers = {}
+        if offset > 0:
+            headers['Range'] = 'bytes=%d-' % offset
+
+        session = self.getSession()
+        with session.get(url, headers = headers, stream = True, timeout = self.timeout) as response:
+            if response.status_code == 416:
+                # We already have all of it.
+                return
+            response.raise_for_status()
+
+            if offset > 0 and response.status_code != 206:
+                # Server ignored the range request. Start again.
+                offset = 0
+
+            with open(partFile, 'ab' if offset > 0 else 'wb') as f:
+                for block in response.iter_content(chunk_size = self.chunkSize):
+                    if block:
+                        f.write(block)
+
+
+    def downloadFile(self, url, localFile, md5sum = None):
+        """Download a single file, resuming and retrying as necessary, and verify it.
+           Returns DOWNLOAD_OK, ERROR_BAD_FILE_CHECKSUM or ERROR_COULD_NOT_DOWNLOAD.
+
+        Args:
+            url:
+            localFile: final location of the file
+            md5sum: expected MD5 sum. None = don't check.
+        """
+        # Already have it (e.g. a rerun of a partially processed request).
+        if md5sum and os.path.exists(localFile) and md5(localFile) == md5sum:
+            return DOWNLOAD_OK
+
+        partFile = localFile + PART_EXTENSION
+        status = ERROR_COULD_NOT_DOWNLOAD
+
+        for attempt in range(self.retries):
+            try:
+                self.transfer(url, partFile)
+            except (requests.exceptions.RequestException, IOError) as e:
+                print("ERROR: %s failed to download (attempt %d of %d). Error is: %s" % (url, attempt + 1, self.retries, str(e)))
+                status = ERROR_COULD_NOT_DOWNLOAD
+                response = getattr(e, 'response', None)
+                if response is not None and response.status_code == 404:
+                    # It's not there. No point trying again.
+                    break
+                # Back off a little before resuming.
+                time.sleep(min(2 ** attempt, 10))
+                continue
+
+            if md5sum and md5(partFile) != md5sum:
+                print("The MD5 check has failed for %s (attempt %d of %d)." % (url, attempt + 1, self.retries))
+                # Whatever we resumed from is garbage. Start from scratch next time.
+                os.remove(partFile)
+                status = ERROR_BAD_FILE_CHECKSUM
+                continue
+
+            os.replace(partFile, localFile)
+            return DOWNLOAD_OK
+
+        return status
+
+
+    def downloadFiles(self, files):
+        """Download a list of files concurrently.  Returns a dict of status codes keyed by local file.
+
+        Args:
+            files: list of (url, localFile, md5sum) tuples
+        """
+        if not files:
+            return {}
+
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers = self.connections)
+
+        statuses = list(self.executor.map(lambda f: self.downloadFile(*f), files))
+
+        return dict(zip([f[1] for f in files], statuses))
+
+
+    def downloadRequestFiles(self, requestName, files):
+        """Download files belonging to a request.  Returns a dict of status codes keyed by local file.
+
+        Args:
+            requestName:
+            files: list of (dataStoreFileInfo, localFile) tuples. dataStoreFileInfo is a
+                   parsed data store index row (with 'fileID' and 'md5sum').
+        """
+        return self.downloadFiles([(self.getURL(requestName, fileInfo['fileID']), localFile, fileInfo.get('md5sum')) for fileInfo, localFile in files])
+
+
+    def close(self):
+        """Shut down the worker threads (and their connections)."""
+        if self.executor is not None:
+            self.executor.shutdown(wait = True)
+            self.executor = None
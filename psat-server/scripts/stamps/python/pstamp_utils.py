@@ -11,13 +11,17 @@ import urllib.request, urllib.parse, urllib.error
 import hashlib
 from astropy.io import fits as pf
 import os,sys,errno
+import itertools
 import image_utils as imu
 import MultipartPostHandler
 import http.cookiejar
 import time
 import datetime
-from gkutils.commonutils import base26, PROCESSING_FLAGS, readPhotpipeDCMPFile, CAT_ID_RA_DEC_COLS
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from gkutils.commonutils import base26, PROCESSING_FLAGS, readPhotpipeDCMPFile, CAT_ID_RA_DEC_COLS, getCurrentMJD
 import re
+from pstampDownloader import PostageStampDownloader, DOWNLOAD_OK
 
 
 
@@ -346,79 +350,86 @@ def addZooRequestIdToTransients(conn, zooReqeustId, transients):
 # data store index files.  Need to modify this to check for each comment line
 # and create separate dictionaries for each one.
 
-def parseIndexList(lines):
-   """parseIndexList.
+# 2026-10-19 KWS The original parser called lines.index(line) and resliced the list
+#                on every header line, which made it quadratic in the length of the
+#                index file.  iterIndexBlocks does the same thing in a single pass, and
+#                takes any iterable of lines (e.g. an open file), yielding each block's
+#                list of dicts as soon as the next header is reached.
+
+def iterIndexBlocks(lines):
+   """iterIndexBlocks. Generator of the blocks (lists of dicts) in an index file.
+      Raises ValueError if the file can't be parsed.
 
    Args:
-       lines:
+       lines: iterable of lines (a list, or an open file)
    """
-   dictList = []
-   result = []
+   lines = iter(lines)
+   firstLine = next(lines, None)
 
-   if len(lines) == 0:
-      print("Empty file")
-      return []
+   if firstLine is None:
+      raise ValueError("Empty file")
 
-   if len(lines[0]) == 0:
-      print("Can't process empty first line")
-      return []
+   if len(firstLine) == 0:
+      raise ValueError("Can't process empty first line")
 
-   if lines[0][0] != "#":
-      print("Did not find at least one '#' in line 1 column 1 of downloaded file list")
-      return []
+   if firstLine[0] != "#":
+      raise ValueError("Did not find at least one '#' in line 1 column 1 of downloaded file list")
 
+   result = []
+   cleanKeys = []
+   # Number of lines since the last keys line.  As before, a keys line that directly
+   # follows another one does not start a new block.
+   lineNumber = 0
 
-   for line in lines:
+   for line in itertools.chain((firstLine,), lines):
       if len(line) == 0:
+         lineNumber += 1
          continue
 
       if line[0] == '#':
          # This is the set of keys
-
-         if lines.index(line) != 0:
-            # Append the previous list of dicts
-            dictList.append(result)
+         if lineNumber != 0:
+            # Yield the previous list of dicts
+            yield result
             result = []
 
-         keys = line[1:].split('|')
-         keys = ( k.strip() for k in keys )
-         cleanKeys = []
-         for k in keys:
-            if len(k)>0:
-               cleanKeys.append(k)
-         # Reset lines to be the lines minus the current keys line
-         lines = lines[lines.index(line)+1:]
+         cleanKeys = [k for k in (k.strip() for k in line[1:].split('|')) if len(k) > 0]
+         lineNumber = 0
+         continue
 
-      else:
-         # This is a value
-         line.strip()
-         if len(line) > 0:
-            words = line.strip().split('|')
-            cleanWords = []
-            for word in words:
-               if len(word) > 0:
-                  cleanWords.append(word)
-            cleanWords= [word.strip() for word in cleanWords]
-            if len(cleanWords) == 0:
-               continue
-
-            # In PSS results, if there is a failure in any of the images
-            # we get a line with 5 keys, but only 4 words...  The "component"
-            # keys is not populated.  We'll have to take account of this...
-            if len(cleanWords) < len(cleanKeys) and cleanKeys[-1] == 'component':
-               cleanKeys.remove(cleanKeys[-1])
-
-            if len(cleanWords) < len(cleanKeys):
-               print("Wrong length line %d in index list" % lines.index(line))
-               return []
-
-            lineDict = {}
-            for i in range(len(cleanKeys)):
-               lineDict[cleanKeys[i]] = cleanWords[i]
-            result.append(lineDict)
-
-   # Now append the last acquired list
-   dictList.append(result)
+      lineNumber += 1
+
+      # This is a value
+      cleanWords = [word.strip() for word in line.strip().split('|') if len(word) > 0]
+      if len(cleanWords) == 0:
+         continue
+
+      # In PSS results, if there is a failure in any of the images
+      # we get a line with 5 keys, but only 4 words...  The "component"
+      # keys is not populated.  We'll have to take account of this...
+      if len(cleanWords) < len(cleanKeys) and cleanKeys[-1] == 'component':
+         cleanKeys = cleanKeys[:-1]
+
+      if len(cleanWords) < len(cleanKeys):
+         raise ValueError("Wrong length line %d in index list" % (lineNumber - 1))
+
+      result.append(dict(zip(cleanKeys, cleanWords)))
+
+   # Now yield the last acquired list
+   yield result
+
+
+def parseIndexList(lines):
+   """parseIndexList.
+
+   Args:
+       lines: list of lines (or an open file)
+   """
+   try:
+      dictList = list(iterIndexBlocks(lines))
+   except ValueError as e:
+      print(e)
+      return []
 
    return dictList
 
@@ -760,7 +771,7 @@ def getObjectNames(conn, objectId):
 
 
 
-def downloadPostageStampImage(conn, requestName, fitsRow, dataStoreFileInfo, PSSImageRootLocation, dataStoreURL = None):
+def downloadPostageStampImage(conn, requestName, fitsRow, dataStoreFileInfo, PSSImageRootLocation, dataStoreURL = None, downloadResult = None):
    """downloadPostageStampImage.
 
    Args:
@@ -770,6 +781,7 @@ def downloadPostageStampImage(conn, requestName, fitsRow, dataStoreFileInfo, PSS
        dataStoreFileInfo:
        PSSImageRootLocation:
        dataStoreURL: The location of the data store.
+       downloadResult: Status of the image if already downloaded by downloadRequestImages.
    """
    downloadStatus = False
    errorCode = fitsRow.field('ERROR_CODE')
@@ -828,45 +840,20 @@ def downloadPostageStampImage(conn, requestName, fitsRow, dataStoreFileInfo, PSS
    # the FITS file (whilst preserving the previously generated JPEG).  So next line now commented out.
    #if not os.path.exists(absoluteLocalImageName):
 
-   urllibFilename = None
-   urllibHeaders = None
-
-   try:
-      (urllibFilename, urllibHeaders) = urllib.request.urlretrieve(dataStoreURL +requestName +'/' + dataStoreFileInfo['fileID'], absoluteLocalImageName)
+   # 2026-10-19 KWS Download via the keep-alive download engine, which resumes partial
+   #                downloads and verifies the MD5 sum before we go anywhere near the file.
+   #                If the request's images were already fetched concurrently, just use
+   #                the result.
+   if downloadResult is None:
+      downloadResult = downloadDataStoreFile(requestName, dataStoreFileInfo, absoluteLocalImageName, dataStoreURL = dataStoreURL)
 
-   except IOError as e:
-      print("ERROR: Image failed to download. Error is: %s. Having another go..." % e.errno)
-      try:
-         (urllibFilename, urllibHeaders) = urllib.request.urlretrieve(dataStoreURL +requestName +'/' + dataStoreFileInfo['fileID'], absoluteLocalImageName)
-
-      except IOError as e:
-         print("ERROR: Image failed to download. Error is: %s. Recording error." % e.errno)
-         (imageId, imageGroupId) = insertPostageStampImageRecord(conn, localImageName, None, imageMJD, ERROR_COULD_NOT_DOWNLOAD, filterId, maskedPixelRatio, maskedPixelRatioAtCore)
-         return downloadStatus
-
-
-   # Check the MD5 sum.  If it fails, don't bother continuing.
-   # Comment out the following block of code to skip MD5 check.
-
-#   if md5(absoluteLocalImageName) != dataStoreFileInfo['md5sum']:
-#      print "The MD5 check has failed.  This file did not download correctly."
-#      # 2011-04-26 KWS Very occasionally urllib does NOT retrieve the file.  I think
-#      #                the problem may be a redirection issue.  When the file fails
-#      #                to download, os.remove throws an exception.  I still don't
-#      #                understand what's causing the problem.  Will have to monitor
-#      #                this one for a while before coming up with a permanent solution.
-#      #                Some testing doesn't seem to reveal anything significantly
-#      #                problemmatic.
-#      if os.path.exists(absoluteLocalImageName):
-#         os.remove(absoluteLocalImageName)
-#      else:
-#         print "File %s did not download!" % absoluteLocalImageName
-#         print "Header Info from Urllib:"
-#         print urllibHeaders
-#
-#      downloadStatus = False
-#      (imageId, imageGroupId) = insertPostageStampImageRecord(conn, localImageName, None, imageMJD, ERROR_BAD_FILE_CHECKSUM, filterId, maskedPixelRatio, maskedPixelRatioAtCore)
-#      return downloadStatus
+   if downloadResult != DOWNLOAD_OK:
+      if downloadResult == ERROR_BAD_FILE_CHECKSUM:
+         print("The MD5 check has failed.  This file did not download correctly. Recording error.")
+      else:
+         print("ERROR: Image failed to download. Recording error.")
+      (imageId, imageGroupId) = insertPostageStampImageRecord(conn, localImageName, None, imageMJD, downloadResult, filterId, maskedPixelRatio, maskedPixelRatioAtCore)
+      return downloadStatus
 
 
    # Open image & extract image MJD. Note that the images are NORMALLY compressed,
@@ -1364,7 +1351,7 @@ def createFinderImage(conn, absoluteLocalImageName, objectInfo = {}, xhColor = '
 
 # 2015-02-24 KWS Download finder images, but use PS1 Ubercal Star catalog.
 # 2015-03-18 KWS Override finder filter (e.g. with r-band).
-def downloadFinderImage2(conn, requestName, fitsRow, dataStoreFileInfo, PSSImageRootLocation, offsetStarSearchRadius = 120.0, offsetStarMagThreshold = 15.0, offsetStarFilter = None, dataStoreURL = None, nsigma = 2.0, connSherlock = None):
+def downloadFinderImage2(conn, requestName, fitsRow, dataStoreFileInfo, PSSImageRootLocation, offsetStarSearchRadius = 120.0, offsetStarMagThreshold = 15.0, offsetStarFilter = None, dataStoreURL = None, nsigma = 2.0, connSherlock = None, downloadResult = None):
    """downloadFinderImage2.
 
    Args:
@@ -1378,6 +1365,7 @@ def downloadFinderImage2(conn, requestName, fitsRow, dataStoreFileInfo, PSSImage
        offsetStarFilter:
        dataStoreURL: The location of the data store.
        connSherlock:
+       downloadResult: Status of the image if already downloaded by downloadRequestImages.
    """
    from gkutils.commonutils import calculateRMSScatter
 
@@ -1441,42 +1429,16 @@ def downloadFinderImage2(conn, requestName, fitsRow, dataStoreFileInfo, PSSImage
    # We need to look into the CMF file for nearby stars. This will have been saved previously.
    absoluteLocalCMFName = imageDownloadLocation + '/' + localImageName + '.cmf'
 
-   urllibFilename = None
-   urllibHeaders = None
-
-   try:
-      (urllibFilename, urllibHeaders) = urllib.request.urlretrieve(dataStoreURL +requestName +'/' + dataStoreFileInfo['fileID'], absoluteLocalImageName)
-
-   except IOError as e:
-      print("ERROR: Image failed to download. Error is: %s. Having another go..." % e.errno)
-      try:
-         (urllibFilename, urllibHeaders) = urllib.request.urlretrieve(dataStoreURL +requestName +'/' + dataStoreFileInfo['fileID'], absoluteLocalImageName)
+   # 2026-10-19 KWS Download via the keep-alive download engine (resumable, MD5 checked).
+   if downloadResult is None:
+      downloadResult = downloadDataStoreFile(requestName, dataStoreFileInfo, absoluteLocalImageName, dataStoreURL = dataStoreURL)
 
-      except IOError as e:
-         print("ERROR: Image failed to download. Error is: %s. Recording error." % e.errno)
-         (imageId, imageGroupId) = insertPostageStampImageRecord(conn, localImageName, None, imageMJD, ERROR_COULD_NOT_DOWNLOAD, filterId, maskedPixelRatio, maskedPixelRatioAtCore, groupType=GROUP_TYPE_FINDER)
-         return downloadStatus
-
-
-   # Check the MD5 sum.  If it fails, don't bother continuing.
-   if md5(absoluteLocalImageName) != dataStoreFileInfo['md5sum']:
-      print("The MD5 check has failed.  This file did not download correctly.")
-      # 2011-04-26 KWS Very occasionally urllib does NOT retrieve the file.  I think
-      #                the problem may be a redirection issue.  When the file fails
-      #                to download, os.remove throws an exception.  I still don't
-      #                understand what's causing the problem.  Will have to monitor
-      #                this one for a while before coming up with a permanent solution.
-      #                Some testing doesn't seem to reveal anything significantly
-      #                problemmatic.
-      if os.path.exists(absoluteLocalImageName):
-         os.remove(absoluteLocalImageName)
+   if downloadResult != DOWNLOAD_OK:
+      if downloadResult == ERROR_BAD_FILE_CHECKSUM:
+         print("The MD5 check has failed.  This file did not download correctly. Recording error.")
       else:
-         print("File %s did not download!" % absoluteLocalImageName)
-         print("Header Info from Urllib:")
-         print(urllibHeaders)
-
-      downloadStatus = False
-      (imageId, imageGroupId) = insertPostageStampImageRecord(conn, localImageName, None, imageMJD, ERROR_BAD_FILE_CHECKSUM, filterId, maskedPixelRatio, maskedPixelRatioAtCore, groupType=GROUP_TYPE_FINDER)
+         print("ERROR: Image failed to download. Recording error.")
+      (imageId, imageGroupId) = insertPostageStampImageRecord(conn, localImageName, None, imageMJD, downloadResult, filterId, maskedPixelRatio, maskedPixelRatioAtCore, groupType=GROUP_TYPE_FINDER)
       return downloadStatus
 
    # 2015-03-24 KWS Get the image information BEFORE passing to createFinderImage.
@@ -1512,6 +1474,92 @@ def downloadFinderImage2(conn, requestName, fitsRow, dataStoreFileInfo, PSSImage
    return downloadStatus
 
 
+# 2026-10-19 KWS One keep-alive downloader per data store, for callers that download
+#                one image at a time.
+_dataStoreDownloaders = {}
+
+def getDataStoreDownloader(dataStoreURL, connections = 1):
+   """getDataStoreDownloader.
+
+   Args:
+       dataStoreURL:
+       connections:
+   """
+   if dataStoreURL not in _dataStoreDownloaders:
+      _dataStoreDownloaders[dataStoreURL] = PostageStampDownloader(dataStoreURL, connections = connections)
+   return _dataStoreDownloaders[dataStoreURL]
+
+
+def downloadDataStoreFile(requestName, dataStoreFileInfo, localFileName, dataStoreURL = None, downloader = None):
+   """Download one file and check it against the MD5 sum in the data store index.
+      Returns DOWNLOAD_OK, ERROR_BAD_FILE_CHECKSUM or ERROR_COULD_NOT_DOWNLOAD.
+
+   Args:
+       requestName:
+       dataStoreFileInfo:
+       localFileName:
+       dataStoreURL:
+       downloader:
+   """
+   if downloader is None:
+      downloader = getDataStoreDownloader(dataStoreURL)
+   return downloader.downloadRequestFiles(requestName, [(dataStoreFileInfo, localFileName)])[localFileName]
+
+
+def getImageDownloadLocation(PSSImageRootLocation, localImageName):
+   """Create (if necessary) the MJD directory for the image and return the full image filename.
+
+   Args:
+       PSSImageRootLocation:
+       localImageName:
+   """
+   (id, mjd, diffid, ippIdet, imageType) = localImageName.split('_')
+   imageDownloadLocation = PSSImageRootLocation + '/' + "%d" % int(float(mjd))
+
+   if not os.path.exists(imageDownloadLocation):
+      try:
+         os.makedirs(imageDownloadLocation)
+      except OSError as e:
+         if e.errno == errno.EEXIST and os.path.isdir(imageDownloadLocation):
+            pass
+         else:
+            raise
+      os.chmod(imageDownloadLocation, 0o775)
+
+   return imageDownloadLocation + '/' + localImageName + '.fits'
+
+
+def downloadRequestImages(downloader, requestName, table, imageInfo, PSSImageRootLocation, imageNameSuffix = ''):
+   """Download all the good images in a results table concurrently, before any of them
+      are converted or registered.  Returns a dict of download status keyed by IMG_NAME.
+
+   Args:
+       downloader: PostageStampDownloader
+       requestName:
+       table: results FITS table
+       imageInfo: parsed data store index rows for the image files
+       PSSImageRootLocation:
+       imageNameSuffix: e.g. 'finder'
+   """
+   imageInfoByName = {}
+   for row in imageInfo:
+      imageInfoByName[row['fileID']] = row
+
+   files = []
+   localFiles = {}
+   for fitsRow in table:
+      pssImageName = fitsRow.field('IMG_NAME')
+      if '.fits' in pssImageName and fitsRow.field('ERROR_CODE') == 0 and pssImageName in imageInfoByName:
+         localFile = getImageDownloadLocation(PSSImageRootLocation, fitsRow.field('COMMENT') + imageNameSuffix)
+         files.append((imageInfoByName[pssImageName], localFile))
+         localFiles[pssImageName] = localFile
+
+   print("Downloading %d images for request %s over %d connections..." % (len(files), requestName, downloader.connections))
+   statuses = downloader.downloadRequestFiles(requestName, files)
+
+   return dict((name, statuses[localFile]) for name, localFile in localFiles.items())
+
+
 # 2023-10-03 KWS Will move this eventually to requests. In the meantime for python 3 need
 #                to add .decode('utf-8').
 
@@ -2552,10 +2600,34 @@ def getDetectabilityInfo2(conn, candidate, limitDays = 100, limitDaysAfter = 0,
         overlapDays:
     """
 
+    detections = getLightcurveDetections(conn, candidate)
+    nonDetections = getLightcurveNonDetectionsAndBlanks(conn, candidate)
+
+    # If we already have forced photometry, don't request it again.
+    maxForcedPhotometryMJD = getMaxForcedPhotometryMJD(conn, candidate, fpType = fpType)
+
+    return selectDetectabilityRows(candidate, detections, nonDetections, maxForcedPhotometryMJD, limitDays = limitDays, limitDaysAfter = limitDaysAfter, useFirstDetection = useFirstDetection, overlapDays = overlapDays)
+
+
+# 2026-10-19 KWS Split out of getDetectabilityInfo2 so that the same selection can be
+#                applied to lightcurves that have been fetched in bulk.
+def selectDetectabilityRows(candidate, detections, nonDetections, maxForcedPhotometryMJD, limitDays = 100, limitDaysAfter = 0, useFirstDetection = True, overlapDays = 0):
+    """selectDetectabilityRows. Pick the (unique) epochs for which we need forced photometry.
+
+    Args:
+        candidate:
+        detections: lightcurve detections (first detection first)
+        nonDetections: lightcurve non-detections and blanks
+        maxForcedPhotometryMJD: MJD of the most recent forced photometry we already have
+        limitDays:
+        limitDaysAfter:
+        useFirstDetection:
+        overlapDays:
+    """
+
     import json
     detectabilityData = []
-    lightcurveData = getLightcurveDetections(conn, candidate)
-    lightcurveData += getLightcurveNonDetectionsAndBlanks(conn, candidate)
+    lightcurveData = list(detections) + list(nonDetections)
 
     lightcurveData = sorted(lightcurveData, key = lambda i: i['tdate'])
     # NOTE: there are duplicates in the non-forced photometry with different values of ipp_idet but all
@@ -2565,19 +2637,15 @@ def getDetectabilityInfo2(conn, candidate, limitDays = 100, limitDaysAfter = 0,
     if limitDays > 0:
         thresholdMJDMax = 70000
         if useFirstDetection:
-            # We need to know when the first detection was,
-            # but we don't always request detections.
-            detectionData = getLightcurveDetections(conn, candidate)
             # The detection MJD should be the first element returned
-            thresholdMJD = detectionData[0]['mjd'] - limitDays
+            thresholdMJD = detections[0]['mjd'] - limitDays
             if limitDaysAfter > 0:
-                thresholdMJDMax = detectionData[0]['mjd'] + limitDaysAfter
+                thresholdMJDMax = detections[0]['mjd'] + limitDaysAfter
         else:
             thresholdMJD = getCurrentMJD() - limitDays
-        lightcurveData = eliminateOldDetections(conn, candidate, lightcurveData, thresholdMJD, thresholdMJDMax)
+        lightcurveData = eliminateOldDetections(None, candidate, lightcurveData, thresholdMJD, thresholdMJDMax)
 
-    # If we already have forced photometry, don't request it again.
-    maxForcedPhotometryMJD = getMaxForcedPhotometryMJD(conn, candidate, fpType = fpType) - overlapDays
+    maxForcedPhotometryMJD = maxForcedPhotometryMJD - overlapDays
 
     if lightcurveData:
         for row in lightcurveData:
@@ -2589,20 +2657,195 @@ def getDetectabilityInfo2(conn, candidate, limitDays = 100, limitDaysAfter = 0,
                 for imType in ['target','ref','diff']:
                     print("%s (%s): %s" % (imType, diffImageCombination[imType][0], diffImageCombination[imType][1]), end=' ')
                 print()
-                detectabilityData.append(json.dumps({'mjd': row['mjd'], 'filter': row['filter'], 'diff': diffImageCombination['diff'][1], 'target': diffImageCombination['target'][1], 'pscamera': row['fpa_detector']}))
+                detectabilityData.append(json.dumps({'mjd': row['mjd'], 'filter': row['filter'], 'diff': diffImageCombination['diff'][1], 'target': diffImageCombination['target'][1], 'pscamera': row['fpa_detector']}, sort_keys = True))
 
         # Now we must eliminate the dupes.  Sadly, we can't use sets, since "dicts are not hashable" but we
         # can do a trick by converting the dict to json and then back to dict.
         if len(detectabilityData) > 0:
-            detectabilityDataJSON = list(set(detectabilityData))
-            detectabilityData = []
-            for d in detectabilityDataJSON:
-                detectabilityData.append(json.loads(d))
-            # Finally sort them the list again.  (Set leaves it unsorted once again.)
-            detectabilityData = sorted(detectabilityData, key = lambda i: i['mjd'])
+            # Sort the list again, since the set leaves it unsorted.  Sorting on the JSON as well
+            # as the MJD makes the order (and hence the requests) reproducible.
+            detectabilityData = [json.loads(d) for d in sorted(set(detectabilityData), key = lambda d: (json.loads(d)['mjd'], d))]
 
     return detectabilityData
 
+
+# Number of objects per query in the bulk detectability queries.
+DETECTABILITY_QUERY_CHUNK_SIZE = 1000
+
+
+def getAverageCoordinatesBulk(conn, candidates, chunkSize = DETECTABILITY_QUERY_CHUNK_SIZE):
+    """getAverageCoordinatesBulk. Bulk version of getAverageCoordinates.
+       Returns a dict of (ra, dec) keyed by object ID.
+
+    Args:
+        conn:
+        candidates: list of object IDs
+        chunkSize:
+    """
+    import MySQLdb
+
+    coordinates = {}
+    candidates = list(candidates)
+
+    try:
+        cursor = conn.cursor (MySQLdb.cursors.DictCursor)
+
+        for i in range(0, len(candidates), chunkSize):
+            chunk = candidates[i:i + chunkSize]
+            placeholders = ','.join(['%s'] * len(chunk))
+            cursor.execute ("""
+                select id, avg(ra_psf) ra_psf, avg(dec_psf) dec_psf from (
+                   select id, ra_psf, dec_psf
+                     from tcs_transient_objects
+                    where id in (%s)
+                union all
+                   select transient_object_id id, ra_psf, dec_psf
+                     from tcs_transient_reobservations
+                    where transient_object_id in (%s)) temp
+                group by id
+            """ % (placeholders, placeholders), tuple(chunk + chunk))
+
+            for row in cursor.fetchall ():
+                coordinates[row['id']] = (row['ra_psf'], row['dec_psf'])
+
+        cursor.close ()
+
+    except MySQLdb.Error as e:
+        print("Error %d: %s" % (e.args[0], e.args[1]))
+        sys.exit (1)
+
+    return coordinates
+
+
+def getMaxForcedPhotometryMJDBulk(conn, candidates, fpType = 0, chunkSize = DETECTABILITY_QUERY_CHUNK_SIZE):
+    """getMaxForcedPhotometryMJDBulk. Bulk version of getMaxForcedPhotometryMJD.
+       Returns a dict of max MJDs keyed by object ID (0 if there's no forced photometry).
+
+    Args:
+        conn:
+        candidates: list of object IDs
+        fpType:
+        chunkSize:
+    """
+    import MySQLdb
+
+    candidates = list(candidates)
+    maxMJDs = dict((candidate, 0) for candidate in candidates)
+
+    try:
+        cursor = conn.cursor (MySQLdb.cursors.DictCursor)
+
+        for i in range(0, len(candidates), chunkSize):
+            chunk = candidates[i:i + chunkSize]
+            cursor.execute ("""
+                select transient_object_id, max(mjd_obs) maxmjd
+                  from tcs_forced_photometry
+                 where transient_object_id in (%s)
+                   and fptype = %%s
+              group by transient_object_id
+            """ % ','.join(['%s'] * len(chunk)), tuple(chunk + [fpType]))
+
+            for row in cursor.fetchall ():
+                if row['maxmjd'] is not None:
+                    maxMJDs[row['transient_object_id']] = row['maxmjd']
+
+        cursor.close ()
+
+    except MySQLdb.Error as e:
+        print("Error %d: %s" % (e.args[0], e.args[1]))
+        sys.exit (1)
+
+    return maxMJDs
+
+
+def getLightcurveForDetectability(conn, candidate, filters = "grizywxBV", ippIdetBlank = IPP_IDET_NON_DETECTION_VALUE):
+    """getLightcurveForDetectability. The detections and non-detections of an object, as
+       getLightcurveDetections and getLightcurveNonDetectionsAndBlanks, but without the
+       coordinates lookup, which the detectability rows don't need.
+
+    Args:
+        conn:
+        candidate:
+        filters:
+        ippIdetBlank:
+    """
+    import MySQLdb
+    from psat_server_web.ps1.psdb.commonqueries import LC_NON_DET_AND_BLANKS_QUERY, LC_DET_QUERY
+
+    detections = nonDetections = ()
+
+    try:
+        cursor = conn.cursor(MySQLdb.cursors.DictCursor)
+        cursor.execute (LC_DET_QUERY, (candidate,) + tuple(filters[0:9]) + (candidate,) + tuple(filters[0:9]))
+        detections = cursor.fetchall ()
+
+        cursor.execute (LC_NON_DET_AND_BLANKS_QUERY, (candidate, candidate, candidate, candidate) + tuple(filters[0:9]))
+        nonDetections = cursor.fetchall ()
+        cursor.close ()
+
+    except MySQLdb.Error as e:
+        print("Error %d: %s" % (e.args[0], e.args[1]))
+
+    for row in nonDetections:
+        row['id'] = candidate
+        row['ipp_idet'] = ippIdetBlank
+
+    return detections, nonDetections
+
+
+# 2026-10-19 KWS Bulk version of getDetectabilityInfo2.  The coordinates and the forced
+#                photometry already in the database are picked up for all the objects at
+#                once.  The lightcurve queries are per object (they live in the web code),
+#                so those are run concurrently, each thread with its own connection.
+def getDetectabilityInfoBulk(conn, db, candidates, limitDays = 100, limitDaysAfter = 0, useFirstDetection = True, fpType = 0, overlapDays = 0, threads = 4):
+    """getDetectabilityInfoBulk. Returns a dict of detectability rows keyed by object ID.
+
+    Args:
+        conn:
+        db: [username, password, database, hostname] for the lightcurve query connections
+        candidates: list of object IDs
+        limitDays:
+        limitDaysAfter:
+        useFirstDetection:
+        fpType:
+        overlapDays:
+        threads: number of concurrent lightcurve queries (and connections)
+    """
+
+    candidates = sorted(set(candidates))
+    if not candidates:
+        return {}
+
+    maxForcedPhotometryMJDs = getMaxForcedPhotometryMJDBulk(conn, candidates, fpType = fpType)
+
+    local = threading.local()
+    connections = []
+    connectionsLock = threading.Lock()
+
+    def getLightcurve(candidate):
+        if not hasattr(local, 'conn'):
+            local.conn = dbConnect(db[3], db[0], db[1], db[2])
+            local.conn.autocommit(True)
+            with connectionsLock:
+                connections.append(local.conn)
+        return getLightcurveForDetectability(local.conn, candidate)
+
+    try:
+        with ThreadPoolExecutor(max_workers = max(min(int(threads), len(candidates)), 1)) as executor:
+            lightcurves = list(executor.map(getLightcurve, candidates))
+    finally:
+        for c in connections:
+            c.close()
+
+    detectabilityInfo = {}
+    for candidate, (detections, nonDetections) in zip(candidates, lightcurves):
+        if useFirstDetection and limitDays > 0 and len(detections) == 0:
+            print("No detections for %s. Skipping." % str(candidate))
+            continue
+        detectabilityInfo[candidate] = selectDetectabilityRows(candidate, detections, nonDetections, maxForcedPhotometryMJDs[candidate], limitDays = limitDays, limitDaysAfter = limitDaysAfter, useFirstDetection = useFirstDetection, overlapDays = overlapDays)
+
+    return detectabilityInfo
+
 def detectabilityCandidateList(conn, candidateFlags = -1, detectionList = 4):
    """detectabilityCandidateList.
 
@@ -3947,41 +4190,9 @@ def writeDetectabilityFITSRequest(conn, outfile, requestName, candidateList, inp
        limitDaysAfter:
    """
 
-   fileSuccessfullyWritten = False
-
-   hdu = pf.PrimaryHDU()
-   hdulist = pf.HDUList()
-   prihdr = hdu.header
-
-   # Make the following changes so that the primary header comments are
-   # IDENTICAL to example Postage Stamp Server requests.
-
-   prihdr.set('SIMPLE', True, 'file does conform to FITS standard')
-   prihdr.set('BITPIX', 16, comment='number of bits per data pixel')
-   prihdr.set('NAXIS', 0, comment='number of data axes')
-   prihdr.set('EXTEND', True, 'FITS dataset may contain extensions')
-   prihdr.add_comment("  FITS (Flexible Image Transport System) format is defined in 'Astronomy")
-   prihdr.add_comment("  and Astrophysics', volume 376, page 359; bibcode: 2001A&A...376..359H")
-   hdulist.append(hdu)
-
-   rownum = []
-   project = []
-   ra1_deg = []
-   dec1_deg = []
-   ra2_deg = []
-   dec2_deg = []
-   mjd_obs = []
-   filter = []
-   fpa_id = []
-
-   row = 1
-
-   fpType = 0
-   if inputType == 'warp':
-      fpType = 1
-   elif inputType == 'stack':
-      fpType = 2
+   fpType = detectabilityFPType(inputType)
 
+   requestRows = []
    for candidate in candidateList:
       # Find the average RA/DEC for the candidate
       if coords:
@@ -3996,56 +4207,110 @@ def writeDetectabilityFITSRequest(conn, outfile, requestName, candidateList, inp
           print("No data to request!")
           continue
 
-      # 2012-04-16 KWS Use base 26 of candidate ID to reduce size of column.
-      #                Will need to create code to restore candidate ID from
-      #                base 26 version.
+      requestRows += detectabilityRequestRows(candidate['id'], ra, dec, detectabilityResultSet, inputType = inputType, camera = camera)
+
+   return writeDetectabilityFITSRows(outfile, requestName, requestRows, inputType = inputType, email = email)
+
+
+def detectabilityFPType(inputType):
+   """detectabilityFPType. The forced photometry type for a detectability request stage.
+
+   Args:
+       inputType:
+   """
+   fpType = 0
+   if inputType == 'warp':
+      fpType = 1
+   elif inputType == 'stack':
+      fpType = 2
+   return fpType
+
+
+# 2026-10-19 KWS Split out of writeDetectabilityFITSRequest.
+def detectabilityRequestRows(candidateId, ra, dec, detectabilityResultSet, inputType = 'WSdiff', camera = 'gpc1'):
+   """detectabilityRequestRows. The request table rows (minus the row number) for one object.
+
+   Args:
+       candidateId:
+       ra:
+       dec:
+       detectabilityResultSet: output of getDetectabilityInfo2
+       inputType:
+       camera:
+   """
+   rows = []
+   previous_fpa_id = 0
+   for result in detectabilityResultSet:
+      if inputType == 'warp' or inputType == 'stack':
+          current_fpa_id = int(result["target"])
+      else:
+          current_fpa_id = int(result["diff"])
+      # 2026-05-09 KWS Skip over any duplicates. Duplicates can happen if the object is
+      #                re-diffed against a new template.
+      if current_fpa_id == previous_fpa_id:
+          continue
+
+      try:
+          project = result["pscamera"].lower()
+      except KeyError as e:
+          project = camera
+
       # 2012-09-21 KWS Discovered that PyFITS3 doesn't allow implicit creation of
       #                double arrays from integer lists.  Need to cast integers
       #                as floats.
-      previous_fpa_id = 0
-      for result in detectabilityResultSet:
-         #rownum.append(str(candidate)) # Detectability rows are ASCII values
+      rows.append({'id': candidateId, 'project': project, 'ra': ra, 'dec': dec, 'mjd_obs': float(int(result["mjd"])), 'filter': result["filter"], 'fpa_id': current_fpa_id})
+      previous_fpa_id = current_fpa_id
 
-         if inputType == 'warp' or inputType == 'stack':
-             current_fpa_id = int(result["target"])
-         else:
-             current_fpa_id = int(result["diff"])
-         # 2026-05-09 KWS Skip over any duplicates. Duplicates can happen if the object is
-         #                re-diffed against a new template.
-         if current_fpa_id == previous_fpa_id:
-             continue
+   return rows
 
-         fpa_id.append(current_fpa_id)
 
-         rownum.append("%s_%05d" % (base26(candidate['id']), row))
-         try:
-             project.append(result["pscamera"].lower())
-         except KeyError as e:
-             project.append(camera)
-         #rownum.append("%05d" % (row))
-         ra1_deg.append(ra)
-         dec1_deg.append(dec)
-         ra2_deg.append(ra)
-         dec2_deg.append(dec)
-         mjd_obs.append(float(int(result["mjd"])))
-         filter.append(result["filter"])
-         row = row + 1
-         previous_fpa_id = current_fpa_id
+def writeDetectabilityFITSRows(outfile, requestName, requestRows, inputType = 'WSdiff', email = 'qub2@qub.ac.uk'):
+   """writeDetectabilityFITSRows. Write the detectability request table.
 
-   # Create the FITS columns.
-   if row == 1:
+   Args:
+       outfile:
+       requestName:
+       requestRows: list of rows from detectabilityRequestRows
+       inputType:
+       email:
+   """
+
+   fileSuccessfullyWritten = False
+
+   if len(requestRows) == 0:
        # No candidates were added to the table.  Don't send an empty request!
        return fileSuccessfullyWritten
 
+   hdu = pf.PrimaryHDU()
+   hdulist = pf.HDUList()
+   prihdr = hdu.header
+
+   # Make the following changes so that the primary header comments are
+   # IDENTICAL to example Postage Stamp Server requests.
+
+   prihdr.set('SIMPLE', True, 'file does conform to FITS standard')
+   prihdr.set('BITPIX', 16, comment='number of bits per data pixel')
+   prihdr.set('NAXIS', 0, comment='number of data axes')
+   prihdr.set('EXTEND', True, 'FITS dataset may contain extensions')
+   prihdr.add_comment("  FITS (Flexible Image Transport System) format is defined in 'Astronomy")
+   prihdr.add_comment("  and Astrophysics', volume 376, page 359; bibcode: 2001A&A...376..359H")
+   hdulist.append(hdu)
+
+   # 2012-04-16 KWS Use base 26 of candidate ID to reduce size of column.
+   #                Will need to create code to restore candidate ID from
+   #                base 26 version.
+   rownum = ["%s_%05d" % (base26(r['id']), i + 1) for i, r in enumerate(requestRows)]
+
+   # Create the FITS columns.
    rownum_col = pf.Column(name='ROWNUM', format='20A', array=rownum)
-   project_col = pf.Column(name='PROJECT', format='16A', array=project)
-   ra1_deg_col = pf.Column(name='RA1_DEG', format='D', array=ra1_deg)
-   dec1_deg_col = pf.Column(name='DEC1_DEG', format='D', array=dec1_deg)
-   ra2_deg_col = pf.Column(name='RA2_DEG', format='D', array=ra2_deg)
-   dec2_deg_col = pf.Column(name='DEC2_DEG', format='D', array=dec2_deg)
-   filter_col = pf.Column(name='FILTER', format='20A', array=filter)
-   mjd_obs_col = pf.Column(name='MJD-OBS', format='D', array=mjd_obs)
-   fpa_id_col = pf.Column(name='FPA_ID', format='J', array=fpa_id)
+   project_col = pf.Column(name='PROJECT', format='16A', array=[r['project'] for r in requestRows])
+   ra1_deg_col = pf.Column(name='RA1_DEG', format='D', array=[r['ra'] for r in requestRows])
+   dec1_deg_col = pf.Column(name='DEC1_DEG', format='D', array=[r['dec'] for r in requestRows])
+   ra2_deg_col = pf.Column(name='RA2_DEG', format='D', array=[r['ra'] for r in requestRows])
+   dec2_deg_col = pf.Column(name='DEC2_DEG', format='D', array=[r['dec'] for r in requestRows])
+   filter_col = pf.Column(name='FILTER', format='20A', array=[r['filter'] for r in requestRows])
+   mjd_obs_col = pf.Column(name='MJD-OBS', format='D', array=[r['mjd_obs'] for r in requestRows])
+   fpa_id_col = pf.Column(name='FPA_ID', format='J', array=[r['fpa_id'] for r in requestRows])
 
    cols=pf.ColDefs([rownum_col,project_col,ra1_deg_col,dec1_deg_col,ra2_deg_col,dec2_deg_col,filter_col,mjd_obs_col,fpa_id_col])
 
@@ -4067,6 +4332,48 @@ def writeDetectabilityFITSRequest(conn, outfile, requestName, candidateList, inp
    return fileSuccessfullyWritten
 
 
+# 2026-10-19 KWS Deterministic split of the detectability rows into requests.  Objects
+#                are taken in ID order and packed into requests of no more than
+#                maxObjects objects and maxRows rows.  An object's rows are never split
+#                across requests (an object with more than maxRows rows gets a request
+#                to itself).
+def planDetectabilityRequests(rowsByObject, maxObjects = 100, maxRows = 5000):
+   """planDetectabilityRequests. Returns a list of requests, each a list of request rows.
+
+   Args:
+       rowsByObject: dict of request rows (from detectabilityRequestRows) keyed by object ID
+       maxObjects: maximum number of objects per request
+       maxRows: maximum number of rows per request
+   """
+   maxObjects = max(int(maxObjects), 1)
+   maxRows = max(int(maxRows), 1)
+
+   requests = []
+   currentRows = []
+   currentObjects = 0
+
+   for objectId in sorted(rowsByObject):
+      rows = rowsByObject[objectId]
+      if not rows:
+         continue
+
+      if currentObjects > 0 and (currentObjects + 1 > maxObjects or len(currentRows) + len(rows) > maxRows):
+         requests.append(currentRows)
+         currentRows = []
+         currentObjects = 0
+
+      if len(rows) > maxRows:
+         print("Warning: object %s has %d rows (> %d). Sending it in a request of its own." % (str(objectId), len(rows), maxRows))
+
+      currentRows = currentRows + rows
+      currentObjects += 1
+
+   if currentRows:
+      requests.append(currentRows)
+
+   return requests
+
+
 
 def writeDetectabilityManualFITSRequest(outfile, requestName, ra, dec, epochRows, inputType = 'SSdiff', email = 'qub2@qub.ac.uk'):
    """writeDetectabilityManualFITSRequest.
@@ -5148,6 +5455,51 @@ def sendPSRequest(filename, requestName, username = None, password = None, posta
     return pssServerId
 
 
+# Number of requests uploaded concurrently, and the number of attempts per request.
+UPLOAD_THREADS = 4
+UPLOAD_RETRIES = 3
+UPLOAD_RETRY_DELAY = 5
+
+# 2026-10-19 KWS Upload several requests concurrently.  Each upload is retried (with an
+#                increasing delay) if the server can't be reached or doesn't accept it.
+#                The upload URL is just a URL, so this works equally well against a local
+#                stand-in of the postage stamp server.
+def sendPSRequests(requests, username = None, password = None, postageStampServerURL = None, threads = UPLOAD_THREADS, retries = UPLOAD_RETRIES, retryDelay = UPLOAD_RETRY_DELAY):
+    """sendPSRequests. Returns a dict of Postage Stamp Server IDs (-1 = failed) keyed by request name.
+
+    Args:
+        requests: list of (filename, requestName) tuples
+        username:
+        password:
+        postageStampServerURL:
+        threads: number of concurrent uploads
+        retries: number of attempts per request
+        retryDelay: seconds to wait before the first retry (doubled for each further retry)
+    """
+
+    def upload(request):
+        filename, requestName = request
+        pssServerId = None
+        for attempt in range(max(int(retries), 1)):
+            if attempt > 0:
+                print("Retrying upload of %s (attempt %d of %d)" % (requestName, attempt + 1, retries))
+                time.sleep(retryDelay * 2 ** (attempt - 1))
+            pssServerId = sendPSRequest(filename, requestName, username = username, password = password, postageStampServerURL = postageStampServerURL)
+            if pssServerId is not None and pssServerId >= 0:
+                break
+        if pssServerId is None:
+            pssServerId = -1
+        return requestName, pssServerId
+
+    if not requests:
+        return {}
+
+    with ThreadPoolExecutor(max_workers = max(min(int(threads), len(requests)), 1)) as executor:
+        results = list(executor.map(upload, requests))
+
+    return dict(results)
+
+
 # 2014-03-05 Added and modified code from Thomas Chen that facilitates PSPS requesting of postage stamps
 
 PSPS_HOST_URL = "http://web01.psps.ifa.hawaii.edu"
@@ -5971,45 +6323,142 @@ DETECTIONTYPES = { 'all': 1, 'detections': 2, 'nondetections': 3 }
 REQUESTTYPES = { 'all': 1, 'incremental': 2}
 
 
-def updateTriplets(conn, objectList):
-    """updateTriplets.
+# Connection specific temporary tables used by updateTriplets.
+TRIPLET_OBJECTS_TABLE = 'tmp_triplet_objects'
+TRIPLET_IMAGES_TABLE = 'tmp_triplet_images'
+
+# Number of objects whose triplets are rebuilt per transaction.
+TRIPLET_UPDATE_BATCH_SIZE = 10000
+
+
+# 2026-10-19 KWS Set based version. We used to make four queries per object
+#                (getRecentImageGroupRow, getPostageStampsForImageGroup,
+#                insertNewImageTripletReference, updateObjectImageTripletReference)
+#                and pivot the stamps in Python. Now each batch of objects is
+#                loaded into a temporary table, the most recent image group and its
+#                target/ref/diff are picked for all of them with one windowed query,
+#                the triplets are bulk inserted and the objects repointed with one
+#                joined update. Group and image names are "<objectId>_...", so the
+#                name matches are anchored on the underscore (the old prefix match
+#                could also pick up objects whose IDs start with the same digits).
+#                The prefix match is also written as a range ('`' follows '_') so MySQL
+#                can use the name index, which it can't for a like on a non-constant
+#                pattern. The like stays as a residual check in case the collation
+#                sorts anything else between the bounds.
+def updateTriplets(conn, objectList, ippIdet = IPP_IDET_NON_DETECTION_VALUE, batchSize = TRIPLET_UPDATE_BATCH_SIZE):
+    """updateTriplets. Point each object at the image triplet of its most recent
+       (detection) image group. Objects whose group has no target are left alone.
+       Returns the number of objects updated.
 
     Args:
         conn:
         objectList:
+        ippIdet: IPP_IDET value of non-detection groups, which are ignored
+        batchSize: number of objects per transaction
     """
+    import MySQLdb
 
-    for object in objectList:
-        recentImageRow = getRecentImageGroupRow(conn, object)
-        stamps = getPostageStampsForImageGroup(conn, recentImageRow["id"])
-        imageData = {}
-        mjd = target = ref = diff = None
-        for stamp in stamps:
-            if stamp["image_type"] == "target":
-                target = stamp["image_filename"]
-                mjd = stamp["mjd_obs"]
+    objectIds = sorted(set(int(objectId) for objectId in objectList))
+    rowsUpdated = 0
 
-            if stamp["image_type"] == "ref":
-                ref = stamp["image_filename"]
+    if not objectIds:
+        return rowsUpdated
 
-            if stamp["image_type"] == "diff":
-                diff = stamp["image_filename"]
+    batchSize = max(int(batchSize), 1)
 
-        if not mjd: # The target wasn't defined
-            continue
+    try:
+        cursor = conn.cursor(MySQLdb.cursors.Cursor)
+        cursor.execute("drop temporary table if exists %s" % TRIPLET_OBJECTS_TABLE)
+        cursor.execute("create temporary table %s (id bigint unsigned not null primary key) engine=memory" % TRIPLET_OBJECTS_TABLE)
+        cursor.execute("drop temporary table if exists %s" % TRIPLET_IMAGES_TABLE)
+        cursor.execute("""
+            create temporary table %s (
+                object_id bigint unsigned not null primary key,
+                target varchar(255),
+                ref varchar(255),
+                diff varchar(255),
+                mjd_obs double
+            ) engine=memory
+        """ % TRIPLET_IMAGES_TABLE)
+
+        for i in range(0, len(objectIds), batchSize):
+            batch = objectIds[i:i + batchSize]
+            try:
+                cursor.execute("start transaction")
+                cursor.execute("delete from %s" % TRIPLET_OBJECTS_TABLE)
+                cursor.execute("delete from %s" % TRIPLET_IMAGES_TABLE)
+                cursor.executemany("insert into " + TRIPLET_OBJECTS_TABLE + " (id) values (%s)", [(objectId,) for objectId in batch])
+
+                # Most recent image group per object (name contains the id and the MJD),
+                # pivoted into one target/ref/diff row.
+                cursor.execute ("""
+                    insert into %s (object_id, target, ref, diff, mjd_obs)
+                    select g.object_id,
+                           max(case when s.image_type = 'target' then s.image_filename end),
+                           max(case when s.image_type = 'ref' then s.image_filename end),
+                           max(case when s.image_type = 'diff' then s.image_filename end),
+                           max(case when s.image_type = 'target' then s.mjd_obs end) mjd_obs
+                      from (select o.id object_id, g.id,
+                                   row_number() over (partition by o.id order by g.name desc) recent
+                              from %s o
+                              join tcs_image_groups g
+                                on g.name >= concat(o.id, '_')
+                               and g.name < concat(o.id, '`')
+                               and g.name like concat(o.id, '\\_%%%%')
+                               and g.name not like concat(o.id, '\\_%%%%\\_', %%s)
+                               and g.group_type is null) g
+                      join tcs_postage_stamp_images s
+                        on s.image_group_id = g.id
+                     where g.recent = 1
+                  group by g.object_id
+                    having mjd_obs is not null
+                       and mjd_obs != 0
+                """ % (TRIPLET_IMAGES_TABLE, TRIPLET_OBJECTS_TABLE), (ippIdet,))
+
+                # Delete any existing triplets of these objects and insert the new ones.
+                cursor.execute ("""
+                    delete i
+                      from tcs_images i
+                      join %s t
+                        on i.target >= concat(t.object_id, '_')
+                       and i.target < concat(t.object_id, '`')
+                       and i.target like concat(t.object_id, '\\_%%')
+                """ % TRIPLET_IMAGES_TABLE)
 
-        imageData["target"] = target
-        imageData["ref"] = ref
-        imageData["diff"] = diff
-        imageData["mjd_obs"] = mjd
+                cursor.execute ("""
+                    insert into tcs_images (target, ref, diff, mjd_obs)
+                    select target, ref, diff, mjd_obs
+                      from %s
+                """ % TRIPLET_IMAGES_TABLE)
+                firstImageId = conn.insert_id()
 
-        print(imageData)
-        tripletId = insertNewImageTripletReference(conn, object, imageData)
-        if tripletId:
-            rowsUpdated = updateObjectImageTripletReference(conn, object, tripletId)
+                cursor.execute ("""
+                    update tcs_transient_objects o
+                      join %s t
+                        on t.object_id = o.id
+                      join tcs_images i
+                        on i.target = t.target
+                       and i.id >= %%s
+                       set o.tcs_images_id = i.id
+                """ % TRIPLET_IMAGES_TABLE, (firstImageId,))
+                rowsUpdated += cursor.rowcount
+
+                conn.commit()
+            except MySQLdb.Error as e:
+                conn.rollback()
+                print("Error %d: %s" % (e.args[0], e.args[1]))
+                print("WARNING: Rolled back the triplets for objects %d to %d." % (batch[0], batch[-1]))
+
+        cursor.execute("drop temporary table if exists %s" % TRIPLET_OBJECTS_TABLE)
+        cursor.execute("drop temporary table if exists %s" % TRIPLET_IMAGES_TABLE)
+        cursor.close ()
 
+    except MySQLdb.Error as e:
+        print("Error %d: %s" % (e.args[0], e.args[1]))
 
-    return (0)
+    print("Updated the image triplets of %d of %d objects." % (rowsUpdated, len(objectIds)))
+
+    return rowsUpdated
 
 
 def makeATLASObjectPostageStamps(conn, candidateList, PSSImageRootLocation, stampSize = 50, limit = 0, detectionType = DETECTIONTYPES['detections'], requestType = REQUESTTYPES['incremental']):
@@ -2,7 +2,7 @@
 """Request Pan-STARRS forced photometry
 
 Usage:
-  %s <configFile> [<candidate>...] [--test] [--listid=<listid>] [--customlist=<customlistid>] [--flagdate=<flagdate>] [--limitdays=<limitdays>] [--limitdaysafter=<limitdaysafter> ] [--usefirstdetection] [--overlapdays=<overlapdays>] [--overrideflags] [--inputtype=<inputtype>] [--requestprefix=<requestprefix>] [--requesthome=<requesthome>] [--rbthreshold=<rbthreshold>] [--camera=<camera>] [--coords=<coords>] [--nprocesses=<nprocesses>] [--loglocation=<loglocation>] [--logprefix=<logprefix>]
+  %s <configFile> [<candidate>...] [--test] [--listid=<listid>] [--customlist=<customlistid>] [--flagdate=<flagdate>] [--limitdays=<limitdays>] [--limitdaysafter=<limitdaysafter> ] [--usefirstdetection] [--overlapdays=<overlapdays>] [--overrideflags] [--inputtype=<inputtype>] [--requestprefix=<requestprefix>] [--requesthome=<requesthome>] [--rbthreshold=<rbthreshold>] [--camera=<camera>] [--coords=<coords>] [--nprocesses=<nprocesses>] [--loglocation=<loglocation>] [--logprefix=<logprefix>] [--planner] [--maxrowsperrequest=<maxrowsperrequest>] [--uploadthreads=<uploadthreads>] [--uploadretries=<uploadretries>]
   %s (-h | --help)
   %s --version
 
@@ -27,17 +27,22 @@ Options:
   --nprocesses=<nprocesses>           Number of processes to use [default: 4]
   --loglocation=<loglocation>         Log file location [default: /tmp/]
   --logprefix=<logprefix>             Log prefix [default: forced_phot_requester]
+  --planner                           Gather the detectability info for all the candidates up front (nprocesses concurrent queries), split it into requests and upload them concurrently.
+  --maxrowsperrequest=<maxrowsperrequest>  Maximum number of rows in each request (planner only) [default: 5000]
+  --uploadthreads=<uploadthreads>     Number of requests uploaded concurrently (planner only) [default: 4]
+  --uploadretries=<uploadretries>     Number of upload attempts per request (planner only) [default: 3]
 
 
 Example:
   python %s ../../../../config/config.yaml 1124922100042044700 --requestprefix=yse_det_request --test
+  python %s ../../../../config/config.yaml --listid=2 --planner --nprocesses=8 --uploadthreads=4
 """
 import sys
-__doc__ = __doc__ % (sys.argv[0], sys.argv[0], sys.argv[0], sys.argv[0])
+__doc__ = __doc__ % (sys.argv[0], sys.argv[0], sys.argv[0], sys.argv[0], sys.argv[0])
 from docopt import docopt
 import os, MySQLdb, shutil, re, datetime, time
 from gkutils.commonutils import find, Struct, cleanOptions, getCurrentMJD, readGenericDataFile, dbConnect, coords_sex_to_dec, PROCESSING_FLAGS, splitList, parallelProcess
-from pstamp_utils import getObjectsByList, writeDetectabilityFITSRequest, addRequestToDatabase, sendPSRequest, updateRequestStatus, DETECTABILITY_REQUEST, SUBMITTED
+from pstamp_utils import getObjectsByList, writeDetectabilityFITSRequest, addRequestToDatabase, sendPSRequest, updateRequestStatus, DETECTABILITY_REQUEST, SUBMITTED, getDetectabilityInfoBulk, getAverageCoordinatesBulk, detectabilityFPType, detectabilityRequestRows, planDetectabilityRequests, writeDetectabilityFITSRows, sendPSRequests
 import random
 
 def requestForcedPhotometry(conn, options, candidateList, objectsPerIteration, stampuser, stamppass, stampemail, requestHome = '/tmp', uploadURL = None, n = None):
@@ -125,6 +130,99 @@ def requestForcedPhotometry(conn, options, candidateList, objectsPerIteration, s
         time.sleep(1)
 
 
+# 2026-10-19 KWS Request planner.  Rather than working through the candidates a few at a time
+#                (several queries per candidate, then a serial upload, then a 1 second sleep),
+#                gather the detectability info for all the candidates up front, split it
+#                deterministically into requests no bigger than the server allows, and upload
+#                the requests concurrently (with retries).
+def requestForcedPhotometryPlanned(conn, db, options, candidateList, objectsPerRequest, stampuser, stamppass, stampemail, requestHome = '/tmp', uploadURL = None):
+    """requestForcedPhotometryPlanned.
+
+    Args:
+        conn:
+        db: [username, password, database, hostname]
+        options:
+        candidateList:
+        objectsPerRequest: maximum number of objects per request
+        stampuser:
+        stamppass:
+        stampemail:
+        requestHome:
+        uploadURL:
+    """
+
+    limitDays = int(options.limitdays)
+    limitDaysAfter = int(options.limitdaysafter)
+    fpType = detectabilityFPType(options.inputtype)
+
+    if options.rbthreshold:
+        rbThreshold = float(options.rbthreshold)
+        candidateList = [c for c in candidateList if c['rb_factor'] is not None and c['rb_factor'] >= rbThreshold]
+
+    candidates = sorted(set(c['id'] for c in candidateList))
+    if not candidates:
+        print("No candidates.")
+        return []
+
+    coords = []
+    if len(candidates) == 1 and options.coords:
+        coords = [float(options.coords.split(',')[0]), float(options.coords.split(',')[1])]
+
+    print("%s Gathering detectability info for %d candidates..." % (datetime.datetime.now().strftime("%Y:%m:%d:%H:%M:%S"), len(candidates)))
+    detectabilityInfo = getDetectabilityInfoBulk(conn, db, candidates, limitDays = limitDays, limitDaysAfter = limitDaysAfter, fpType = fpType, overlapDays = abs(float(options.overlapdays)), threads = int(options.nprocesses))
+
+    if coords:
+        coordinates = {candidates[0]: (coords[0], coords[1])}
+    else:
+        coordinates = getAverageCoordinatesBulk(conn, list(detectabilityInfo.keys()))
+
+    rowsByObject = {}
+    for candidate, detectabilityResultSet in detectabilityInfo.items():
+        if len(detectabilityResultSet) == 0:
+            continue
+        ra, dec = coordinates.get(candidate, (None, None))
+        rowsByObject[candidate] = detectabilityRequestRows(candidate, ra, dec, detectabilityResultSet, inputType = options.inputtype, camera = options.camera)
+
+    requestRowsList = planDetectabilityRequests(rowsByObject, maxObjects = objectsPerRequest, maxRows = int(options.maxrowsperrequest))
+    print("%d candidates with data to request in %d requests." % (len(rowsByObject), len(requestRowsList)))
+
+    # One time stamp for the whole run.  The sequence number keeps the request names unique.
+    currentDate = datetime.datetime.now()
+    timeRequestSuffix = currentDate.strftime("%Y%m%d_%H%M%S")
+    sqlCurrentDate = currentDate.strftime("%Y-%m-%d %H:%M:%S")
+
+    requests = []
+    for i, requestRows in enumerate(requestRowsList):
+        requestName = "%s_%s_%03d" % (options.requestprefix, timeRequestSuffix, i + 1)
+        requestFileName = "%s/%s.fits" % (requestHome, requestName)
+        if writeDetectabilityFITSRows(requestFileName, requestName, requestRows, inputType = options.inputtype, email = stampemail):
+            requests.append((requestFileName, requestName))
+
+    if options.test or not uploadURL:
+        print("No requests were sent to the stamp server. This is either a test or upload URL is not set.")
+        return requests
+
+    for requestFileName, requestName in requests:
+        addRequestToDatabase(conn, requestName, sqlCurrentDate, DETECTABILITY_REQUEST)
+
+    pssServerIds = sendPSRequests(requests, username = stampuser, password = stamppass, postageStampServerURL = uploadURL, threads = int(options.uploadthreads), retries = int(options.uploadretries))
+
+    submitted = 0
+    for requestFileName, requestName in requests:
+        pssServerId = pssServerIds.get(requestName, -1)
+        if pssServerId >= 0:
+            if updateRequestStatus(conn, requestName, SUBMITTED, pssServerId) > 0:
+                submitted += 1
+            else:
+                print("Submitted job %s, but did not update database." % requestName)
+        else:
+            print("Did Not successfully submit the job %s to the Postage Stamp Server!" % requestName)
+
+    print("Submitted %d of %d requests to the Postage Stamp Server." % (submitted, len(requests)))
+
+    return requests
+
+
 def workerFPRequester(num, db, listFragment, dateAndTime, firstPass, miscParameters):
     """thread worker function"""
     # Redefine the output to be a log file.
@@ -235,7 +333,10 @@ def main(argv = None):
     if len(candidateList) > MAX_NUMBER_OF_OBJECTS:
         sys.exit("Maximum request size is for images for %d candidates. Attempted to make %d requests.  Aborting..." % (MAX_NUMBER_OF_OBJECTS, len(candidateList)))
 
-    if int(options.nprocesses) == 1 or len(candidateList) == 1 or options.test:
+    if options.planner:
+        requestForcedPhotometryPlanned(conn, db, options, candidateList, OBJECTS_PER_ITERATION, stampuser, stamppass, email, requestHome = requestHome, uploadURL = uploadURL)
+
+    elif int(options.nprocesses) == 1 or len(candidateList) == 1 or options.test:
         requestForcedPhotometry(conn, options, candidateList, OBJECTS_PER_ITERATION, stampuser, stamppass, email, requestHome = requestHome, uploadURL = uploadURL)
 
     else:
@@ -26,7 +26,7 @@ from docopt import docopt
 import os, MySQLdb, shutil, re
 from gkutils.commonutils import find, Struct, cleanOptions, getCurrentMJD, splitList, parallelProcess
 import gc
-from makeATLASStamps import doRsync
+from exposureCache import ExposureCache
 import queue
 from random import shuffle
 import datetime
@@ -44,7 +44,10 @@ def workerImageDownloader(num, db, listFragment, dateAndTime, firstPass, miscPar
         timeout = int(options.timeout)
 
     # Call the postage stamp downloader
-    objectsForUpdate = doRsync(listFragment, imageType, ignoreExistingFiles = True, timeout = timeout)
+    # 2026-10-19 KWS Go via the exposure cache so that exposures we already have are never
+    #                handed to rsync. We're already parallel at the process level, so one stream.
+    exposureCache = ExposureCache(streams = 1, timeout = timeout)
+    objectsForUpdate = exposureCache.fetch(listFragment, imageType)
     #q.put(objectsForUpdate)
     print("Process complete.")
     return 0
@@ -1,9 +1,10 @@
 #!/usr/bin/env python
 """ATLAS TNS daemon code. This code loads up a daemon that listens on a configured
-port for TNS Submit and Results messages.
+port for TNS Submit and Results messages. Submit and Results are run as background
+jobs. The reply contains a job ID that can be polled with "Status <jobid>".
 
 Usage:
-  %s <configfile> <action> [--server=<server>] [--port=<port>] [--pidfile=<pidfile>] [--sandbox] [--internalids] [--daemonErrFile=<daemonErrFile>] [--daemonOutFile=<daemonOutFile>] [--terminal] [--logfile=<logfile>]
+  %s <configfile> <action> [--server=<server>] [--port=<port>] [--pidfile=<pidfile>] [--sandbox] [--internalids] [--daemonErrFile=<daemonErrFile>] [--daemonOutFile=<daemonOutFile>] [--terminal] [--logfile=<logfile>] [--tnsurl=<tnsurl>] [--workers=<workers>] [--dbconnections=<dbconnections>]
   %s (-h | --help)
   %s --version
 
@@ -19,6 +20,9 @@ Options:
   --daemonErrFile=<daemonErrFile>   Daemon Error File - for recording unexpected errors [default: /tmp/atlastnsdaemonerr.log].
   --daemonOutFile=<daemonOutFile>   Daemon Out File - for recording unexpected output [default: /tmp/atlastnsdaemonout.log].
   --terminal                        Override the Daemon error and out files and write to the terminal. 
+  --tnsurl=<tnsurl>                 Override the configured TNS base URL (e.g. a local fake TNS endpoint for testing).
+  --workers=<workers>               Number of background job workers [default: 1].
+  --dbconnections=<dbconnections>   Number of persistent database connections [default: 2].
 
 Example:
   python atlasTNSDaemon.py ../../../../config/config4_db1.yaml start --pidfile=/localdisk/scratch/tnsDaemon.pid --internalids
@@ -31,13 +35,13 @@ from docopt import docopt
 
 import os
 import signal
-import socket
 import time
 import logging
 import yaml
 
-from gkutils.commonutils import Struct, cleanOptions, dbConnect
-from requestATLASTNSNames import tnsReport, COMPLETE, getSubmissionReports, tnsUpdateRequestStatus, getObjectsByList, updateTNSNames
+from gkutils.commonutils import Struct, cleanOptions
+from requestATLASTNSNames import tnsReport, COMPLETE, getSubmissionReports, getObjectsByList, updateTNSNames
+from tnsDaemonUtils import DBConnectionPool, JobRunner, TNSDaemonServer, queueJob
 
 import daemon
 from daemon import pidfile
@@ -49,13 +53,6 @@ def shutdown(signum, frame):  # signum and frame are mandatory
     sys.exit(0)
 
 
-def _send(conn, message):
-    """Send a text response in a Python 3 safe way."""
-    if isinstance(message, str):
-        message = message.encode("utf-8")
-    conn.sendall(message)
-
-
 def listen(options):
     """Listen for TNS daemon commands."""
 
@@ -96,83 +93,64 @@ def listen(options):
         botName = config['tns_api']['atlas']['live']['bot_name']
 
 
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        s.bind((options.server, int(options.port)))
-        s.listen(1)
-
-        while True:
-            conn, addr = s.accept()
-            with conn:
-                logger.info('Received connection from %s', str(addr))
-                try:
-                    data = conn.recv(1024).decode('utf-8').strip()
-                except socket.error:
-                    logger.error('Something went wrong. (Connection reset?) Cannot continue. Skipping this object.')
-                    continue
-
-                if data == 'Submit':
-                    dbConn = dbConnect(hostname, username, password, database)
-                    dbConn.autocommit(True)
-
-                    objectList = getObjectsByList(dbConn, 2)
-                    reports = tnsReport(
-                        dbConn,
-                        tnsBaseURL,
-                        tnsApiKey,
-                        objectList,
-                        ddc=True,
-                        reporter=tnsAuthors,
-                        botId=botId,
-                        botName=botName,
-                        addInternalIDs=options.internalids,
-                    )
-                    for row in reports:
-                        logger.info('Daemon Submission - TNS report ID = %s', row)
-                    dbConn.close()
-                    _send(conn, 'Submitted')
-
-                elif data == 'SubmitTest':
-                    dbConn = dbConnect(hostname, username, password, database)
-                    dbConn.autocommit(True)
-
-                    objectList = getObjectsByList(dbConn, 2)
-                    reports = tnsReport(
-                        dbConn,
-                        tnsBaseURL,
-                        tnsApiKey,
-                        objectList,
-                        ddc=True,
-                        donotsend=True,
-                        reporter=tnsAuthors,
-                        botId=botId,
-                        botName=botName,
-                        addInternalIDs=internalids,
-                    )
-                    for row in reports:
-                        logger.info('Daemon Submission - TNS report ID = %s', row)
-                    dbConn.close()
-                    _send(conn, 'Submitted Test')
-
-                elif data == 'Results':
-                    dbConn = dbConnect(hostname, username, password, database)
-                    dbConn.autocommit(True)
-
-                    names = getSubmissionReports(dbConn, tnsBaseURL, tnsApiKey, botId=botId, botName=botName)
-                    if not names:
-                        logger.info('No reports found.')
-                    else:
-                        reports = updateTNSNames(dbConn, names)
-                        if reports:
-                            for reportId in set(reports):
-                                tnsUpdateRequestStatus(dbConn, reportId, COMPLETE)
-                    dbConn.close()
-                    _send(conn, 'Got reports')
-
-                else:
-                    _send(conn, 'Error: Invalid message.')
-
-                time.sleep(2)
+    if options.tnsurl:
+        tnsBaseURL = options.tnsurl
+
+    dbPool = DBConnectionPool(hostname, username, password, database, size = int(options.dbconnections))
+    jobRunner = JobRunner(workers = int(options.workers), logger = logger)
+
+    def submit(donotsend = False):
+        with dbPool.connection() as dbConn:
+            objectList = getObjectsByList(dbConn, 2)
+            reports = tnsReport(
+                dbConn,
+                tnsBaseURL,
+                tnsApiKey,
+                objectList,
+                ddc=True,
+                donotsend=donotsend,
+                reporter=tnsAuthors,
+                botId=botId,
+                botName=botName,
+                addInternalIDs=options.internalids,
+            )
+        for row in reports:
+            logger.info('Daemon Submission - TNS report ID = %s', row)
+        return '%d objects' % len(objectList)
+
+    def results():
+        with dbPool.connection() as dbConn:
+            names = getSubmissionReports(dbConn, tnsBaseURL, tnsApiKey, botId=botId, botName=botName)
+            if not names:
+                logger.info('No reports found.')
+                return '0 reports'
+            reports = updateTNSNames(dbConn, names, status=COMPLETE)
+        return '%d reports' % len(set(reports)) if reports else '0 reports'
+
+    def handleCommand(data):
+        # Submit always submits everything on the submission list, so a Submit that arrives
+        # while another is queued or running is just coalesced into that one.
+        if data == 'Submit':
+            return queueJob(jobRunner, 'Submitted', 'Submit', submit)
+
+        elif data == 'SubmitTest':
+            return queueJob(jobRunner, 'Submitted Test', 'SubmitTest', submit, donotsend=True)
+
+        elif data == 'Results':
+            return queueJob(jobRunner, 'Got reports', 'Results', results)
+
+        elif data.startswith('Status '):
+            return jobRunner.status(data.replace('Status ', '', 1).strip())
+
+        return 'Error: Invalid message.'
+
+    server = TNSDaemonServer((options.server, int(options.port)), handleCommand, logger = logger)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        jobRunner.shutdown()
+        dbPool.close()
 
 
 def startDaemon(options):
@@ -201,8 +179,8 @@ def main(argv=None):
     options = Struct(**opts)
 
 
-    if options.action not in ['start', 'stop', 'restart']:
-        sys.stderr.write('Valid options for action are start|stop|restart\n')
+    if options.action not in ['start', 'stop', 'restart', 'listen']:
+        sys.stderr.write('Valid options for action are start|stop|restart|listen\n')
         sys.exit(1)
 
     try:
@@ -215,8 +193,8 @@ def main(argv=None):
         sys.exit(1)
 
     if options.action == 'listen':
-        if os.path.exists(pidfile_name):
-            with open(pidfile_name, mode='r') as f:
+        if os.path.exists(options.pidfile):
+            with open(options.pidfile, mode='r') as f:
                 pid = f.read().strip()
                 sys.stderr.write(
                     '\nDaemon is already running (PID = %s). Kill the existing daemon first. E.g. use the stop option.\n' % pid
@@ -1,8 +1,9 @@
 #!/usr/bin/env python
 """Pan-STARRS TNS daemon code. This code loads up a daemon that listens on a configured port for TNS Submit and Results messages.
+Submit and Results are run as background jobs. The reply contains a job ID that can be polled with "Status <jobid>".
 
 Usage:
-  %s <configfile> <action> [--server=<server>] [--port=<port>] [--pidfile=<pidfile>] [--sandbox] [--internalids] [--daemonErrFile=<daemonErrFile>] [--daemonOutFile=<daemonOutFile>] [--terminal] [--logfile=<logfile>]
+  %s <configfile> <action> [--server=<server>] [--port=<port>] [--pidfile=<pidfile>] [--sandbox] [--internalids] [--daemonErrFile=<daemonErrFile>] [--daemonOutFile=<daemonOutFile>] [--terminal] [--logfile=<logfile>] [--tnsurl=<tnsurl>] [--workers=<workers>] [--dbconnections=<dbconnections>]
   %s (-h | --help)
   %s --version
 
@@ -18,6 +19,9 @@ Options:
   --daemonErrFile=<daemonErrFile>   Daemon Error File - for recording unexpected errors [default: /tmp/panstarrstnsdaemonerr.log].
   --daemonOutFile=<daemonOutFile>   Daemon Out File - for recording unexpected output [default: /tmp/panstarrstnsdaemonout.log].
   --terminal                        Override the Daemon error and out files and write to the terminal. 
+  --tnsurl=<tnsurl>                 Override the configured TNS base URL (e.g. a local fake TNS endpoint for testing).
+  --workers=<workers>               Number of background job workers [default: 1].
+  --dbconnections=<dbconnections>   Number of persistent database connections [default: 2].
 
 Example:
   python %s ../../../../config/config.yaml start --pidfile=/nvme/1/var/tnsDaemonPS.pid
@@ -30,7 +34,6 @@ __doc__ = __doc__ % (sys.argv[0], sys.argv[0], sys.argv[0], sys.argv[0])
 from docopt import docopt
 import os
 import logging
-import socket
 import signal
 import time
 import yaml
@@ -38,8 +41,9 @@ import yaml
 import daemon
 from daemon import pidfile
 
-from gkutils.commonutils import Struct, cleanOptions, dbConnect
-from requestPanSTARRSTNSNames import tnsReport, COMPLETE, getSubmissionReports, tnsUpdateRequestStatus, updateTNSNames, getSpecifiedObjects
+from gkutils.commonutils import Struct, cleanOptions
+from requestPanSTARRSTNSNames import tnsReport, COMPLETE, getSubmissionReports, updateTNSNames, getSpecifiedObjects
+from tnsDaemonUtils import DBConnectionPool, JobRunner, TNSDaemonServer, queueJob, parseObjectIds
 
 
 # To kick off the script, run the following from the python directory:
@@ -63,21 +67,6 @@ def _get_config_value(config, *keys, default=None):
     return current
 
 
-def _recv_text(conn, size=1024):
-    """Receive a socket payload and return a stripped unicode string."""
-    data = conn.recv(size)
-    if isinstance(data, bytes):
-        return data.decode("utf-8", errors="replace").strip()
-    return str(data).strip()
-
-
-def _send_text(conn, message):
-    """Send a response as bytes under Python 3."""
-    if isinstance(message, str):
-        message = message.encode("utf-8")
-    conn.sendall(message)
-
-
 def listen(options):
     """Listen for incoming TNS requests."""
 
@@ -139,135 +128,89 @@ def listen(options):
     except (TypeError, ValueError):
         discoveryDataSourceId = 4
 
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        s.bind((server, port))
-        s.listen(1)
-
-        while True:
-            conn, addr = s.accept()
-            with conn:
-                logger.info('Received connection from %s', addr)
-
-                try:
-                    data = _recv_text(conn)
-                except socket.error:
-                    logger.error('Something went wrong reading from the socket. Skipping this object.')
-                    continue
-
-                if data.startswith('Submit '):
-                    ids = data.replace('Submit ', '', 1).split()
-                    try:
-                        objectIds = list(map(int, ids))
-                    except ValueError:
-                        logger.error('IDs should be integers')
-                        _send_text(conn, 'Error: Bad IDs.')
-                        continue
-
-                    if not objectIds:
-                        logger.error('No objects to request TNS names for.')
-                        _send_text(conn, 'Error: No IDs.')
-                        continue
-
-                    dbConn = dbConnect(hostname, username, password, database)
-                    dbConn.autocommit(True)
-                    try:
-                        objectList = getSpecifiedObjects(dbConn, objectIds)
-
-                        if objectList:
-                            logger.info('Requesting TNS names for: %s', objectIds)
-                            reports = tnsReport(
-                                dbConn,
-                                tnsBaseURL,
-                                tnsApiKey,
-                                objectList,
-                                skipNonDetections=True,
-                                reporter=tnsAuthors,
-                                supplementaryAuthors=supplementaryAuthors,
-                                supplementaryAuthorsTrigger=supplementaryAuthorsTrigger,
-                                reportingGroupId=reportingGroupId,
-                                discoveryDataSourceId=discoveryDataSourceId,
-                                zooniverseBoilerplate=zooniverseBoilerplate,
-                                zooniverseScoreThreshold=zooniverseScoreThreshold,
-                                botId=botId,
-                                botName=botName,
-                                addInternalIDs=internalids,
-                            )
-                            for row in reports:
-                                logger.info('Daemon Submission - TNS report ID = %s', row)
-                            _send_text(conn, 'Submitted')
-                        else:
-                            logger.info('Error: No valid objects to submit.')
-                            _send_text(conn, 'Error: Submitted Nothing')
-                    finally:
-                        dbConn.close()
-
-                elif data.startswith('SubmitTest '):
-                    ids = data.replace('SubmitTest ', '', 1).split()
-                    try:
-                        objectIds = list(map(int, ids))
-                    except ValueError:
-                        logger.error('IDs should be integers')
-                        _send_text(conn, 'Error: Bad IDs.')
-                        continue
-
-                    if not objectIds:
-                        logger.error('No objects to request TNS names for.')
-                        _send_text(conn, 'Error: No IDs.')
-                        continue
-
-                    dbConn = dbConnect(hostname, username, password, database)
-                    dbConn.autocommit(True)
-                    try:
-                        objectList = getSpecifiedObjects(dbConn, objectIds)
-
-                        if objectList:
-                            logger.info('TEST Requesting TNS names for: %s', objectIds)
-                            reports = tnsReport(
-                                dbConn,
-                                tnsBaseURL,
-                                tnsApiKey,
-                                objectList,
-                                skipNonDetections=True,
-                                reporter=tnsAuthors,
-                                supplementaryAuthors=supplementaryAuthors,
-                                supplementaryAuthorsTrigger=supplementaryAuthorsTrigger,
-                                donotsend=True,
-                                zooniverseBoilerplate=zooniverseBoilerplate,
-                                zooniverseScoreThreshold=zooniverseScoreThreshold,
-                                botId=botId,
-                                botName=botName,
-                                addInternalIDs=internalids,
-                            )
-                            for row in reports:
-                                logger.info('Daemon TEST Submission - TNS report ID = %s', row)
-                            _send_text(conn, 'Submitted Test')
-                        else:
-                            logger.info('Error: No valid objects to submit.')
-                            _send_text(conn, 'Error: Submitted Nothing')
-                    finally:
-                        dbConn.close()
-
-                elif data == 'Results':
-                    dbConn = dbConnect(hostname, username, password, database)
-                    dbConn.autocommit(True)
-                    try:
-                        names = getSubmissionReports(dbConn, tnsBaseURL, tnsApiKey, botId=botId, botName=botName)
-                        if not names:
-                            logger.info('No reports found.')
-                        else:
-                            reports = updateTNSNames(dbConn, names)
-                            if reports:
-                                for reportId in set(reports):
-                                    tnsUpdateRequestStatus(dbConn, reportId, COMPLETE)
-                        _send_text(conn, 'Got reports')
-                    finally:
-                        dbConn.close()
-                else:
-                    logger.error('Invalid message.')
-                    _send_text(conn, 'Error: Invalid message.')
-
-                time.sleep(1)
+    if options.tnsurl:
+        tnsBaseURL = options.tnsurl
+
+    dbPool = DBConnectionPool(hostname, username, password, database, size = int(options.dbconnections))
+    jobRunner = JobRunner(workers = int(options.workers), logger = logger)
+
+    def submit(objectIds, objectList, donotsend = False):
+        with dbPool.connection() as dbConn:
+            logger.info('%sRequesting TNS names for: %s', 'TEST ' if donotsend else '', objectIds)
+            kwargs = {}
+            if not donotsend:
+                kwargs = {'reportingGroupId': reportingGroupId, 'discoveryDataSourceId': discoveryDataSourceId}
+            reports = tnsReport(
+                dbConn,
+                tnsBaseURL,
+                tnsApiKey,
+                objectList,
+                skipNonDetections=True,
+                reporter=tnsAuthors,
+                supplementaryAuthors=supplementaryAuthors,
+                supplementaryAuthorsTrigger=supplementaryAuthorsTrigger,
+                donotsend=donotsend,
+                zooniverseBoilerplate=zooniverseBoilerplate,
+                zooniverseScoreThreshold=zooniverseScoreThreshold,
+                botId=botId,
+                botName=botName,
+                addInternalIDs=options.internalids,
+                **kwargs
+            )
+        for row in reports:
+            logger.info('Daemon %sSubmission - TNS report ID = %s', 'TEST ' if donotsend else '', row)
+        return '%d objects' % len(objectList)
+
+    def results():
+        with dbPool.connection() as dbConn:
+            names = getSubmissionReports(dbConn, tnsBaseURL, tnsApiKey, botId=botId, botName=botName)
+            if not names:
+                logger.info('No reports found.')
+                return '0 reports'
+            reports = updateTNSNames(dbConn, names, status=COMPLETE)
+        return '%d reports' % len(set(reports)) if reports else '0 reports'
+
+    def handleCommand(data):
+        for command, reply, donotsend in (('SubmitTest ', 'Submitted Test', True), ('Submit ', 'Submitted', False)):
+            if data.startswith(command):
+                objectIds = parseObjectIds(data, command)
+                if objectIds is None:
+                    logger.error('IDs should be integers')
+                    return 'Error: Bad IDs.'
+
+                if not objectIds:
+                    logger.error('No objects to request TNS names for.')
+                    return 'Error: No IDs.'
+
+                # Check the objects before queueing so that the client still gets an
+                # immediate reply when there is nothing to submit.
+                with dbPool.connection() as dbConn:
+                    objectList = getSpecifiedObjects(dbConn, objectIds)
+
+                if not objectList:
+                    logger.info('Error: No valid objects to submit.')
+                    return 'Error: Submitted Nothing'
+
+                # A request for exactly the same objects while one is queued or running is
+                # coalesced into that one.
+                return queueJob(jobRunner, reply, (command, tuple(objectIds)), submit, objectIds, objectList, donotsend=donotsend)
+
+        if data == 'Results':
+            return queueJob(jobRunner, 'Got reports', 'Results', results)
+
+        elif data.startswith('Status '):
+            return jobRunner.status(data.replace('Status ', '', 1).strip())
+
+        logger.error('Invalid message.')
+        return 'Error: Invalid message.'
+
+    server = TNSDaemonServer((options.server if options.server is not None else '', int(options.port)), handleCommand, logger = logger)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        jobRunner.shutdown()
+        dbPool.close()
 
 
 def startDaemon(options):
@@ -2,7 +2,7 @@
 """Get ATLAS TNS names.
 
 Usage:
-  %s <configfile> [<objectid>...] [--list=<list>] [--customlist=<customlist>] [--getreports] [--live] [--ddc] [--daysbefore=<daysbefore>] [--daysafter=<daysafter>] [--internalids] [--donotsend]
+  %s <configfile> [<objectid>...] [--list=<list>] [--customlist=<customlist>] [--getreports] [--live] [--ddc] [--daysbefore=<daysbefore>] [--daysafter=<daysafter>] [--internalids] [--donotsend] [--reportfile=<reportfile>]
   %s (-h | --help)
   %s --version
 
@@ -19,6 +19,7 @@ Options:
   --daysafter=<daysafter>     Days after flag date [default: 20.0].
   --internalids               Add the new internal_ids key as custom key/value pair dictionary
   --donotsend                 Do not send a report to TNS. Just test.
+  --reportfile=<reportfile>   With --donotsend, write the reports that would have been sent to this (JSON) file.
 
 Example:
 
@@ -32,12 +33,14 @@ import json
 import time
 import logging
 
-from tnsUtils import tnsAddRequestToDatabase, tnsUpdateRequestStatus, tnsUpdateRequestDownloadAttempts, tnsGetRequestList, getSubmissionReports
-from gkutils.commonutils import dbConnect, PROCESSING_FLAGS, calculateRMSScatter, getDateFractionMJD, coneSearchHTM, QUICK
+from tnsUtils import tnsAddRequestToDatabase, tnsUpdateRequestDownloadAttempts, tnsGetRequestList, getSubmissionReports, tnsApplyNames
+from tnsAPI import addBulkReport, TNS_ARCHIVE
+from gkutils.commonutils import dbConnect, PROCESSING_FLAGS, calculateRMSScatter, getDateFractionMJD, coneSearchHTM, QUICK, getMJDFromSqlDate, cleanOptions, Struct
 sys.path.append('../../common/python')
 from queries import getObjectInfo
 # 2018-05-21 KWS Retest the cut to grab the flag MJD
-from postIngestAtlasCutsDDC_XGBOOST_MJD_WINDOW import testObject
+# 2026-10-19 KWS Now only the detection gates and trigger logic are reused. See getTriggerMJD.
+from postIngestAtlasCutsDDC_XGBOOST_MJD_WINDOW import evaluateDetectionGates, evaluateXGBoostCandidate
 
 # Use the TNS logger /tmp/tns.log to record log info
 logger = logging.getLogger(__name__)
@@ -46,6 +49,11 @@ logger = logging.getLogger(__name__)
 ATLASFilters = {'c': '71', 'o': '72', 'w': '73'}
 ATLASInstrument = {'02a': '159', '01a': '160', '03a': '255', '04a': '256', '05r': '290'}
 ATLASGroup = 18
+# 2026-10-19 KWS Half width (degrees) of a standard ATLAS chip (5280 * 1.86 arcsec). Used
+#                for the coarse search for exposures that might cover an object, and for
+#                exposures with no nx, ny or scale. Each exposure is then checked against
+#                its own dimensions.
+ATLAS_FOOTPRINT_HALF_WIDTH = 2.73
 TNSAUTHORS = "J. Tonry, L. Denneau, A. Heinze, H. Weiland, H. Flewelling (IfA, University of Hawaii), B. Stalder (LSST), A. Rest (STScI), C. Stubbs (Harvard University), K. W. Smith, S. J. Smartt, D. R. Young, K. Maguire, S. Prentice, O. McBrien, D. O'Neill, P. Clark, M. Magee, M. Fulton, A. McCormack (Queen's University Belfast), D. E. Wright (University of Minnesota)"
 
 # A selection of possible responses.  We currently only use 1 and 2.
@@ -203,58 +211,31 @@ def updateTNSRequestFlag(conn, objectList, processingFlag = PROCESSING_FLAGS['tn
     return updatedRows
 
 
-def updateTNSNames(conn, tnsNames):
+def updateTNSNames(conn, tnsNames, status = None):
     """
     Depending on what we got back from the nameserver, update the appropriate field
     in the database for the relevant object.
 
     :param conn: database connection
     :param tnsNames: list of dicts of tns names and internal names for association
+    :param status: if set, also set the status of the TNS requests (in the same transaction)
     :return reports: the list of TNS report IDs processed
 
     """
-    import MySQLdb
-
-    updatedRows = 0
-    reports = []
-
-    try:
-        cursor = conn.cursor (MySQLdb.cursors.DictCursor)
-
-        for name in tnsNames:
-            if name['exists']:
-                logger.info('The name %s (%s) already exists on the nameserver.' % (name['objname'], name['internal_name']))
 
-            tnsName = name['objname']
-            if tnsName[0:2] == 'AT' or tnsName[0:2] == 'SN':
-                # Strip the prefix
-                tnsName = tnsName[2:]
+    # TEMPORARY FIX before I add the relevant index.
+    # If the query below doesn't use detection_list_id
+    # it will take forever.  There is currently no index
+    # on the atlas_diff_objects atlas_designation or other_designation
+    # columns.
+    updateQuery = """
+        update atlas_diff_objects
+        set other_designation = %s
+        where atlas_designation = %s
+        and detection_list_id > 0
+        """
 
-            # TEMPORARY FIX before I add the relevant index.
-            # If the query below doesn't use detection_list_id
-            # it will take forever.  There is currently no index
-            # on the atlas_diff_objects atlas_designation or other_designation
-            # columns.
-
-            # For the time being ONLY update the other_designation if the object is NEW.
-            if not name['exists']:
-                cursor.execute ("""
-                    update atlas_diff_objects
-                    set other_designation = %s
-                    where atlas_designation = %s
-                    and detection_list_id > 0
-                    """, (tnsName, name['internal_name']))
-
-            reports.append(name['report_id'])
-
-        updatedRows = cursor.rowcount
-        cursor.close()
-
-    except MySQLdb.Error as e:
-        sys.stderr.write("Error %d: %s\n" % (e.args[0], e.args[1]))
-        reports = []
-
-    return reports
+    return tnsApplyNames(conn, tnsNames, updateQuery, status = status)
 
 
 def getLastNonDetection(conn, candidate, sdssRadius = 300, sdssCatalogue = 'tcs_cat_sdss_dr9_photo_stars_galaxies', ddc = False, discoveryMJD = None):
@@ -357,8 +338,331 @@ def getLastNonDetection(conn, candidate, sdssRadius = 300, sdssCatalogue = 'tcs_
     return nonDetectionData
 
 
+# 2026-10-19 KWS Set based report building. Rather than running getObjectInfo, the full
+#                cuts (testObject) and getLastNonDetection for every object in a bulk
+#                report, get the detections for the whole batch in one query, derive
+#                the trigger and discovery epochs from them, and get the last
+#                non-detections for the whole batch in one more query.
+
+def getReportDetections(conn, objectIds):
+    """
+    Get the detections of all the objects in a report batch, with the columns required
+    by the cuts (see postIngestAtlasCutsDDC_XGBOOST_MJD_WINDOW.getObjectInfo) and by
+    the report (see queries.getAtlasObjectInfoddc).
+
+    :param conn: database connection
+    :param objectIds: list of object IDs
+    :return detections: dict of detection lists, ordered by MJD, keyed by object ID
+
+    """
+    import MySQLdb
+
+    detections = {}
+    if not objectIds:
+        return detections
+
+    try:
+        cursor = conn.cursor(MySQLdb.cursors.DictCursor)
+        cursor.execute ("""
+            SELECT d.atlas_object_id,
+                   d.ra RA,
+                   d.dec 'DEC',
+                   m.id atlas_metadata_id,
+                   m.filt Filter,
+                   m.mjd MJD,
+                   m.filename Filename,
+                   m.obj field,
+                   d.mag,
+                   d.dmag,
+                   d.dmag dm,
+                   m.texp exptime,
+                   m.obs expname,
+                   m.mag5sig,
+                   m.obj object,
+                   m.nx,
+                   m.ny,
+                   d.pmv,
+                   d.pvr,
+                   d.ptr,
+                   n.real,
+                   n.var,
+                   n.lin,
+                   n.flaw,
+                   n.cr,
+                   n.flg,
+                   n.chin as nnc_chin,
+                   n.x as nnc_x,
+                   n.y as nnc_y,
+                   d.pkn,
+                   d.det,
+                   d.dup,
+                   d.psc,
+                   d.pbn,
+                   d.x,
+                   d.y,
+                   d.chin,
+                   d.deprecated
+            FROM atlas_detectionsddc d
+            JOIN atlas_metadataddc m
+              on d.atlas_metadata_id = m.id
+            LEFT JOIN atlas_detectionsnnc n
+              on n.detection_id = d.id
+            where d.atlas_object_id in (%s)
+            ORDER by d.atlas_object_id, MJD
+        """ % ','.join(['%s'] * len(objectIds)), tuple(objectIds))
+
+        for row in cursor.fetchall():
+            detections.setdefault(row['atlas_object_id'], []).append(row)
+
+        cursor.close ()
+
+    except MySQLdb.Error as e:
+        sys.stderr.write("Error %d: %s\n" % (e.args[0], e.args[1]))
+        sys.exit (1)
+
+    return detections
+
+
+def getReportLightcurve(detections):
+    """
+    The positive flux lightcurve used for the report. Equivalent to queries.getAtlasObjectInfoddc.
+
+    :param detections: all the detections of an object, ordered by MJD
+    :return lc: list of detections
+
+    """
+    return [row for row in detections if row['det'] != 5 and row['mag'] > 0.0 and (row['deprecated'] is None or row['deprecated'] != 1)]
+
+
+def getTriggerMJD(detections, followupFlagDate, mjdWindow = 100):
+    """
+    The (whole) MJD on which the object was triggered. Applies exactly the same detection
+    gates and intra day recurrence test as testObject (with the default, empty, masks),
+    but to detections we already have.
+
+    :param detections: all the detections of an object, ordered by MJD
+    :param followupFlagDate: the followup flag date (datetime)
+    :param mjdWindow:  (Default value = 100)
+    :return triggerMJD: the trigger MJD, or None
+
+    """
+    followupFlagMJD = None
+    if followupFlagDate is not None:
+        followupFlagMJD = getMJDFromSqlDate(followupFlagDate.strftime("%Y-%m-%d")) + 1
+
+    cleanedObjectInfo = []
+    detectionList = []
+    mjds = []
+    for objectRow in detections:
+        if followupFlagMJD is not None and objectRow['MJD'] >= followupFlagMJD:
+            break
+
+        if objectRow['expname'][0:3] != '05r' and objectRow['nnc_x'] is not None and objectRow['nnc_y'] is not None:
+            minSize = 100
+        else:
+            minSize = 148
+
+        if evaluateDetectionGates(objectRow, False, minSize)['xgboostPass']:
+            mjds.append([objectRow['MJD']])
+            detectionList.append((objectRow, 1))
+            cleanedObjectInfo.append(objectRow)
+
+    result = evaluateXGBoostCandidate(None, None, detectionList, cleanedObjectInfo, mjds, mjdWindow = mjdWindow, debug = False, followupFlagMJD = followupFlagMJD)
+
+    return result['triggerMJD']
+
+
+def getAverageCoordinates(detections):
+    """
+    Average position of the lightcurve points, chosen exactly as getLightcurvePoints
+    (LC_POINTS_QUERY_ATLAS_DDC) chooses them: not deprecated, in FILTERS, and only the
+    dup >= 0 points if there are any. getNonDetectionsUsingATLASFootprint searched
+    around this position.
+
+    :param detections: all the detections of an object
+    :return ra, dec: the average position, or None, None
+
+    """
+    from commonqueries import FILTERS
+
+    recurrences = [row for row in detections if row['deprecated'] is None and row['Filter'] in FILTERS]
+    cleanedRecurrences = [row for row in recurrences if row['dup'] is not None and row['dup'] >= 0]
+    if cleanedRecurrences:
+        recurrences = cleanedRecurrences
+    if not recurrences:
+        return None, None
+
+    avgRa, avgDec, rms = calculateRMSScatter(recurrences)
+    return avgRa, avgDec
+
+
+def getLastNonDetections(conn, objectInfo, mjdTolerance = 0.5, lookbackDays = None):
+    """
+    Get the most recent exposure covering each object, before its discovery (minus
+    mjdTolerance), that did not detect it. One query for the whole batch.
+    An exposure covers the object if the object is inside the exposure's own footprint
+    (nx * scale by ny * scale), the same test as isObjectInsideATLASFootprintGeneric.
+
+    :param conn: database connection
+    :param objectInfo: list of dicts containing id, ra, dec (the average position) and discoveryMJD
+    :param mjdTolerance:  (Default value = 0.5)
+    :param lookbackDays: If set, don't search further back than this before discovery (Default value = None)
+    :return nonDetections: dict of non-detections keyed by object ID
+
+    """
+    import MySQLdb
+    from math import cos, radians
+
+    nonDetections = {}
+    if not objectInfo:
+        return nonDetections
+
+    objectsSelect = []
+    parameters = []
+    for row in objectInfo:
+        # Coarse (index friendly) box that contains every footprint that can cover the
+        # object. The RA width allows for exposure centres further from the equator.
+        raHalfWidth = 180.0
+        if abs(row['dec']) + 2 * ATLAS_FOOTPRINT_HALF_WIDTH < 90.0:
+            raHalfWidth = min(ATLAS_FOOTPRINT_HALF_WIDTH / cos(radians(abs(row['dec']) + ATLAS_FOOTPRINT_HALF_WIDTH)), 180.0)
+        objectsSelect.append("select %s objectId, %s ra, %s `dec`, %s decMin, %s decMax, %s raHalfWidth, %s mjdLimit")
+        parameters += [row['id'], row['ra'], row['dec'], row['dec'] - ATLAS_FOOTPRINT_HALF_WIDTH, row['dec'] + ATLAS_FOOTPRINT_HALF_WIDTH, raHalfWidth, row['discoveryMJD'] - mjdTolerance]
+
+    filters = list(ATLASFilters.keys())
+
+    lookbackClause = ''
+    lookbackParameters = []
+    if lookbackDays is not None:
+        lookbackClause = 'and m.mjd >= t.mjdLimit - %s'
+        lookbackParameters = [lookbackDays]
+
+    try:
+        cursor = conn.cursor(MySQLdb.cursors.DictCursor)
+        cursor.execute ("""
+            select objectId, mjd, filter, mag5sig, expname, exptime from (
+                select t.objectId, m.mjd, m.filt filter, m.mag5sig, m.obs expname, m.texp exptime,
+                       row_number() over (partition by t.objectId order by m.mjd desc) epoch
+                  from (%s) t
+                  join atlas_metadataddc m
+                    on m.mjd < t.mjdLimit
+                   %s
+                   and m.`dec` between t.decMin and t.decMax
+                   and abs(mod(m.ra - t.ra + 540.0, 360.0) - 180.0) < t.raHalfWidth
+                 where m.filt in (%s)
+                   and abs(mod(t.ra - m.ra + 540.0, 360.0) - 180.0) * cos(radians(m.`dec`)) <= coalesce(m.nx * m.scale / 7200.0, %%s)
+                   and abs(t.`dec` - m.`dec`) <= coalesce(m.ny * m.scale / 7200.0, %%s)
+                   and not exists (select 1
+                                     from atlas_detectionsddc d
+                                    where d.atlas_metadata_id = m.id
+                                      and d.atlas_object_id = t.objectId)
+            ) nd
+            where epoch = 1
+        """ % (' union all '.join(objectsSelect), lookbackClause, ','.join(['%s'] * len(filters))), tuple(parameters + lookbackParameters + filters + [ATLAS_FOOTPRINT_HALF_WIDTH, ATLAS_FOOTPRINT_HALF_WIDTH]))
+
+        for row in cursor.fetchall():
+            nonDetections[row['objectId']] = row
+
+        cursor.close ()
+
+    except MySQLdb.Error as e:
+        sys.stderr.write("Error %d: %s\n" % (e.args[0], e.args[1]))
+        sys.exit (1)
+
+    return nonDetections
+
+
+def getReportData(conn, candidateArray, sdssRadius = 300, sdssCatalogue = 'tcs_cat_sdss_dr9_photo_stars_galaxies', mjdTolerance = 0.5):
+    """
+    Get the discovery photometry and non-detection data for a batch of (ddc) objects.
+    Same rules as tnsReport and getLastNonDetection, but set based.
+
+    :param conn: database connection
+    :param candidateArray: list of object dicts
+    :param sdssRadius:  (Default value = 300)
+    :param sdssCatalogue:  (Default value = 'tcs_cat_sdss_dr9_photo_stars_galaxies')
+    :param mjdTolerance:  (Default value = 0.5)
+    :return reportData: dict of dicts containing 'discovery' and 'non_detection' keyed by object ID
+
+    """
+    detections = getReportDetections(conn, [row['id'] for row in candidateArray])
+
+    reportData = {}
+    discoveryInfo = []
+    for row in candidateArray:
+        lc = getReportLightcurve(detections.get(row['id'], []))
+        if not lc:
+            print("Object %d has no detections. Skipping." % row['id'])
+            continue
+
+        triggerMJD = getTriggerMJD(detections[row['id']], row['followup_flag_date'], mjdWindow = 100)
+        print(triggerMJD)
+
+        discovery = None
+        if triggerMJD is not None:
+            for recurrence in lc:
+                if recurrence['MJD'] > triggerMJD:
+                    discovery = recurrence
+                    break
+
+        # If we didn't find our discoveryMJD, work it out the old way
+        if discovery is None:
+            discovery = lc[0]
+
+        # The most recent detection before the trigger, which might be more recent than
+        # the last non-detection.
+        detectionBeforeTrigger = None
+        for recurrence in reversed(lc):
+            if recurrence['MJD'] < discovery['MJD'] - mjdTolerance:
+                detectionBeforeTrigger = recurrence
+                break
+
+        reportData[row['id']] = {'discovery': discovery, 'detectionBeforeTrigger': detectionBeforeTrigger}
+
+        avgRa, avgDec = getAverageCoordinates(detections[row['id']])
+        if avgRa is None:
+            avgRa, avgDec = row['ra'], row['dec']
+        discoveryInfo.append({'id': row['id'], 'ra': avgRa, 'dec': avgDec, 'discoveryMJD': discovery['MJD']})
+
+    nonDetections = getLastNonDetections(conn, discoveryInfo, mjdTolerance = mjdTolerance)
+
+    for row in candidateArray:
+        if row['id'] not in reportData:
+            continue
+
+        lastNonDetection = None
+        if row['id'] in nonDetections:
+            nd = nonDetections[row['id']]
+            lastNonDetection = {'MJD': nd['mjd'], 'Filter': nd['filter'], 'mag5sig': nd['mag5sig'], 'expname': nd['expname'], 'exptime': nd['exptime']}
+
+        detectionBeforeTrigger = reportData[row['id']]['detectionBeforeTrigger']
+        if detectionBeforeTrigger and (lastNonDetection is None or detectionBeforeTrigger['MJD'] > lastNonDetection['MJD']):
+            lastNonDetection = detectionBeforeTrigger
+
+        if lastNonDetection:
+            nonDetectionData = { 'obsdate': getDateFractionMJD(lastNonDetection['MJD'], delimiter = '-', decimalPlaces = 5),
+                                 'limiting_flux': str(lastNonDetection['mag5sig']),
+                                 'flux_units': '1',
+                                 'filter_value': ATLASFilters[lastNonDetection['Filter']],
+                                 'instrument_value': ATLASInstrument[lastNonDetection['expname'][0:3]],
+                                 'exptime': str(lastNonDetection['exptime']),
+                                 'observer': 'Robot'
+                                }
+        else:
+            # Check for SDSS object. Only needed for the (rare) objects with no non-detection.
+            message, results = coneSearchHTM(row['ra'], row['dec'], sdssRadius, sdssCatalogue, queryType = QUICK, conn = conn)
+            if results:
+                logger.info("We got %d SDSS results" % len(results))
+                nonDetectionData = { 'archiveid': TNS_ARCHIVE['SDSS'] }
+            else:
+                nonDetectionData = { 'archiveid': TNS_ARCHIVE['DSS'] }
+
+        reportData[row['id']]['non_detection'] = nonDetectionData
+
+    return reportData
+
+
 # 2018-10-12 KWS Now pass TNS authors to the function. Allows me to read them from the config file.
-def tnsReport(conn, tnsBaseURL, tnsApiKey, objectList, ddc = False, donotsend = False, reporter = TNSAUTHORS, tnsBaseURLExperimental = None, tnsApiKeyExperimental = None, botId = None, botName = None, addInternalIDs = False):
+def tnsReport(conn, tnsBaseURL, tnsApiKey, objectList, ddc = False, donotsend = False, reporter = TNSAUTHORS, tnsBaseURLExperimental = None, tnsApiKeyExperimental = None, botId = None, botName = None, addInternalIDs = False, reportFile = None):
     """
     Construct and send reports to the TNS, with a maximum of 100 objects
     at a time.
@@ -367,6 +671,8 @@ def tnsReport(conn, tnsBaseURL, tnsApiKey, objectList, ddc = False, donotsend =
     :param tnsBaseURL: TNS base URL
     :param tnsApiKey: TNS API Key
     :param objectList: 
+    :param donotsend: Build the reports, but don't send them or touch the database
+    :param reportFile: If donotsend, write the reports to this JSON file
     :return reports: the report IDs sent to the Transient Nameserver
 
     """
@@ -383,7 +689,7 @@ def tnsReport(conn, tnsBaseURL, tnsApiKey, objectList, ddc = False, donotsend =
     
     arrayLength = len(objectList)
     maxNumberOfCandidates = 100
-    numberOfIterations = arrayLength/maxNumberOfCandidates
+    numberOfIterations = arrayLength//maxNumberOfCandidates
 
     # Check to see if we need an extra iteration to clean up the end of the array
     if arrayLength%maxNumberOfCandidates != 0:
@@ -391,43 +697,39 @@ def tnsReport(conn, tnsBaseURL, tnsApiKey, objectList, ddc = False, donotsend =
 
     logger.info("Number of iterations = %d" % numberOfIterations)
 
+    unsentReports = []
+
     for currentIteration in range(numberOfIterations):
         candidateArray = objectList[currentIteration*maxNumberOfCandidates:currentIteration*maxNumberOfCandidates+maxNumberOfCandidates]
         logger.info("Iteration %d" % (currentIteration + 1))
+        startTime = time.time()
         tnsDict = {'at_report': {} }
         counter = 0
+
+        reportData = {}
+        if ddc:
+            reportData = getReportData(conn, candidateArray)
+
         for row in candidateArray:
-            triggerMJD = None
             discoveryMJD = None
             discoveryMag = None
             discoveryFilter = None
             discoveryInstrument = None
             discoveryExptime = None
             limitingMag = None
+            nonDetectionData = None
             if ddc:
-                lc = getObjectInfo(conn, row['id'])
-                testResults = testObject(conn, row['id'], mjdWindow = 100, debug = False, followupFlagDate = row['followup_flag_date'].strftime("%Y-%m-%d"))
-                triggerMJD = testResults['triggerMJD']
-                print(triggerMJD)
-                for recurrence in lc:
-                    if recurrence['MJD'] > triggerMJD:
-                        discoveryMJD = recurrence['MJD']
-                        discoveryMag = recurrence['mag']
-                        discoveryMagError = recurrence['dm']
-                        discoveryFilter = ATLASFilters[recurrence['Filter']]
-                        discoveryInstrument = ATLASInstrument[recurrence['expname'][0:3]]
-                        discoveryExptime = recurrence['exptime']
-                        limitingMag = recurrence['mag5sig']
-                        break
-                # If we didn't find our discoveryMJD, work it out the old way
-                if discoveryMJD is None:
-                    discoveryMJD = lc[0]['MJD']
-                    discoveryMag = lc[0]['mag']
-                    discoveryMagError = lc[0]['dm']
-                    discoveryFilter = ATLASFilters[lc[0]['Filter']]
-                    discoveryInstrument = ATLASInstrument[lc[0]['expname'][0:3]]
-                    discoveryExptime = lc[0]['exptime']
-                    limitingMag = lc[0]['mag5sig']
+                if row['id'] not in reportData:
+                    continue
+                discovery = reportData[row['id']]['discovery']
+                discoveryMJD = discovery['MJD']
+                discoveryMag = discovery['mag']
+                discoveryMagError = discovery['dm']
+                discoveryFilter = ATLASFilters[discovery['Filter']]
+                discoveryInstrument = ATLASInstrument[discovery['expname'][0:3]]
+                discoveryExptime = discovery['exptime']
+                limitingMag = discovery['mag5sig']
+                nonDetectionData = reportData[row['id']]['non_detection']
             else:
                 lc = getObjectInfo(conn, row['id'])
                 discoveryMJD = lc[0]['MJD']
@@ -444,7 +746,8 @@ def tnsReport(conn, tnsBaseURL, tnsApiKey, objectList, ddc = False, donotsend =
             discoveryDate = getDateFractionMJD(discoveryMJD, delimiter = '-', decimalPlaces = 5)
             internalName = row['atlas_designation']
 
-            nonDetectionData = getLastNonDetection(conn, row, ddc = ddc, discoveryMJD = discoveryMJD)
+            if nonDetectionData is None:
+                nonDetectionData = getLastNonDetection(conn, row, ddc = ddc, discoveryMJD = discoveryMJD)
 
             # 2020-01-15 KWS changed 'groupid': str(groupId) to 'reporting_group_id': str(groupId) and 'discovery_data_source_id': str(groupId)
             #                as per instructions from Ofer Yaron and Avner Sass on 2019-11-24.
@@ -484,12 +787,20 @@ def tnsReport(conn, tnsBaseURL, tnsApiKey, objectList, ddc = False, donotsend =
         # We have now constructed the TNS dictionary. Send it to the TNS.  Record the report id in the database.
         logger.debug("REQUEST")
         logger.debug(json.dumps(tnsDict, indent=4, sort_keys=True))
- 
+        logger.info("Built report of %d objects in %.2f seconds" % (counter, time.time() - startTime))
+
+        if donotsend:
+            print("Built report of %d objects in %.2f seconds (not sent)" % (counter, time.time() - startTime))
+            unsentReports.append(tnsDict)
+            # Nothing is being sent, so there's no need to wait.
+            continue
+
         if not donotsend:
             reportId = addBulkReport(tnsDict, tnsBaseURL, tnsApiKey, botId = botId, botName = botName)
             if reportId:
                 tnsAddRequestToDatabase(conn, reportId)
-                updateTNSRequestFlag(conn, objectList)
+                # 2026-10-19 KWS Only flag the objects in THIS report.
+                updateTNSRequestFlag(conn, candidateArray)
                 reports.append(reportId)
             #if tnsBaseURLExperimental is not None and tnsApiKeyExperimental is not None:
             #    print "Sending Experimental request"
@@ -502,6 +813,10 @@ def tnsReport(conn, tnsBaseURL, tnsApiKey, objectList, ddc = False, donotsend =
         # Sleep for at least 1 second before sending the next report
         time.sleep(1)
 
+    if donotsend and reportFile is not None:
+        with open(reportFile, 'w') as f:
+            json.dump(unsentReports, f, indent=4, sort_keys=True, default=str)
+
     return reports
 
 
@@ -557,17 +872,14 @@ def main(argv=None):
         if not names:
             sys.stderr.write("Bad response. Looks like the report does not exist yet\n")
         else:
-            reports = updateTNSNames(conn, names)
-            if reports:
-                # Set the relevant request ID to be completed
-                for reportId in set(reports):
-                    tnsUpdateRequestStatus(conn, reportId, COMPLETE)
+            # Set the relevant request IDs to be completed
+            reports = updateTNSNames(conn, names, status = COMPLETE)
 
     else:
         # 2018-04-27 KWS Override the object list and feed specific objects
-        if len(args) > 1:
-            for i in range(1,len(args)):
-                o = getObjectById(conn, objectId = int(args[i]))
+        if options.objectid:
+            for objectId in options.objectid:
+                o = getObjectById(conn, objectId = int(objectId))
                 if o:
                     objectList.append(o)
         elif options.customlist is not None:
@@ -586,7 +898,7 @@ def main(argv=None):
                     sys.stderr.write("The list must be between 0 and 6 inclusive.  Exiting.")
                     sys.exit(1)
 
-        reports = tnsReport(conn, tnsBaseURL, tnsApiKey, objectList, ddc = options.ddc, donotsend = options.donotsend, reporter = tnsAuthors, tnsBaseURLExperimental = tnsBaseURLExperimental, tnsApiKeyExperimental = tnsApiKeyExperimental, botId = botId, botName = botName, addInternalIDs = options.internalids) 
+        reports = tnsReport(conn, tnsBaseURL, tnsApiKey, objectList, ddc = options.ddc, donotsend = options.donotsend, reporter = tnsAuthors, tnsBaseURLExperimental = tnsBaseURLExperimental, tnsApiKeyExperimental = tnsApiKeyExperimental, botId = botId, botName = botName, addInternalIDs = options.internalids, reportFile = options.reportfile)
         for row in reports:
             print("TNS report ID = %s" % row)
 
@@ -34,7 +34,7 @@ import json
 import time
 import logging
 
-from tnsUtils import tnsAddRequestToDatabase, tnsUpdateRequestStatus, tnsUpdateRequestDownloadAttempts, tnsGetRequestList, getSubmissionReports
+from tnsUtils import tnsAddRequestToDatabase, tnsUpdateRequestDownloadAttempts, tnsGetRequestList, getSubmissionReports, tnsApplyNames
 
 from gkutils.commonutils import dbConnect, PROCESSING_FLAGS, calculateRMSScatter, getDateFractionMJD, coneSearchHTM, QUICK, grammarJoin, FLAGS, getMJDFromSqlDate
 #from apply3piDiffCuts import getObjectInfo
@@ -343,58 +343,31 @@ def updateTNSRequestFlag(conn, objectList, processingFlag = PROCESSING_FLAGS['tn
     return updatedRows
 
 
-def updateTNSNames(conn, tnsNames):
+def updateTNSNames(conn, tnsNames, status = None):
     """
     Depending on what we got back from the nameserver, update the appropriate field
     in the database for the relevant object.
 
     :param conn: database connection
     :param tnsNames: list of dicts of tns names and internal names for association
+    :param status: if set, also set the status of the TNS requests (in the same transaction)
     :return reports: the list of TNS report IDs processed
 
     """
-    import MySQLdb
-
-    updatedRows = 0
-    reports = []
-
-    try:
-        cursor = conn.cursor (MySQLdb.cursors.DictCursor)
-
-        for name in tnsNames:
-            if name['exists']:
-                logger.info('The name %s (%s) already exists on the nameserver.' % (name['objname'], name['internal_name']))
-
-            tnsName = name['objname']
-            if tnsName[0:2] == 'AT' or tnsName[0:2] == 'SN':
-                # Strip the prefix
-                tnsName = tnsName[2:]
 
-            # TEMPORARY FIX before I add the relevant index.
-            # If the query below doesn't use detection_list_id
-            # it will take forever.  There is currently no index
-            # on the atlas_diff_objects ps1_designation or other_designation
-            # columns.
+    # TEMPORARY FIX before I add the relevant index.
+    # If the query below doesn't use detection_list_id
+    # it will take forever.  There is currently no index
+    # on the atlas_diff_objects ps1_designation or other_designation
+    # columns.
+    updateQuery = """
+        update tcs_transient_objects
+        set other_designation = %s
+        where ps1_designation = %s
+        and detection_list_id > 0
+        """
 
-            # For the time being ONLY update the other_designation if the object is NEW.
-            if not name['exists']:
-                cursor.execute ("""
-                    update tcs_transient_objects
-                    set other_designation = %s
-                    where ps1_designation = %s
-                    and detection_list_id > 0
-                    """, (tnsName, name['internal_name']))
-
-            reports.append(name['report_id'])
-
-        updatedRows = cursor.rowcount
-        cursor.close()
-
-    except MySQLdb.Error as e:
-        sys.stderr.write("Error %d: %s\n" % (e.args[0], e.args[1]))
-        reports = []
-
-    return reports
+    return tnsApplyNames(conn, tnsNames, updateQuery, status = status)
 
 
 # Group lightcurves into whole MJDs.
@@ -751,11 +724,8 @@ def main(argv=None):
         if not names:
             sys.stderr.write("Bad response. Looks like the report does not exist yet, or there are no reports to request.\n")
         else:
-            reports = updateTNSNames(conn, names)
-            if reports:
-                # Set the relevant request ID to be completed
-                for reportId in set(reports):
-                    tnsUpdateRequestStatus(conn, reportId, COMPLETE)
+            # Set the relevant request IDs to be completed
+            reports = updateTNSNames(conn, names, status = COMPLETE)
 
     else:
         objectList = []
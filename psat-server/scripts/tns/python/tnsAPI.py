@@ -18,11 +18,46 @@ httpErrors = {
     400: 'Error 400: Bad Request: The request was invalid. An accompanying error message will explain why.',
     403: 'Error 403: Forbidden: The request is understood, but it has been refused. An accompanying error message will explain why',
     404: 'Error 404: Not Found: The URI requested is invalid or the resource requested, such as a category, does not exists.',
+    429: 'Error 429: Too Many Requests: The TNS rate limit has been exceeded.',
     500: 'Error 500: Internal Server Error: Something is broken.',
     502: 'Error 502: Bad Gateway Error.',
     503: 'Error 503: Service Unavailable.'
 }
 
+# 2026-10-19 KWS The TNS is rate limiting us or is (temporarily) broken. jsonResponse would
+#                turn these into an empty reply, which looks like "not processed yet", so
+#                the report reply poller raises this instead and backs off.
+class TNSUnavailableError(requests.exceptions.HTTPError):
+    """HTTP 429 or 5xx from the TNS. retryAfter is the Retry-After delay in seconds, or None."""
+
+    def __init__(self, message, retryAfter = None, **kwargs):
+        super(TNSUnavailableError, self).__init__(message, **kwargs)
+        self.retryAfter = retryAfter
+
+
+def getRetryAfter(r):
+    """
+    Parse the Retry-After header, which is either a number of seconds or an HTTP date.
+
+    :param r: requests object - the response we got back from the server
+    :return: delay in seconds, or None if there is no (valid) header
+
+    """
+    value = r.headers.get('Retry-After')
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        from email.utils import parsedate_to_datetime
+        from datetime import datetime, timezone
+        return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
 class TNSClient(object):
     """Send Bulk TNS Request."""
 
@@ -143,6 +178,8 @@ class TNSClient(object):
         r = requests.post(feed_url, data = feed_parameters, timeout = 300, headers = self.header)
         print(r.status_code)
         print(r.text)
+        if r.status_code == 429 or r.status_code >= 500:
+            raise TNSUnavailableError(httpErrors.get(r.status_code, 'Error %d: Undocumented error' % r.status_code), retryAfter = getRetryAfter(r), response = r)
         return self.jsonResponse(r)
 
 
@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+"""Shared machinery for the ATLAS and Pan-STARRS TNS daemons.
+
+The daemons used to accept one client at a time, open a new database connection for
+every command, and run the (slow) TNS submission before replying. Now:
+
+  * Clients are served concurrently (one thread per client connection).
+  * Database connections come from a small persistent pool.
+  * Submit and Results commands are queued as background jobs and the client gets
+    a job ID straight away (e.g. "Submitted 3f2a9c0e1b7d"), which it can poll with
+    "Status <jobid>".
+  * A command that arrives while an identical one is queued or running is coalesced
+    into the existing job (the client gets the existing job ID).
+
+The TNS base URL can be overridden on the daemon command line (--tnsurl), so the whole
+daemon can be exercised against a local fake TNS HTTP endpoint.
+"""
+import time
+import uuid
+import queue
+import socket
+import socketserver
+import threading
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from gkutils.commonutils import dbConnect
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED   = 'queued'
+JOB_RUNNING  = 'running'
+JOB_COMPLETE = 'complete'
+JOB_FAILED   = 'failed'
+
+# Don't remember more than this many finished jobs.
+MAX_FINISHED_JOBS = 1000
+
+
+def recvText(conn, size=65536):
+    """Receive a socket payload and return a stripped unicode string."""
+    data = conn.recv(size)
+    if isinstance(data, bytes):
+        return data.decode("utf-8", errors="replace").strip()
+    return str(data).strip()
+
+
+def sendText(conn, message):
+    """Send a response as bytes under Python 3."""
+    if isinstance(message, str):
+        message = message.encode("utf-8")
+    conn.sendall(message)
+
+
+class DBConnectionPool(object):
+    """Small pool of persistent database connections"""
+
+    def __init__(self, hostname, username, password, database, size = 2):
+        self.credentials = (hostname, username, password, database)
+        self.pool = queue.Queue()
+        for i in range(max(int(size), 1)):
+            self.pool.put(None)
+
+
+    def connect(self):
+        conn = dbConnect(*self.credentials, quitOnError = False)
+        if conn:
+            conn.autocommit(True)
+        return conn
+
+
+    def get(self):
+        """Get a connection from the pool, (re)connecting if necessary. Blocks if none are free."""
+        conn = self.pool.get()
+        if conn is not None:
+            try:
+                conn.ping()
+            except Exception:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+                conn = None
+        if conn is None:
+            conn = self.connect()
+        if not conn:
+            self.pool.put(None)
+            raise RuntimeError("Cannot connect to the database")
+        return conn
+
+
+    def put(self, conn):
+        self.pool.put(conn)
+
+
+    def connection(self):
+        """Context manager: with pool.connection() as conn: ..."""
+        pool = self
+        class PooledConnection(object):
+            def __enter__(self):
+                self.conn = pool.get()
+                return self.conn
+            def __exit__(self, *args):
+                pool.put(self.conn)
+                return False
+        return PooledConnection()
+
+
+    def close(self):
+        while True:
+            try:
+                conn = self.pool.get_nowait()
+            except queue.Empty:
+                break
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+
+
+class JobRunner(object):
+    """Run daemon commands as background jobs, coalescing duplicates"""
+
+    def __init__(self, workers = 1, logger = None):
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        self.executor = ThreadPoolExecutor(max_workers = max(int(workers), 1))
+        self.lock = threading.Lock()
+        self.jobs = OrderedDict()
+        # Key of each queued or running job -> job ID
+        self.active = {}
+
+
+    def submit(self, key, function, *args, **kwargs):
+        """Queue function(*args, **kwargs) as a job. If a job with the same key is already
+           queued or running, don't queue another one. Returns (jobId, coalesced)."""
+        with self.lock:
+            if key is not None and key in self.active:
+                return self.active[key], True
+
+            jobId = uuid.uuid4().hex[:12]
+            self.jobs[jobId] = {'key': key, 'status': JOB_QUEUED, 'result': None, 'submitted': time.time(), 'finished': None}
+            if key is not None:
+                self.active[key] = jobId
+
+        self.executor.submit(self.run, jobId, function, *args, **kwargs)
+        return jobId, False
+
+
+    def run(self, jobId, function, *args, **kwargs):
+        with self.lock:
+            self.jobs[jobId]['status'] = JOB_RUNNING
+
+        # The job functions call sys.exit() on database errors, so catch BaseException
+        # (SystemExit included) and always finish the job, otherwise it would stay
+        # running forever and identical commands would coalesce onto it.
+        result = None
+        status = JOB_FAILED
+        try:
+            result = function(*args, **kwargs)
+            status = JOB_COMPLETE
+        except BaseException as e:
+            self.logger.exception('Job %s failed', jobId)
+            result = 'Error: %s' % (str(e) or e.__class__.__name__)
+        finally:
+            with self.lock:
+                job = self.jobs[jobId]
+                job['status'] = status
+                job['result'] = result
+                job['finished'] = time.time()
+                if job['key'] is not None and self.active.get(job['key']) == jobId:
+                    del self.active[job['key']]
+                self.expire()
+
+
+    def expire(self):
+        """Forget the oldest finished jobs. Call with the lock held."""
+        finished = [jobId for jobId, job in self.jobs.items() if job['finished'] is not None]
+        for jobId in finished[:max(len(finished) - MAX_FINISHED_JOBS, 0)]:
+            del self.jobs[jobId]
+
+
+    def status(self, jobId):
+        """Return a one line description of the job status."""
+        with self.lock:
+            job = self.jobs.get(jobId)
+            if job is None:
+                return 'Error: Unknown job %s' % jobId
+            if job['result'] is not None:
+                return 'Job %s %s: %s' % (jobId, job['status'], job['result'])
+            return 'Job %s %s' % (jobId, job['status'])
+
+
+    def shutdown(self):
+        self.executor.shutdown(wait = True)
+
+
+class TNSDaemonServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """Threaded TCP server. Each client connection gets its own thread."""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, handleCommand, logger = None):
+        """
+        address:       (server, port)
+        handleCommand: function(message) -> reply
+        logger:        the daemon's logger
+        """
+        self.handleCommand = handleCommand
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        socketserver.TCPServer.__init__(self, address, TNSDaemonRequestHandler)
+
+
+class TNSDaemonRequestHandler(socketserver.BaseRequestHandler):
+    """Read one command, send one reply."""
+
+    def handle(self):
+        logger = self.server.logger
+        logger.info('Received connection from %s', str(self.client_address))
+        try:
+            data = recvText(self.request)
+        except socket.error:
+            logger.error('Something went wrong. (Connection reset?) Cannot continue. Skipping this request.')
+            return
+
+        try:
+            reply = self.server.handleCommand(data)
+        except (Exception, SystemExit) as e:
+            # SystemExit too - the database helpers exit on errors, and the client still needs a reply.
+            logger.exception('Error handling command %s', data)
+            reply = 'Error: %s' % (str(e) or e.__class__.__name__)
+
+        try:
+            sendText(self.request, reply)
+        except socket.error:
+            logger.error('Could not send reply to %s', str(self.client_address))
+
+
+def parseObjectIds(data, command):
+    """Parse '<command> id1 id2 ...' into a sorted list of unique integer IDs. Returns None if bad."""
+    ids = data.replace(command, '', 1).split()
+    try:
+        return sorted(set(map(int, ids)))
+    except ValueError:
+        return None
+
+
+def queueJob(jobRunner, reply, key, function, *args, **kwargs):
+    """Queue a job and return the reply for the client, which is the old synchronous
+       reply (e.g. 'Submitted') followed by the job ID, so existing clients that only
+       look at the start of the reply carry on working."""
+    jobId, coalesced = jobRunner.submit(key, function, *args, **kwargs)
+    if coalesced:
+        jobRunner.logger.info('Request coalesced into queued or running job %s', jobId)
+    return '%s %s' % (reply, jobId)
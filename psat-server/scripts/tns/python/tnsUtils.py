@@ -1,7 +1,15 @@
 #!/usr/bin/env python
-from tnsAPI import addBulkReport, getBulkReportReply
+from tnsAPI import addBulkReport, getBulkReportReply, TNSUnavailableError
 import sys
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
 import logging
+from concurrent.futures import ThreadPoolExecutor
+import requests
 
 # The following code should be useable by both the Pan-STARRS and ATLAS surveys.
 
@@ -21,6 +29,32 @@ TIMEOUT             = 4
 DOWNLOADING         = 5
 CORRUPT             = 7
 
+# Complete TNS report replies are cached here, and deleted after TNS_REPLY_CACHE_MAX_AGE seconds.
+TNS_REPLY_CACHE = os.path.join(tempfile.gettempdir(), 'tns_report_replies')
+TNS_REPLY_CACHE_MAX_AGE = 7 * 86400
+
+# Never wait longer than this (seconds) for a Retry-After.
+TNS_MAX_RETRY_AFTER = 600
+
+# When the TNS tells us to back off, ALL the concurrent pollers wait until this time.
+tnsHoldOff = {'until': 0.0}
+tnsHoldOffLock = threading.Lock()
+
+
+def holdOffTNS(seconds):
+    """Don't send any more requests to the TNS for the next few seconds."""
+    with tnsHoldOffLock:
+        tnsHoldOff['until'] = max(tnsHoldOff['until'], time.time() + seconds)
+
+
+def waitForTNS():
+    """Wait until we're allowed to send requests to the TNS again."""
+    with tnsHoldOffLock:
+        delay = tnsHoldOff['until'] - time.time()
+    if delay > 0:
+        time.sleep(delay)
+
+
 def tnsAddRequestToDatabase(conn, reportId):
     """
     Add the TNS request to the database
@@ -148,102 +182,285 @@ def tnsGetRequestList(conn, status, creationDate = '2016-04-01 00:00:00', limit
     return psRequestList
 
 
-def getSubmissionReports(conn, tnsBaseURL, tnsApiKey, botId = None, botName = None):
+def parseReportReply(reportId, request, response):
     """
-    Get all the reports back from the TNS that have not yet been
-    processed and return a list of tns names with internal names
-    and whether or not the object exists on the nameserver.
+    Parse the TNS reply to a bulk report and return a list of tns names with internal
+    names and whether or not the object exists on the nameserver.
 
-    :param conn: database connection
-    :param tnsBaseURL: TNS base URL
-    :param tnsApiKey: TNS API Key
-    :return names: dict containing internal name, tns name, bool exists, tns report id
+    :param reportId: TNS report ID
+    :param request: the original request (if returned)
+    :param response: the TNS response
+    :return names: list of dicts containing internal name, tns name, bool exists, tns report id
 
     """
-
     names = []
-    tnsRequests = tnsGetRequestList(conn, SUBMITTED)
-    if tnsRequests:
-        for r in tnsRequests:
-            # 2025-01-27 KWS Major changes in 2025. We will no longer receive the originating request as part of the response.
-            #                The only reason we parse it was to tie up the TNS name with ATLAS or Pan-STARRS internal name.
-            #                In the new regime, we will get an "internal_ids" key made up of the user defined key value pairs
-            #                we sent in our request.
-            request, response = getBulkReportReply(r['tns_report_id'], tnsBaseURL, tnsApiKey, botId = botId, botName = botName)
-            if request is None:
-                # We have now reverted to placing internal_ids data into the response
-                pass
-            else:    
-                logger.debug("ORIGINAL REQUEST is BELOW")
-                logger.debug(json.dumps(request, indent=4, sort_keys=True))
-
-            logger.debug("RESPONSE is BELOW")
-            logger.debug(json.dumps(response, indent=4, sort_keys=True))
-
-            # 2025-01-29 KWS New code to deal with the new internal_ids.
-
-            if request is None and response is not None:
-                # We have some kind of response back from the TNS, which no longer includes the original request.
-                if type(response) is list:
-                    for row in response:
+
+    # 2025-01-27 KWS Major changes in 2025. We will no longer receive the originating request as part of the response.
+    #                The only reason we parse it was to tie up the TNS name with ATLAS or Pan-STARRS internal name.
+    #                In the new regime, we will get an "internal_ids" key made up of the user defined key value pairs
+    #                we sent in our request.
+    if request is None:
+        # We have now reverted to placing internal_ids data into the response
+        pass
+    else:    
+        logger.debug("ORIGINAL REQUEST is BELOW")
+        logger.debug(json.dumps(request, indent=4, sort_keys=True))
+
+    logger.debug("RESPONSE is BELOW")
+    logger.debug(json.dumps(response, indent=4, sort_keys=True))
+
+    # 2025-01-29 KWS New code to deal with the new internal_ids.
+
+    if request is None and response is not None:
+        # We have some kind of response back from the TNS, which no longer includes the original request.
+        if type(response) is list:
+            for row in response:
+                try:
+                    names.append({'objname': row['100']['objname'],
+                                  'internal_name': row['internal_ids']['internal_name'],
+                                  'internal_id': row['internal_ids']['internal_objid'],
+                                  'exists': False, 'report_id': reportId})
+                except KeyError as e:
+                    if '100' in str(e):
                         try:
-                            names.append({'objname': row['100']['objname'],
+                            names.append({'objname': row['101']['objname'],
                                           'internal_name': row['internal_ids']['internal_name'],
                                           'internal_id': row['internal_ids']['internal_objid'],
-                                          'exists': False, 'report_id': r['tns_report_id']})
+                                          'exists': True, 'report_id': reportId})
                         except KeyError as e:
-                            if '100' in str(e):
-                                try:
-                                    names.append({'objname': row['101']['objname'],
-                                                  'internal_name': row['internal_ids']['internal_name'],
-                                                  'internal_id': row['internal_ids']['internal_objid'],
-                                                  'exists': True, 'report_id': r['tns_report_id']})
-                                except KeyError as e:
-                                    logger.error("One of the relevant keys (%s) is missing." % str(e))
-
-            elif request is not None and response is not None:
-                # We got our old request, so read the data the old way.
-                if type(request) is list and type(response) is list and len(response) == len(request):
-                    # Process the data as a list. Could be one or more objects.
-                    for i in range(len(response)):
+                            logger.error("One of the relevant keys (%s) is missing." % str(e))
+
+    elif request is not None and response is not None:
+        # We got our old request, so read the data the old way.
+        if type(request) is list and type(response) is list and len(response) == len(request):
+            # Process the data as a list. Could be one or more objects.
+            for i in range(len(response)):
+                try:
+                    names.append({'objname': response[i]['100']['objname'],
+                                  'internal_name': request[i]['internal_name'],
+                                  'exists': False, 'report_id': reportId})
+                except KeyError as e:
+                    if '100' in str(e):
                         try:
-                            names.append({'objname': response[i]['100']['objname'],
+                            names.append({'objname': response[i]['101']['objname'],
                                           'internal_name': request[i]['internal_name'],
-                                          'exists': False, 'report_id': r['tns_report_id']})
+                                          'exists': True, 'report_id': reportId})
                         except KeyError as e:
-                            if '100' in str(e):
-                                try:
-                                    names.append({'objname': response[i]['101']['objname'],
-                                                  'internal_name': request[i]['internal_name'],
-                                                  'exists': True, 'report_id': r['tns_report_id']})
-                                except KeyError as e:
-                                    logger.error("Cannot find the relevant message. Must be 100 or 101. Got %s." % str(e))
-
-                elif type(request) is dict and type(response) is dict and len(list(request.keys())) == len(list(response.keys())):
-                    for k, v in request.items():
+                            logger.error("Cannot find the relevant message. Must be 100 or 101. Got %s." % str(e))
+
+        elif type(request) is dict and type(response) is dict and len(list(request.keys())) == len(list(response.keys())):
+            for k, v in request.items():
+                try:
+                    names.append({'objname': response[k]['100']['objname'],
+                                  'internal_name': request[k]['internal_name'],
+                                  'exists': False, 'report_id': reportId})
+                except KeyError as e:
+                    if '100' in str(e):
+                        # The object already exists, so append the existing name
                         try:
-                            names.append({'objname': response[k]['100']['objname'],
+                            names.append({'objname': response[k]['101']['objname'],
                                           'internal_name': request[k]['internal_name'],
-                                          'exists': False, 'report_id': r['tns_report_id']})
+                                          'exists': True, 'report_id': reportId})
                         except KeyError as e:
-                            if '100' in str(e):
-                                # The object already exists, so append the existing name
-                                try:
-                                    names.append({'objname': response[k]['101']['objname'],
-                                                  'internal_name': request[k]['internal_name'],
-                                                  'exists': True, 'report_id': r['tns_report_id']})
-                                except KeyError as e:
-                                    logger.error("Cannot find the relevant message. Must be 100 or 101. Got %s." % str(e))
-                                    #names = []
-                            else:
-                                logger.error("Cannot find the relevant message. Must be 100 or 101.")
-                                #names = []
-                else:
-                    logger.error("Request or Response missing! The report may have expired.")
-            else:
-                logger.error("Unexpected request/response combination.")
+                            logger.error("Cannot find the relevant message. Must be 100 or 101. Got %s." % str(e))
+                            #names = []
+                    else:
+                        logger.error("Cannot find the relevant message. Must be 100 or 101.")
+                        #names = []
+        else:
+            logger.error("Request or Response missing! The report may have expired.")
+    else:
+        logger.error("Unexpected request/response combination.")
+
+    return names
+
+
+def getReportReplyCacheFile(cacheDirectory, reportId, tnsBaseURL):
+    # Report IDs are only unique per TNS instance (e.g. sandbox and live), so the key includes the URL.
+    return os.path.join(cacheDirectory, 'tns_report_reply_%s_%s.json' % (hashlib.md5(tnsBaseURL.encode('utf-8')).hexdigest()[:12], str(reportId)))
+
+
+def pruneReportReplyCache(cacheDirectory, maxAge = TNS_REPLY_CACHE_MAX_AGE):
+    """
+    Delete cached report replies (and any abandoned temporary files) older than maxAge seconds.
+
+    :param cacheDirectory: the reply cache
+    :param maxAge: in seconds  (Default value = TNS_REPLY_CACHE_MAX_AGE)
+    :return: number of files deleted
+
+    """
+    deleted = 0
+    oldest = time.time() - maxAge
+    try:
+        filenames = os.listdir(cacheDirectory)
+    except OSError:
+        return deleted
+
+    for filename in filenames:
+        if not filename.startswith('tns_report_reply_'):
+            continue
+        path = os.path.join(cacheDirectory, filename)
+        try:
+            if os.path.getmtime(path) < oldest:
+                os.remove(path)
+                deleted += 1
+        except OSError:
+            # Deleted by another process, or not ours to delete.
+            pass
+    return deleted
+
+
+def getCachedReportReply(reportId, tnsBaseURL, tnsApiKey, botId = None, botName = None, retries = 3, cacheDirectory = TNS_REPLY_CACHE):
+    """
+    Get the TNS reply to a bulk report, backing off and retrying if the request fails.
+    A clean "not ready yet" reply (no response) is returned straight away. If the TNS
+    rate limits us (429) or is unavailable (5xx), every poller holds off for the
+    Retry-After time (or the backoff time if there isn't one).
+    Complete replies are cached locally, so a report that we have already seen (e.g. if the
+    database update failed last time) is not requested from the TNS again until the cached
+    reply expires.
+
+    :param reportId: TNS report ID
+    :param tnsBaseURL: TNS base URL
+    :param tnsApiKey: TNS API Key
+    :param retries: number of attempts  (Default value = 3)
+    :param cacheDirectory: where to cache the complete replies. None = don't cache.
+    :return request: The original request
+    :return response: The TNS response
+
+    """
+    cacheFile = None
+    if cacheDirectory is not None:
+        cacheFile = getReportReplyCacheFile(cacheDirectory, reportId, tnsBaseURL)
+        try:
+            with open(cacheFile) as f:
+                reply = json.load(f)
+            return reply['request'], reply['response']
+        except (IOError, ValueError, KeyError):
+            pass
+
+    request = None
+    response = None
+    for attempt in range(max(int(retries), 1)):
+        if attempt > 0:
+            time.sleep(min(2 ** attempt, 30))
+        waitForTNS()
+        try:
+            request, response = getBulkReportReply(reportId, tnsBaseURL, tnsApiKey, botId = botId, botName = botName)
+        except TNSUnavailableError as e:
+            delay = min(e.retryAfter, TNS_MAX_RETRY_AFTER) if e.retryAfter is not None else min(2 ** (attempt + 1), 30)
+            logger.error("Report %s: attempt %d of %d failed: %s Holding off for %.0f seconds." % (str(reportId), attempt + 1, retries, str(e), delay))
+            holdOffTNS(delay)
+            continue
+        except requests.exceptions.RequestException as e:
+            logger.error("Report %s: attempt %d of %d failed: %s" % (str(reportId), attempt + 1, retries, str(e)))
+            continue
+        break
+
+    if response is not None and cacheFile is not None:
+        # Write to a temporary file and rename, so concurrent readers never see a partial reply.
+        try:
+            os.makedirs(cacheDirectory, exist_ok = True)
+            tmpFile = '%s.%d.%d' % (cacheFile, os.getpid(), threading.get_ident())
+            with open(tmpFile, 'w') as f:
+                json.dump({'request': request, 'response': response}, f)
+            os.replace(tmpFile, cacheFile)
+        except (IOError, OSError) as e:
+            logger.error("Unable to cache the reply for report %s: %s" % (str(reportId), str(e)))
+
+    return request, response
+
+
+def getSubmissionReports(conn, tnsBaseURL, tnsApiKey, botId = None, botName = None, threads = 8, retries = 3, cacheDirectory = TNS_REPLY_CACHE):
+    """
+    Get all the reports back from the TNS that have not yet been
+    processed and return a list of tns names with internal names
+    and whether or not the object exists on the nameserver.
+
+    :param conn: database connection
+    :param tnsBaseURL: TNS base URL
+    :param tnsApiKey: TNS API Key
+    :param threads: number of concurrent requests to the TNS  (Default value = 8)
+    :param retries: number of attempts per report  (Default value = 3)
+    :param cacheDirectory: where to cache the complete replies. None = don't cache.
+    :return names: dict containing internal name, tns name, bool exists, tns report id
+
+    """
+
+    names = []
+    if cacheDirectory is not None:
+        pruneReportReplyCache(cacheDirectory)
+
+    tnsRequests = tnsGetRequestList(conn, SUBMITTED)
+    if tnsRequests:
+        # 2026-10-19 KWS Poll the TNS for all outstanding replies concurrently.
+        reportIds = [r['tns_report_id'] for r in tnsRequests]
+        with ThreadPoolExecutor(max_workers = max(min(int(threads), len(reportIds)), 1)) as executor:
+            replies = list(executor.map(lambda reportId: getCachedReportReply(reportId, tnsBaseURL, tnsApiKey, botId = botId, botName = botName, retries = retries, cacheDirectory = cacheDirectory), reportIds))
+
+        for reportId, (request, response) in zip(reportIds, replies):
+            names += parseReportReply(reportId, request, response)
 
     else:
         print("No reports to process.")
 
     return names
+
+
+def tnsApplyNames(conn, tnsNames, updateQuery, status = None):
+    """
+    Assign the TNS names to the new objects and (optionally) set the status of all the
+    TNS requests involved, in ONE transaction.
+
+    :param conn: database connection
+    :param tnsNames: list of dicts of tns names and internal names for association
+    :param updateQuery: update query with two parameters - the TNS name and the internal name
+    :param status: new status of the requests. None = don't update.
+    :return reports: the list of TNS report IDs processed
+
+    """
+    import MySQLdb
+
+    reports = []
+    updates = []
+
+    for name in tnsNames:
+        if name['exists']:
+            logger.info('The name %s (%s) already exists on the nameserver.' % (name['objname'], name['internal_name']))
+
+        tnsName = name['objname']
+        if tnsName[0:2] == 'AT' or tnsName[0:2] == 'SN':
+            # Strip the prefix
+            tnsName = tnsName[2:]
+
+        # For the time being ONLY update the other_designation if the object is NEW.
+        if not name['exists']:
+            updates.append((tnsName, name['internal_name']))
+
+        reports.append(name['report_id'])
+
+    try:
+        cursor = conn.cursor (MySQLdb.cursors.DictCursor)
+        cursor.execute("start transaction")
+
+        if updates:
+            cursor.executemany(updateQuery, updates)
+
+        uniqueReports = sorted(set(reports))
+        if status is not None and uniqueReports:
+            cursor.execute ("""
+                  update tcs_tns_requests
+                  set status = %s,
+                  updated = now()
+                  where tns_report_id in (""" + ','.join(['%s'] * len(uniqueReports)) + """)
+                  """, tuple([status] + uniqueReports))
+
+        conn.commit()
+        cursor.close()
+
+    except MySQLdb.Error as e:
+        sys.stderr.write("Error %d: %s\n" % (e.args[0], e.args[1]))
+        conn.rollback()
+        reports = []
+
+    return reports
@@ -32,12 +32,8 @@ import numpy as np
 # 2024-06-24 KWS Use the st3ph3n API code to write the results.
 from atlasapiclient import client as atlasapiclient
 from atlasvras.utils.misc import fetch_vra_dataframe
+from vraUtils import insertVRAEntry, runObjectWrites
 
-def insertVRAEntry(API_CONFIG_FILE, objectId, pReal, pGal, rank, debug = False):
-    payload = {'objectid': objectId, 'preal': pReal, 'pgal': pGal, 'rank': rank, 'debug': debug}
-    writeto_vra = atlasapiclient.WriteToVRAScores(api_config_file = API_CONFIG_FILE, payload=payload)
-    writeto_vra.get_response()
-    
     
 def get_vra_eyeball():
     todo_list = atlasapiclient.RequestVRAToDoList(payload = {'datethreshold': "2024-02-22"}, get_response=True)
@@ -98,8 +94,8 @@ def main():
     delete_df.to_csv(outputFile, header=False, index=False)
     
     # add a row in the vra scores table to record the deletion
-    for atlas_id in list_to_delete:
-        insertVRAEntry(configFile, atlas_id, None, None, -1, debug = debug)
+    # 2026-10-19 KWS Write the rows concurrently.
+    runObjectWrites({atlas_id: [(insertVRAEntry, (configFile, atlas_id, None, None, -1), {'debug': debug})] for atlas_id in list_to_delete})
         
 if __name__ == '__main__':
     main()
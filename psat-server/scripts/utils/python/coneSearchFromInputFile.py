@@ -2,14 +2,14 @@
 """Do a cone search for a catalogue of a csv file full of objectid, ra, dec. Return objectid, ra, dec, attributes
 
 Usage:
-  %s <configfile> <filename> <tablename> [<attributes>...] [--delimiter=<delimiter>]  [--matchradius=<matchradius>] [--outputfile=<outputFile>] [--nprocesses=<nprocesses>] [--loglocation=<loglocation>] [--logprefix=<logprefix>] [--namecolumn=<namecolumn>] [--racolumn=<racolumn>] [--deccolumn=<deccolumn>]
+  %s <configfile> <filename> <tablename> [<attributes>...] [--delimiter=<delimiter>]  [--matchradius=<matchradius>] [--outputfile=<outputFile>] [--nprocesses=<nprocesses>] [--loglocation=<loglocation>] [--logprefix=<logprefix>] [--namecolumn=<namecolumn>] [--racolumn=<racolumn>] [--deccolumn=<deccolumn>] [--stream] [--chunksize=<chunksize>] [--checkpointfile=<checkpointfile>]
   %s (-h | --help)
   %s --version
 
 Options:
   -h --help                      Show this screen.
   --version                      Show version.
-  --delimiter=<delimiter>        Delimiter [default: ,]
+  --delimiter=<delimiter>        Input file delimiter, used in both modes. Use tab for a tab [default: tab]
   --matchradius=<matchradius>    Match radius [default: 2.0]
   --outputfile=<outputFile>      Output filename [default: /tmp/xmresults.csv]
   --nprocesses=<nprocesses>      Number of processes to use [default: 1].
@@ -18,13 +18,17 @@ Options:
   --namecolumn=<namecolumn>      Column representing name [default: atlas_object_id]
   --racolumn=<racolumn>          Column representing RA [default: ra]
   --deccolumn=<deccolumn>        Column representing Declination [default: dec]
+  --stream                       Stream the input file in chunks through a pool of workers, writing results in input order as they complete. Resumable.
+  --chunksize=<chunksize>        Number of input rows per chunk in streaming mode [default: 10000].
+  --checkpointfile=<checkpointfile>  Checkpoint file for streaming mode. Defaults to the output filename + .checkpoint
 
   Example:
     %s ../../../../config/config_readonly.yaml objects.csv tcs_cat_tns tns_name type
+    %s ../../../../config/config_readonly.yaml objects.csv tcs_cat_tns tns_name type --stream --nprocesses=16
 """
 # 2019-09-03 KWS Make python 3 compatible
 import sys
-__doc__ = __doc__ % (sys.argv[0], sys.argv[0], sys.argv[0], sys.argv[0])
+__doc__ = __doc__ % (sys.argv[0], sys.argv[0], sys.argv[0], sys.argv[0], sys.argv[0])
 from docopt import docopt
 import os, MySQLdb, shutil, re
 from gkutils.commonutils import find, Struct, cleanOptions, dbConnect, coneSearchHTM, QUICK, FULL, splitList, parallelProcess, readGenericDataFile
@@ -32,6 +36,9 @@ import MySQLdb
 import numpy as np
 import csv
 import datetime
+import json
+import multiprocessing
+from collections import deque
 
 # ******** This code should be moved to a COMMON area ********
 
@@ -88,6 +95,146 @@ def worker(num, db, objectListFragment, dateAndTime, firstPass, miscParameters,
 
 
 
+# 2026-10-19 KWS Streaming mode. The input file is read in chunks, which are fed to a pool of
+#                workers that each keep their own database connection open. Results are
+#                written in input order as soon as each chunk completes and a checkpoint is
+#                written after every chunk, so memory stays bounded by (nprocesses x 2)
+#                chunks and an interrupted run can be resumed.
+
+_streamConn = None
+_streamOptions = None
+
+def streamWorkerInitialiser(db, options):
+    """Open one database connection per pool worker."""
+    global _streamConn, _streamOptions
+    _streamOptions = options
+    _streamConn = dbConnect(db['hostname'], db['username'], db['password'], db['database'], quitOnError = True)
+    _streamConn.autocommit(True)
+
+
+def crossmatchChunk(chunk):
+    """Cone search a chunk of rows on this worker's connection."""
+    chunkNumber, rows = chunk
+    return chunkNumber, crossmatchObjects(_streamConn, _streamOptions, rows, matchRadius = float(_streamOptions.matchradius))
+
+
+def readCheckpoint(checkpointFile):
+    checkpoint = None
+    if os.path.exists(checkpointFile):
+        with open(checkpointFile) as f:
+            checkpoint = json.load(f)
+    return checkpoint
+
+
+def writeCheckpoint(checkpointFile, checkpoint):
+    """Write the checkpoint atomically."""
+    tmpFile = checkpointFile + '.tmp'
+    with open(tmpFile, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmpFile, checkpointFile)
+
+
+def readHeader(inputFile, delimiter):
+    """Read the column names the same way readGenericDataFile does (so both modes accept the
+       same files): ignore a leading '#' and whitespace around the names."""
+    header = inputFile.readline().strip().lstrip('#')
+    if delimiter == ' ':
+        return header.split()
+    return [name.strip() for name in header.split(delimiter)]
+
+
+def readChunks(reader, chunkSize, skipRows = 0):
+    """Yield (chunkNumber, rows) from a csv reader, skipping rows already done."""
+    for i in range(skipRows):
+        if next(reader, None) is None:
+            return
+    chunkNumber = 0
+    chunk = []
+    for row in reader:
+        chunk.append(row)
+        if len(chunk) == chunkSize:
+            yield chunkNumber, chunk
+            chunkNumber += 1
+            chunk = []
+    if chunk:
+        yield chunkNumber, chunk
+
+
+def streamCrossmatch(db, options, outputFile):
+    """Crossmatch the input file in streaming mode, resuming from the checkpoint if present."""
+
+    chunkSize = int(options.chunksize)
+    nProcesses = max(int(options.nprocesses), 1)
+    checkpointFile = options.checkpointfile if options.checkpointfile else outputFile + '.checkpoint'
+
+    checkpoint = readCheckpoint(checkpointFile)
+    if checkpoint is None:
+        checkpoint = {'inputfile': os.path.abspath(options.filename), 'rowsRead': 0, 'rowsWritten': 0, 'outputBytes': 0}
+    elif checkpoint['inputfile'] != os.path.abspath(options.filename):
+        sys.exit("Checkpoint file %s belongs to a different input file (%s)." % (checkpointFile, checkpoint['inputfile']))
+    elif checkpoint['outputBytes'] > 0 and (not os.path.exists(outputFile) or os.path.getsize(outputFile) < checkpoint['outputBytes']):
+        # We can't resume if the output written so far has gone. Start again.
+        print("Output file %s is missing or shorter than the checkpoint says. Starting from the beginning." % outputFile)
+        checkpoint.update({'rowsRead': 0, 'rowsWritten': 0, 'outputBytes': 0})
+    else:
+        print("Resuming from row %d." % checkpoint['rowsRead'])
+
+    with open(options.filename, newline = '') as inputFile:
+        inputFieldnames = readHeader(inputFile, options.delimiter)
+        reader = csv.DictReader(inputFile, fieldnames = inputFieldnames, delimiter = options.delimiter, skipinitialspace = True)
+        fieldnames = inputFieldnames + ['separation'] + [a for a in options.attributes if a not in inputFieldnames]
+
+        # Open for update rather than append so that any output written after the
+        # last checkpoint can be thrown away.
+        mode = 'r+' if checkpoint['outputBytes'] > 0 else 'w'
+        with open(outputFile, mode, newline = '') as f:
+            f.seek(checkpoint['outputBytes'])
+            f.truncate()
+            w = csv.DictWriter(f, fieldnames, delimiter = ',')
+            if checkpoint['outputBytes'] == 0:
+                w.writeheader()
+
+            chunks = readChunks(reader, chunkSize, skipRows = checkpoint['rowsRead'])
+
+            pool = multiprocessing.Pool(nProcesses, initializer = streamWorkerInitialiser, initargs = (db, options))
+            try:
+                pending = deque()
+                exhausted = False
+                while True:
+                    # Keep at most two chunks per worker in flight.
+                    while not exhausted and len(pending) < 2 * nProcesses:
+                        chunk = next(chunks, None)
+                        if chunk is None:
+                            exhausted = True
+                            break
+                        pending.append((len(chunk[1]), pool.apply_async(crossmatchChunk, (chunk,))))
+
+                    if not pending:
+                        break
+
+                    # Write the results strictly in input order.
+                    nRows, result = pending.popleft()
+                    chunkNumber, objects = result.get()
+                    for row in objects:
+                        w.writerow(row)
+                    f.flush()
+
+                    checkpoint['rowsRead'] += nRows
+                    checkpoint['rowsWritten'] += len(objects)
+                    checkpoint['outputBytes'] = f.tell()
+                    writeCheckpoint(checkpointFile, checkpoint)
+
+                    print("%s Done %d rows (%d matches)" % (datetime.datetime.now().strftime("%Y:%m:%d:%H:%M:%S"), checkpoint['rowsRead'], checkpoint['rowsWritten']))
+            finally:
+                pool.terminate()
+                pool.join()
+
+    # We're done. The checkpoint is no longer needed.
+    os.remove(checkpointFile)
+
+    return checkpoint['rowsWritten']
+
+
 def main(argv = None):
     opts = docopt(__doc__, version='0.1')
     opts = cleanOptions(opts)
@@ -114,8 +261,6 @@ def main(argv = None):
     (year, month, day, hour, min, sec) = currentDate.split(':')
     dateAndTime = "%s%s%s_%s%s%s" % (year, month, day, hour, min, sec)
 
-    data = readGenericDataFile(options.filename, delimiter='\t')
-
     if options.outputfile is not None:
         prefix = options.outputfile.split('.')[0]
         suffix = options.outputfile.split('.')[-1]
@@ -126,6 +271,18 @@ def main(argv = None):
         if suffix:
             suffix = '.' + suffix
 
+    # 2026-10-19 KWS The non-streaming read always used tabs, whatever --delimiter said.
+    #                Both modes now use --delimiter, which defaults to tab.
+    if options.delimiter in ('tab', '\\t'):
+        options.delimiter = '\t'
+
+    if options.stream:
+        rowsWritten = streamCrossmatch(db, options, '%s%s' % (prefix, suffix))
+        print("%d matched rows written." % rowsWritten)
+        return
+
+    data = readGenericDataFile(options.filename, delimiter=options.delimiter)
+
     if len(data) == 1 or int(options.nprocesses) == 1:
         # Do it single threaded
         conn = dbConnect(hostname, username, password, database, quitOnError = True)
@@ -2,7 +2,7 @@
 """Crossmatch GW events using Dave's skytag code.
 
 Usage:
-  %s <configFile> <survey> [<candidate>...] [--listid=<listid>] [--customlist=<customlist>] [--datethreshold=<datethreshold>] [--timedeltas] [--distances] [--mapiteration=<mapiteration>] [--event=<event>] [--gwEventMap=<gwEventMap>] [--areaThreshold=<areaThreshold>] [--areaContour=<areaContour>] [--distanceThreshold=<distanceThreshold>] [--far=<far>] [--mapRootLocation=<mapRootLocation>] [--daysBeforeEvent=<daysBeforeEvent>] [--daysAfterEvent=<daysAfterEvent>] [--update]
+  %s <configFile> <survey> [<candidate>...] [--listid=<listid>] [--customlist=<customlist>] [--datethreshold=<datethreshold>] [--timedeltas] [--distances] [--mapiteration=<mapiteration>] [--event=<event>] [--gwEventMap=<gwEventMap>] [--areaThreshold=<areaThreshold>] [--areaContour=<areaContour>] [--distanceThreshold=<distanceThreshold>] [--far=<far>] [--mapRootLocation=<mapRootLocation>] [--daysBeforeEvent=<daysBeforeEvent>] [--daysAfterEvent=<daysAfterEvent>] [--skymapCacheLocation=<skymapCacheLocation>] [--update]
   %s (-h | --help)
   %s --version
 
@@ -26,6 +26,7 @@ Options:
   --daysBeforeEvent=<daysBeforeEvent>      Days before the event to trigger search [default: 10].
   --daysAfterEvent=<daysAfterEvent>        Days after the event to trigger search [default: 21].
   --far=<far>                              False alarm rate (e.g. 1 in 6 months) [default: 0.00000006337747701362287].
+  --skymapCacheLocation=<skymapCacheLocation>  Location of the precomputed sky map cache [default: /tmp/gw_skymap_cache].
   --update                                 Update the database.
 
 
@@ -48,6 +49,7 @@ from pstamp_utils import getObjectsByList as getPSObjectsByList
 from pstamp_utils import getObjectsByCustomList as getPSObjectsByCustomList
 
 from skytag.commonutils import prob_at_location
+from gwSkymapCache import getSkymap, probAtLocations
 import glob
 from math import isinf
 
@@ -284,12 +286,20 @@ def crossmatchGWEvents(conn, options, event):
             ras.append(candidate['ra'])
             decs.append(candidate['dec'])
 
-    probs = prob_at_location(
-        ra=ras,
-        dec=decs,
-        mjd=mjds,
-        mapPath=event['map'],
-        distance = requestDistance)
+    # 2026-10-19 KWS Use the cached, memory-mapped version of the map if we can. The map is
+    #                only read and processed the first time we see a new map file (or mtime).
+    #                Fall back to skytag if it's not a multi-order map.
+    skymap = getSkymap(event['map'], cacheLocation = options.skymapCacheLocation)
+
+    if skymap is not None:
+        probs = probAtLocations(skymap, ras, decs, mjds = mjds, distance = requestDistance)
+    else:
+        probs = prob_at_location(
+            ra=ras,
+            dec=decs,
+            mjd=mjds,
+            mapPath=event['map'],
+            distance = requestDistance)
 
     # prob_at_location returns a simple list if timedeltas not requested, otherwise a list of lists.
     # Create a consistent two element array which contains None if timedeltas not requested.
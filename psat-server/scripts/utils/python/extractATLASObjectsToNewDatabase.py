@@ -23,7 +23,7 @@ Assumes:
   2. The databases are in the SAME MySQL server instance.
 
 Usage:
-  %s <username> <password> <database> <hostname> <sourceschema> [<candidates>...] [--truncate] [--ddc] [--list=<listid>] [--flagdate=<flagdate>] [--copyimages] [--dumpfile=<dumpfile>] [--nocreateinfo] [--djangofile=<djangofile>] [--imagessource=<imagessource>] [--imagesdest=<imagesdest>] [--createtarcommand]
+  %s <username> <password> <database> <hostname> <sourceschema> [<candidates>...] [--truncate] [--ddc] [--list=<listid>] [--flagdate=<flagdate>] [--copyimages] [--dumpfile=<dumpfile>] [--nocreateinfo] [--djangofile=<djangofile>] [--imagessource=<imagessource>] [--imagesdest=<imagesdest>] [--createtarcommand] [--setbased] [--chunksize=<chunksize>] [--imagethreads=<imagethreads>]
   %s (-h | --help)
   %s --version
 
@@ -41,13 +41,17 @@ Options:
   --djangofile=<djangofile>      Filename of dumped Django data [default: /home/atls/django_schema.sql].
   --imagessource=<imagessource>  Source root location of the images [default: /db4/images/].
   --imagesdest=<imagesdest>      Destination location for extracted images [default: /db4/images/].
+  --setbased                     Migrate all the objects together with one insert per table per chunk, rather than object by object.
+  --chunksize=<chunksize>        Number of objects per insert in set-based mode [default: 1000].
+  --imagethreads=<imagethreads>  Number of parallel image copiers in set-based mode [default: 8].
 
 E.g.:
   %s publicuser publicpass public db1 atlas4 --ddc --list=5 --copyimages
+  %s publicuser publicpass public db1 atlas4 --ddc --list=5 --copyimages --setbased
   %s atlas4_extracteduser xxxxxxxxxxxxxx atlas4_extracted db5 atlas4 1111822090325015200 --copyimages --nocreateinfo --dumpfile=/home/atls/atlas4/atlas4_extracted.sql --djangofile=/home/atls/atlas4/atlas4_extracted_django.sql --imagessource=/db5/images/ --imagesdest=/db5/images/ --ddc 
 """
 import sys
-__doc__ = __doc__ % (sys.argv[0], sys.argv[0], sys.argv[0], sys.argv[0], sys.argv[0])
+__doc__ = __doc__ % (sys.argv[0], sys.argv[0], sys.argv[0], sys.argv[0], sys.argv[0], sys.argv[0])
 from docopt import docopt
 import os, MySQLdb, shutil, re
 from gkutils.commonutils import dbConnect, find, Struct, cleanOptions
@@ -61,6 +65,41 @@ COMPILED_FIELD_REGEX = re.compile(FIELD_REGEX)
 SKYCELL_REGEX = 'skycell\.([0-9]+(\.[0-9]+){0,1})(\.[S|W]S){0,1}\.dif\.'
 COMPILED_SKYCELL_REGEX = re.compile(SKYCELL_REGEX)
 
+# 2026-10-19 KWS The per-object tables to be migrated and the column that holds the object ID.
+#                Used by both the object-at-a-time and the set-based migration.
+# 2017-05-10 KWS Added the new tcs_object_comments table
+# 2024-03-04 KWS Added the new tcs_vra_scores table
+# 2024-07-30 KWS Added tcs_vra_rank and tcs_vra_todo tables
+OBJECT_TABLES = [('tcs_transient_objects', 'id'),
+                 ('tcs_transient_reobservations', 'transient_object_id'),
+                 ('atlas_diff_objects', 'id'),
+                 ('atlas_detectionsddc', 'atlas_object_id'),
+                 ('atlas_diff_detections', 'atlas_object_id'),
+                 ('atlas_forced_photometry', 'atlas_object_id'),
+                 ('atlas_stacked_forced_photometry', 'atlas_object_id'),
+                 ('tcs_cross_matches', 'transient_object_id'),
+                 ('tcs_latest_object_stats', 'id'),
+                 ('tcs_cross_matches_external', 'transient_object_id'),
+                 ('tcs_object_comments', 'transient_object_id'),
+                 ('sherlock_classifications', 'transient_object_id'),
+                 ('sherlock_crossmatches', 'transient_object_id'),
+                 ('tcs_object_groups', 'transient_object_id'),
+                 ('tcs_gravity_event_annotations', 'transient_object_id'),
+                 ('tcs_zooniverse_scores', 'transient_object_id'),
+                 ('tcs_forced_photometry', 'transient_object_id'),
+                 ('tcs_vra_scores', 'transient_object_id'),
+                 ('tcs_vra_todo', 'transient_object_id'),
+                 ('tcs_vra_rank', 'transient_object_id'),
+                 ('atlas_detectionsnnc', 'atlas_object_id')]
+
+# Tables where the object ID is the prefix of a name column.
+OBJECT_NAME_TABLES = [('tcs_image_groups', 'name'),
+                      ('tcs_postage_stamp_images', 'image_filename'),
+                      ('tcs_images', 'target')]
+
+# Name of the (connection specific) temporary table of objects to be migrated.
+MIGRATION_OBJECTS_TABLE = 'tmp_migration_objects'
+
 class EmptyRecurreces:
     pass
 
@@ -387,11 +426,12 @@ def getObjectCMFFiles(conn, field, skycells, schemaName):
 
 
 
-def getSpecifiedObjects(conn, objectIds):
+def getSpecifiedObjects(conn, objectIds, chunkSize = 1000):
     """
 
     :param conn: database connection
     :param objectIds: 
+    :param chunkSize: number of objects per query
     :return resultSet: The tuple of object dicts
 
     """
@@ -399,21 +439,24 @@ def getSpecifiedObjects(conn, objectIds):
 
     try:
         cursor = conn.cursor(MySQLdb.cursors.DictCursor)
-        objectList = []
-        for id in objectIds:
+        objects = {}
+        # 2026-10-19 KWS Fetch the objects in chunks rather than one at a time.
+        for i in range(0, len(objectIds), chunkSize):
+            chunk = objectIds[i:i + chunkSize]
             cursor.execute ("""
                 select id, ra, `dec`, followup_flag_date, atlas_designation
                 from atlas_diff_objects
-                where id = %s
-            """ , (id,))
-
-            resultSet = cursor.fetchone ()
+                where id in (""" + ','.join(['%s'] * len(chunk)) + """)
+            """ , tuple(chunk))
 
-            if resultSet is not None and len(resultSet) > 0:
-                objectList.append(resultSet)
+            for row in cursor.fetchall ():
+                objects[row['id']] = row
 
         cursor.close ()
 
+        # Preserve the order in which the objects were specified.
+        objectList = [objects[id] for id in objectIds if id in objects]
+
     except MySQLdb.Error as e:
         sys.stderr.write("Error %d: %s\n" % (e.args[0], e.args[1]))
         sys.exit (1)
@@ -421,11 +464,12 @@ def getSpecifiedObjects(conn, objectIds):
     return objectList
 
 
-def getSpecifiedObjectsPanSTARRS(conn, objectIds):
+def getSpecifiedObjectsPanSTARRS(conn, objectIds, chunkSize = 1000):
     """
 
     :param conn: database connection
     :param objectIds: 
+    :param chunkSize: number of objects per query
     :return resultSet: The tuple of object dicts
 
     """
@@ -433,21 +477,24 @@ def getSpecifiedObjectsPanSTARRS(conn, objectIds):
 
     try:
         cursor = conn.cursor(MySQLdb.cursors.DictCursor)
-        objectList = []
-        for id in objectIds:
+        objects = {}
+        # 2026-10-19 KWS Fetch the objects in chunks rather than one at a time.
+        for i in range(0, len(objectIds), chunkSize):
+            chunk = objectIds[i:i + chunkSize]
             cursor.execute ("""
                 select id, ra_psf as ra, dec_psf as `dec`, followup_flag_date, ps1_designation
                 from tcs_transient_objects
-                where id = %s
-            """ , (id,))
-
-            resultSet = cursor.fetchone ()
+                where id in (""" + ','.join(['%s'] * len(chunk)) + """)
+            """ , tuple(chunk))
 
-            if resultSet is not None and len(resultSet) > 0:
-                objectList.append(resultSet)
+            for row in cursor.fetchall ():
+                objects[row['id']] = row
 
         cursor.close ()
 
+        # Preserve the order in which the objects were specified.
+        objectList = [objects[id] for id in objectIds if id in objects]
+
     except MySQLdb.Error as e:
         sys.stderr.write("Error %d: %s\n" % (e.args[0], e.args[1]))
         sys.exit (1)
@@ -591,59 +638,66 @@ def removeAllImagesAndLocationMaps(newSchema, imageRootDestination):
 
 
 
-def copyImages(conn, objectId, sourceReadOnlySchema, newSchema, imageRootSource, imageRootDestination, taronly = False):
+def getImagePaths(imageFilename, sourceReadOnlySchema, newSchema, imageRootSource, imageRootDestination):
+    """Return the destination directory and the (source, destination) pairs of the JPEG and FITS files"""
 
-    imageFilenames = getObjectImages(conn, objectId, sourceReadOnlySchema)
-    for filename in imageFilenames:
-        # Copy the files over one by one. Don't worry if they're not there.
+    # 2023-03-06 KWS For South Africa, the MJD of the exposure is usually 1
+    #                night BEFORE the designated night number (since it straddles
+    #                midnight UTC). So if we have exposure name in the file, get
+    #                the MJD from the exposure name. Otherwise get it from the MJD
+    #                embedded in the image_filename (as before).
+    if any([x in imageFilename for x in ['01a', '02a', '03a', '04a', '05r']]):
+        mjd = imageFilename.split('_')[2][3:8]
+    else:
+        # Use the old way to get the MJD - relevant for finding charts.
+        mjd = imageFilename.split('_')[1]
+        mjd = mjd.split('.')[0]
+    imageDestinationDirectoryName = imageRootDestination + newSchema + '/' + mjd
 
-        # 2023-03-06 KWS For South Africa, the MJD of the exposure is usually 1
-        #                night BEFORE the designated night number (since it straddles
-        #                midnight UTC). So if we have exposure name in the file, get
-        #                the MJD from the exposure name. Otherwise get it from the MJD
-        #                embedded in the image_filename (as before).
-        if any([x in filename['image_filename'] for x in ['01a', '02a', '03a', '04a', '05r']]):
-            mjd = filename['image_filename'].split('_')[2][3:8]
-        else:
-            # Use the old way to get the MJD - relevant for finding charts.
-            mjd = filename['image_filename'].split('_')[1]
-            mjd = mjd.split('.')[0]
-        imageDestinationDirectoryName = imageRootDestination + newSchema + '/' + mjd
+    paths = []
+    for extension in ['.jpeg', '.fits']:
+        paths.append((imageRootSource + sourceReadOnlySchema + '/' + mjd + '/' + imageFilename + extension,
+                      imageDestinationDirectoryName + '/' + imageFilename + extension))
 
-        imageSourceFilenameJpeg = imageRootSource + sourceReadOnlySchema + '/' + mjd + '/' + filename['image_filename'] + '.jpeg'
-        imageDestinationFilenameJpeg = imageDestinationDirectoryName + '/' + filename['image_filename'] + '.jpeg'
-        imageSourceFilenameFits = imageRootSource + sourceReadOnlySchema + '/' + mjd + '/' + filename['image_filename'] + '.fits'
-        imageDestinationFilenameFits = imageDestinationDirectoryName + '/' + filename['image_filename'] + '.fits'
+    return imageDestinationDirectoryName, paths
 
 
-        if not taronly:
+def copyImageFile(imageFilename, sourceReadOnlySchema, newSchema, imageRootSource, imageRootDestination, taronly = False):
+    """Copy the JPEG and FITS files for one image. Don't worry if they're not there."""
 
-            if not os.path.exists(imageDestinationDirectoryName):
-                os.makedirs(imageDestinationDirectoryName, exist_ok=True)
+    imageDestinationDirectoryName, paths = getImagePaths(imageFilename, sourceReadOnlySchema, newSchema, imageRootSource, imageRootDestination)
 
-            try:
-                if not os.path.exists(imageDestinationFilenameJpeg):
-                    # Don't need to copy files we already have.
-                    shutil.copy2(imageSourceFilenameJpeg, imageDestinationFilenameJpeg)
-                if not os.path.exists(imageDestinationFilenameFits):
+    if not taronly:
+
+        if not os.path.exists(imageDestinationDirectoryName):
+            os.makedirs(imageDestinationDirectoryName, exist_ok=True)
+
+        try:
+            for source, destination in paths:
+                if not os.path.exists(destination):
                     # Don't need to copy files we already have.
-                    shutil.copy2(imageSourceFilenameFits, imageDestinationFilenameFits)
-            except IOError as e:
-                print(e)
+                    shutil.copy2(source, destination)
+        except IOError as e:
+            print(e)
 
-        else:
-            # Write into the logfile what needs to be copied. We only need the source filename
-            # We will use this to MANUALLY create a TAR file afterwards.
-            print("TAR:", imageSourceFilenameJpeg)
-            print("TAR:", imageSourceFilenameFits)
+    else:
+        # Write into the logfile what needs to be copied. We only need the source filename
+        # We will use this to MANUALLY create a TAR file afterwards.
+        for source, destination in paths:
+            print("TAR:", source)
+
+
+def copyImages(conn, objectId, sourceReadOnlySchema, newSchema, imageRootSource, imageRootDestination, taronly = False):
+
+    imageFilenames = getObjectImages(conn, objectId, sourceReadOnlySchema)
+    for filename in imageFilenames:
+        # Copy the files over one by one. Don't worry if they're not there.
+        copyImageFile(filename['image_filename'], sourceReadOnlySchema, newSchema, imageRootSource, imageRootDestination, taronly = taronly)
 
 
 # 2015-04-24 KWS Occasionally we'd like to publish individual objects or a small sublist
 #                e.g. when we announce a discovery ATel.  Hence allow publishing of the
 #                sublist without trashing the entire database.
-# 2017-05-10 KWS Added the new tcs_object_comments table
-# 2024-03-04 KWS Added the new tcs_vra_scores table
-# 2024-07-30 KWS Added tcs_vra_rank and tcs_vra_todo tables
 def migrateData(conn, connPrivateReadonly, objectList, newSchema, sourceReadOnlySchema, ddc = False, copyimages = False, imageRootSource = None, imageRootDestination = None, getmetadata = False, survey = 'atlas', taronly = False):
 
     # Now add the objects one-at-a time.  The advantage of doing it this way is
@@ -656,34 +710,10 @@ def migrateData(conn, connPrivateReadonly, objectList, newSchema, sourceReadOnly
     for object in objectList:
         detectionIds = []
         print("Migrating object %d (%d of %d)" % (object['id'], counter, listLength))
-        insertRecord(conn, 'tcs_transient_objects', object['id'], 'id', sourceReadOnlySchema, newSchema)
-        insertRecord(conn, 'tcs_transient_reobservations', object['id'], 'transient_object_id', sourceReadOnlySchema, newSchema)
-        insertRecord(conn, 'atlas_diff_objects', object['id'], 'id', sourceReadOnlySchema, newSchema)
-        insertRecord(conn, 'atlas_detectionsddc', object['id'], 'atlas_object_id', sourceReadOnlySchema, newSchema)
-        insertRecord(conn, 'atlas_diff_detections', object['id'], 'atlas_object_id', sourceReadOnlySchema, newSchema)
-        insertRecord(conn, 'atlas_forced_photometry', object['id'], 'atlas_object_id', sourceReadOnlySchema, newSchema)
-        insertRecord(conn, 'atlas_stacked_forced_photometry', object['id'], 'atlas_object_id', sourceReadOnlySchema, newSchema)
-        insertRecord(conn, 'tcs_cross_matches', object['id'], 'transient_object_id', sourceReadOnlySchema, newSchema)
-        insertRecord(conn, 'tcs_latest_object_stats', object['id'], 'id', sourceReadOnlySchema, newSchema)
-        insertRecord(conn, 'tcs_cross_matches_external', object['id'], 'transient_object_id', sourceReadOnlySchema, newSchema)
-        insertRecord(conn, 'tcs_object_comments', object['id'], 'transient_object_id', sourceReadOnlySchema, newSchema)
-        insertRecord(conn, 'sherlock_classifications', object['id'], 'transient_object_id', sourceReadOnlySchema, newSchema)
-        insertRecord(conn, 'sherlock_crossmatches', object['id'], 'transient_object_id', sourceReadOnlySchema, newSchema)
-        insertRecord(conn, 'tcs_object_groups', object['id'], 'transient_object_id', sourceReadOnlySchema, newSchema)
-        insertRecordLike(conn, 'tcs_image_groups', object['id'], 'name', sourceReadOnlySchema, newSchema)
-        insertRecordLike(conn, 'tcs_postage_stamp_images', object['id'], 'image_filename', sourceReadOnlySchema, newSchema)
-        insertRecordLike(conn, 'tcs_images', object['id'], 'target', sourceReadOnlySchema, newSchema)
-        insertRecord(conn, 'tcs_gravity_event_annotations', object['id'], 'transient_object_id', sourceReadOnlySchema, newSchema)
-        insertRecord(conn, 'tcs_zooniverse_scores', object['id'], 'transient_object_id', sourceReadOnlySchema, newSchema)
-        # 2024-03-22 KWS Added tcs_forced_photometry.
-        insertRecord(conn, 'tcs_forced_photometry', object['id'], 'transient_object_id', sourceReadOnlySchema, newSchema)
-        # 2024-03-09 KWS Added tcs_vra_scores.
-        insertRecord(conn, 'tcs_vra_scores', object['id'], 'transient_object_id', sourceReadOnlySchema, newSchema)
-        # 2024-07-30 KWS Added tcs_vra_todo and tcs_vra_rank.
-        insertRecord(conn, 'tcs_vra_todo', object['id'], 'transient_object_id', sourceReadOnlySchema, newSchema)
-        insertRecord(conn, 'tcs_vra_rank', object['id'], 'transient_object_id', sourceReadOnlySchema, newSchema)
-        # 2024-07-30 KWS Added atlas_detectionsnnc.
-        insertRecord(conn, 'atlas_detectionsnnc', object['id'], 'atlas_object_id', sourceReadOnlySchema, newSchema)
+        for tableName, idColumn in OBJECT_TABLES:
+            insertRecord(conn, tableName, object['id'], idColumn, sourceReadOnlySchema, newSchema)
+        for tableName, nameColumn in OBJECT_NAME_TABLES:
+            insertRecordLike(conn, tableName, object['id'], nameColumn, sourceReadOnlySchema, newSchema)
 
         # Create a dummy recurrence so we can reuse existing code.
         # By having a dummy recurrence, we actually return all the exosures containing detections too.
@@ -751,6 +781,167 @@ def migrateData(conn, connPrivateReadonly, objectList, newSchema, sourceReadOnly
 
 
 
+def executeStatement(conn, sql, parameters = None):
+    """Execute a (set-based) statement and return the number of rows affected."""
+
+    rowcount = 0
+    try:
+        cursor = conn.cursor(MySQLdb.cursors.Cursor)
+        cursor.execute(sql, parameters)
+        rowcount = cursor.rowcount
+        cursor.close ()
+
+    except MySQLdb.Error as e:
+        print("Error %d: %s" % (e.args[0], e.args[1]))
+
+    return rowcount
+
+
+def loadMigrationObjects(conn, objectIds, tableName = MIGRATION_OBJECTS_TABLE):
+    """Load the object IDs into a temporary table. The table is only visible to this connection."""
+
+    try:
+        cursor = conn.cursor(MySQLdb.cursors.Cursor)
+        cursor.execute("drop temporary table if exists %s" % tableName)
+        cursor.execute("create temporary table %s (id bigint unsigned not null primary key) engine=memory" % tableName)
+        objectIds = sorted(set(objectIds))
+        for i in range(0, len(objectIds), 10000):
+            cursor.executemany("insert into " + tableName + " (id) values (%s)", [(id,) for id in objectIds[i:i + 10000]])
+        cursor.close ()
+
+    except MySQLdb.Error as e:
+        print("Error %d: %s" % (e.args[0], e.args[1]))
+        sys.exit (1)
+
+    return objectIds
+
+
+def getIdRanges(objectIds, chunkSize):
+    """Split the sorted object IDs into (first, last) ranges of at most chunkSize objects."""
+    return [(objectIds[i], objectIds[min(i + chunkSize, len(objectIds)) - 1]) for i in range(0, len(objectIds), chunkSize)]
+
+
+def copyImageFiles(imageFilenames, sourceReadOnlySchema, newSchema, imageRootSource, imageRootDestination, taronly = False, threads = 8):
+    """Copy the image files in parallel. (Or print the TAR list.)"""
+
+    if taronly or threads <= 1:
+        for imageFilename in imageFilenames:
+            copyImageFile(imageFilename, sourceReadOnlySchema, newSchema, imageRootSource, imageRootDestination, taronly = taronly)
+        return
+
+    # The copying is almost all I/O, so threads are fine.
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers = threads) as executor:
+        list(executor.map(lambda imageFilename: copyImageFile(imageFilename, sourceReadOnlySchema, newSchema, imageRootSource, imageRootDestination), imageFilenames))
+
+
+# 2026-10-19 KWS Set-based version of migrateData. The object IDs are loaded into a temporary
+#                table and each table is copied with ONE insert ... select per chunk of
+#                objects (by ID range), rather than one insert per table per object.
+#                Tables are replaced into, so the migration can be safely rerun.
+def migrateDataSetBased(conn, connPrivateReadonly, objectList, newSchema, sourceReadOnlySchema, ddc = False, copyimages = False, imageRootSource = None, imageRootDestination = None, getmetadata = False, survey = 'atlas', taronly = False, chunkSize = 1000, imageThreads = 8):
+
+    objectIds = loadMigrationObjects(conn, [object['id'] for object in objectList])
+    idRanges = getIdRanges(objectIds, chunkSize)
+
+    for tableName, idColumn in OBJECT_TABLES:
+        print("Migrating %s..." % tableName)
+        rows = 0
+        for first, last in idRanges:
+            rows += executeStatement(conn, """
+                replace into %s.%s
+                select s.* from %s.%s s
+                  join %s t on t.id = s.%s
+                 where t.id between %%s and %%s
+            """ % (newSchema, tableName, sourceReadOnlySchema, tableName, MIGRATION_OBJECTS_TABLE, idColumn), (first, last))
+        print("%d rows migrated." % rows)
+
+    # The name tables can't be joined to the object IDs, but a chunk of name prefixes is a
+    # single range scan on the name index.
+    for tableName, nameColumn in OBJECT_NAME_TABLES:
+        print("Migrating %s..." % tableName)
+        rows = 0
+        for i in range(0, len(objectIds), chunkSize):
+            chunk = objectIds[i:i + chunkSize]
+            rows += executeStatement(conn, """
+                replace into %s.%s
+                select * from %s.%s
+                 where """ % (newSchema, tableName, sourceReadOnlySchema, tableName) + ' or '.join(["%s like '%s%%'" % (nameColumn, id) for id in chunk]))
+        print("%d rows migrated." % rows)
+
+    if not ddc and survey == 'atlas':
+        # Insert the moments entries.
+        print("Migrating atlas_diff_moments...")
+        for first, last in idRanges:
+            executeStatement(conn, """
+                replace into %s.atlas_diff_moments
+                select m.* from %s.atlas_diff_moments m
+                  join %s.atlas_diff_detections d on d.id = m.detection_id
+                  join %s t on t.id = d.atlas_object_id
+                 where t.id between %%s and %%s
+            """ % (newSchema, sourceReadOnlySchema, sourceReadOnlySchema, MIGRATION_OBJECTS_TABLE), (first, last))
+
+    # Only do the following if we don't insert the entire metadata table.
+    if getmetadata:
+        exposures = []
+        cmfFiles = []
+        for object in objectList:
+            if survey == 'atlas':
+                # Create a dummy recurrence so we can reuse existing code.
+                recurrence = EmptyRecurreces()
+                recurrence.ra = object['ra']
+                recurrence.dec = object['dec']
+                recurrence.mjd = 50000
+                recurrence.atlas_metadata_id = 0
+                if ddc:
+                    b, blanks, lastNonDetection = getNonDetectionsUsingATLASFootprint([recurrence], conn = connPrivateReadonly, ndQuery=ATLAS_METADATADDC, filterWhereClause = filterWhereClauseddc, catalogueName = 'atlas_metadataddc')
+                else:
+                    b, blanks, lastNonDetection = getNonDetectionsUsingATLASFootprint([recurrence], conn = connPrivateReadonly)
+                for row in blanks:
+                    exposures.append(row.expname)
+
+            elif survey == 'panstarrs':
+                objectInfo = getObjectInfoPanSTARRS(object['id'], conn = connPrivateReadonly)
+                fields, skycells = getUniqueFieldsAndSkycells(objectInfo)
+                cmfFilenames = getObjectCMFFiles(conn, fields[0], skycells, sourceReadOnlySchema)
+                for filename in cmfFilenames:
+                    cmfFiles.append(filename['filename'])
+
+        if survey == 'atlas':
+            tableName, nameColumn, names = ('atlas_metadataddc', 'obs', exposures) if ddc else ('atlas_metadata', 'expname', exposures)
+        else:
+            tableName, nameColumn, names = ('tcs_cmf_metadata', 'filename', cmfFiles)
+
+        print("Migrating %s..." % tableName)
+        names = sorted(set(names))
+        for i in range(0, len(names), chunkSize):
+            chunk = names[i:i + chunkSize]
+            executeStatement(conn, """
+                replace into %s.%s
+                select * from %s.%s
+                 where %s in (""" % (newSchema, tableName, sourceReadOnlySchema, tableName, nameColumn) + ','.join(['%s'] * len(chunk)) + ")", tuple(chunk))
+
+    if copyimages and imageRootSource is not None and imageRootDestination is not None:
+        print("Copying images...")
+        imageFilenames = []
+        for i in range(0, len(objectIds), chunkSize):
+            chunk = objectIds[i:i + chunkSize]
+            try:
+                cursor = conn.cursor(MySQLdb.cursors.DictCursor)
+                cursor.execute("""
+                    select image_filename
+                      from %s.tcs_postage_stamp_images
+                     where """ % sourceReadOnlySchema + ' or '.join(["image_filename like '%s%%'" % id for id in chunk]))
+                imageFilenames += [row['image_filename'] for row in cursor.fetchall ()]
+                cursor.close ()
+            except MySQLdb.Error as e:
+                print("Error %d: %s" % (e.args[0], e.args[1]))
+
+        copyImageFiles(imageFilenames, sourceReadOnlySchema, newSchema, imageRootSource, imageRootDestination, taronly = taronly, threads = imageThreads)
+
+    executeStatement(conn, "drop temporary table if exists %s" % MIGRATION_OBJECTS_TABLE)
+
+
 def main(argv = None):
     opts = docopt(__doc__, version='0.1')
     opts = cleanOptions(opts)
@@ -887,7 +1078,10 @@ def main(argv = None):
 #        insertAllRecords(conn, 'atlas_diff_subcell_logs', options.sourceschema, options.database)
 
     print("Length of list = %d)" % len(candidateList))
-    migrateData(conn, connPrivateReadonly, candidateList, options.database, options.sourceschema, ddc = options.ddc, copyimages = options.copyimages, imageRootSource = options.imagessource, imageRootDestination = options.imagesdest, taronly = options.createtarcommand)
+    if options.setbased:
+        migrateDataSetBased(conn, connPrivateReadonly, candidateList, options.database, options.sourceschema, ddc = options.ddc, copyimages = options.copyimages, imageRootSource = options.imagessource, imageRootDestination = options.imagesdest, taronly = options.createtarcommand, chunkSize = int(options.chunksize), imageThreads = int(options.imagethreads))
+    else:
+        migrateData(conn, connPrivateReadonly, candidateList, options.database, options.sourceschema, ddc = options.ddc, copyimages = options.copyimages, imageRootSource = options.imagessource, imageRootDestination = options.imagesdest, taronly = options.createtarcommand)
 
     conn.close ()
     connPrivateReadonly.close ()
@@ -2,7 +2,7 @@
 """Generate an ATLAS Heatmap from specified whole MJD nights.
 
 Usage:
-  %s <configfile> <mjdList>... [--site=<site>] [--resolution=<resolution>] [--update] [--useddc] [--trim] [--multiplier=<multiplier>]
+  %s <configfile> <mjdList>... [--site=<site>] [--resolution=<resolution>] [--update] [--useddc] [--trim] [--multiplier=<multiplier>] [--nightly] [--recount]
   %s (-h | --help)
   %s --version
 
@@ -15,33 +15,93 @@ Options:
   --useddc                   Get the info from the DDC files, not the database.
   --trim                     Try and exclude outlier exposures that contain too many detections.
   --multiplier=<multiplier>  Multiplier of the median used to act as a mask [default: 1.5].
+  --nightly                  Keep the counts of each night in atlas_heatmap_nights and only count the nights that aren't already there.
+  --recount                  With --nightly, recount (and replace) the specified nights even if they are already there.
 
 E.g.:
   %s ../../../../../atlas/config/config4_db1_readonly.yaml 59781 59782 59785 59786 --site=03a
+  %s ../../../../../atlas/config/config4_db1.yaml 59781 59782 59785 59786 59787 --site=03a --nightly --update
 """
 
 import sys
-__doc__ = __doc__ % (sys.argv[0], sys.argv[0], sys.argv[0], sys.argv[0])
+__doc__ = __doc__ % (sys.argv[0], sys.argv[0], sys.argv[0], sys.argv[0], sys.argv[0])
 from docopt import docopt
 import sys, os, shutil, re, csv
-from gkutils.commonutils import dbConnect, Struct, cleanOptions, calculateHeatMap
+from gkutils.commonutils import dbConnect, Struct, cleanOptions
 import MySQLdb
 
 
-def getDetectionsForHeatmap(conn, site, mjdList):
+# Detector size (pixels) and the allowed heatmap resolutions.
+CHIP_SIZE = 10560
+HEATMAP_RESOLUTIONS = [8, 16, 32, 64, 128, 256, 512]
 
-    try:
-        cursor = conn.cursor(MySQLdb.cursors.DictCursor)
+# Per night heatmap counts, so that a new night can be added without recounting the others.
+NIGHTLY_HEATMAP_TABLE = 'atlas_heatmap_nights'
+
+
+# 2026-10-19 KWS The heatmap used to be made by pulling every detection for the nights
+#                to the client (with an unindexable chain of "obs like" ORs) and binning
+#                them here.  Now the binning is done by the database and only the counts
+#                come back.  Exposure names start with the site and MJD, so each night is
+#                an indexed range of obs values.  The bins are the same as calculateHeatMap:
+#                int(x / (chipSize - 1) * resolution), region = ybin * resolution + xbin.
+def heatmapCountsQuery(resolution = 128, chipSize = CHIP_SIZE):
+    """
+    The grouped (region, ndet) counts query for one night. Parameters are (obs from, obs to).
 
-        sqlSelect = 'select distinct obs, det_id, x, y from atlas_metadataddc m, atlas_detectionsddc d where d.atlas_metadata_id = m.id and x >= 0 and x < 10560 and y >= 0 and y < 10560 and '
-        sqlOrPhrase = '(%s)'
-        orClause=' or '.join(map(lambda x: 'm.obs like concat(%s, \'%%%%\')', mjdList))
-        sql = sqlSelect + sqlOrPhrase % orClause
+    :param resolution:
+    :param chipSize:
+    :return: SQL
 
-        #print(sql % tuple([str(site) + str(mjd) for mjd in mjdList]))
+    """
+    return """
+        select ybin * %d + xbin region, count(*) ndet
+          from (
+            select floor(x * 1e0 / %d * %d) xbin, floor(y * 1e0 / %d * %d) ybin
+              from (
+                select distinct m.obs, d.det_id, d.x, d.y
+                  from atlas_metadataddc m
+                  join atlas_detectionsddc d
+                    on d.atlas_metadata_id = m.id
+                 where m.obs >= %%s
+                   and m.obs < %%s
+                   and d.x >= 0 and d.x < %d
+                   and d.y >= 0 and d.y < %d
+              ) dets
+          ) bins
+         where xbin < %d
+           and ybin < %d
+      group by ybin, xbin
+    """ % (resolution, chipSize - 1, resolution, chipSize - 1, resolution, chipSize, chipSize, resolution, resolution)
+
+
+def nightObsRange(site, mjd):
+    """
+    The range of exposure names (e.g. 03a59781o0123c) taken at a site on an MJD night.
 
-        cursor.execute (sql, tuple([str(site) + str(mjd) for mjd in mjdList]))
+    :param site:
+    :param mjd:
+    :return: (from, to)
 
+    """
+    return (str(site) + str(int(mjd)), str(site) + str(int(mjd) + 1))
+
+
+def getHeatmapCountsForNight(conn, site, mjd, resolution = 128, chipSize = CHIP_SIZE):
+    """
+    Get the detection counts per heatmap region for one night.
+
+    :param conn: database connection
+    :param site:
+    :param mjd:
+    :param resolution:
+    :param chipSize:
+    :return: list of (region, ndet) dicts
+
+    """
+    try:
+        cursor = conn.cursor(MySQLdb.cursors.DictCursor)
+        cursor.execute (heatmapCountsQuery(resolution = resolution, chipSize = chipSize), nightObsRange(site, mjd))
         resultSet = cursor.fetchall ()
         cursor.close ()
 
@@ -51,53 +111,194 @@ def getDetectionsForHeatmap(conn, site, mjdList):
 
     return resultSet
 
-def delete_atlas_map(conn, site):
+
+def create_nightly_heatmap_table(conn):
     try:
         cursor = conn.cursor (MySQLdb.cursors.DictCursor)
 
         cursor.execute ("""
-            delete from atlas_heatmaps
-            where site = %s
-            """, (site,))
+            create table if not exists %s (
+                site varchar(10) not null,
+                mjd int not null,
+                resolution smallint unsigned not null,
+                region int unsigned not null,
+                ndet int unsigned not null,
+                primary key (site, mjd, resolution, region)
+            ) engine=InnoDB
+            """ % NIGHTLY_HEATMAP_TABLE)
+
+        cursor.close ()
 
     except MySQLdb.Error as e:
         sys.stderr.write("Error %d: %s\n" % (e.args[0], e.args[1]))
+        sys.exit (1)
 
-    cursor.close ()
-    conn.commit()
     return
 
-def insert_map_row(conn, site, region, ndet):
+
+def getStoredNights(conn, site, mjdList, resolution = 128):
+    """
+    Which of the nights have already been counted?
+
+    :param conn: database connection
+    :param site:
+    :param mjdList:
+    :param resolution:
+    :return: set of MJDs
+
+    """
+    try:
+        cursor = conn.cursor (MySQLdb.cursors.DictCursor)
+
+        cursor.execute ("""
+            select distinct mjd
+              from %s
+             where site = %%s
+               and resolution = %%s
+               and mjd in (%s)
+            """ % (NIGHTLY_HEATMAP_TABLE, ','.join(['%s'] * len(mjdList))), tuple([site, resolution] + [int(mjd) for mjd in mjdList]))
+
+        resultSet = cursor.fetchall ()
+        cursor.close ()
+
+    except MySQLdb.Error as e:
+        sys.stderr.write("Error %d: %s\n" % (e.args[0], e.args[1]))
+        sys.exit (1)
+
+    return set(row['mjd'] for row in resultSet)
+
+
+def store_nightly_heatmap(conn, site, mjd, resolution = 128, chipSize = CHIP_SIZE):
+    """
+    Count one night in the database and store (or replace) its counts.
+    Nothing but the row count comes back to the client.
+
+    :param conn: database connection
+    :param site:
+    :param mjd:
+    :param resolution:
+    :param chipSize:
+    :return: number of regions stored
+
+    """
+    rowsAdded = 0
+    try:
+        cursor = conn.cursor (MySQLdb.cursors.DictCursor)
+        cursor.execute("start transaction")
+
+        cursor.execute ("""
+            delete from %s
+             where site = %%s
+               and mjd = %%s
+               and resolution = %%s
+            """ % NIGHTLY_HEATMAP_TABLE, (site, int(mjd), resolution))
+
+        cursor.execute ("""
+            insert into %s (site, mjd, resolution, region, ndet)
+            select %%s, %%s, %%s, region, ndet from (%s) counts
+            """ % (NIGHTLY_HEATMAP_TABLE, heatmapCountsQuery(resolution = resolution, chipSize = chipSize)), (site, int(mjd), resolution) + nightObsRange(site, mjd))
+        rowsAdded = cursor.rowcount
+
+        conn.commit()
+        cursor.close ()
+
+    except MySQLdb.Error as e:
+        conn.rollback()
+        sys.stderr.write("Error %d: %s\n" % (e.args[0], e.args[1]))
+        sys.exit (1)
+
+    return rowsAdded
+
+
+def getStoredHeatmapCounts(conn, site, mjdList, resolution = 128):
     """
-    Add the Map row to the database
+    Sum the stored counts of the nights.
 
     :param conn: database connection
     :param site:
-    :param region:
-    :param ndet:
-    :return: insert id
+    :param mjdList:
+    :param resolution:
+    :return: list of (region, ndet) dicts
 
     """
-    import MySQLdb
+    try:
+        cursor = conn.cursor (MySQLdb.cursors.DictCursor)
+
+        cursor.execute ("""
+            select region, sum(ndet) ndet
+              from %s
+             where site = %%s
+               and resolution = %%s
+               and mjd in (%s)
+          group by region
+            """ % (NIGHTLY_HEATMAP_TABLE, ','.join(['%s'] * len(mjdList))), tuple([site, resolution] + [int(mjd) for mjd in mjdList]))
+
+        resultSet = cursor.fetchall ()
+        cursor.close ()
+
+    except MySQLdb.Error as e:
+        sys.stderr.write("Error %d: %s\n" % (e.args[0], e.args[1]))
+        sys.exit (1)
 
+    return resultSet
+
+
+def countsToMatrix(counts, resolution = 128):
+    """
+    Convert (region, ndet) rows into the resolution x resolution heatmap matrix.
+
+    :param counts:
+    :param resolution:
+    :return: numpy matrix
+
+    """
+    import numpy as n
+    matrix = n.zeros(resolution * resolution, dtype = n.int64)
+    for row in counts:
+        matrix[int(row['region'])] += int(row['ndet'])
+    return matrix.reshape((resolution, resolution))
+
+
+def delete_atlas_map(conn, site):
     try:
         cursor = conn.cursor (MySQLdb.cursors.DictCursor)
 
         cursor.execute ("""
-             insert into atlas_heatmaps (site, region, ndet)
-             values (%s, %s, %s)
-             """, (site, region, ndet))
+            delete from atlas_heatmaps
+            where site = %s
+            """, (site,))
 
     except MySQLdb.Error as e:
         sys.stderr.write("Error %d: %s\n" % (e.args[0], e.args[1]))
 
     cursor.close ()
-    return conn.insert_id()
+    conn.commit()
+    return
 
+# 2026-10-19 KWS Replace the site's map in one transaction with a single (multi-row) insert,
+#                rather than a delete followed by one insert per region.
 def insert_atlas_map(conn, matrix, site):
-    delete_atlas_map(conn, site)
-    for region, ndet in enumerate(matrix.flatten()):
-        insert_map_row(conn, site, region, ndet)
+    try:
+        cursor = conn.cursor (MySQLdb.cursors.DictCursor)
+        cursor.execute("start transaction")
+
+        cursor.execute ("""
+            delete from atlas_heatmaps
+            where site = %s
+            """, (site,))
+
+        cursor.executemany ("""
+            insert into atlas_heatmaps (site, region, ndet)
+            values (%s, %s, %s)
+            """, [(site, region, int(ndet)) for region, ndet in enumerate(matrix.flatten())])
+
+        conn.commit()
+        cursor.close ()
+
+    except MySQLdb.Error as e:
+        conn.rollback()
+        sys.stderr.write("Error %d: %s\n" % (e.args[0], e.args[1]))
+
     return
 
 # ###########################################################################################
@@ -129,23 +330,43 @@ def main():
     conn.autocommit(True)
 
 
-    detections = getDetectionsForHeatmap(conn, options.site, options.mjdList)
-    print(len(detections))
-
-    mat = calculateHeatMap(detections, resolution = int(options.resolution))
-
-    median = n.median(mat['matrix'])
+    resolution = int(options.resolution)
+    if resolution not in HEATMAP_RESOLUTIONS:
+        print("Heatmap resolution should be one of %s" % ', '.join(str(r) for r in HEATMAP_RESOLUTIONS))
+        conn.close()
+        return 1
+
+    mjdList = sorted(set(int(mjd) for mjd in options.mjdList))
+
+    if options.nightly:
+        create_nightly_heatmap_table(conn)
+        storedNights = set()
+        if not options.recount:
+            storedNights = getStoredNights(conn, options.site, mjdList, resolution = resolution)
+        for mjd in mjdList:
+            if mjd in storedNights:
+                continue
+            regions = store_nightly_heatmap(conn, options.site, mjd, resolution = resolution)
+            print("Counted night %d (%d regions)" % (mjd, regions))
+        counts = getStoredHeatmapCounts(conn, options.site, mjdList, resolution = resolution)
+    else:
+        counts = []
+        for mjd in mjdList:
+            counts += getHeatmapCountsForNight(conn, options.site, mjd, resolution = resolution)
+
+    matrix = countsToMatrix(counts, resolution = resolution)
+    print(int(matrix.sum()))
+
+    median = n.median(matrix)
     mask = float(options.multiplier) * median
-    count = n.count_nonzero(mat['matrix'] > mask)
-    proportionPercentage = count/(mat['matrix'].shape[0]*mat['matrix'].shape[1]) * 100.0
+    count = n.count_nonzero(matrix > mask)
+    proportionPercentage = count/(matrix.shape[0]*matrix.shape[1]) * 100.0
 
     print ("Mask percentage = %.2f%%" % (proportionPercentage))
 
     if options.update:
-        # Delete the previous map for that ATLAS site.
-        delete_atlas_map(conn, options.site)
-        # Add the new map for the specified site.
-        insert_atlas_map(conn, mat['matrix'], options.site)
+        # Replace the map for the specified ATLAS site.
+        insert_atlas_map(conn, matrix, options.site)
 
 
     conn.close()
@@ -2,7 +2,7 @@
 """Generate CSV summary and recurrence files for (e.g.) PESSTO and YSE.
 
 Usage:
-  %s <configfile> [--lists=<lists>] [--listAGN=<listAGN>] [--delimiter=<delimiter>] [--customlist=<customlist>] [--writeAGNs] [--summaryfile=<summaryfile>] [--recfile=<recfile>] [--agnsummaryfile=<agnsummaryfile>] [--agnrecfile=<agnrecfile>] [--flagdate=<flagdate>]
+  %s <configfile> [--lists=<lists>] [--listAGN=<listAGN>] [--delimiter=<delimiter>] [--customlist=<customlist>] [--writeAGNs] [--summaryfile=<summaryfile>] [--recfile=<recfile>] [--agnsummaryfile=<agnsummaryfile>] [--agnrecfile=<agnrecfile>] [--flagdate=<flagdate>] [--streaming] [--perobjectdir=<perobjectdir>] [--processes=<processes>]
   %s (-h | --help)
   %s --version
 
@@ -19,17 +19,23 @@ Options:
   --agnsummaryfile=<agnsummaryfile>  Summary filename for AGNs if required [default: agnsummary.csv].
   --agnrecfile=<agnrecfile>          AGN recurrences filename if required [default: agnrecurrences.csv].
   --flagdate=<flagdate>              Don't produce any data from before this date.
+  --streaming                        Stream the recurrences for all the objects with one server side cursor (ordered by object) and write
+                                     each object as soon as its recurrences are complete. Memory use does not depend on the number of objects.
+                                     Output is in object ID order. (Generic lists only - not the custom list.)
+  --perobjectdir=<perobjectdir>      Streaming only. Also write the recurrences for each object to <perobjectdir>/<id>.csv.
+  --processes=<processes>            Streaming only. Split the objects into this many object ID ranges and write them in parallel [default: 1].
 
 E.g.:
   %s ../../../../../ps1yse/config/config.yaml --lists=1,2,3 --writeAGNs
+  %s ../../../../../ps1yse/config/config.yaml --lists=1,2,3 --writeAGNs --streaming --processes=4
 """
 
 import sys
-__doc__ = __doc__ % (sys.argv[0], sys.argv[0], sys.argv[0], sys.argv[0])
+__doc__ = __doc__ % (sys.argv[0], sys.argv[0], sys.argv[0], sys.argv[0], sys.argv[0])
 
 from docopt import docopt
-import sys, os, shutil, re, csv
-from gkutils.commonutils import dbConnect, Struct, cleanOptions, calculateHeatMap
+import sys, os, shutil, re, csv, itertools, datetime
+from gkutils.commonutils import dbConnect, Struct, cleanOptions, calculateHeatMap, parallelProcess
 
 import warnings
 warnings.filterwarnings('ignore', '.*the sets module is deprecated.*', DeprecationWarning, 'MySQLdb')
@@ -335,6 +341,236 @@ def getRecurrenceData(conn, id):
 
    return resultSet
 
+# 2026-10-19 KWS Streaming export. The per object export runs three queries for every object
+#                and holds the whole object list in memory. The streaming export reads the
+#                summary rows and the recurrences for ALL the objects through two server side
+#                cursors (on two connections, both ordered by object ID) and writes each object
+#                as soon as its recurrences are complete. Only one object's recurrences are
+#                held in memory at any time.
+
+def getObjectConditions(detectionLists, queryType = ALL_OBJECTS, flagdate = None, idRange = None):
+   """Build the object (tcs_transient_objects o) selection conditions for the streaming queries.
+      Returns the SQL and its parameters.
+
+   Args:
+       detectionLists:
+       queryType:
+       flagdate:
+       idRange: (lowest id, highest id) or None for all objects
+   """
+
+   sql = '''
+             and o.detection_list_id in (%s)
+   ''' % ', '.join(['%s' for x in detectionLists])
+   parameters = list(detectionLists)
+
+   if flagdate:
+      sql += '''
+             and o.followup_flag_date >= %s
+      '''
+      parameters.append(flagdate)
+
+   if queryType == EXCLUDE_AGNS:
+      sql += '''
+             and o.sherlockClassification != 'AGN'
+      '''
+   elif queryType == AGNS_ONLY:
+      sql += '''
+             and o.sherlockClassification = 'AGN'
+      '''
+
+   if idRange:
+      sql += '''
+             and o.id between %s and %s
+      '''
+      parameters += list(idRange)
+
+   return sql, parameters
+
+
+def getGenericSummaryDataCursor(conn, detectionLists=[1,2,3,5], queryType = ALL_OBJECTS, flagdate = None, idRange = None):
+   """Execute the generic summary query, ordered by object ID, on a server side cursor.
+      The representative image (rep_target, rep_ref, rep_diff) is joined in. Returns the cursor.
+
+   Args:
+       conn:
+       detectionLists:
+       queryType:
+       flagdate:
+       idRange:
+   """
+
+   conditions, parameters = getObjectConditions(detectionLists, queryType = queryType, flagdate = flagdate, idRange = idRange)
+
+   try:
+      cursor = conn.cursor (MySQLdb.cursors.SSDictCursor)
+
+      cursor.execute ('''
+          select o.id, o.ra_psf, o.dec_psf, o.psf_inst_mag_sig, o.cal_psf_mag, substr(m.fpa_filter,1,1) filter, o.local_designation, o.ps1_designation, o.other_designation tns_name, o.followup_flag_date, o.sherlockClassification, o.detection_list_id, sh.z sherlock_specz, sh.catalogue_object_id sherlock_object_id, sh.raDeg sherlock_host_ra, sh.decDeg sherlock_host_dec, ifnull(sh.direct_distance, sh.distance) sherlock_distancempc, sh.catalogue_table_name sherlock_tables, classification_confidence rb_factor_catalogue, confidence_factor rb_factor_image, s.latest_mjd_forced, s.latest_flux_forced, s.latest_dflux_forced, s.latest_filter_forced, s.latest_pscamera_forced,
+                 ti.target rep_target, ti.ref rep_ref, ti.diff rep_diff
+            from tcs_cmf_metadata m, tcs_latest_object_stats s
+            join tcs_transient_objects o on s.id = o.id
+       left join sherlock_crossmatches sh on sh.transient_object_id = o.id
+       left join tcs_images ti on ti.id = o.tcs_images_id
+           where o.tcs_cmf_metadata_id = m.id
+             and (m.filename like 'MD%%' or m.filename like 'FGSS%%' or m.filename like 'RINGS%%')
+             and ((sh.rank is null and sh.transient_object_id is null) or (sh.rank = 1 and sh.transient_object_id is not null))
+      ''' + conditions + '''
+        order by o.id
+      ''', parameters)
+
+   except MySQLdb.Error as e:
+      print("Error %d: %s" % (e.args[0], e.args[1]))
+      sys.exit (1)
+
+   return cursor
+
+
+def getRecurrenceDataCursor(conn, detectionLists=[1,2,3,5], queryType = ALL_OBJECTS, flagdate = None, idRange = None):
+   """Execute the recurrence query for ALL the selected objects, ordered by object ID and then
+      (like getRecurrenceData) by mjd_obs desc, on a server side cursor. Returns the cursor.
+
+   Args:
+       conn:
+       detectionLists:
+       queryType:
+       flagdate:
+       idRange:
+   """
+
+   conditions, parameters = getObjectConditions(detectionLists, queryType = queryType, flagdate = flagdate, idRange = idRange)
+
+   try:
+      cursor = conn.cursor (MySQLdb.cursors.SSDictCursor)
+
+      cursor.execute ('''
+          select o.id,
+                 o.id transient_object_id,
+                 o.local_designation,
+                 o.ps1_designation,
+                 o.other_designation tns_name,
+                 m.mjd_obs,
+                 o.ra_psf,
+                 o.dec_psf,
+                 o.psf_inst_mag_sig,
+                 o.ap_mag,
+                 o.cal_psf_mag,
+                 substr(m.fpa_filter,1,1)
+                 filter,
+                 ifnull(NULL, concat(name, '_target')) target,
+                 ifnull(NULL, concat(name, '_ref')) ref,
+                 ifnull(NULL, concat(name, '_diff')) diff,
+                 m.fpa_detector pscamera
+            from tcs_transient_objects o
+      inner join tcs_cmf_metadata m
+              on (o.tcs_cmf_metadata_id = m.id)
+       left join tcs_image_groups i
+              on (o.image_group_id = i.id)
+           where 1 = 1
+      ''' + conditions + '''
+           union all
+          select r.id,
+                 r.transient_object_id,
+                 o.local_designation,
+                 o.ps1_designation,
+                 o.other_designation tns_name,
+                 m.mjd_obs,
+                 r.ra_psf,
+                 r.dec_psf,
+                 r.psf_inst_mag_sig,
+                 r.ap_mag,
+                 r.cal_psf_mag,
+                 substr(m.fpa_filter,1,1)
+                 filter,
+                 ifnull(NULL, concat(name, '_target')) target,
+                 ifnull(NULL, concat(name, '_ref')) ref,
+                 ifnull(NULL, concat(name, '_diff')) diff,
+                 m.fpa_detector pscamera
+            from tcs_transient_reobservations r
+      inner join tcs_cmf_metadata m
+              on (r.tcs_cmf_metadata_id = m.id)
+      inner join tcs_transient_objects o
+              on (r.transient_object_id = o.id)
+       left join tcs_image_groups i
+              on (r.image_group_id = i.id)
+           where 1 = 1
+      ''' + conditions + '''
+        order by transient_object_id, mjd_obs desc
+      ''', parameters + parameters)
+
+   except MySQLdb.Error as e:
+      print("Error %d: %s" % (e.args[0], e.args[1]))
+      sys.exit (1)
+
+   return cursor
+
+
+def getObjectIdRanges(conn, detectionLists=[1,2,3,5], queryType = ALL_OBJECTS, flagdate = None, ranges = 1):
+   """Split the selected objects into (at most) the specified number of object ID ranges,
+      each containing roughly the same number of objects.
+
+   Args:
+       conn:
+       detectionLists:
+       queryType:
+       flagdate:
+       ranges:
+   """
+
+   conditions, parameters = getObjectConditions(detectionLists, queryType = queryType, flagdate = flagdate)
+
+   idRanges = []
+   try:
+      cursor = conn.cursor (MySQLdb.cursors.DictCursor)
+
+      cursor.execute ('''
+          select count(*) count
+            from tcs_transient_objects o
+           where 1 = 1
+      ''' + conditions, parameters)
+      count = cursor.fetchone()['count']
+
+      if count == 0:
+         cursor.close ()
+         return idRanges
+
+      ranges = max(min(int(ranges), count), 1)
+
+      # Find the first ID of each range. Each is a single indexed row lookup.
+      boundaries = []
+      for i in range(ranges):
+         cursor.execute ('''
+             select o.id
+               from tcs_transient_objects o
+              where 1 = 1
+         ''' + conditions + '''
+           order by o.id
+              limit 1 offset %s
+         ''', parameters + [count * i // ranges])
+         boundaries.append(cursor.fetchone()['id'])
+
+      cursor.execute ('''
+          select max(o.id) id
+            from tcs_transient_objects o
+           where 1 = 1
+      ''' + conditions, parameters)
+      highestId = cursor.fetchone()['id']
+
+      cursor.close ()
+
+   except MySQLdb.Error as e:
+      print("Error %d: %s" % (e.args[0], e.args[1]))
+      sys.exit (1)
+
+   for i in range(len(boundaries)):
+      if i < len(boundaries) - 1:
+         idRanges.append((boundaries[i], boundaries[i+1] - 1))
+      else:
+         idRanges.append((boundaries[i], highestId))
+
+   return idRanges
+
+
 # 2013-10
 
 def producePESSTOCSV(conn, options, delimiter, customList, listId = 3, summaryCSVFilename = None, recurrenceCSVFilename = None):
@@ -519,6 +755,205 @@ def produceGenericCSV(conn, options, delimiter, detectionLists=[1,2,3,5], summar
     return 0
 
 
+def groupRecurrences(cursor):
+    """Yield (object id, list of recurrences) for each object from the streaming recurrence cursor.
+
+    Args:
+        cursor: cursor returned by getRecurrenceDataCursor
+    """
+    for objectId, rows in itertools.groupby(iter(cursor.fetchone, None), key = lambda x: x['transient_object_id']):
+        yield objectId, list(rows)
+
+
+def averageOfColumn(rows, column):
+    """Average the non null values of a column (like SQL avg). None if there aren't any."""
+    values = [r[column] for r in rows if r[column] is not None]
+    if not values:
+        return None
+    return sum(values) / len(values)
+
+
+def writeGenericCSVStream(summaryCursor, recurrenceCursor, delimiter, summaryCSVFile, recurrenceCSVFile, writeHeaders = True, perObjectDirectory = None):
+    """Merge the summary and recurrence streams (both ordered by object ID) and write each
+       object as soon as its group of recurrences is complete. Returns the number of objects written.
+
+    Args:
+        summaryCursor: cursor returned by getGenericSummaryDataCursor
+        recurrenceCursor: cursor returned by getRecurrenceDataCursor
+        delimiter:
+        summaryCSVFile: open summary file
+        recurrenceCSVFile: open recurrence file
+        writeHeaders:
+        perObjectDirectory: if set, also write each object's recurrences to <perObjectDirectory>/<id>.csv
+    """
+
+    # The headers come from the cursor descriptions, so we know them even if there are no rows.
+    repColumns = ['rep_target', 'rep_ref', 'rep_diff']
+    summaryHeader = [c[0] for c in summaryCursor.description if c[0] not in repColumns]
+    summaryHeader.append('target')
+    summaryHeader.append('ref')
+    summaryHeader.append('diff')
+    summaryHeader.append('mjd_obs')
+    recurrenceHeader = [c[0] for c in recurrenceCursor.description]
+
+    if writeHeaders:
+        csv.writer(summaryCSVFile, delimiter=delimiter).writerow(summaryHeader)
+        csv.writer(recurrenceCSVFile, delimiter=delimiter).writerow(recurrenceHeader)
+
+    summaryw = csv.DictWriter(summaryCSVFile, fieldnames=summaryHeader, delimiter=delimiter)
+    recurrencew = csv.DictWriter(recurrenceCSVFile, fieldnames=recurrenceHeader, delimiter=delimiter)
+
+    recurrences = groupRecurrences(recurrenceCursor)
+    objectId, recurrenceList = next(recurrences, (None, None))
+
+    objectsWritten = 0
+    for row in iter(summaryCursor.fetchone, None):
+        # The recurrence stream may contain objects the summary query rejected. Skip them.
+        while objectId is not None and objectId < row["id"]:
+            objectId, recurrenceList = next(recurrences, (None, None))
+
+        if objectId != row["id"]:
+            # No recurrences. Shouldn't happen - there is always at least the object itself.
+            continue
+
+        # Replace the ra_psf and dec_psf values with the average ones for this transient
+        row["ra_psf"] = averageOfColumn(recurrenceList, "ra_psf")
+        row["dec_psf"] = averageOfColumn(recurrenceList, "dec_psf")
+
+        # The representative image
+        row["target"] = row.pop("rep_target")
+        row["ref"] = row.pop("rep_ref")
+        row["diff"] = row.pop("rep_diff")
+
+        row["mjd_obs"] = recurrenceList[0]["mjd_obs"]
+        row["cal_psf_mag"] = recurrenceList[0]["cal_psf_mag"]
+        row["psf_inst_mag_sig"] = recurrenceList[0]["psf_inst_mag_sig"]
+        row["filter"] = recurrenceList[0]["filter"]
+
+        row["detection_list_id"] = QUBLISTS[row["detection_list_id"]]
+        summaryw.writerow(row)
+
+        for recRow in recurrenceList:
+            recurrencew.writerow(recRow)
+
+        if perObjectDirectory:
+            with open(os.path.join(perObjectDirectory, '%s.csv' % str(row["id"])), 'w') as objectCSVFile:
+                csv.writer(objectCSVFile, delimiter=delimiter).writerow(recurrenceHeader)
+                objectw = csv.DictWriter(objectCSVFile, fieldnames=recurrenceHeader, delimiter=delimiter)
+                for recRow in recurrenceList:
+                    objectw.writerow(recRow)
+
+        objectsWritten += 1
+
+    return objectsWritten
+
+
+def writeGenericCSVRange(db, delimiter, detectionLists, queryType, flagdate, summaryCSVFilename, recurrenceCSVFilename, idRange = None, writeHeaders = True, perObjectDirectory = None):
+    """Stream the objects in an ID range to the summary and recurrence files.
+       Server side cursors can't share a connection, so we open one for each stream.
+
+    Args:
+        db: [username, password, database, hostname]
+        delimiter:
+        detectionLists:
+        queryType:
+        flagdate:
+        summaryCSVFilename:
+        recurrenceCSVFilename:
+        idRange:
+        writeHeaders:
+        perObjectDirectory:
+    """
+    summaryConn = dbConnect(db[3], db[0], db[1], db[2])
+    recurrenceConn = dbConnect(db[3], db[0], db[1], db[2])
+
+    summaryCursor = getGenericSummaryDataCursor(summaryConn, detectionLists=detectionLists, queryType = queryType, flagdate = flagdate, idRange = idRange)
+    recurrenceCursor = getRecurrenceDataCursor(recurrenceConn, detectionLists=detectionLists, queryType = queryType, flagdate = flagdate, idRange = idRange)
+
+    try:
+        with open(summaryCSVFilename, 'w') as summaryCSVFile, open(recurrenceCSVFilename, 'w') as recurrenceCSVFile:
+            objectsWritten = writeGenericCSVStream(summaryCursor, recurrenceCursor, delimiter, summaryCSVFile, recurrenceCSVFile, writeHeaders = writeHeaders, perObjectDirectory = perObjectDirectory)
+    except MySQLdb.Error as e:
+        print("Error %d: %s" % (e.args[0], e.args[1]))
+        sys.exit (1)
+    finally:
+        summaryCursor.close ()
+        recurrenceCursor.close ()
+        summaryConn.close ()
+        recurrenceConn.close ()
+
+    return objectsWritten
+
+
+def workerCSVWriter(num, db, listFragment, dateAndTime, firstPass, miscParameters):
+    """thread worker function"""
+    delimiter, detectionLists, queryType, flagdate, summaryCSVFilename, recurrenceCSVFilename, perObjectDirectory = miscParameters
+
+    # Each fragment is a list of (part number, lowest id, highest id). The first part writes the headers.
+    for part, lowestId, highestId in listFragment:
+        objectsWritten = writeGenericCSVRange(db, delimiter, detectionLists, queryType, flagdate, '%s.part%03d' % (summaryCSVFilename, part), '%s.part%03d' % (recurrenceCSVFilename, part), idRange = (lowestId, highestId), writeHeaders = (part == 0), perObjectDirectory = perObjectDirectory)
+        print("Part %d (objects %s to %s): %d objects written." % (part, str(lowestId), str(highestId), objectsWritten))
+
+    print("Process complete.")
+    return 0
+
+
+def concatenateParts(filename, parts):
+    """Concatenate <filename>.part000, <filename>.part001, ... into filename and remove the parts."""
+    with open(filename, 'w') as outputFile:
+        for part in range(parts):
+            partFilename = '%s.part%03d' % (filename, part)
+            with open(partFilename) as partFile:
+                shutil.copyfileobj(partFile, outputFile)
+            os.remove(partFilename)
+
+
+def produceGenericCSVStreaming(conn, db, options, delimiter, detectionLists=[1,2,3,5], summaryCSVFilename = None, recurrenceCSVFilename = None, queryType = ALL_OBJECTS):
+    """Streaming version of produceGenericCSV. The rows are written in object ID order.
+
+    Args:
+        conn:
+        db: [username, password, database, hostname]
+        options:
+        delimiter:
+        detectionLists:
+        summaryCSVFilename:
+        recurrenceCSVFilename:
+        queryType:
+    """
+
+    perObjectDirectory = options.perobjectdir
+    if perObjectDirectory and not os.path.exists(perObjectDirectory):
+        os.makedirs(perObjectDirectory)
+
+    processes = int(options.processes)
+
+    if processes <= 1:
+        objectsWritten = writeGenericCSVRange(db, delimiter, detectionLists, queryType, options.flagdate, summaryCSVFilename, recurrenceCSVFilename, perObjectDirectory = perObjectDirectory)
+        print("%d objects written." % objectsWritten)
+        return 0
+
+    idRanges = getObjectIdRanges(conn, detectionLists=detectionLists, queryType = queryType, flagdate = options.flagdate, ranges = processes)
+
+    if not idRanges:
+        # Nothing to split. Just write the (empty) files with their headers.
+        writeGenericCSVRange(db, delimiter, detectionLists, queryType, options.flagdate, summaryCSVFilename, recurrenceCSVFilename, perObjectDirectory = perObjectDirectory)
+        return 0
+
+    listChunks = [[(part, idRange[0], idRange[1])] for part, idRange in enumerate(idRanges)]
+
+    currentDate = datetime.datetime.now().strftime("%Y:%m:%d:%H:%M:%S")
+    (year, month, day, hour, min, sec) = currentDate.split(':')
+    dateAndTime = "%s%s%s_%s%s%s" % (year, month, day, hour, min, sec)
+
+    parallelProcess(db, dateAndTime, len(listChunks), listChunks, workerCSVWriter, miscParameters = [delimiter, detectionLists, queryType, options.flagdate, summaryCSVFilename, recurrenceCSVFilename, perObjectDirectory], drainQueues = False)
+
+    concatenateParts(summaryCSVFilename, len(listChunks))
+    concatenateParts(recurrenceCSVFilename, len(listChunks))
+
+    return 0
+
+
 # ###########################################################################################
 #                                         Main program
 # ###########################################################################################
@@ -561,8 +996,12 @@ def main():
     summaryCSVFilename = '/' + hostname + '/images/' + database + '/lightcurves/' + options.summaryfile
     recurrenceCSVFilename = '/' + hostname + '/images/' + database + '/lightcurves/' + options.recfile
 
+    db = [username, password, database, hostname]
+
     if customList:
         producePESSTOCSV(conn, options, delimiter, customList, summaryCSVFilename = summaryCSVFilename, recurrenceCSVFilename = recurrenceCSVFilename)
+    elif options.streaming:
+        produceGenericCSVStreaming(conn, db, options, delimiter, detectionLists = detectionLists, summaryCSVFilename = summaryCSVFilename, recurrenceCSVFilename = recurrenceCSVFilename, queryType = EXCLUDE_AGNS)
     else:
         produceGenericCSV(conn, options, delimiter, detectionLists = detectionLists, summaryCSVFilename = summaryCSVFilename, recurrenceCSVFilename = recurrenceCSVFilename, queryType = EXCLUDE_AGNS)
 
@@ -570,7 +1009,10 @@ def main():
         summaryCSVFilename = '/' + hostname + '/images/' + database + '/lightcurves/' + options.agnsummaryfile
         recurrenceCSVFilename = '/' + hostname + '/images/' + database + '/lightcurves/' + options.agnrecfile
 
-        produceGenericCSV(conn, options, delimiter, detectionLists = [int(options.listAGN)], summaryCSVFilename = summaryCSVFilename, recurrenceCSVFilename = recurrenceCSVFilename, queryType = AGNS_ONLY)
+        if options.streaming:
+            produceGenericCSVStreaming(conn, db, options, delimiter, detectionLists = [int(options.listAGN)], summaryCSVFilename = summaryCSVFilename, recurrenceCSVFilename = recurrenceCSVFilename, queryType = AGNS_ONLY)
+        else:
+            produceGenericCSV(conn, options, delimiter, detectionLists = [int(options.listAGN)], summaryCSVFilename = summaryCSVFilename, recurrenceCSVFilename = recurrenceCSVFilename, queryType = AGNS_ONLY)
 
     conn.close ()
 
@@ -0,0 +1,225 @@
+"""Cached, vectorised sky map lookups for GW crossmatching.
+
+The multi-order (NUNIQ) sky map for each event/iteration is read ONCE and converted
+into a set of flat numpy arrays, sorted by the start of each pixel's nested index
+range at the maximum HEALPix order present in the map:
+
+    start, end   - nested pixel index range at the maximum order
+    prob         - probability contained in the pixel
+    credible     - credible level (percent) of the region that includes the pixel
+    distmu       - conditional distance location parameter (if present)
+    distsigma    - conditional distance scale parameter (if present)
+
+The arrays are written to a cache directory keyed by the map filename and its mtime
+and are subsequently memory-mapped, so re-running the crossmatch against a new set
+of candidates costs a few milliseconds rather than a full re-read of the map.
+"""
+import os
+import hashlib
+import json
+import numpy as np
+
+# 2026-10-19 KWS Bump this if the layout of the cached arrays changes.
+CACHE_VERSION = 1
+
+SKYMAP_COLUMNS = ['start', 'end', 'credible', 'distmu', 'distsigma']
+
+# In-process cache so that multiple candidate lists in one run don't even hit the disk.
+_skymapCache = {}
+
+
+def uniqToLevelAndIpix(uniq):
+    """Split NUNIQ pixel indices into HEALPix order and nested pixel index.
+
+    Args:
+        uniq: array of NUNIQ pixel indices
+    """
+    uniq = np.asarray(uniq, dtype = np.int64)
+    level = (np.floor(np.log2(uniq)).astype(np.int64) - 2) // 2
+    ipix = uniq - (np.int64(4) << (2 * level))
+    return level, ipix
+
+
+def readMultiOrderSkymap(mapPath):
+    """Read a multi-order sky map and precompute the sorted pixel ranges and credible levels.
+       Returns None if the map is not a multi-order (UNIQ) map.
+
+    Args:
+        mapPath: location of the multiorder FITS file
+    """
+    from astropy.io import fits
+
+    with fits.open(mapPath, memmap = True) as hdul:
+        header = hdul[1].header
+        data = hdul[1].data
+        columns = [c.upper() for c in data.columns.names]
+        if 'UNIQ' not in columns:
+            return None
+
+        uniq = np.array(data['UNIQ'], dtype = np.int64)
+        probdensity = np.array(data['PROBDENSITY'], dtype = np.float64)
+        if 'DISTMU' in columns and 'DISTSIGMA' in columns:
+            distmu = np.array(data['DISTMU'], dtype = np.float64)
+            distsigma = np.array(data['DISTSIGMA'], dtype = np.float64)
+        else:
+            distmu = np.full(len(uniq), np.inf)
+            distsigma = np.full(len(uniq), np.inf)
+        mjdObs = header.get('MJD-OBS')
+
+    level, ipix = uniqToLevelAndIpix(uniq)
+    maxLevel = int(level.max())
+
+    # Probability contained in each pixel = density * pixel area.
+    area = 4.0 * np.pi / (12.0 * (np.float64(4) ** level))
+    prob = probdensity * area
+
+    # Credible level of each pixel: cumulative probability of all pixels with the same or
+    # higher probability density, expressed as a percentage.
+    order = np.argsort(-probdensity, kind = 'stable')
+    cumulative = np.empty(len(prob))
+    cumulative[order] = np.cumsum(prob[order])
+    credible = 100.0 * cumulative / cumulative[order[-1]]
+
+    shift = 2 * (maxLevel - level)
+    start = ipix << shift
+    end = (ipix + 1) << shift
+
+    sortIndex = np.argsort(start)
+
+    skymap = {'start': start[sortIndex],
+              'end': end[sortIndex],
+              'credible': credible[sortIndex],
+              'distmu': distmu[sortIndex],
+              'distsigma': distsigma[sortIndex],
+              'maxLevel': maxLevel,
+              'mjdObs': mjdObs}
+
+    return skymap
+
+
+def getCacheKey(mapPath):
+    """Cache key for the map is derived from its absolute filename and mtime.
+
+    Args:
+        mapPath:
+    """
+    mapPath = os.path.abspath(mapPath)
+    mtime = os.path.getmtime(mapPath)
+    return hashlib.sha1(('%s:%f:%d' % (mapPath, mtime, CACHE_VERSION)).encode('utf-8')).hexdigest()
+
+
+def writeSkymapCache(skymap, cacheDirectory):
+    """Write the precomputed arrays to the cache directory.  Write to a temporary
+       directory first and rename so that concurrent runs never see a partial cache.
+
+    Args:
+        skymap:
+        cacheDirectory:
+    """
+    tmpDirectory = '%s.tmp%d' % (cacheDirectory, os.getpid())
+    os.makedirs(tmpDirectory, exist_ok = True)
+    for column in SKYMAP_COLUMNS:
+        np.save(os.path.join(tmpDirectory, column + '.npy'), skymap[column])
+    with open(os.path.join(tmpDirectory, 'metadata.json'), 'w') as f:
+        json.dump({'maxLevel': skymap['maxLevel'], 'mjdObs': skymap['mjdObs']}, f)
+    try:
+        os.rename(tmpDirectory, cacheDirectory)
+    except OSError:
+        # Someone else got there first. Use theirs.
+        import shutil
+        shutil.rmtree(tmpDirectory, ignore_errors = True)
+
+
+def readSkymapCache(cacheDirectory):
+    """Memory-map the cached arrays.
+
+    Args:
+        cacheDirectory:
+    """
+    with open(os.path.join(cacheDirectory, 'metadata.json')) as f:
+        skymap = json.load(f)
+    for column in SKYMAP_COLUMNS:
+        skymap[column] = np.load(os.path.join(cacheDirectory, column + '.npy'), mmap_mode = 'r')
+    return skymap
+
+
+def getSkymap(mapPath, cacheLocation = None):
+    """Get the precomputed sky map for mapPath, from memory, the disk cache or (if neither)
+       by reading the map itself.  Returns None if the map cannot be handled here.
+
+    Args:
+        mapPath:
+        cacheLocation: root directory of the disk cache. None = in-process cache only.
+    """
+    key = getCacheKey(mapPath)
+    if key in _skymapCache:
+        return _skymapCache[key]
+
+    skymap = None
+    cacheDirectory = None
+    if cacheLocation is not None:
+        cacheDirectory = os.path.join(cacheLocation, key)
+        if os.path.exists(os.path.join(cacheDirectory, 'metadata.json')):
+            skymap = readSkymapCache(cacheDirectory)
+
+    if skymap is None:
+        skymap = readMultiOrderSkymap(mapPath)
+        if skymap is None:
+            return None
+        if cacheDirectory is not None:
+            try:
+                os.makedirs(cacheLocation, exist_ok = True)
+                writeSkymapCache(skymap, cacheDirectory)
+                skymap = readSkymapCache(cacheDirectory)
+            except OSError as e:
+                print("Unable to write sky map cache %s: %s" % (cacheDirectory, str(e)))
+
+    _skymapCache[key] = skymap
+    return skymap
+
+
+def lookupPixels(skymap, ras, decs):
+    """Return the index into the sorted skymap arrays of the pixel containing each position.
+
+    Args:
+        skymap:
+        ras: RA (degrees)
+        decs: Dec (degrees)
+    """
+    from astropy_healpix import lonlat_to_healpix
+    import astropy.units as u
+
+    nside = 2 ** int(skymap['maxLevel'])
+    ipix = lonlat_to_healpix(np.asarray(ras, dtype = np.float64) * u.deg, np.asarray(decs, dtype = np.float64) * u.deg, nside, order = 'nested')
+    ipix = np.asarray(ipix, dtype = np.int64)
+
+    index = np.searchsorted(skymap['start'], ipix, side = 'right') - 1
+    return index
+
+
+def probAtLocations(skymap, ras, decs, mjds = None, distance = False):
+    """Vectorised equivalent of skytag's prob_at_location, operating on a cached sky map.
+       Returns [credible levels, (time deltas), ((distmu, distsigma) pairs)] in the same
+       layout as prob_at_location so the caller does not care which one it got.
+
+    Args:
+        skymap:
+        ras:
+        decs:
+        mjds: if not empty, also return the days since the event
+        distance: if True, also return distance location and scale
+    """
+    index = lookupPixels(skymap, ras, decs)
+
+    results = [[float(p) for p in np.asarray(skymap['credible'])[index]]]
+
+    if mjds is not None and len(mjds) > 0:
+        mjdObs = skymap['mjdObs']
+        results.append([float(m) - mjdObs if mjdObs is not None else None for m in mjds])
+
+    if distance:
+        distmu = np.asarray(skymap['distmu'])[index]
+        distsigma = np.asarray(skymap['distsigma'])[index]
+        results.append([(float(mu), float(sigma)) for mu, sigma in zip(distmu, distsigma)])
+
+    return results
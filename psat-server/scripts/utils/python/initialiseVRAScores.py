@@ -22,9 +22,8 @@ __doc__ = __doc__ % (sys.argv[0], sys.argv[0], sys.argv[0], sys.argv[0])
 from docopt import docopt
 import os, shutil, re, csv, subprocess
 from gkutils.commonutils import Struct, cleanOptions, dbConnect, coords_dec_to_sex, getDateFractionMJD, readGenericDataFile
-from atlasvras.st3ph3n.dataprocessing import FeaturesSingleSource
 from atlasvras.st3ph3n.scoreandrank import ScoreAndRank
-from atlasvras.utils.exceptions import VRASaysNo
+from vraUtils import insertVRAEntry, insertVRATodo, insertVRARank, updateObjectDetectionList, makeFeatureMakers, runObjectWrites
 
 import requests
 import json
@@ -36,35 +35,11 @@ import numpy as np
 
 # 2024-06-24 KWS Use the st3ph3n API code to write the results.
 #from st3ph3n.utils import api as vraapi
-from atlasapiclient import client as atlasapiclient
 
 import os
     
 EYEBALL_THRESHOLD = 7.5
 
-def insertVRAEntry(API_CONFIG_FILE, objectId, pReal, pGal, rank, rank_column, is_gal_cand, debug = False):
-    if rank_column not in ['rank', 'rank_alt1']:
-        raise VRASaysNo('The rank column must be rank or rank_alt1.')
-    payload = {'objectid': objectId, 'preal': pReal, 'pgal': pGal, rank_column: rank, 'is_gal_cand': is_gal_cand, 'debug': debug}
-    writeto_vra = atlasapiclient.WriteToVRAScores(api_config_file = API_CONFIG_FILE, payload=payload)
-    writeto_vra.get_response()
-
-def insertVRATodo(API_CONFIG_FILE, objectId):
-    payload = {'objectid': objectId}
-    writeto_todo = atlasapiclient.WriteToToDo(api_config_file = API_CONFIG_FILE, payload=payload)
-    writeto_todo.get_response()
-
-def insertVRARank(API_CONFIG_FILE, objectId, rank, is_gal_cand):
-    payload = {'objectid': objectId, 'rank': rank, 'is_gal_cand': is_gal_cand}
-    writeto_rank = atlasapiclient.WriteToVRARank(api_config_file = API_CONFIG_FILE, payload=payload)
-    writeto_rank.get_response()
-
-def updateObjectDetectionList(API_CONFIG_FILE, objectId, objectList = 4):
-    payload = {'objectid': objectId, 'objectlist': objectList}
-    update_list = atlasapiclient.WriteObjectDetectionListNumber(api_config_file = API_CONFIG_FILE, payload=payload)
-    update_list.get_response()
-
-
 def main():
     """main.
     """
@@ -102,10 +77,11 @@ def main():
     #      call the FeaturesSingleSource pipeline which interrogates the API and stores all the lightcurve features from last -N days (100)
     #      append the features to the main feature list
 
+    # 2026-10-19 KWS Fetch the source data for all the objects in a few paged requests
+    #                rather than one API request per object.
     atlas_id_tns_xm = []
     feature_list = []
-    for _atlas_id in data.objectid.values:
-        feature_maker = FeaturesSingleSource(atlas_id=_atlas_id, api_config_file=api_config)
+    for _atlas_id, feature_maker in makeFeatureMakers(api_config, data.objectid.values):
         feature_maker.make_day1_features()
         feature_list.append(feature_maker.day1_features)
 
@@ -141,21 +117,24 @@ def main():
 
     gal_flags = np.array( ( s_a_r.is_gal_cand & (s_a_r.ranks<EYEBALL_THRESHOLD) ) ).astype(int)
 
+    # The writes for each object, in order. The objects are written concurrently.
+    writes = {}
+
     rank_column=options.rankcolumn
     for atlas_id, pReal, pGal, rank, gal_flag in zip(data.objectid.values,
                                      s_a_r.real_scores.T[1],
                                      s_a_r.gal_scores.T[1],
                                      s_a_r.ranks,
                                      gal_flags):
-        insertVRAEntry(api_config, atlas_id, pReal, pGal, rank, rank_column=rank_column, is_gal_cand = gal_flag, debug = debug)
-        insertVRATodo(api_config, atlas_id)
+        writes[atlas_id] = [(insertVRAEntry, (api_config, atlas_id, pReal, pGal, rank), {'rank_column': rank_column, 'is_gal_cand': gal_flag, 'debug': debug}),
+                            (insertVRATodo, (api_config, atlas_id), {})]
         i += 1
         if debug:
             continue
         else:
-            insertVRARank(api_config, atlas_id, rank, gal_flag)
+            writes[atlas_id].append((insertVRARank, (api_config, atlas_id, rank, gal_flag), {}))
             if gal_flag:
-                updateObjectDetectionList(api_config, atlas_id, 12)
+                writes[atlas_id].append((updateObjectDetectionList, (api_config, atlas_id, 12), {}))
                 # 2025-01-30 HFS: If the event is a galactic candidate that didn't pass the (extragalactic candidate) eyeball
                 #                 threshold we send it to the galactic candidate list (12) to be eyeballed with lower priority
 
@@ -169,11 +148,14 @@ def main():
             break
 
         rank = 10
-        insertVRAEntry(api_config, atlas_id, None, None, rank, rank_column=rank_column, is_gal_cand = gal_flag, debug = debug)
+        # These go after the object's score, so the override is the last row written.
+        writes[atlas_id].append((insertVRAEntry, (api_config, atlas_id, None, None, rank), {'rank_column': rank_column, 'is_gal_cand': gal_flag, 'debug': debug}))
         if debug:
             continue
         else:
-            insertVRARank(api_config, atlas_id, rank, is_gal_cand = gal_flag)
+            writes[atlas_id].append((insertVRARank, (api_config, atlas_id, rank), {'is_gal_cand': gal_flag}))
+
+    runObjectWrites(writes)
 
     #for row in data:
     #    #print(row['objectid'], row['score'])
@@ -25,8 +25,10 @@ Options:
 import sys
 __doc__ = __doc__ % (sys.argv[0], sys.argv[0], sys.argv[0], sys.argv[0])
 from docopt import docopt
-import os, MySQLdb, shutil, re
-from gkutils.commonutils import find, Struct, cleanOptions, dbConnect, calculateRMSScatter, getAngularSeparation, coneSearchHTM, QUICK, FULL, CAT_ID_RA_DEC_COLS, PROCESSING_FLAGS
+import os, MySQLdb, shutil, re, math
+import numpy as np
+from scipy.spatial import cKDTree
+from gkutils.commonutils import find, Struct, cleanOptions, dbConnect, calculateRMSScatter, getAngularSeparation, QUICK, CAT_ID_RA_DEC_COLS, PROCESSING_FLAGS
 import MySQLdb
 sys.path.append('../../common/python')
 from queries import getATLASCandidates, getAtlasObjects, getPanSTARRSCandidates, updateTransientObservationAndProcessingStatus, insertTransientObjectComment, getObjectInfo
@@ -59,56 +61,237 @@ def updateObservationStatus(conn, objectId, status):
     return rowsUpdated
 
 
-def moonMatcher(conn, connCatalogues, options, candidateList, detectionOffset = 0):
+def getDetectionToUse(conn, options, candidate, detectionOffset = 0):
+    """Pick the detection (counting back from the most recent) that we will match against the ephemerides.
+
+    Args:
+        conn:
+        options:
+        candidate:
+        detectionOffset:
+    """
+
+    detections = getObjectInfo(conn, candidate['id'], options.survey, options.ddc)
+
+    counter = 0
+    for det in reversed(detections):
+        if options.survey == 'atlas':
+            if det['dup'] >= 0:
+                if counter == detectionOffset:
+                    return det
+                counter += 1
+        elif options.survey == 'panstarrs':
+            if det['psf_inst_mag'] is not None and det['psf_inst_mag_sig'] is not None and det['cal_psf_mag'] is not None:
+                if counter == detectionOffset:
+                    return det
+                counter += 1
+
+    return None
 
-    matchRadius = int(options.matchRadius)
-    matchTimeDelta = float(options.matchTimeDelta)
-    objectsForUpdate = []
 
-    moon = None
-    separation = None
+def getDetectionsToUse(conn, options, candidateList, detectionOffset = 0):
+    """Return a list of {'id', 'ra', 'dec', 'mjd'} dicts, one per candidate that has a usable detection.
 
-    detectionToUse = None
+    Args:
+        conn:
+        options:
+        candidateList:
+        detectionOffset:
+    """
 
+    detectionsToUse = []
     for candidate in candidateList:
-        xmResult = {'id': candidate['id'], 'moon': None, 'separation': None, 'matchTime': None}
-
-        detections = getObjectInfo(conn, candidate['id'], options.survey, options.ddc)
-
-        counter = 0
-        for det in reversed(detections):
-            if options.survey == 'atlas':
-                if det['dup'] >= 0:
-                    if counter == detectionOffset:
-                        detectionToUse = det
-                        break
-                    counter += 1
-            elif options.survey == 'panstarrs':
-                if det['psf_inst_mag'] is not None and det['psf_inst_mag_sig'] is not None and det['cal_psf_mag'] is not None:
-                    if counter == detectionOffset:
-                        detectionToUse = det
-                        break
-                    counter += 1
-
-        # If we don't have a decent detection, skip on
-        if detectionToUse is None:
+        det = getDetectionToUse(conn, options, candidate, detectionOffset = detectionOffset)
+        if det is not None:
+            detectionsToUse.append({'id': candidate['id'], 'ra': det['RA'], 'dec': det['DEC'], 'mjd': det['MJD']})
+
+    return detectionsToUse
+
+
+def getNightsSpanned(mjds, matchTimeDelta):
+    """Return the sorted integer MJD nights touched by the +/- matchTimeDelta window around each MJD.
+
+    Args:
+        mjds:
+        matchTimeDelta:
+    """
+
+    nights = set()
+    for mjd in mjds:
+        for night in range(int(math.floor(mjd - matchTimeDelta)), int(math.floor(mjd + matchTimeDelta)) + 1):
+            nights.add(night)
+
+    return sorted(nights)
+
+
+def getSatelliteEphemerides(connCatalogues, nights, tableName = 'tcs_cat_satellites'):
+    """Grab ALL the ephemeris rows for the specified integer MJD nights in one query. Each night
+       is expressed as a half open MJD range so that the mjd index can be used.
+
+    Args:
+        connCatalogues:
+        nights:
+        tableName:
+    """
+
+    resultSet = []
+    if not nights:
+        return resultSet
+
+    raCol, decCol = CAT_ID_RA_DEC_COLS[tableName][0][1:3]
+
+    # Merge contiguous nights into single ranges to keep the where clause short.
+    ranges = []
+    for night in nights:
+        if ranges and ranges[-1][1] == night:
+            ranges[-1][1] = night + 1
+        else:
+            ranges.append([night, night + 1])
+
+    whereClause = ' or '.join(['(mjd >= %s and mjd < %s)'] * len(ranges))
+    parameters = tuple([value for r in ranges for value in r])
+
+    try:
+        cursor = connCatalogues.cursor(MySQLdb.cursors.DictCursor)
+        cursor.execute ("""
+            select name, mjd, `%s` ra, `%s` `dec`
+              from %s
+             where %s
+        """ % (raCol, decCol, tableName, whereClause), parameters)
+        resultSet = cursor.fetchall ()
+        cursor.close ()
+
+    except MySQLdb.Error as e:
+        print("Error %d: %s" % (e.args[0], e.args[1]))
+
+    return resultSet
+
+
+def radecToUnitVectors(ra, dec):
+    """Convert RA and Dec (degrees) arrays into an N x 3 array of unit vectors.
+
+    Args:
+        ra:
+        dec:
+    """
+
+    ra = np.radians(np.asarray(ra, dtype = float))
+    dec = np.radians(np.asarray(dec, dtype = float))
+    return np.column_stack((np.cos(dec) * np.cos(ra), np.cos(dec) * np.sin(ra), np.sin(dec)))
+
+
+def buildEphemerisIndex(ephemerides):
+    """Bucket the ephemeris rows by integer MJD night and build a KD tree of unit vectors for each night.
+
+    Args:
+        ephemerides:
+    """
+
+    rowsByNight = {}
+    for row in ephemerides:
+        rowsByNight.setdefault(int(math.floor(row['mjd'])), []).append(row)
+
+    ephemerisIndex = {}
+    for night, rows in rowsByNight.items():
+        xyz = radecToUnitVectors([r['ra'] for r in rows], [r['dec'] for r in rows])
+        ephemerisIndex[night] = {'names': [r['name'] for r in rows],
+                                 'mjd': np.array([r['mjd'] for r in rows], dtype = float),
+                                 'xyz': xyz,
+                                 'tree': cKDTree(xyz)}
+
+    return ephemerisIndex
+
+
+def loadEphemerisIndex(connCatalogues, detectionsToUse, matchTimeDelta):
+    """Load the ephemerides for the nights spanned by the detections and index them.
+
+    Args:
+        connCatalogues:
+        detectionsToUse:
+        matchTimeDelta:
+    """
+
+    nights = getNightsSpanned([d['mjd'] for d in detectionsToUse], matchTimeDelta)
+    ephemerides = getSatelliteEphemerides(connCatalogues, nights)
+    print("Loaded %d ephemeris rows for %d nights." % (len(ephemerides), len(nights)))
+    return buildEphemerisIndex(ephemerides)
+
+
+def matchDetectionsToEphemerides(ephemerisIndex, detectionsToUse, matchRadius, matchTimeDelta):
+    """Match all the detections against the per-night indexes in one pass. The nearest ephemeris
+       row within matchRadius (arcsec) AND within matchTimeDelta (days) wins.
+
+    Args:
+        ephemerisIndex:
+        detectionsToUse:
+        matchRadius:
+        matchTimeDelta:
+    """
+
+    objectsForUpdate = [{'id': d['id'], 'moon': None, 'separation': None, 'matchTime': None} for d in detectionsToUse]
+
+    if not detectionsToUse:
+        return objectsForUpdate
+
+    detMjd = np.array([d['mjd'] for d in detectionsToUse], dtype = float)
+    detXyz = radecToUnitVectors([d['ra'] for d in detectionsToUse], [d['dec'] for d in detectionsToUse])
+
+    # Chord length equivalent of the match radius on the unit sphere.
+    chord = 2.0 * math.sin(math.radians(matchRadius / 3600.0) / 2.0)
+
+    bestSeparation = np.full(len(detectionsToUse), np.inf)
+
+    for night in getNightsSpanned(detMjd, matchTimeDelta):
+        nightIndex = ephemerisIndex.get(night)
+        if nightIndex is None:
             continue
 
-        message, results = coneSearchHTM(detectionToUse['RA'], detectionToUse['DEC'], matchRadius, 'tcs_cat_satellites', queryType = FULL, conn = connCatalogues)
-        if results and len(results) >= 1:
-            # We have more than one object.  No we need to merge anything. Can exit now.
-
-            for row in results:
-                if detectionToUse['MJD'] > row[1]['mjd'] - matchTimeDelta and detectionToUse['MJD'] < row[1]['mjd'] + matchTimeDelta:
-                    moon = row[1]['name']
-                    separation = row[0]
-                    xmResult['moon'] = moon
-                    xmResult['separation'] = separation
-                    xmResult['matchTime'] = row[1]['mjd']
-                    print("MOONS: %s (%.2f arcsec)" % (moon, separation))
-                    break
-
-        objectsForUpdate.append(xmResult)
+        # Only the detections whose time window touches this night need to be queried.
+        candidates = np.where((np.floor(detMjd - matchTimeDelta) <= night) & (np.floor(detMjd + matchTimeDelta) >= night))[0]
+        if len(candidates) == 0:
+            continue
+
+        neighbours = nightIndex['tree'].query_ball_point(detXyz[candidates], chord)
+
+        for i, rows in zip(candidates, neighbours):
+            if not rows:
+                continue
+            rows = np.asarray(rows)
+            timeOK = (detMjd[i] > nightIndex['mjd'][rows] - matchTimeDelta) & (detMjd[i] < nightIndex['mjd'][rows] + matchTimeDelta)
+            rows = rows[timeOK]
+            if len(rows) == 0:
+                continue
+            chords = np.linalg.norm(nightIndex['xyz'][rows] - detXyz[i], axis = 1)
+            separations = np.degrees(2.0 * np.arcsin(np.clip(chords / 2.0, 0.0, 1.0))) * 3600.0
+            nearest = np.argmin(separations)
+            if separations[nearest] < bestSeparation[i]:
+                bestSeparation[i] = separations[nearest]
+                objectsForUpdate[i]['moon'] = nightIndex['names'][rows[nearest]]
+                objectsForUpdate[i]['separation'] = float(separations[nearest])
+                objectsForUpdate[i]['matchTime'] = float(nightIndex['mjd'][rows[nearest]])
+
+    for xmResult in objectsForUpdate:
+        if xmResult['moon'] is not None:
+            print("MOONS: %s (%.2f arcsec)" % (xmResult['moon'], xmResult['separation']))
+
+    return objectsForUpdate
+
+
+# 2026-10-19 KWS Match in time first, then space. Rather than a cone search per candidate
+#                (which drags back every epoch of every satellite in the cone) we grab only the
+#                ephemeris rows for the nights spanned by the candidates in one query, build a
+#                KD tree per night and match everything in one pass.
+def moonMatcher(conn, connCatalogues, options, candidateList, detectionOffset = 0, ephemerisIndex = None):
+
+    matchRadius = int(options.matchRadius)
+    matchTimeDelta = float(options.matchTimeDelta)
+
+    detectionsToUse = getDetectionsToUse(conn, options, candidateList, detectionOffset = detectionOffset)
+
+    if ephemerisIndex is None:
+        ephemerisIndex = loadEphemerisIndex(connCatalogues, detectionsToUse, matchTimeDelta)
+
+    objectsForUpdate = matchDetectionsToEphemerides(ephemerisIndex, detectionsToUse, matchRadius, matchTimeDelta)
 
     return objectsForUpdate
 
@@ -30,7 +30,7 @@ import os, MySQLdb, shutil, re
 from gkutils.commonutils import find, Struct, cleanOptions, dbConnect, calculateRMSScatter, getAngularSeparation, coneSearchHTM, QUICK, FULL, CAT_ID_RA_DEC_COLS, PROCESSING_FLAGS, splitList, parallelProcess
 import MySQLdb
 sys.path.append('../../common/python')
-from moonMatcher import moonMatcher, updateObjects
+from moonMatcher import updateObjects, getDetectionsToUse, loadEphemerisIndex, matchDetectionsToEphemerides
 from queries import getATLASCandidates, getAtlasObjects, getPanSTARRSCandidates, updateTransientObservationAndProcessingStatus, insertTransientObjectComment, getObjectInfo
 import datetime
 
@@ -46,16 +46,16 @@ def worker(num, db, objectListFragment, dateAndTime, firstPass, miscParameters,
     # 2023-03-25 KWS MySQLdb disables autocommit by default. Switch it on globally.
     conn.autocommit(True)
 
-    connCatalogues = dbConnect(db['cathost'], db['catuser'], db['catpass'], db['catname'], quitOnError = True)
-
     # This is in the worker function
-    # 2015-02-17 KWS Note to self - I need to pass the radius through the miscParameters
-    objectsForUpdate = moonMatcher(conn, connCatalogues, options, objectListFragment)
+    # 2026-10-19 KWS The workers now only pick out the detections to match. The ephemerides
+    #                are loaded and indexed ONCE by the parent, which does the matching for
+    #                all the candidates in a single pass against the shared per-night indexes.
+    detectionsToUse = getDetectionsToUse(conn, options, objectListFragment)
 
-    # Write the objects for update onto a Queue object
-    print("Adding %d objects onto the queue." % len(objectsForUpdate))
+    # Write the detections onto a Queue object
+    print("Adding %d detections onto the queue." % len(detectionsToUse))
 
-    q.put(objectsForUpdate)
+    q.put(detectionsToUse)
 
     print("Process complete.")
     conn.close()
@@ -141,9 +141,13 @@ def main(argv = None):
         nProcessors, listChunks = splitList(candidateList, bins=56)
 
         print("%s Parallel Processing..." % (datetime.datetime.now().strftime("%Y:%m:%d:%H:%M:%S")))
-        objectsForUpdate = parallelProcess(db, dateAndTime, nProcessors, listChunks, worker, miscParameters = [options])
+        detectionsToUse = parallelProcess(db, dateAndTime, nProcessors, listChunks, worker, miscParameters = [options])
         print("%s Done Parallel Processing" % (datetime.datetime.now().strftime("%Y:%m:%d:%H:%M:%S")))
 
+        matchTimeDelta = float(options.matchTimeDelta)
+        ephemerisIndex = loadEphemerisIndex(connCatalogues, detectionsToUse, matchTimeDelta)
+        objectsForUpdate = matchDetectionsToEphemerides(ephemerisIndex, detectionsToUse, int(options.matchRadius), matchTimeDelta)
+
         print("TOTAL OBJECTS TO UPDATE = %d" % len(objectsForUpdate))
 
     if len(objectsForUpdate) > 0 and options.update:
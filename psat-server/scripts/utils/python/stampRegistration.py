@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+"""
+Batch stamp registration checker.
+
+checkStampMisalignment.py and panstarrsCheckStampRegistrationByFFT.py check one
+target/reference pair at a time, with a full complex FFT phase correlation and an
+iterative (curve_fit) peak fit for every pair. This does the same check for a whole
+stack of stamps at once:
+
+  * All the stamps of the same shape are processed as one (N, H, W) stack, in chunks.
+  * The cross-power spectra are computed with real FFTs over the whole stack. scipy.fft
+    caches the plan for each transform shape, so every chunk reuses the same plan.
+  * The smoothing of the correlation surface is done in the Fourier domain (a multiply)
+    rather than with a separate filter pass.
+  * The peak is refined with a closed-form 3 point (Gaussian, falling back to parabolic)
+    sub-pixel estimator instead of a non-linear fit.
+
+Usage:
+  %s <pairfile> [--prominence=<s>] [--shiftcut=<d>] [--sigma=<g>] [--fitwin=<w>] [--margin=<m>] [--nan=<policy>] [--chunksize=<n>] [--threads=<n>] [--significantonly]
+  %s benchmark [--stamps=<n>] [--size=<n>] [--maxshift=<d>] [--noise=<n>] [--compare=<n>] [--chunksize=<n>] [--threads=<n>]
+  %s (-h | --help)
+
+Options:
+  <pairfile>              File containing one "<ref_fits> <target_fits>" pair per line.
+  --prominence=<s>        SNR threshold for prominence [default: 5.0].
+  --shiftcut=<d>          Pixel shift threshold [default: 1.0].
+  --sigma=<g>             Gaussian smoothing sigma of the correlation surface [default: 1.5].
+  --fitwin=<w>            Window (excluded from the noise estimate) around the peak [default: 9].
+  --margin=<m>            Flag peaks closer than this to the edge of the correlation surface [default: 10].
+  --nan=<policy>          NaN handling policy (median-fill or mask) [default: median-fill].
+  --chunksize=<n>         Number of stamps per FFT stack [default: 256].
+  --threads=<n>           Number of threads for reading the FITS files and for the FFTs [default: 4].
+  --significantonly       Only print the significantly misaligned pairs.
+  --stamps=<n>            Number of synthetic stamp pairs [default: 2000].
+  --size=<n>              Synthetic stamp size (pixels) [default: 100].
+  --maxshift=<d>          Maximum synthetic shift (pixels) [default: 4.0].
+  --noise=<n>             Synthetic noise level relative to the peak source flux [default: 0.02].
+  --compare=<n>           Number of synthetic pairs also run through the one pair at a time checker [default: 50].
+
+E.g.:
+  %s /tmp/stamppairs.txt --threads=8 --significantonly
+  %s benchmark --stamps=5000 --size=100
+"""
+import sys
+__doc__ = __doc__ % (sys.argv[0], sys.argv[0], sys.argv[0], sys.argv[0], sys.argv[0])
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+
+from docopt import docopt
+import numpy as np
+from scipy import fft as scipyfft
+
+from gkutils.commonutils import Struct, cleanOptions
+from checkStampMisalignment import load_fits, zscale_image
+
+# Quality flags (a bitmask - 0 means the measurement is good)
+FLAG_OK       = 0
+FLAG_EDGE     = 1   # The correlation peak is too close to the edge of the surface. No shift measured.
+FLAG_LOW_SNR  = 2   # The peak is below the prominence threshold. The shift is unreliable.
+FLAG_BLANK    = 4   # One of the stamps has no structure (e.g. all NaN or constant).
+FLAG_NO_DATA  = 8   # One of the FITS files could not be read.
+
+CHUNK_SIZE = 256
+
+EPS = 1e-12
+
+
+def gaussian_transfer(shape, sigma):
+    """Fourier transfer function (for an rfft2 half spectrum) of a Gaussian smoothing kernel.
+
+    Args:
+        shape: (H, W) of the image
+        sigma: Gaussian sigma in pixels
+    """
+    H, W = shape
+    fy = scipyfft.fftfreq(H)[:, None]
+    fx = scipyfft.rfftfreq(W)[None, :]
+    return np.exp(-2.0 * (np.pi * sigma) ** 2 * (fy ** 2 + fx ** 2)).astype(np.float32)
+
+
+def fill_nans(refs, news, nan_policy = "median-fill"):
+    """Vectorised version of the NaN handling in assess_shift.
+
+    Args:
+        refs: (N, H, W) reference stack
+        news: (N, H, W) target stack
+        nan_policy: median-fill or mask
+    """
+    blank = np.zeros(refs.shape[0], dtype=bool)
+
+    if nan_policy == "median-fill":
+        refNaN = np.isnan(refs)
+        newNaN = np.isnan(news)
+        blank |= refNaN.all(axis=(1, 2)) | newNaN.all(axis=(1, 2))
+        if refNaN.any():
+            with np.errstate(all='ignore'):
+                medians = np.nan_to_num(np.nanmedian(refs, axis=(1, 2)))
+            refs = np.where(refNaN, medians[:, None, None], refs)
+        if newNaN.any():
+            with np.errstate(all='ignore'):
+                medians = np.nan_to_num(np.nanmedian(news, axis=(1, 2)))
+            news = np.where(newNaN, medians[:, None, None], news)
+    elif nan_policy == "mask":
+        mask = np.isnan(refs) | np.isnan(news)
+        blank |= mask.all(axis=(1, 2))
+        refs = np.where(mask, 0, refs)
+        news = np.where(mask, 0, news)
+    else:
+        raise ValueError("nan_policy must be 'median-fill' or 'mask'")
+
+    return refs, news, blank
+
+
+def subpixel_offset(left, centre, right):
+    """Closed-form sub-pixel offset of a peak from three samples. Uses the Gaussian (log)
+       estimator where all three samples are positive and the parabolic one elsewhere.
+
+    Args:
+        left: arrays of samples either side of (and at) the peak
+        centre:
+        right:
+    """
+    with np.errstate(all='ignore'):
+        positive = (left > 0) & (centre > 0) & (right > 0)
+        lnL = np.log(np.where(positive, left, 1.0))
+        lnC = np.log(np.where(positive, centre, 1.0))
+        lnR = np.log(np.where(positive, right, 1.0))
+        gaussian = (lnL - lnR) / (2.0 * (lnL - 2.0 * lnC + lnR))
+        parabolic = (left - right) / (2.0 * (left - 2.0 * centre + right))
+        offset = np.where(positive, gaussian, parabolic)
+
+    # A flat or degenerate peak gives nonsense. Stay on the integer peak.
+    offset = np.where(np.isfinite(offset) & (np.abs(offset) <= 1.0), offset, 0.0)
+    return offset
+
+
+def assess_shifts(refs, news, *,
+                  prominence_cut = 5.0,
+                  shift_cut = 1.0,
+                  smooth_sigma = 1.5,
+                  fit_window = 9,
+                  edge_margin = 10,
+                  nan_policy = "median-fill",
+                  threads = 1):
+    """Batch equivalent of checkStampMisalignment.assess_shift.
+
+    Args:
+        refs: (N, H, W) stack of (Z-scaled) reference stamps
+        news: (N, H, W) stack of (Z-scaled) target stamps
+        prominence_cut: SNR threshold
+        shift_cut: pixel shift threshold
+        smooth_sigma: Gaussian smoothing of the correlation surface
+        fit_window: window around the peak that is excluded from the noise estimate
+        edge_margin: peaks closer than this to the edge are flagged (and given a NaN shift). 0 = no check.
+        nan_policy: median-fill or mask
+        threads: number of FFT threads
+
+    Returns a dict of arrays of length N: dy, dx, snr, significant, flags.
+    """
+    refs = np.asarray(refs, dtype=np.float32)
+    news = np.asarray(news, dtype=np.float32)
+    if refs.ndim == 2:
+        refs = refs[None]
+        news = news[None]
+    if refs.shape != news.shape:
+        raise ValueError("Reference and target stacks must have the same shape")
+
+    N, H, W = refs.shape
+
+    refs, news, blank = fill_nans(refs, news, nan_policy = nan_policy)
+    blank |= (np.ptp(refs, axis=(1, 2)) == 0) | (np.ptp(news, axis=(1, 2)) == 0)
+
+    # --- Phase-correlation surfaces ------------------------------------
+    with scipyfft.set_workers(max(int(threads), 1)):
+        cps = scipyfft.rfft2(refs, axes=(-2, -1))
+        cps *= np.conj(scipyfft.rfft2(news, axes=(-2, -1)))
+        cps /= (np.abs(cps) + EPS)
+        if smooth_sigma:
+            cps *= gaussian_transfer((H, W), smooth_sigma)
+        corr = scipyfft.irfft2(cps, s=(H, W), axes=(-2, -1))
+    del cps
+    corr = np.abs(scipyfft.fftshift(corr, axes=(-2, -1)))
+
+    # --- Integer peaks ------------------------------------------------
+    flat = corr.reshape(N, -1)
+    peak = np.argmax(flat, axis=1)
+    py, px = np.unravel_index(peak, (H, W))
+    rows = np.arange(N)
+    centre = flat[rows, peak]
+
+    # --- Closed-form sub-pixel refinement ------------------------------
+    # The correlation surface is periodic, so the neighbours wrap.
+    cy = py + subpixel_offset(corr[rows, (py - 1) % H, px], centre, corr[rows, (py + 1) % H, px])
+    cx = px + subpixel_offset(corr[rows, py, (px - 1) % W], centre, corr[rows, py, (px + 1) % W])
+
+    # --- SNR estimate (peak above background, relative to MAD outside the peak window) ---
+    # The medians are the most expensive part of the whole check. Taking them over every
+    # other pixel makes no practical difference to the estimate, and is four times cheaper.
+    half = fit_window // 2
+    yy = np.arange(0, H, 2)[None, :, None]
+    xx = np.arange(0, W, 2)[None, None, :]
+    window = (np.abs(yy - py[:, None, None]) <= half) & (np.abs(xx - px[:, None, None]) <= half)
+    ann = np.where(window, np.nan, corr[:, ::2, ::2])
+    off = np.nanmedian(ann, axis=(1, 2))
+    noise_sig = np.nanmedian(np.abs(ann - off[:, None, None]), axis=(1, 2)) * 1.4826
+    snr = (centre - off) / (noise_sig + EPS)
+
+    # --- Shift relative to centre -------------------------------------
+    dy = cy - H // 2
+    dx = cx - W // 2
+    dy = np.where(dy > H / 2, dy - H, dy)
+    dx = np.where(dx > W / 2, dx - W, dx)
+
+    flags = np.zeros(N, dtype=np.int32)
+    flags[blank] |= FLAG_BLANK
+    flags[snr < prominence_cut] |= FLAG_LOW_SNR
+    if edge_margin:
+        edge = (px < edge_margin) | (px >= W - edge_margin) | (py < edge_margin) | (py >= H - edge_margin)
+        flags[edge] |= FLAG_EDGE
+        dy = np.where(edge, np.nan, dy)
+        dx = np.where(edge, np.nan, dx)
+        snr = np.where(edge, 0.0, snr)
+
+    mag = np.hypot(dy, dx)
+    with np.errstate(invalid='ignore'):
+        significant = (snr >= prominence_cut) & (mag > shift_cut) & ((flags & (FLAG_EDGE | FLAG_BLANK)) == 0)
+
+    return {
+        'dy': dy,
+        'dx': dx,
+        'snr': snr,
+        'significant': significant,
+        'flags': flags
+    }
+
+
+def load_pair(pair):
+    """Load and Z-scale a (ref, target) pair of FITS files. Returns (ref, target) or None."""
+    refPath, targetPath = pair
+    try:
+        ref, _ = load_fits(refPath)
+        new, _ = load_fits(targetPath)
+    except (IOError, OSError, ValueError) as e:
+        print("Cannot read %s or %s: %s" % (refPath, targetPath, str(e)))
+        return None
+    if ref.shape != new.shape:
+        print("Reference %s and target %s are different shapes." % (refPath, targetPath))
+        return None
+    return zscale_image(ref).astype(np.float32), zscale_image(new).astype(np.float32)
+
+
+def assess_shift_files(pairs, chunk_size = CHUNK_SIZE, threads = 4, **kwargs):
+    """Check the registration of many (ref, target) FITS file pairs. The files are read (and
+       Z-scaled) concurrently, then the stamps are grouped by shape and assessed in stacks of
+       up to chunk_size. Returns a list of result dicts in the same order as the pairs.
+
+    Args:
+        pairs: list of (ref_fits, target_fits)
+        chunk_size: number of stamps per stack
+        threads: number of reader and FFT threads
+        kwargs: passed to assess_shifts
+    """
+    results = [None] * len(pairs)
+
+    for start in range(0, len(pairs), chunk_size):
+        chunk = pairs[start:start + chunk_size]
+        with ThreadPoolExecutor(max_workers = max(int(threads), 1)) as executor:
+            stamps = list(executor.map(load_pair, chunk))
+
+        # Group by stamp shape. Each shape is one stack.
+        shapes = OrderedDict()
+        for i, stamp in enumerate(stamps):
+            if stamp is None:
+                results[start + i] = {'shift': (float('nan'), float('nan')), 'snr': 0.0, 'significant': False, 'flags': FLAG_NO_DATA}
+                continue
+            shapes.setdefault(stamp[0].shape, []).append(i)
+
+        for shape, indices in shapes.items():
+            refs = np.stack([stamps[i][0] for i in indices])
+            news = np.stack([stamps[i][1] for i in indices])
+            stack = assess_shifts(refs, news, threads = threads, **kwargs)
+            for j, i in enumerate(indices):
+                results[start + i] = {'shift': (float(stack['dy'][j]), float(stack['dx'][j])),
+                                      'snr': float(stack['snr'][j]),
+                                      'significant': bool(stack['significant'][j]),
+                                      'flags': int(stack['flags'][j])}
+
+    return results
+
+
+def read_pair_file(filename):
+    """Read "<ref_fits> <target_fits>" pairs from a file. Blank lines and # comments are ignored."""
+    pairs = []
+    with open(filename) as f:
+        for line in f:
+            line = line.split('#')[0].strip()
+            if not line:
+                continue
+            columns = line.split()
+            if len(columns) != 2:
+                print("Ignoring bad line: %s" % line)
+                continue
+            pairs.append((columns[0], columns[1]))
+    return pairs
+
+
+# ======================================
+# Synthetic shifted-stamp benchmark
+# ======================================
+def make_synthetic_stamps(n, size = 100, max_shift = 4.0, noise = 0.02, seed = 42):
+    """Make n reference stamps containing a few Gaussian sources, and target stamps with the
+       same scene shifted by a known (sub-pixel) amount. Returns (refs, news, true dy, true dx).
+
+    Args:
+        n: number of pairs
+        size: stamp size in pixels
+        max_shift: the shifts are uniform in [-max_shift, max_shift] in each axis
+        noise: Gaussian noise sigma relative to the peak source flux
+        seed: random seed
+    """
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:size, 0:size].astype(np.float32)
+
+    trueDy = rng.uniform(-max_shift, max_shift, n).astype(np.float32)
+    trueDx = rng.uniform(-max_shift, max_shift, n).astype(np.float32)
+
+    refs = np.zeros((n, size, size), dtype=np.float32)
+    news = np.zeros((n, size, size), dtype=np.float32)
+
+    for i in range(n):
+        nSources = rng.integers(3, 8)
+        for s in range(nSources):
+            y0, x0 = rng.uniform(0.2 * size, 0.8 * size, 2)
+            flux = 1.0 if s == 0 else rng.uniform(0.1, 0.8)
+            width = rng.uniform(1.5, 3.0)
+            refs[i] += flux * np.exp(-((yy - y0) ** 2 + (xx - x0) ** 2) / (2 * width ** 2))
+            # The target is the reference scene moved by -shift, so that the measured
+            # shift (reference relative to target) is +shift.
+            news[i] += flux * np.exp(-((yy - y0 + trueDy[i]) ** 2 + (xx - x0 + trueDx[i]) ** 2) / (2 * width ** 2))
+
+    refs += rng.normal(0, noise, refs.shape).astype(np.float32)
+    news += rng.normal(0, noise, news.shape).astype(np.float32)
+
+    return refs, news, trueDy, trueDx
+
+
+def benchmark(options):
+    """Time the batch checker on synthetic stamps, and compare a subset against the one
+       pair at a time checker."""
+    nStamps   = int(options.stamps)
+    size      = int(options.size)
+    chunkSize = int(options.chunksize)
+    threads   = int(options.threads)
+    nCompare  = min(int(options.compare), nStamps)
+
+    print("Making %d synthetic %dx%d stamp pairs..." % (nStamps, size, size))
+    refs, news, trueDy, trueDx = make_synthetic_stamps(nStamps, size = size, max_shift = float(options.maxshift), noise = float(options.noise))
+
+    dy = np.empty(nStamps)
+    dx = np.empty(nStamps)
+    flags = np.empty(nStamps, dtype=np.int32)
+    t0 = time.time()
+    for start in range(0, nStamps, chunkSize):
+        result = assess_shifts(refs[start:start + chunkSize], news[start:start + chunkSize], threads = threads)
+        dy[start:start + chunkSize] = result['dy']
+        dx[start:start + chunkSize] = result['dx']
+        flags[start:start + chunkSize] = result['flags']
+    batchTime = time.time() - t0
+
+    good = flags == FLAG_OK
+    error = np.hypot(dy - trueDy, dx - trueDx)
+    print("Batch:       %8.3f s  (%8.1f stamps/s)  flagged = %d  RMS error = %.3f px  max error = %.3f px" % (batchTime, nStamps / batchTime, np.sum(~good), np.sqrt(np.nanmean(error[good] ** 2)), np.nanmax(error[good])))
+
+    if nCompare > 0:
+        from checkStampMisalignment import assess_shift
+        single = np.empty((nCompare, 2))
+        t0 = time.time()
+        for i in range(nCompare):
+            single[i] = assess_shift(refs[i], news[i], smooth_sigma = 1.5, fit_window = 9)['shift']
+        singleTime = time.time() - t0
+        error = np.hypot(single[:, 0] - trueDy[:nCompare], single[:, 1] - trueDx[:nCompare])
+        print("One by one:  %8.3f s  (%8.1f stamps/s)  RMS error = %.3f px  (first %d pairs)" % (singleTime, nCompare / singleTime, np.sqrt(np.nanmean(error ** 2)), nCompare))
+        print("Speed up:    %8.1f x" % ((singleTime / nCompare) / (batchTime / nStamps)))
+
+
+def registrationCheck(options):
+    pairs = read_pair_file(options.pairfile)
+
+    results = assess_shift_files(pairs,
+                                 chunk_size = int(options.chunksize),
+                                 threads = int(options.threads),
+                                 prominence_cut = float(options.prominence),
+                                 shift_cut = float(options.shiftcut),
+                                 smooth_sigma = float(options.sigma),
+                                 fit_window = int(options.fitwin),
+                                 edge_margin = int(options.margin),
+                                 nan_policy = options.nan)
+
+    print("ref target dy dx snr significant flags")
+    for (refPath, targetPath), result in zip(pairs, results):
+        if options.significantonly and not result['significant']:
+            continue
+        print("%s %s %.2f %.2f %.2f %s %d" % (refPath, targetPath, result['shift'][0], result['shift'][1], result['snr'], result['significant'], result['flags']))
+
+    print("%d pairs checked. %d significantly misaligned. %d flagged." % (len(results), sum(r['significant'] for r in results), sum(r['flags'] != FLAG_OK for r in results)))
+
+
+def main():
+
+    args = docopt(__doc__)
+
+    opts = cleanOptions(args)
+
+    # Use utils.Struct to convert the dict into an object for compatibility with old optparse code.
+    options = Struct(**opts)
+
+    if options.benchmark:
+        benchmark(options)
+    else:
+        registrationCheck(options)
+
+if __name__ == "__main__":
+    main()
@@ -45,9 +45,8 @@ import os, shutil, re, csv, subprocess
 from gkutils.commonutils import Struct, cleanOptions, dbConnect, coords_dec_to_sex, getDateFractionMJD, readGenericDataFile, getMJDFromSqlDate
 
 from atlasapiclient import client as atlasapiclient
-from atlasvras.st3ph3n.dataprocessing import FeaturesSingleSource
 from atlasvras.st3ph3n.scoreandrank import ScoreAndRank
-from atlasvras.utils.exceptions import VRASaysNo
+from vraUtils import insertVRAEntry, insertVRARank, updateObjectDetectionList, makeFeatureMakers, runObjectWrites
 import requests
 import json
 import random
@@ -64,28 +63,6 @@ from astropy.time import Time
 
 EYEBALL_THRESHOLD = 7.5
 
-def insertVRAEntry(API_CONFIG_FILE, objectId, pReal, pGal, rank, rank_column, is_gal_cand, debug = False):
-    if rank_column not in ['rank', 'rank_alt1']:
-        raise VRASaysNo('The rank column must be rank or rank_alt1.')
-    payload = {'objectid': objectId, 'preal': pReal, 'pgal': pGal, rank_column: rank, 'is_gal_cand': is_gal_cand, 'debug': debug}
-    writeto_vra = atlasapiclient.WriteToVRAScores(api_config_file = API_CONFIG_FILE, payload=payload)
-    writeto_vra.get_response()
-
-def insertVRATodo(API_CONFIG_FILE, objectId):
-    payload = {'objectid': objectId}
-    writeto_todo = atlasapiclient.WriteToToDo(api_config_file = API_CONFIG_FILE, payload=payload)
-    writeto_todo.get_response()
-
-def insertVRARank(API_CONFIG_FILE, objectId, rank, is_gal_cand):
-    payload = {'objectid': objectId, 'rank': rank, 'is_gal_cand': is_gal_cand}
-    writeto_rank = atlasapiclient.WriteToVRARank(api_config_file = API_CONFIG_FILE, payload=payload)
-    writeto_rank.get_response()
-
-def updateObjectDetectionList(API_CONFIG_FILE, objectId, objectList = 4):
-    payload = {'objectid': objectId, 'objectlist': objectList}
-    update_list = atlasapiclient.WriteObjectDetectionListNumber(api_config_file = API_CONFIG_FILE, payload=payload)
-    update_list.get_response()
-
 def runUpdates(options):
     """
     Read the VRA table on the following conditions:
@@ -147,12 +124,10 @@ def runUpdates(options):
     feature_list = []
     atlas_ids_to_update = []
 
-    for _atlas_id in vratodo_df.transient_object_id.values:
+    # 2026-10-19 KWS Fetch the source data for the whole todo list in a few paged requests
+    #                rather than one API request per object.
+    for _atlas_id, feature_maker in makeFeatureMakers(api_config, vratodo_df.transient_object_id.values):
         ## HFS: 2024-08-17 -- Adding Features to the Update Scorer
-        feature_maker = FeaturesSingleSource(atlas_id=str(_atlas_id),
-                                             api_config_file = api_config ,
-                                             )
-    
     
         # Keep a record of transients with TNS crossmatches.
         if len(feature_maker.json_data.data['tns_crossmatches']) > 0:
@@ -169,6 +144,8 @@ def runUpdates(options):
         else:
             continue
 
+    # The writes for each object, in order. The objects are written concurrently.
+    writes = {}
 
     ## HFS: 2024-08-17 -- Adding Features to the Update Scorer
     if not atlas_ids_to_update:
@@ -185,11 +162,12 @@ def runUpdates(options):
                     # the main rank column. (We don't want duplicates.)
                     break
                 rank = 10
-                insertVRAEntry(api_config, atlas_id, None, None, rank, rank_column=rank_column, is_gal_cand = None, debug = debug)
+                writes.setdefault(atlas_id, []).append((insertVRAEntry, (api_config, atlas_id, None, None, rank), {'rank_column': rank_column, 'is_gal_cand': None, 'debug': debug}))
                 if options.debug:
                     continue
                 else:
-                    insertVRARank(api_config, atlas_id, rank, None)
+                    writes[atlas_id].append((insertVRARank, (api_config, atlas_id, rank, None), {}))
+            runObjectWrites(writes)
             return 0
 
 
@@ -208,19 +186,19 @@ def runUpdates(options):
                                      s_a_r.ranks,
                                      gal_flags):
 
-        insertVRAEntry(api_config, atlas_id, pReal, pGal, rank, rank_column=rank_column, is_gal_cand = gal_flag, debug = debug)
+        writes[atlas_id] = [(insertVRAEntry, (api_config, atlas_id, pReal, pGal, rank), {'rank_column': rank_column, 'is_gal_cand': gal_flag, 'debug': debug})]
                                        
         i += 1
         if options.debug:
             continue
         else:
-            insertVRARank(api_config, atlas_id, rank, gal_flag)
+            writes[atlas_id].append((insertVRARank, (api_config, atlas_id, rank, gal_flag), {}))
             if gal_flag:
-                updateObjectDetectionList(api_config, atlas_id, 12)
+                writes[atlas_id].append((updateObjectDetectionList, (api_config, atlas_id, 12), {}))
             else:
                 # HFS 2024-09-25: 
                 # when not in debug mode we make sure that the updated objects list is reset to eyeball list = 4
-                updateObjectDetectionList(api_config, atlas_id, 4)
+                writes[atlas_id].append((updateObjectDetectionList, (api_config, atlas_id, 4), {}))
 
     # Set the rank to 10 for objects with a TNS crossmatch.
     for atlas_id in atlas_id_tns_xm:
@@ -231,11 +209,14 @@ def runUpdates(options):
             # the main rank column. (We don't want duplicates.)
             break
         rank = 10
-        insertVRAEntry(api_config, atlas_id, None, None, rank, rank_column=rank_column, is_gal_cand = gal_flag, debug = debug)
+        # These go after the object's score (if any), so the override is the last row written.
+        writes.setdefault(atlas_id, []).append((insertVRAEntry, (api_config, atlas_id, None, None, rank), {'rank_column': rank_column, 'is_gal_cand': gal_flag, 'debug': debug}))
         if options.debug:
             continue
         else:
-            insertVRARank(api_config, atlas_id, rank, gal_flag)
+            writes[atlas_id].append((insertVRARank, (api_config, atlas_id, rank, gal_flag), {}))
+
+    runObjectWrites(writes)
 
     # 6. Calculate ranks and for each atlas ID, rank pair write to the tcs_vra_rank table.
 
@@ -0,0 +1,139 @@
+"""Bulk helpers for the VRA scripts (initialiseVRAScores, updateVRAScores, VRAGarbageCollector).
+
+The VRA scripts used to build a FeaturesSingleSource for every object, each of which
+fetched the full object JSON from the ATLAS API, and then wrote each score back with
+several sequential API calls per object.  Here:
+
+  * The source data for ALL the objects is fetched in a few paged (chunked) API
+    requests and written to a local JSON directory, from which the feature makers
+    are built without going back to the API.
+  * The writes are grouped per object (so that e.g. the TNS rank override is still
+    written AFTER the score for the same object) and the objects are written
+    concurrently over a bounded pool of workers.
+
+The base URL comes from the API config file, so all of this can be run against a
+local stand-in of the ATLAS API.
+"""
+import os
+import json
+import shutil
+import tempfile
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+from atlasapiclient import client as atlasapiclient
+from atlasvras.st3ph3n.dataprocessing import FeaturesSingleSource
+from atlasvras.utils.exceptions import VRASaysNo
+
+# Number of objects per paged source data request.
+SOURCE_DATA_CHUNK_SIZE = 100
+
+# Number of objects written concurrently.
+WRITE_THREADS = 8
+
+
+def insertVRAEntry(API_CONFIG_FILE, objectId, pReal, pGal, rank, rank_column = 'rank', is_gal_cand = None, debug = False):
+    if rank_column not in ['rank', 'rank_alt1']:
+        raise VRASaysNo('The rank column must be rank or rank_alt1.')
+    payload = {'objectid': objectId, 'preal': pReal, 'pgal': pGal, rank_column: rank, 'is_gal_cand': is_gal_cand, 'debug': debug}
+    writeto_vra = atlasapiclient.WriteToVRAScores(api_config_file = API_CONFIG_FILE, payload=payload)
+    writeto_vra.get_response()
+
+def insertVRATodo(API_CONFIG_FILE, objectId):
+    payload = {'objectid': objectId}
+    writeto_todo = atlasapiclient.WriteToToDo(api_config_file = API_CONFIG_FILE, payload=payload)
+    writeto_todo.get_response()
+
+def insertVRARank(API_CONFIG_FILE, objectId, rank, is_gal_cand):
+    payload = {'objectid': objectId, 'rank': rank, 'is_gal_cand': is_gal_cand}
+    writeto_rank = atlasapiclient.WriteToVRARank(api_config_file = API_CONFIG_FILE, payload=payload)
+    writeto_rank.get_response()
+
+def updateObjectDetectionList(API_CONFIG_FILE, objectId, objectList = 4):
+    payload = {'objectid': objectId, 'objectlist': objectList}
+    update_list = atlasapiclient.WriteObjectDetectionListNumber(api_config_file = API_CONFIG_FILE, payload=payload)
+    update_list.get_response()
+
+
+def fetchSourceData(api_config, atlasIds, jsonDirectory, chunkSize = SOURCE_DATA_CHUNK_SIZE):
+    """Fetch the source data for all the objects in a few paged requests and write it to
+       <jsonDirectory>/<atlas_id>.json.  Returns the set of IDs we got data for.
+
+    Args:
+        api_config: API config file
+        atlasIds: list of ATLAS IDs
+        jsonDirectory: where to write the JSON files
+        chunkSize: number of objects per request
+    """
+    if len(atlasIds) == 0:
+        return set()
+
+    request_data = atlasapiclient.RequestMultipleSourceData(api_config_file = api_config,
+                                                            array_ids = np.array([str(x) for x in atlasIds]),
+                                                            chunk_size = chunkSize)
+    request_data.chunk_get_response_quiet()
+
+    fetched = set()
+    for row in request_data.response_data:
+        atlasId = str(row['object']['id'])
+        with open(os.path.join(jsonDirectory, atlasId + '.json'), 'w') as f:
+            json.dump(row, f)
+        fetched.add(atlasId)
+
+    return fetched
+
+
+def makeFeatureMakers(api_config, atlasIds, chunkSize = SOURCE_DATA_CHUNK_SIZE):
+    """Build a FeaturesSingleSource for each object from data fetched in bulk.
+       Returns a list of (atlas_id, feature maker) tuples in the same order as the input.
+
+    Args:
+        api_config: API config file
+        atlasIds: list of ATLAS IDs
+        chunkSize: number of objects per source data request
+    """
+    jsonDirectory = tempfile.mkdtemp(prefix = 'vra_source_data_')
+    try:
+        fetched = fetchSourceData(api_config, atlasIds, jsonDirectory, chunkSize = chunkSize)
+        missing = [str(x) for x in atlasIds if str(x) not in fetched]
+        if missing:
+            print("No bulk source data for %d objects. These will be fetched individually." % len(missing))
+
+        featureMakers = []
+        for atlasId in atlasIds:
+            if str(atlasId) in fetched:
+                featureMaker = FeaturesSingleSource(atlas_id = str(atlasId), api_config_file = api_config, json_path = os.path.join(jsonDirectory, ''))
+            else:
+                featureMaker = FeaturesSingleSource(atlas_id = str(atlasId), api_config_file = api_config)
+            featureMakers.append((atlasId, featureMaker))
+    finally:
+        shutil.rmtree(jsonDirectory, ignore_errors = True)
+
+    return featureMakers
+
+
+def runObjectWrites(writes, threads = WRITE_THREADS):
+    """Run the API writes.  The writes for each object are run in order, but the objects
+       are written concurrently.  Returns the number of objects whose writes all succeeded.
+
+    Args:
+        writes: dict of lists of (function, args, kwargs) keyed by ATLAS ID
+        threads: number of objects to write concurrently
+    """
+    def writeObject(item):
+        atlasId, calls = item
+        try:
+            for function, args, kwargs in calls:
+                function(*args, **kwargs)
+        except Exception as e:
+            print("Failed to write VRA data for %s: %s" % (str(atlasId), str(e)))
+            return False
+        return True
+
+    if not writes:
+        return 0
+
+    with ThreadPoolExecutor(max_workers = max(min(int(threads), len(writes)), 1)) as executor:
+        results = list(executor.map(writeObject, writes.items()))
+
+    return sum(results)